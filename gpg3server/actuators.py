@@ -0,0 +1,145 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Coalescing, last-write-wins queue for actuator writes (LEDs, motors).
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A Scratch forever loop that sets the eye colour from a sensor value sends
+# requests faster than the SPI bus can carry them, and only the latest value
+# of each actuator matters. Request handlers therefore only record the value
+# they want an actuator (a key) to have. One writer thread flushes the
+# pending values at most max_rate times per second:
+#
+# - A pending value that is replaced before it is flushed is coalesced,
+#   it never reaches the hardware.
+# - A value equal to the one last flushed for its key is skipped.
+#
+# Writes that bypass the writer (motion commands, batches, stop) must call
+# forget() for the keys they touch, while holding the hardware lock. That
+# way the writer neither flushes an older pending value after them nor
+# skips a value because of a stale state.
+
+import collections
+import sys
+import threading
+import time
+
+class CoalescingWriter:
+    """
+    Last-write-wins queue with a single writer thread.
+
+    flush(changes) performs the hardware writes, changes is a list of (key,
+    value) in the order the keys were first written. It is called on the
+    writer thread while holding lock. max_rate limits the number of flushes
+    per second, 0 writes through on the calling thread.
+    """
+
+    def __init__(self, flush, lock, max_rate=50):
+        self._flush = flush
+        self._lock = lock
+        self.max_rate = max_rate
+        self._pending = collections.OrderedDict()
+        self._state = {}
+        self._changed = threading.Condition()
+        self._next_flush = 0
+        self.received = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        if max_rate > 0:
+            threading.Thread(target=self._run, name='actuators', daemon=True).start()
+
+    def write(self, key, value):
+        """
+        Request actuator key to be set to value. Does not block, unless the
+        writer writes through.
+        """
+        with self._changed:
+            self.received += 1
+            if key in self._pending:
+                # replaced before it reached the hardware
+                self.coalesced += 1
+                del self._pending[key]
+            if key in self._state and self._state[key] == value:
+                self.skipped += 1
+                return
+            if self.max_rate > 0:
+                self._pending[key] = value
+                self._changed.notify()
+                return
+        with self._lock:
+            self._write([(key, value)])
+
+    def forget(self, *keys):
+        """
+        Keys were written by other means: drop their pending values and
+        their last flushed state.
+        """
+        with self._changed:
+            for key in keys:
+                self._pending.pop(key, None)
+                self._state.pop(key, None)
+
+    def to_dict(self):
+        with self._changed:
+            return {
+                'received': self.received,
+                'coalesced': self.coalesced,
+                'skipped': self.skipped,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'pending': len(self._pending),
+                'max_rate': self.max_rate
+                }
+
+    def _write(self, changes):
+        # with self._lock held
+        try:
+            self._flush(changes)
+        except Exception as e:
+            with self._changed:
+                self.errors += 1
+            sys.stderr.write("Actuator write failed: {}\n".format(e))
+            return
+        with self._changed:
+            for key, value in changes:
+                self._state[key] = value
+            self.flushed += len(changes)
+            self.flushes += 1
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+                delay = self._next_flush - time.monotonic()
+                if delay > 0:
+                    # more writes may be coalesced meanwhile
+                    self._changed.wait(delay)
+                    continue
+                self._next_flush = time.monotonic() + 1.0 / self.max_rate
+            with self._lock:
+                # taken with the lock held, so a forget() either drops the
+                # values or comes after the flush
+                with self._changed:
+                    changes = list(self._pending.items())
+                    self._pending.clear()
+                if changes:
+                    self._write(changes)
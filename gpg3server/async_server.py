@@ -0,0 +1,397 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# HTTP server based on asyncio, alternative to ThreadingHTTPServer.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ThreadingHTTPServer uses one thread per connection, and an M-JPEG viewer
+# keeps its connection, and thread, for as long as it watches. This server
+# handles all connections on one event loop:
+#
+# - The request (head and body) is read on the event loop. It is then
+#   handled by the regular request handler class on a thread of a bounded
+#   pool, with the request bytes as input and the response collected in
+#   memory. All routes therefore behave exactly as with the threaded server,
+#   and the blocking easygopigo3 calls never run on the event loop.
+#   Requests wait for a thread in a queue per scheduler class (see
+#   scheduler.py), a stop request is taken before queued reads. A request
+#   finding the queue of its class full is answered with 503. Requests
+#   that wait for a manoeuvre to finish (?wait=true) run on threads of
+#   their own instead, so they cannot hold all workers while a stop request
+#   waits.
+# - /camera.mjpg is streamed from the event loop. The camera thread wakes
+#   the loop when a frame arrives, no thread is held per viewer.
+# - /v1/telemetry/stream is sent from the event loop as well, woken by the
+#   telemetry sampler thread.
+# - /v1/ws WebSocket connections are read on the event loop, the session
+#   runs commands on threads of its own (see websocket.Session).
+#
+# Connections stay open as long as the request handler allows (keep-alive,
+# see GPG3ServerHTTPRequestHandler.timeout), pipelined requests are handled
+# one after the other.
+
+import asyncio
+import email.utils
+import http.client
+import io
+import socket
+import urllib.parse
+
+import camera
+import scheduler
+import telemetry
+import websocket
+
+# longest request head accepted
+MAX_HEAD_SIZE = 65536
+
+# largest request body accepted
+MAX_BODY_SIZE = 1024 * 1024
+
+class AsyncHTTPServer:
+    """
+    Serves handler_class (GPG3ServerHTTPRequestHandler, which provides
+    handle_in_memory(), request_priority(), request_waits() and
+    create_websocket_session()) on server_address. Handlers run on at most max_workers threads,
+    queue_limits is the most requests waiting per scheduler class, and
+    max_waiting the most requests waiting for a manoeuvre (0 for no
+    limit). A connection is closed if the client does not send a
+    request within handler_class.timeout seconds.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers=8,
+                 queue_limits=(0, 0, 0, 0), max_waiting=0):
+        self.handler_class = handler_class
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(128)
+        self.server_address = self.socket.getsockname()
+        self.pool = scheduler.WorkerPool(max_workers, queue_limits, scheduler.CLASSES, 'http')
+        self.waiting = scheduler.WaitingThreads(max_waiting, 'http-waiting')
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def server_close(self):
+        self.socket.close()
+        self.pool.shutdown()
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle_connection,
+            sock=self.socket, limit=MAX_HEAD_SIZE)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        requests_on_connection = 0
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader),
+                                                     self.handler_class.timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ValueError, ConnectionError):
+                    return
+                if request is None:
+                    return
+                requests_on_connection += 1
+
+                requestline, headers, head, body = request
+                if _request_path(requestline) == '/v1/ws' and \
+                        websocket.is_upgrade_request(headers):
+                    await self._measure_stream('handle_websocket',
+                        self._serve_websocket(reader, writer, client_address,
+                                              requestline, headers))
+                    return
+
+                subscription = self._open_telemetry_stream(requestline)
+                if subscription is not None:
+                    await self._measure_stream('send_telemetry_stream',
+                        self._stream_telemetry(writer, client_address, requestline,
+                                               headers, subscription))
+                    return
+
+                profile = _camera_stream_profile(requestline)
+                if profile is not None:
+                    await self._measure_stream('get_mjpeg_stream',
+                        self._stream_camera(writer, client_address, requestline, profile))
+                    return
+
+                try:
+                    if self.handler_class.request_waits(requestline):
+                        future = self.waiting.submit(self.handler_class.handle_in_memory,
+                            self, client_address, head + body, requests_on_connection)
+                    else:
+                        future = self.pool.submit(
+                            self.handler_class.request_priority(requestline),
+                            self.handler_class.handle_in_memory, self, client_address,
+                            head + body, requests_on_connection)
+                    response, close = await asyncio.wrap_future(future)
+                except scheduler.QueueFull as e:
+                    self._log(client_address, '"%s" rejected: %s' % (requestline, e))
+                    response, close = error_response(503, str(e),
+                        {'Retry-After': scheduler.retry_after(e.retry_after)}), True
+                writer.write(response)
+                await writer.drain()
+                if close:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _run(self, priority, fn, *args):
+        """
+        Run fn(*args) on a worker, return an awaitable of the result.
+        Raises QueueFull if the queue of priority is full.
+        """
+        return asyncio.wrap_future(self.pool.submit(priority, fn, *args))
+
+    async def _measure_stream(self, route, stream):
+        """
+        Await stream, a coroutine that returns the response status, counted
+        in the request metrics of route like the request handler does.
+        """
+        route_metrics = self.handler_class.route_metrics(route)
+        route_metrics.begin()
+        status = 0
+        try:
+            status = await stream
+        finally:
+            route_metrics.end(status)
+
+    def _log(self, client_address, message):
+        self.handler_class.log_client_message(client_address, message)
+
+    async def _read_request(self, reader):
+        """
+        Return (request line, headers, head, body), None if the client
+        closed the connection without sending a request.
+        """
+        head = await reader.readuntil(b'\r\n\r\n')
+        requestline, _, header_bytes = head.partition(b'\r\n')
+        if not requestline:
+            return None
+        headers = http.client.parse_headers(io.BytesIO(header_bytes))
+        length = int(headers.get('Content-Length', 0))
+        if length < 0 or length > MAX_BODY_SIZE:
+            raise ValueError("Invalid Content-Length")
+        body = await reader.readexactly(length) if length else b''
+        return requestline.decode('iso-8859-1'), headers, head, body
+
+    def _open_telemetry_stream(self, requestline):
+        # invalid stream requests are left to the request handler, which
+        # reports the error
+        words = requestline.split()
+        if len(words) != 3 or words[0] != 'GET':
+            return None
+        url = urllib.parse.urlsplit(words[1])
+        if url.path != '/v1/telemetry/stream':
+            return None
+        try:
+            return self.handler_class.open_telemetry_stream(url.query)
+        except ValueError:
+            return None
+
+    async def _stream_telemetry(self, writer, client_address, requestline, headers, subscription):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def on_change():
+            if not changed.is_set():
+                try:
+                    loop.call_soon_threadsafe(changed.set)
+                except RuntimeError:
+                    # event loop already closed
+                    pass
+
+        subscription.on_change = on_change
+        try:
+            origin = ''
+            if headers.get('Origin') is not None:
+                origin = 'Access-Control-Allow-Origin: {}\r\n'.format(headers['Origin'])
+            writer.write((
+                '{} 200 OK\r\n'
+                'Date: {}\r\n'
+                'Connection: close\r\n'
+                '{}'
+                'Content-Type: text/event-stream; charset=UTF-8\r\n'
+                'Cache-Control: no-cache\r\n'
+                '\r\n').format(self.handler_class.protocol_version,
+                    email.utils.formatdate(usegmt=True), origin).encode())
+            # reads sources that have no sample yet
+            snapshot = await self._run(scheduler.TELEMETRY, subscription.snapshot)
+            writer.write(telemetry.sse_event(snapshot))
+            await writer.drain()
+
+            while True:
+                delay = subscription.update_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                changed.clear()
+                values = subscription.poll()
+                if values is None:
+                    try:
+                        await asyncio.wait_for(changed.wait(),
+                                               self.handler_class.STREAM_KEEP_ALIVE)
+                    except asyncio.TimeoutError:
+                        writer.write(telemetry.SSE_KEEP_ALIVE)
+                        await writer.drain()
+                    continue
+                writer.write(telemetry.sse_event(values))
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+        finally:
+            subscription.on_change = None
+            subscription.close()
+            self._log(client_address, '"%s" sent %d telemetry events, %d samples suppressed' % (
+                requestline, subscription.updates, subscription.suppressed))
+        return 200
+
+    async def _serve_websocket(self, reader, writer, client_address, requestline, headers):
+        loop = asyncio.get_running_loop()
+        writer.write((
+            '{} 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n'
+            '\r\n').format(self.handler_class.protocol_version,
+                websocket.accept_key(headers['Sec-WebSocket-Key'])).encode())
+
+        def send(data):
+            # called by the session's threads, and on the event loop
+            try:
+                loop.call_soon_threadsafe(writer.write, data)
+            except RuntimeError:
+                raise ConnectionResetError("Event loop closed")
+
+        session = self.handler_class.create_websocket_session(self, client_address, send)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data or not session.receive(data):
+                    break
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+            self._log(client_address, '"%s" WebSocket closed after %d commands, %d telemetry messages' % (
+                requestline, session.commands, session.pushed))
+        return 101
+
+    async def _stream_camera(self, writer, client_address, requestline, profile):
+        loop = asyncio.get_running_loop()
+        stream = camera.CameraMJPEGStream(profile)
+        try:
+            # may start the camera, which takes a while
+            await self._run(scheduler.TELEMETRY, stream.open)
+        except (camera.CameraBusyError, scheduler.QueueFull) as e:
+            writer.write(error_response(503, str(e)))
+            await writer.drain()
+            return 503
+
+        frame_ready = asyncio.Event()
+
+        def on_frame():
+            if not frame_ready.is_set():
+                try:
+                    loop.call_soon_threadsafe(frame_ready.set)
+                except RuntimeError:
+                    # event loop already closed
+                    pass
+
+        stream.set_frame_callback(on_frame)
+        try:
+            writer.write(
+                self.handler_class.protocol_version.encode() + b' 200 OK\r\n'
+                b'Date: ' + email.utils.formatdate(usegmt=True).encode() + b'\r\n'
+                b'Connection: close\r\n'
+                b'Age: 0\r\n'
+                b'Cache-Control: no-cache, private\r\n'
+                b'Pragma: no-cache\r\n'
+                b'Content-Type: multipart/x-mixed-replace; boundary=' +
+                camera.MJPEG_BOUNDARY.encode() + b'\r\n'
+                b'\r\n')
+            # drain() returns only when everything is sent, so a frame is
+            # not released while the transport still references its buffer
+            writer.transport.set_write_buffer_limits(high=0)
+
+            while True:
+                delay = stream.frame_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                frame_ready.clear()
+                frame = stream.get_frame(timeout=0)
+                if frame is None:
+                    await frame_ready.wait()
+                    continue
+                with frame:
+                    writer.writelines(camera.mjpeg_part(frame))
+                    await writer.drain()
+
+        except ConnectionError:
+            self._log(client_address, '"%s" ended with ConnectionError' % requestline)
+        finally:
+            stream.set_frame_callback(None)
+            self._log(client_address, '"%s" sent %d frames, dropped %d frames, first frame after %s s' % (
+                requestline, stream.sent, stream.dropped,
+                '-' if stream.first_frame_time is None else '%.3f' % stream.first_frame_time))
+            # the stop queue has no limit, closing is never rejected
+            await self._run(scheduler.STOP, stream.close)
+        return 200
+
+def _camera_stream_profile(requestline):
+    """
+    Return camera profile if requestline is a valid M-JPEG stream request,
+    else None. Invalid stream requests are left to the request handler,
+    which reports the error.
+    """
+    words = requestline.split()
+    if len(words) != 3 or words[0] != 'GET':
+        return None
+    url = urllib.parse.urlsplit(words[1])
+    if url.path != '/camera.mjpg':
+        return None
+    query = urllib.parse.parse_qs(url.query)
+    params = {name: values[-1] for name, values in query.items()
+              if name in {'profile', 'width', 'height', 'quality', 'framerate'}}
+    try:
+        return camera.make_profile(**params)
+    except ValueError:
+        return None
+
+def _request_path(requestline):
+    words = requestline.split()
+    if len(words) != 3:
+        return None
+    return urllib.parse.urlsplit(words[1]).path
+
+def error_response(status, message, headers={}):
+    body = message.encode()
+    return ('HTTP/1.0 {} {}\r\n'
+            'Connection: close\r\n'
+            '{}'
+            'Content-Type: text/plain; charset=UTF-8\r\n'
+            'Content-Length: {}\r\n'
+            '\r\n').format(status, http.client.responses[status],
+                ''.join('{}: {}\r\n'.format(name, value) for name, value in headers.items()),
+                len(body)).encode() + body
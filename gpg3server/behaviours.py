@@ -0,0 +1,377 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Closed-loop behaviours (drive until obstacle, avoid obstacles, follow
+# wall) run on the robot at a fixed rate.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A Scratch loop that reads the distance sensor and sets the motors reacts
+# at 5-10 Hz, limited by the network and Scratch's frame rate. Here the
+# loop runs on a thread of the server: every tick it reads the distance
+# sensor, asks the behaviour for motor speeds and writes them if they
+# changed.
+#
+# Ticks are scheduled at absolute times (start + n / rate), so the rate does
+# not drift. The delay between the scheduled and the actual start of a tick
+# is its jitter. A tick that takes longer than the period is an overrun;
+# ticks that are more than a period late are skipped, not run back to back.
+#
+# Only one behaviour runs at a time. It is a motor user like the motion
+# executor: any other motor operation preempts it, and motor commands are
+# issued holding the motor lock, after checking that the run was not
+# stopped.
+#
+# Behaviours are hardware independent. They are created with their
+# parameters, the tick period in seconds and the robot's turn rate in
+# radians per second for 1 percent speed difference between the wheels.
+# step() gets the distance in mm and returns the left and right motor speed
+# in percent of the default speed (negative for backward), or None when
+# done.
+
+import itertools
+import math
+import threading
+import time
+
+import metrics
+import routing
+import scheduler
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+STOPPED = 'stopped'
+PREEMPTED = 'preempted'
+FAILED = 'failed'
+
+# upper bounds in seconds of tick jitter
+JITTER_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+                  0.05, 0.1)
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+class DriveUntil:
+    """
+    Drive forward until the distance is less than distance mm, then stop.
+    """
+
+    SCHEMA = {
+        'speed': routing.Int(0, 100, optional=True, default=50),
+        'distance': routing.Int(0, 3000, optional=True, default=200)
+        }
+
+    def __init__(self, params, period, turn_rate):
+        self.params = params
+
+    def step(self, distance):
+        if distance < self.params['distance']:
+            return None
+        speed = self.params['speed']
+        return speed, speed
+
+class AvoidObstacles:
+    """
+    Drive forward; when the distance is less than distance mm, turn on the
+    spot towards direction until it is more than distance + clearance mm.
+    """
+
+    SCHEMA = {
+        'speed': routing.Int(0, 100, optional=True, default=50),
+        'distance': routing.Int(0, 3000, optional=True, default=250),
+        'clearance': routing.Int(0, 3000, optional=True, default=100),
+        'turn_speed': routing.Int(0, 100, optional=True, default=40),
+        'direction': routing.Enum('left', 'right', optional=True, default='right')
+        }
+
+    def __init__(self, params, period, turn_rate):
+        self.params = params
+        self.turning = False
+
+    def step(self, distance):
+        params = self.params
+        if self.turning:
+            self.turning = distance < params['distance'] + params['clearance']
+        else:
+            self.turning = distance < params['distance']
+        if not self.turning:
+            return params['speed'], params['speed']
+        turn = params['turn_speed']
+        return (turn, -turn) if params['direction'] == 'right' else (-turn, turn)
+
+class FollowWall:
+    """
+    Drive along a wall on side at distance mm, the distance sensor pointing
+    at the wall (e.g. turned by a servo), starting parallel to it.
+
+    Turning towards the wall makes the sensor look at it at an angle, so the
+    reading grows. The angle to the wall is estimated from the speeds sent
+    (dead reckoning), the reading corrected with it, and the speed
+    difference of the wheels is gain percent per mm of error minus
+    angle_gain percent per degree of angle, at most max_correction percent.
+    """
+
+    SCHEMA = {
+        'speed': routing.Int(0, 100, optional=True, default=40),
+        'distance': routing.Int(0, 3000, optional=True, default=200),
+        'side': routing.Enum('left', 'right', optional=True, default='right'),
+        'gain': routing.Float(0, 10, optional=True, default=0.1),
+        'angle_gain': routing.Float(0, 10, optional=True, default=0.5),
+        'max_correction': routing.Int(0, 100, optional=True, default=20)
+        }
+
+    def __init__(self, params, period, turn_rate):
+        self.params = params
+        self.period = period
+        self.turn_rate = turn_rate
+        # radians, positive towards the wall
+        self.angle = 0.0
+
+    def step(self, distance):
+        params = self.params
+        limit = params['max_correction']
+        error = distance * math.cos(self.angle) - params['distance']
+        # positive: steer towards the wall
+        correction = _clamp(error * params['gain'] - math.degrees(self.angle) * params['angle_gain'],
+                            -limit, limit)
+        # the wheels' speed difference is 2 * correction
+        self.angle += 2 * correction * self.turn_rate * self.period
+        if params['side'] == 'left':
+            correction = -correction
+        speed = params['speed']
+        return speed + correction, speed - correction
+
+BEHAVIOURS = {
+    'drive_until': DriveUntil,
+    'avoid_obstacles': AvoidObstacles,
+    'follow_wall': FollowWall
+    }
+
+class BehaviourRun:
+    """
+    One run of a behaviour with its timing statistics.
+    """
+
+    def __init__(self, id, name, behaviour, rate):
+        self.id = id
+        self.name = name
+        self.behaviour = behaviour
+        self.rate = rate
+        self.state = RUNNING
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.motor_writes = 0
+        self.jitter = metrics.Histogram(JITTER_BUCKETS)
+        self.max_jitter = 0.0
+        self.step_time = metrics.Histogram()
+        self.max_step_time = 0.0
+        self.distance = None
+        self.speeds = None
+        self._stop = threading.Event()
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait until run finished, return True if it did.
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'behaviour': self.name,
+            'parameters': self.behaviour.params,
+            'state': self.state,
+            'error': self.error,
+            'started': self.started,
+            'finished': self.finished,
+            'rate': self.rate,
+            'distance': self.distance,
+            'speeds': None if self.speeds is None else {
+                'left': self.speeds[0], 'right': self.speeds[1]},
+            'timing': {
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'motor_writes': self.motor_writes,
+                'jitter': dict(self.jitter.to_dict(), max=round(self.max_jitter, 6)),
+                'step': dict(self.step_time.to_dict(), max=round(self.max_step_time, 6))
+                }
+            }
+
+class BehaviourEngine:
+    """
+    Runs behaviours on a thread, rate ticks per second. motion_executor is
+    the motion.MotionExecutor the motor lock and preemption are shared
+    with, read_distance() returns the distance in mm.
+    """
+
+    def __init__(self, egpg3, motion_executor, read_distance, rate=50):
+        self.egpg3 = egpg3
+        self.motion_executor = motion_executor
+        self.read_distance = read_distance
+        self.rate = rate
+        # name -> parameters used by the next run, changed by
+        # set_parameters()
+        self.parameters = {name: routing.validate(cls.SCHEMA, {})
+                           for name, cls in BEHAVIOURS.items()}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._run = None
+        # totals of all runs, for /metrics
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = metrics.Histogram(JITTER_BUCKETS)
+        motion_executor.add_preempt_listener(self._preempted)
+
+    def set_parameters(self, name, params):
+        """
+        Update parameters of behaviour name (a validated subset), also of
+        a running run.
+        """
+        with self._lock:
+            self.parameters[name] = dict(self.parameters[name], **params)
+            run = self._run
+            if run is not None and run.name == name and run.state == RUNNING:
+                # the loop reads params once per step
+                run.behaviour.params = self.parameters[name]
+
+    def start(self, name):
+        """
+        Preempt motor operations and start behaviour name. Returns the
+        BehaviourRun.
+        """
+        # stops a running behaviour too, see _preempted()
+        self.motion_executor.preempt()
+        with self._lock:
+            behaviour = BEHAVIOURS[name](self.parameters[name], 1.0 / self.rate,
+                                         self._turn_rate())
+            run = BehaviourRun(next(self._ids), name, behaviour, self.rate)
+            self._run = run
+        thread = threading.Thread(target=self._main, args=(run,), name='behaviour', daemon=True)
+        thread.start()
+        return run
+
+    def stop(self, state=STOPPED):
+        """
+        Stop the running behaviour, return its BehaviourRun (None if none
+        was running). The caller takes care of the motors.
+        """
+        with self._lock:
+            run = self._run
+            if run is None or run.state != RUNNING:
+                return None
+            run.state = state
+            run._stop.set()
+        return run
+
+    def _preempted(self):
+        self.stop(PREEMPTED)
+
+    def _turn_rate(self):
+        egpg3 = self.egpg3
+        # mm per second of wheel speed difference, divided by the distance
+        # between the wheels
+        return egpg3.DEFAULT_SPEED / 100 * egpg3.WHEEL_CIRCUMFERENCE / 360 / \
+            egpg3.WHEEL_BASE_WIDTH
+
+    def current(self):
+        """
+        Return the running or last BehaviourRun, None if there was none.
+        """
+        return self._run
+
+    def _finish(self, run, state, error=None):
+        with self._lock:
+            if run.state == RUNNING:
+                run.state = state
+                run.error = error
+        with self.motion_executor.motor_lock:
+            if not run._stop.is_set():
+                self.egpg3.stop()
+        run.finished = time.time()
+        run._done.set()
+
+    def _main(self, run):
+        with scheduler.request_class(scheduler.MOTION, reject=False):
+            self._loop(run)
+
+    def _loop(self, run):
+        egpg3 = self.egpg3
+        period = 1.0 / run.rate
+        speeds = None
+        with self.motion_executor.motor_lock:
+            if run._stop.is_set():
+                run.finished = time.time()
+                run._done.set()
+                return
+            # remove limits a previous operation may have set, see
+            # /v1/motors/drive
+            egpg3.set_speed(egpg3.DEFAULT_SPEED)
+
+        next_tick = time.monotonic()
+        try:
+            while True:
+                delay = next_tick - time.monotonic()
+                if delay > 0 and run._stop.wait(delay) or run._stop.is_set():
+                    # whoever stopped the run takes care of the motors
+                    run.finished = time.time()
+                    run._done.set()
+                    return
+
+                start = time.monotonic()
+                jitter = start - next_tick
+                run.jitter.observe(jitter)
+                self.jitter.observe(jitter)
+                run.max_jitter = max(run.max_jitter, jitter)
+
+                run.distance = distance = self.read_distance()
+                output = run.behaviour.step(distance)
+                if output is None:
+                    self._finish(run, COMPLETED)
+                    return
+                new_speeds = tuple(int(_clamp(s, -100, 100) * egpg3.DEFAULT_SPEED / 100)
+                                   for s in output)
+                if new_speeds != speeds:
+                    with self.motion_executor.motor_lock:
+                        if run._stop.is_set():
+                            continue
+                        egpg3.set_motor_dps(egpg3.MOTOR_LEFT, new_speeds[0])
+                        egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, new_speeds[1])
+                    speeds = run.speeds = new_speeds
+                    run.motor_writes += 1
+
+                end = time.monotonic()
+                run.ticks += 1
+                self.ticks += 1
+                run.step_time.observe(end - start)
+                run.max_step_time = max(run.max_step_time, end - start)
+                if end - start > period:
+                    run.overruns += 1
+                    self.overruns += 1
+                next_tick += period
+                if end - next_tick >= period:
+                    missed = int((end - next_tick) / period)
+                    run.skipped += missed
+                    self.skipped += missed
+                    next_tick += missed * period
+        except Exception as e:
+            self._finish(run, FAILED, str(e))
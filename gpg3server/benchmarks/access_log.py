@@ -0,0 +1,134 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Request throughput with the request log off and on, runs without
+# hardware.
+#
+# Starts the server with simulated hardware once per log configuration,
+# with stderr redirected to a temporary file (like the journal under
+# systemd). Several clients poll the distance sensor and motor status over
+# persistent connections as fast as they can, like Scratch forever loops
+# do. Prints requests/sec, latency percentiles, the server's log counters
+# and the lines that ended up in the log.
+#
+# Usage: python3 benchmarks/access_log.py [--clients 4] [--seconds 5]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = ['/v1/sensors/I2C/distance/distance', '/v1/motors/status']
+
+CONFIGURATIONS = [
+    ('off', ['--access-log', 'off']),
+    ('all', ['--access-log-burst', '1000000000']),
+    ('all, repeats', []),
+    ('sampled', ['--access-log', 'sampled']),
+    ]
+
+def request(conn, method, path):
+    conn.request(method, path)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def client(port, end, latencies):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    i = 0
+    while time.monotonic() < end:
+        t = time.perf_counter()
+        status, _ = request(conn, 'GET', PATHS[i % len(PATHS)])
+        if status != 200:
+            raise RuntimeError("Unexpected status {}".format(status))
+        latencies.append(time.perf_counter() - t)
+        i += 1
+    conn.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(args, options):
+    with tempfile.TemporaryFile('w+') as log:
+        server = subprocess.Popen([sys.executable, 'gpg3server.py',
+            '--port', str(args.port),
+            '--server', args.server,
+            '--hardware', 'simulated'] + options,
+            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+                    request(conn, 'GET', '/ping')
+                    conn.close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError("Server did not start")
+                    time.sleep(0.1)
+
+            end = time.monotonic() + args.seconds
+            latencies = [[] for i in range(args.clients)]
+            threads = [threading.Thread(target=client, args=(args.port, end, latencies[i]))
+                       for i in range(args.clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+            status, body = request(conn, 'GET', '/v1/stats')
+            conn.close()
+        finally:
+            server.terminate()
+            server.wait()
+        log.seek(0)
+        lines = sum(1 for line in log)
+        return [l for client_latencies in latencies for l in client_latencies], \
+            json.loads(body.decode())['log'], lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Request log benchmark')
+    parser.add_argument('--port', type=int, default=8096)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print("{:<14} {:>10} {:>9} {:>9} {:>9} {:>11} {:>10} {:>8} {:>8}".format('',
+        'requests/s', 'p50 ms', 'p99 ms', 'queued', 'not sampled', 'suppressed',
+        'dropped', 'lines'))
+    for name, options in CONFIGURATIONS:
+        latencies, stats, lines = run(args, options)
+        print("{:<14} {:>10.1f} {:>9.3f} {:>9.3f} {:>9} {:>11} {:>10} {:>8} {:>8}".format(name,
+            len(latencies) / args.seconds,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000,
+            stats['queued'], stats['not_sampled'], stats['suppressed'], stats['dropped'],
+            lines))
+
+if __name__ == "__main__":
+    main()
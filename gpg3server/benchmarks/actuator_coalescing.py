@@ -0,0 +1,133 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Eye colour and motor updates with and without coalescing, runs without
+# hardware.
+#
+# Starts the server with simulated hardware (and a simulated SPI latency)
+# twice, once writing every request through (--actuator-rate 0) and once
+# coalescing. Several clients send eye colours and motor speeds derived from
+# a slowly changing "sensor" value as fast as they can, like Scratch forever
+# loops do. Prints requests/sec, latency percentiles and the server's
+# actuator counters.
+#
+# Usage: python3 benchmarks/actuator_coalescing.py [--clients 4] [--seconds 5]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def request(conn, method, path, data=None):
+    body = None if data is None else json.dumps(data)
+    conn.request(method, path, body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def client(port, end, latencies):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() < end:
+        # changes 10 times per second, so many requests repeat a value
+        sensor = int((time.monotonic() - start) * 10) % 100
+        if i % 2 == 0:
+            path, data = '/v1/eyes', {'red': sensor * 2, 'green': 0, 'blue': 255 - sensor * 2}
+        else:
+            path, data = '/v1/motors/set', {
+                'left_direction': 'forward', 'left_speed': sensor,
+                'right_direction': 'forward', 'right_speed': 100 - sensor}
+        t = time.perf_counter()
+        status, _ = request(conn, 'PUT' if path == '/v1/eyes' else 'POST', path, data)
+        if status != 204:
+            raise RuntimeError("Unexpected status {}".format(status))
+        latencies.append(time.perf_counter() - t)
+        i += 1
+    conn.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(args, actuator_rate):
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', args.server,
+        '--hardware', 'simulated',
+        '--simulated-spi-latency', str(args.spi_latency),
+        '--actuator-rate', str(actuator_rate)],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+                request(conn, 'GET', '/ping')
+                conn.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        end = time.monotonic() + args.seconds
+        latencies = [[] for i in range(args.clients)]
+        threads = [threading.Thread(target=client, args=(args.port, end, latencies[i]))
+                   for i in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+        request(conn, 'POST', '/v1/motors/stop')
+        status, body = request(conn, 'GET', '/v1/stats')
+        conn.close()
+        return [l for client_latencies in latencies for l in client_latencies], \
+            json.loads(body.decode())['actuators']
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Actuator coalescing benchmark')
+    parser.add_argument('--port', type=int, default=8095)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--spi-latency', type=float, default=0.002)
+    args = parser.parse_args()
+
+    print("{:<14} {:>10} {:>9} {:>9} {:>9} {:>10} {:>8} {:>8}".format('',
+        'requests/s', 'p50 ms', 'p99 ms', 'received', 'coalesced', 'skipped', 'flushed'))
+    for name, actuator_rate in (('write-through', 0), ('coalescing', 50)):
+        latencies, stats = run(args, actuator_rate)
+        print("{:<14} {:>10.1f} {:>9.3f} {:>9.3f} {:>9} {:>10} {:>8} {:>8}".format(name,
+            len(latencies) / args.seconds,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000,
+            stats['received'], stats['coalesced'], stats['skipped'], stats['flushed']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Drive until obstacle as a Scratch-style HTTP loop and as a server-side
+# behaviour, runs without hardware.
+#
+# Starts the server with simulated hardware. The robot starts in the centre
+# of a 2 x 2 m room, 1000 mm from the wall ahead, and drives towards it
+# until the distance is less than --distance mm:
+#
+#   http loop  the client polls the distance sensor and stops the motors,
+#              at most --client-rate times per second (Scratch runs its
+#              loops at up to 30 Hz, over WiFi often 5-10 Hz)
+#   behaviour  POST /v1/behaviours/drive_until/start?wait=true
+#
+# After each run the robot drives back to the start. Prints how far the
+# robot went past the target distance and, for the behaviour, its tick
+# jitter and overruns.
+#
+# Usage: python3 benchmarks/behaviour_loop.py [--speed 100] [--runs 3]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def request(conn, method, path, data=None):
+    body = None if data is None else json.dumps(data)
+    conn.request(method, path, body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    body = response.read()
+    if response.status >= 400:
+        raise RuntimeError("{} {}: {} {}".format(method, path, response.status, body))
+    return json.loads(body.decode()) if body else None
+
+def read_distance(conn):
+    return request(conn, 'GET', '/v1/sensors/I2C/distance/distance?max_age=0')['distance']
+
+def http_loop(conn, args):
+    period = 1.0 / args.client_rate
+    request(conn, 'POST', '/v1/motors/drive', {'direction': 'forward', 'speed': args.speed})
+    while True:
+        start = time.monotonic()
+        if read_distance(conn) < args.distance:
+            request(conn, 'POST', '/v1/motors/stop')
+            return None
+        time.sleep(max(0, period - (time.monotonic() - start)))
+
+def behaviour(conn, args):
+    request(conn, 'POST', '/v1/behaviours/drive_until/start?wait=true',
+            {'distance': args.distance, 'speed': args.speed})
+    return request(conn, 'GET', '/v1/behaviours/current')['timing']
+
+def main():
+    parser = argparse.ArgumentParser(description='Behaviour loop benchmark')
+    parser.add_argument('--port', type=int, default=8097)
+    parser.add_argument('--speed', type=int, default=100)
+    parser.add_argument('--distance', type=int, default=300)
+    parser.add_argument('--client-rate', type=float, default=10)
+    parser.add_argument('--behaviour-rate', type=float, default=50)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--hardware', 'simulated',
+        '--behaviour-rate', str(args.behaviour_rate),
+        '--no-access-log'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                conn = http.client.HTTPConnection('localhost', args.port, timeout=30)
+                request(conn, 'GET', '/ping')
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        start_distance = read_distance(conn)
+        print("{:<12} {:>12} {:>12} {:>10} {:>10} {:>9}".format('',
+            'stopped at', 'overshoot', 'jitter p99', 'max ms', 'overruns'))
+        for name, run in (('http loop', http_loop), ('behaviour', behaviour)):
+            for i in range(args.runs):
+                timing = run(conn, args)
+                distance = read_distance(conn)
+                row = "{:<12} {:>9} mm {:>9} mm".format(name, distance, args.distance - distance)
+                if timing is not None:
+                    row += " {:>10.3f} {:>10.3f} {:>9}".format(
+                        timing['jitter']['p99'] * 1000, timing['jitter']['max'] * 1000,
+                        timing['overruns'])
+                print(row)
+                # back to the start
+                request(conn, 'POST', '/v1/motors/drive?wait=true', {'direction': 'backward',
+                    'speed': 100, 'distance': start_distance - distance})
+        conn.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Load test for the MJPEG fan-out without camera hardware.
+#
+# A synthetic JPEG source feeds the frame broadcaster. Every simulated viewer
+# has its own socket pair: one thread sends the stream like the /camera.mjpg
+# handler does, the other end reads it at the viewer's speed. Some viewers
+# are deliberately slow. Prints per-viewer sent/dropped frame counts.
+#
+# Usage: python3 benchmarks/camera_fanout.py [--viewers 60] [--seconds 10]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import camera
+
+def sender(client, sock, stop):
+    while not stop.is_set():
+        frame = client.get_frame(timeout=0.5)
+        if frame is None:
+            continue
+        try:
+            with frame:
+                camera.send_buffers(sock, camera.mjpeg_part(frame))
+        except OSError:
+            break
+    sock.close()
+
+def reader(sock, delay, stop, received):
+    # read the stream, sleeping after every read to simulate a slow viewer
+    while not stop.is_set():
+        try:
+            data = sock.recv(8192)
+        except OSError:
+            break
+        if not data:
+            break
+        received[0] += data.count(b'--' + camera.MJPEG_BOUNDARY.encode())
+        if delay:
+            time.sleep(delay)
+    sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='MJPEG fan-out load test')
+    parser.add_argument('--viewers', type=int, default=60)
+    parser.add_argument('--slow-every', type=int, default=5,
+                        help='every n-th viewer is slow')
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--frame-size', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    broadcaster = camera._FrameBroadcaster()
+    output = camera._JPEGFrameOutputBuffer(broadcaster)
+    source = camera.SyntheticJPEGSource(output, framerate=args.framerate,
+                                        frame_size=args.frame_size)
+
+    stop = threading.Event()
+    viewers = []
+    threads = []
+    for i in range(args.viewers):
+        slow = args.slow_every > 0 and i % args.slow_every == 0
+        server_sock, client_sock = socket.socketpair()
+        client = broadcaster.register()
+        received = [0]
+        viewers.append((i, slow, client, received))
+        threads.append(threading.Thread(target=sender, args=(client, server_sock, stop)))
+        threads.append(threading.Thread(target=reader,
+            args=(client_sock, 0.05 if slow else 0, stop, received)))
+
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    source.start()
+    time.sleep(args.seconds)
+    source.stop()
+    stop.set()
+
+    print("frames produced: {}".format(source.frames))
+    print("{:>6} {:>5} {:>8} {:>8} {:>8}".format('viewer', 'slow', 'sent', 'dropped', 'received'))
+    total_sent = total_dropped = 0
+    for i, slow, client, received in viewers:
+        total_sent += client.sent
+        total_dropped += client.dropped
+        print("{:>6} {:>5} {:>8} {:>8} {:>8}".format(
+            i, 'yes' if slow else 'no', client.sent, client.dropped, received[0]))
+    print("total sent: {}, total dropped: {}".format(total_sent, total_dropped))
+    print("frame ring slots: {}".format(len(output.ring)))
+
+if __name__ == "__main__":
+    main()
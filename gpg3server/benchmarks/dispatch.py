@@ -0,0 +1,96 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Micro-benchmark of request dispatch and parameter validation, runs without
+# hardware and without a server.
+#
+# Times GPG3ServerHTTPRequestHandler.routes.match() for typical request
+# paths, compared with trying every route one after the other (which is
+# what an if/elif chain does), and routing.validate() with the request body
+# schemas. Prints microseconds per call.
+#
+# Usage: python3 benchmarks/dispatch.py [--iterations 100000]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpg3server
+import routing
+
+REQUESTS = [
+    ('PUT', '/v1/eyes'),
+    ('PUT', '/v1/eyes/left'),
+    ('POST', '/v1/motors/set'),
+    ('GET', '/v1/sensors/I2C/distance/distance'),
+    ('GET', '/v1/servos/SERVO1/position'),
+    ('GET', '/v1/motors/commands/42'),
+    ('GET', '/v1/telemetry/distance'),
+    ('GET', '/scratch_extension.js')
+    ]
+
+VALIDATIONS = [
+    ('eyes', gpg3server.EYES_SCHEMA, {'red': 255, 'green': 128, 'blue': 0}),
+    ('drive', gpg3server.DRIVE_SCHEMA, {'direction': 'forward', 'speed': 50, 'distance': 100}),
+    ('motors/set', gpg3server.MOTORS_SET_SCHEMA, {'left_direction': 'forward', 'left_speed': 40,
+        'right_direction': 'backward', 'right_speed': 40}),
+    ('max_age query', gpg3server.GPG3ServerHTTPRequestHandler.MAX_AGE_SCHEMA, {'max_age': '100'})
+    ]
+
+def linear_match(compiled, method, path):
+    # every route in turn, like an if/elif chain
+    for route_method, regex, handler in compiled:
+        if route_method == method and regex.fullmatch(path):
+            return handler
+    return None
+
+def routes_of_assets(handler_class):
+    return [('GET', path, 'get_static_asset')
+            for path in sorted(handler_class.ALLOWED_TEXT_DOWNLOADS |
+                               handler_class.ALLOWED_BINARY_DOWNLOADS)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Dispatch micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    handler_class = gpg3server.GPG3ServerHTTPRequestHandler
+    routes = handler_class.routes
+    compiled = [(method, routing._compile(path)[0], handler)
+                for method, path, handler in handler_class.ROUTES]
+    compiled += [(method, routing._compile(path)[0], handler)
+                 for method, path, handler in routes_of_assets(handler_class)]
+
+    print("{:<40} {:>10} {:>10}".format('request', 'table us', 'linear us'))
+    for method, path in REQUESTS:
+        table = timeit.timeit(lambda: routes.match(method, path), number=args.iterations)
+        linear = timeit.timeit(lambda: linear_match(compiled, method, path), number=args.iterations)
+        print("{:<40} {:>10.3f} {:>10.3f}".format(method + ' ' + path,
+            table / args.iterations * 1e6, linear / args.iterations * 1e6))
+
+    print()
+    print("{:<40} {:>10}".format('validation', 'us'))
+    for name, schema, data in VALIDATIONS:
+        t = timeit.timeit(lambda: routing.validate(schema, data), number=args.iterations)
+        print("{:<40} {:>10.3f}".format(name, t / args.iterations * 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Fleet gateway against direct requests to every robot, runs without
+# hardware.
+#
+# Starts --robots servers with simulated hardware and synthetic cameras,
+# and the gateway in front of them. Then, like a teacher dashboard:
+#
+#   poll       read the distance sensor of every robot, one robot after
+#              the other, over a fresh connection per request (direct), or
+#              over one persistent connection to the gateway
+#   fan-out    stop all motors, one request per robot (direct), or one
+#              POST /fleet/all/v1/motors/stop
+#   cameras    --viewers clients watch the mosaic and every robot's
+#              relayed stream; the robots still serve one stream each
+#
+# Prints the time per round over all robots (p50/p99) and the gateway's
+# connection pool and camera figures.
+#
+# Usage: python3 benchmarks/fleet_gateway.py [--robots 4] [--rounds 200]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def request(conn, method, path):
+    conn.request(method, path)
+    response = conn.getresponse()
+    body = response.read()
+    if response.status >= 400:
+        raise RuntimeError("{} {}: {}".format(method, path, response.status))
+    return json.loads(body.decode()) if body else None
+
+def wait_for(port, path):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            conn = http.client.HTTPConnection('localhost', port, timeout=10)
+            request(conn, 'GET', path)
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Server at port {} did not start".format(port))
+            time.sleep(0.1)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def timed_rounds(rounds, fn):
+    times = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def fresh(port, method, path):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    request(conn, method, path)
+    conn.close()
+
+def viewer(port, path, end):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    while time.monotonic() < end:
+        if not response.read1(65536):
+            break
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fleet gateway benchmark')
+    parser.add_argument('--port', type=int, default=8100,
+        help='gateway port, the robots get the following ones')
+    parser.add_argument('--robots', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--viewers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5,
+        help='duration of the camera test')
+    args = parser.parse_args()
+
+    robot_ports = [args.port + 1 + i for i in range(args.robots)]
+    processes = []
+    try:
+        for port in robot_ports:
+            processes.append(subprocess.Popen([sys.executable, 'gpg3server.py',
+                '--port', str(port),
+                '--hardware', 'simulated',
+                '--camera', 'synthetic',
+                '--no-access-log'],
+                cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        gateway_args = [sys.executable, 'gpg3gateway.py', '--port', str(args.port),
+                        '--access-log', 'off']
+        for i, port in enumerate(robot_ports):
+            gateway_args += ['--robot', 'robot{}=localhost:{}'.format(i, port)]
+        processes.append(subprocess.Popen(gateway_args,
+            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for port in robot_ports:
+            wait_for(port, '/ping')
+        wait_for(args.port, '/fleet')
+
+        gateway = http.client.HTTPConnection('localhost', args.port, timeout=10)
+        distance = '/v1/sensors/I2C/distance/distance'
+        results = [
+            ('poll direct', timed_rounds(args.rounds, lambda: [
+                fresh(port, 'GET', distance) for port in robot_ports])),
+            ('poll gateway', timed_rounds(args.rounds, lambda: [
+                request(gateway, 'GET', '/fleet/robot{}{}'.format(i, distance))
+                for i in range(args.robots)])),
+            ('poll fan-out', timed_rounds(args.rounds, lambda:
+                request(gateway, 'GET', '/fleet/all' + distance))),
+            ('stop direct', timed_rounds(args.rounds, lambda: [
+                fresh(port, 'POST', '/v1/motors/stop') for port in robot_ports])),
+            ('stop fan-out', timed_rounds(args.rounds, lambda:
+                request(gateway, 'POST', '/fleet/all/v1/motors/stop'))),
+            ]
+        print("{} robots, time per round over all robots".format(args.robots))
+        print("{:<14} {:>9} {:>9}".format('', 'p50 ms', 'p99 ms'))
+        for name, times in results:
+            print("{:<14} {:>9.3f} {:>9.3f}".format(name, percentile(times, 50) * 1000,
+                                                    percentile(times, 99) * 1000))
+
+        end = time.monotonic() + args.seconds
+        paths = ['/fleet/camera.mjpg'] + ['/fleet/robot{}/camera.mjpg'.format(i)
+                                          for i in range(args.robots)]
+        threads = [threading.Thread(target=viewer, args=(args.port, path, end))
+                   for path in paths for i in range(args.viewers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        fleet = request(gateway, 'GET', '/fleet')
+        print("")
+        print("{:<10} {:>9} {:>9} {:>9} {:>16} {:>15}".format('', 'requests', 'opened',
+            'reused', 'camera connects', 'camera frames'))
+        for name, robot in sorted(fleet['robots'].items()):
+            pool, relay = robot['pool'], robot['camera']
+            print("{:<10} {:>9} {:>9} {:>9} {:>16} {:>15}".format(name, pool['requests'],
+                pool['opened'], pool['reused'], relay['connects'], relay['frames']))
+        print("{} viewers per stream; mosaic: {}".format(args.viewers, fleet['mosaic']))
+        gateway.close()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Micro-benchmark of the JSON backends, runs without hardware and without a
+# server.
+#
+# Times encoding of typical responses and decoding of typical request
+# bodies with every installed backend (json, ujson, orjson), and rendering
+# of the fixed-shape responses from their templates (Template.fill()).
+# Prints microseconds per call.
+#
+# Usage: python3 benchmarks/json_codec.py [--iterations 100000]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpg3server
+import jsoncodec
+
+MOTORS_STATUS = {
+    'left': {'flags': 0, 'power': 52, 'encoder': 5270, 'dps': 175},
+    'right': {'flags': 0, 'power': 54, 'encoder': 5624, 'dps': 174}
+    }
+
+RESPONSES = [
+    ('voltage', {'voltage': 9.434}, gpg3server.VOLTAGE_TEMPLATE),
+    ('distance', {'distance': 523}, gpg3server.DISTANCE_TEMPLATE),
+    ('motors status', MOTORS_STATUS, gpg3server.MOTORS_STATUS_TEMPLATE),
+    ('telemetry', {name: {'rate': 10, 'reads': 1234, 'errors': 0, 'age': 0.04,
+                          'latest': {'value': 523, 'timestamp': 1543000000.1}}
+                   for name in ('5v', 'battery', 'motors', 'distance')}, None)
+    ]
+
+REQUESTS = [
+    ('eyes', b'{"red":255,"green":128,"blue":0}'),
+    ('motors/set', b'{"left_direction":"forward","left_speed":40,'
+                   b'"right_direction":"backward","right_speed":40}'),
+    ('websocket command', b'{"id":7,"method":"PUT","path":"/v1/eyes",'
+                          b'"body":{"red":255,"green":0,"blue":0}}')
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON backend micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    backends = sorted(jsoncodec.BACKENDS)
+    print("{:<24}".format('encode') + ''.join("{:>10}".format(b) for b in backends)
+          + "{:>10}".format('template'))
+    for name, data, template in RESPONSES:
+        row = "{:<24}".format(name)
+        for backend in backends:
+            dumps = jsoncodec.BACKENDS[backend][0]
+            t = timeit.timeit(lambda: dumps(data), number=args.iterations)
+            row += "{:>10.3f}".format(t / args.iterations * 1e6)
+        if template is not None:
+            t = timeit.timeit(lambda: template.fill(data), number=args.iterations)
+            row += "{:>10.3f}".format(t / args.iterations * 1e6)
+        print(row)
+
+    print()
+    print("{:<24}".format('decode') + ''.join("{:>10}".format(b) for b in backends))
+    for name, body in REQUESTS:
+        row = "{:<24}".format(name)
+        for backend in backends:
+            loads = jsoncodec.BACKENDS[backend][1]
+            t = timeit.timeit(lambda: loads(body), number=args.iterations)
+            row += "{:>10.3f}".format(t / args.iterations * 1e6)
+        print(row)
+    print()
+    print("(microseconds per call)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Request latency with and without persistent connections, runs without
+# hardware.
+#
+# Starts the server with simulated hardware and sends eye colour updates
+# like a Scratch loop does, once opening a new connection per request and
+# once reusing one connection. Prints mean, p50 and p99 latency of both
+# runs and the connection statistics of the server.
+#
+# Usage: python3 benchmarks/keep_alive.py [--requests 2000] [--server asyncio]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def request(conn, i):
+    body = json.dumps({'red': i % 256, 'green': 0, 'blue': 0})
+    conn.request('PUT', '/v1/eyes', body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    if response.status != 204:
+        raise RuntimeError("Unexpected status {}".format(response.status))
+
+def run(port, count, keep_alive):
+    latencies = []
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    for i in range(count):
+        start = time.perf_counter()
+        if not keep_alive:
+            conn = http.client.HTTPConnection('localhost', port, timeout=10)
+        request(conn, i)
+        if not keep_alive:
+            conn.close()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep-alive benchmark')
+    parser.add_argument('--port', type=int, default=8092)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', args.server,
+        '--hardware', 'simulated'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+                conn.request('GET', '/ping')
+                conn.getresponse().read()
+                conn.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        print("{:<12} {:>9} {:>9} {:>9}".format('', 'mean ms', 'p50 ms', 'p99 ms'))
+        for name, keep_alive in (('close', False), ('keep-alive', True)):
+            latencies = run(args.port, args.requests, keep_alive)
+            print("{:<12} {:>9.3f} {:>9.3f} {:>9.3f}".format(name,
+                sum(latencies) / len(latencies) * 1000,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000))
+
+        conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+        conn.request('GET', '/v1/stats')
+        print("server: {}".format(conn.getresponse().read().decode()))
+        conn.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,563 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Load test: replays the traffic of typical clients against the server with
+# simulated hardware and a synthetic camera, runs without hardware.
+#
+# Scenarios (--scenarios, comma separated, default all), the number of
+# clients multiplied by --scale:
+#
+#   avoidance   4 Scratch projects like scratch_examples/Avoidance Demo.sb2:
+#               drive, read the distance sensor every frame until an
+#               obstacle is near, look left and right with the servo, turn
+#   rover       8 like Simple Manual Rover.sb2: read the distance sensor 4
+#               times a second and set the eyes, drive with the arrow keys
+#   systemtest  4 like System Test.sb2: keys toggling blinkers and eyes,
+#               drive 10 cm, turn 90 degrees, move the servo
+#   controller  4 controller.html users: load the page, click buttons
+#   camera      8 camera.html viewers of /camera.mjpg
+#   mixed       all of the above, half the clients each
+#
+# Scratch 2 runs blocks at 30 frames per second; a reporter (the distance)
+# or a command block takes at least one frame. Scratch clients send AJAX
+# requests from another origin, with a CORS pre-flight the first time a
+# method and path is used (the browser caches it). Requests go over
+# persistent connections.
+#
+# Every scenario gets a new server. Clients run for --warmup seconds before
+# figures are taken for --seconds. Reported per scenario: requests per
+# second and latency percentiles (requests with wait=true, which last as
+# long as the motion, only counted), camera frames per second and time to
+# first frame, and the server's CPU use (percent of one core) and memory
+# (RSS at the end, peak). Clients are seeded (--seed), so runs replay the
+# same traffic.
+#
+# --json writes the results to a file, --compare prints the change against
+# such a file of an earlier run.
+#
+# Usage: python3 benchmarks/loadtest.py [--scenarios rover,camera] [--seconds 10]
+#                                       [--json results.json] [--compare baseline.json]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scratch frame
+FRAME = 1 / 30
+
+# origin of the Scratch editor, requests from it are cross-origin
+SCRATCH_ORIGIN = 'http://scratchx.org'
+
+DISTANCE = '/v1/sensors/I2C/distance/distance'
+
+class Stats:
+    """
+    Figures of all clients of a scenario, recorded while recording is set.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recording = threading.Event()
+        # request kind (method and path without query) -> latencies
+        self.latencies = collections.defaultdict(list)
+        self.waits = 0
+        self.errors = 0
+        self.frames = 0
+        self.first_frame = []
+
+    def request(self, kind, latency, status, wait):
+        if not self.recording.is_set():
+            return
+        with self.lock:
+            if status == 0 or status >= 400:
+                self.errors += 1
+            elif wait:
+                self.waits += 1
+            else:
+                self.latencies[kind].append(latency)
+
+class Client:
+    """
+    One client with a persistent connection. Blocks like the client would
+    between its requests.
+    """
+
+    def __init__(self, port, stats, stop, rng, origin=None):
+        self.port = port
+        self.stats = stats
+        self.stop = stop
+        self.rng = rng
+        self.origin = origin
+        self.conn = None
+        self.preflighted = set()
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('localhost', self.port, timeout=30)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def send(self, method, path, data=None, headers=None):
+        """
+        Send request, return (status, Content-Type, body bytes), status 0 if
+        the request failed.
+        """
+        body = None if data is None else json.dumps(data)
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Type'] = 'application/json; charset=UTF-8'
+        if self.origin is not None:
+            headers['Origin'] = self.origin
+        try:
+            conn = self.connect()
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                self.close()
+            return response.status, response.getheader('Content-Type', ''), data
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0, '', b''
+
+    def request(self, method, path, data=None, headers=None):
+        """
+        Send request like the client does, record it, return the parsed
+        JSON response (None if there is none).
+        """
+        kind = method + ' ' + path.partition('?')[0]
+        if self.origin is not None and method != 'GET' and kind not in self.preflighted:
+            self.preflighted.add(kind)
+            start = time.perf_counter()
+            status, _, _ = self.send('OPTIONS', path, headers={
+                'Access-Control-Request-Method': method,
+                'Access-Control-Request-Headers': 'content-type'})
+            self.stats.request('OPTIONS', time.perf_counter() - start, status, False)
+        start = time.perf_counter()
+        status, content_type, body = self.send(method, path, data, headers)
+        self.stats.request(kind, time.perf_counter() - start, status, 'wait=true' in path)
+        if status == 200 and content_type.startswith('application/json'):
+            return json.loads(body.decode())
+        return None
+
+    def distance(self):
+        result = self.request('GET', DISTANCE)
+        return 0 if result is None else result['distance']
+
+    def block(self, method, path, data=None):
+        """
+        Scratch command block: the request, then the rest of the frame.
+        """
+        start = time.monotonic()
+        result = self.request(method, path, data)
+        self.sleep(FRAME - (time.monotonic() - start) % FRAME)
+        return result
+
+    def eyes(self, red, green, blue, path='/v1/eyes'):
+        # Scratch blocks take 0..100 percent
+        return self.block('PUT', path, {'red': red * 255 // 100, 'green': green * 255 // 100,
+                                        'blue': blue * 255 // 100})
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.stop.wait(seconds)
+
+    @property
+    def running(self):
+        return not self.stop.is_set()
+
+def avoidance(client):
+    client.origin = SCRATCH_ORIGIN
+    client.block('PUT', '/v1/servos/SERVO1/position?wait=true', {'position': 90})
+    while client.running:
+        client.block('POST', '/v1/motors/drive', {'direction': 'forward', 'speed': 50})
+        client.eyes(0, 10, 0)
+        # wait until distance < 30 cm, evaluated every frame
+        while client.running:
+            start = time.monotonic()
+            if client.distance() < 300:
+                break
+            client.sleep(FRAME - (time.monotonic() - start) % FRAME)
+        client.block('POST', '/v1/motors/stop')
+        client.eyes(10, 0, 0)
+        client.block('PUT', '/v1/servos/SERVO1/position?wait=true', {'position': 135})
+        left = client.distance()
+        client.block('PUT', '/v1/servos/SERVO1/position?wait=true', {'position': 45})
+        right = client.distance()
+        client.block('PUT', '/v1/servos/SERVO1/position?wait=true', {'position': 90})
+        if left < 400 and right < 400:
+            # the project stops here; turn around to keep going
+            client.block('POST', '/v1/motors/turn?wait=true',
+                         {'direction': 'left', 'speed': 30, 'angle': 180})
+        else:
+            client.block('POST', '/v1/motors/turn?wait=true',
+                         {'direction': 'left' if left > right else 'right', 'speed': 30,
+                          'angle': 45})
+
+ARROW_KEYS = [
+    ('/v1/motors/drive', {'direction': 'forward', 'speed': 50}),
+    ('/v1/motors/drive', {'direction': 'backward', 'speed': 50}),
+    ('/v1/motors/turn', {'direction': 'left', 'speed': 30}),
+    ('/v1/motors/turn', {'direction': 'right', 'speed': 30}),
+    ('/v1/motors/stop', None)
+    ]
+
+def rover(client):
+    client.origin = SCRATCH_ORIGIN
+    while client.running:
+        if client.distance() < 250:
+            client.block('POST', '/v1/motors/stop')
+            client.eyes(10, 0, 0)
+        else:
+            client.eyes(0, 10, 0)
+        client.sleep(0.25)
+        # a key press now and then
+        if client.rng.random() < 0.1:
+            path, data = client.rng.choice(ARROW_KEYS)
+            client.block('POST', path, data)
+
+def systemtest(client):
+    client.origin = SCRATCH_ORIGIN
+    rng = client.rng
+    blinkers = {'left': 'off', 'right': 'off'}
+    colours = [(0, 0, 0), (10, 0, 0), (0, 10, 0), (0, 0, 10)]
+    eyes = {'left': 0, 'right': 0}
+    servo = 90
+    while client.running:
+        client.sleep(rng.uniform(0.3, 1.5))
+        key = rng.randrange(10)
+        if key < 2:
+            side = rng.choice(['left', 'right'])
+            blinkers[side] = 'on' if blinkers[side] == 'off' else 'off'
+            client.block('PUT', '/v1/blinkers/' + side, {'state': blinkers[side]})
+        elif key < 4:
+            side = rng.choice(['left', 'right'])
+            eyes[side] = (eyes[side] + 1) % len(colours)
+            client.eyes(*colours[eyes[side]], path='/v1/eyes/' + side)
+        elif key == 4:
+            client.block('POST', '/v1/motors/drive?wait=true',
+                         {'direction': rng.choice(['forward', 'backward']), 'speed': 50,
+                          'distance': 100})
+        elif key == 5:
+            client.block('POST', '/v1/motors/turn?wait=true',
+                         {'direction': rng.choice(['left', 'right']), 'speed': 30,
+                          'angle': 90})
+        elif key == 6:
+            servo = {90: 180, 180: 0}.get(servo, 90)
+            client.block('PUT', '/v1/servos/SERVO1/position?wait=true', {'position': servo})
+        else:
+            path, data = rng.choice(ARROW_KEYS)
+            client.block('POST', path, data)
+
+CONTROLLER_PAGE = ['/controller.html', '/bootstrap/css/bootstrap.min.css',
+                   '/jquery/jquery-3.2.1.min.js', '/bootstrap/js/bootstrap.min.js',
+                   '/controller.js', '/favicon.ico']
+
+CONTROLLER_BUTTONS = [
+    ('GET', '/v1/platform/voltages/5v', None),
+    ('GET', '/v1/platform/voltages/battery', None),
+    ('GET', DISTANCE, None),
+    ('GET', '/v1/motors/status', None),
+    ('PUT', '/v1/blinkers', {'state': 'on'}),
+    ('PUT', '/v1/blinkers', {'state': 'off'}),
+    ('PUT', '/v1/eyes', {'red': 255, 'green': 0, 'blue': 0}),
+    ('PUT', '/v1/eyes/left', {'red': 0, 'green': 0, 'blue': 255}),
+    ('POST', '/v1/motors/drive', {'direction': 'forward', 'speed': 50}),
+    ('POST', '/v1/motors/turn', {'direction': 'left', 'speed': 30}),
+    ('POST', '/v1/motors/set', {'left_direction': 'forward', 'left_speed': 40,
+                                'right_direction': 'forward', 'right_speed': 60}),
+    ('POST', '/v1/motors/stop', None),
+    ('PUT', '/v1/servos/SERVO1/position', {'position': 45}),
+    ('PUT', '/v1/servos/SERVO1/position', {'position': 135})
+    ]
+
+def controller(client):
+    for path in CONTROLLER_PAGE:
+        client.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+    while client.running:
+        client.sleep(client.rng.uniform(0.2, 1.0))
+        client.request(*client.rng.choice(CONTROLLER_BUTTONS))
+
+def camera(client):
+    client.request('GET', '/camera.html', headers={'Accept-Encoding': 'gzip'})
+    while client.running:
+        conn = http.client.HTTPConnection('localhost', client.port, timeout=30)
+        try:
+            start = time.perf_counter()
+            conn.request('GET', '/camera.mjpg')
+            response = conn.getresponse()
+            if response.status != 200:
+                raise OSError("Status {}".format(response.status))
+            first = True
+            while client.running:
+                data = response.read1(65536)
+                if not data:
+                    break
+                frames = data.count(b'Content-Type: image/jpeg')
+                if not frames:
+                    continue
+                with client.stats.lock:
+                    # viewers connect during the warmup, their first frame
+                    # is counted anyway
+                    if first:
+                        client.stats.first_frame.append(time.perf_counter() - start)
+                    if client.stats.recording.is_set():
+                        client.stats.frames += frames
+                first = False
+        except (OSError, http.client.HTTPException):
+            if client.stats.recording.is_set():
+                with client.stats.lock:
+                    client.stats.errors += 1
+            client.sleep(1)
+        finally:
+            conn.close()
+
+ROLES = {
+    'avoidance': avoidance,
+    'rover': rover,
+    'systemtest': systemtest,
+    'controller': controller,
+    'camera': camera
+    }
+
+# scenario -> list of (role, clients)
+SCENARIOS = {
+    'avoidance': [('avoidance', 4)],
+    'rover': [('rover', 8)],
+    'systemtest': [('systemtest', 4)],
+    'controller': [('controller', 4)],
+    'camera': [('camera', 8)],
+    'mixed': [('avoidance', 2), ('rover', 4), ('systemtest', 2), ('controller', 2),
+              ('camera', 4)]
+    }
+
+def process_times(pid):
+    """
+    Return CPU seconds (user + system) of process pid.
+    """
+    with open('/proc/{}/stat'.format(pid)) as f:
+        # fields after the command name, which may contain spaces
+        fields = f.read().rpartition(')')[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def process_memory(pid):
+    """
+    Return (RSS, peak RSS) of process pid in KiB.
+    """
+    status = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.strip()
+    return int(status['VmRSS'].split()[0]), int(status['VmHWM'].split()[0])
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def start_server(args):
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', args.server,
+        '--hardware', 'simulated',
+        '--simulated-spi-latency', str(args.spi_latency),
+        '--simulated-i2c-latency', str(args.i2c_latency),
+        '--camera', 'synthetic',
+        # the clients stand in for machines of their own, but all have the
+        # same address
+        '--rate-limit', 'motion=0', '--rate-limit', 'actuators=0',
+        '--rate-limit', 'telemetry=0',
+        '--no-access-log'] + args.server_arg,
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+            conn.request('GET', '/ping')
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("Server did not start")
+            time.sleep(0.1)
+
+def run(name, args):
+    """
+    Run scenario name, return its results as dict.
+    """
+    server = start_server(args)
+    try:
+        stats = Stats()
+        stop = threading.Event()
+        threads = []
+        for role, count in SCENARIOS[name]:
+            for i in range(max(1, round(count * args.scale))):
+                client = Client(args.port, stats, stop,
+                                random.Random('{}-{}-{}'.format(args.seed, role, i)))
+                threads.append(threading.Thread(target=ROLES[role], args=(client,),
+                                                daemon=True))
+        for t in threads:
+            t.start()
+
+        time.sleep(args.warmup)
+        stats.recording.set()
+        cpu_start = process_times(server.pid)
+        start = time.monotonic()
+        time.sleep(args.seconds)
+        stats.recording.clear()
+        elapsed = time.monotonic() - start
+        cpu = process_times(server.pid) - cpu_start
+        rss, max_rss = process_memory(server.pid)
+
+        stop.set()
+        for t in threads:
+            t.join(5)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [l for values in stats.latencies.values() for l in values]
+    return {
+        'clients': len(threads),
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'waits': stats.waits,
+        'errors': stats.errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'frames_per_second': round(stats.frames / elapsed, 1),
+        'first_frame_p50_ms': ms(percentile(stats.first_frame, 50)),
+        'cpu_percent': round(cpu / elapsed * 100, 1),
+        'rss_kib': rss,
+        'max_rss_kib': max_rss,
+        'routes': {kind: {'requests': len(values), 'p50_ms': ms(percentile(values, 50)),
+                          'p99_ms': ms(percentile(values, 99))}
+                   for kind, values in sorted(stats.latencies.items())}
+        }
+
+# (key, heading, format) of the printed columns
+COLUMNS = [
+    ('requests_per_second', 'req/s', '{:>9.1f}'),
+    ('p50_ms', 'p50 ms', '{:>9.3f}'),
+    ('p99_ms', 'p99 ms', '{:>9.3f}'),
+    ('errors', 'errors', '{:>9}'),
+    ('frames_per_second', 'frames/s', '{:>9.1f}'),
+    ('cpu_percent', 'cpu %', '{:>9.1f}'),
+    ('rss_kib', 'rss KiB', '{:>9}'),
+    ('max_rss_kib', 'peak KiB', '{:>9}')
+    ]
+
+def print_result(name, result, baseline=None):
+    """
+    Print result of scenario name, and its change against the results of
+    an earlier run (dict scenario -> result) if given.
+    """
+    row = "{:<12}".format(name)
+    for key, _, fmt in COLUMNS:
+        row += '{:>9}'.format('-') if result[key] is None else fmt.format(result[key])
+    print(row)
+    if baseline is None or name not in baseline:
+        return
+    row = "{:<12}".format('  change')
+    for key, _, _ in COLUMNS:
+        old, new = baseline[name].get(key), result[key]
+        if old is None or new is None:
+            row += '{:>9}'.format('-')
+        elif old == 0:
+            row += '{:>9}'.format('=' if new == 0 else 'new')
+        else:
+            row += '{:>+8.1f}%'.format((new - old) / old * 100)
+    print(row)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Server load test')
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+        help='comma separated, of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1,
+        help='factor applied to the number of clients')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading')
+    parser.add_argument('--spi-latency', type=float, default=0.0001,
+        help='seconds per simulated SPI transaction')
+    parser.add_argument('--i2c-latency', type=float, default=0.001,
+        help='seconds per simulated I2C transaction')
+    parser.add_argument('--server-arg', action='append', default=[],
+        help='additional server argument, e.g. --server-arg=--json-backend=json')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    names = args.scenarios.split(',')
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error("Unknown scenario " + name)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['scenarios']
+
+    print("{:<12}".format('') + ''.join('{:>9}'.format(heading) for _, heading, _ in COLUMNS))
+    results = {}
+    for name in names:
+        results[name] = run(name, args)
+        print_result(name, results[name], baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'settings': vars(args),
+                'scenarios': results
+                }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Micro-benchmark of odometry integration, runs without hardware and
+# without a server.
+#
+# Records encoder traces of the simulated GoPiGo3 driving a random course
+# (straight segments, turns and arcs), sampled at 50 Hz like the encoders
+# telemetry source. The simulation runs on a simulated clock, so recording
+# is fast. Integrates the traces, stored in arrays like Odometry keeps them,
+# with the Python loop and, if installed, with NumPy, and feeds them sample by sample to Odometry.on_sample() as
+# the telemetry sampler does. Prints samples per second, and how far the
+# integrated end pose is from the simulated one.
+#
+# Usage: python3 benchmarks/odometry_integration.py [--lengths 1000,30000,300000]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import array
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import odometry
+import simulation
+import telemetry
+
+RATE = 50
+
+def record(length, seed=1):
+    """
+    Return encoder trace (arrays left, right) of length samples and the
+    simulated end pose (x, y, heading in radians).
+    """
+    rng = random.Random(seed)
+    # time advances by one sample period per sample
+    clock = [0.0]
+    robot = simulation.SimulatedEasyGoPiGo3(room=(1e9, 1e9), clock=lambda: clock[0])
+    left = array.array('q')
+    right = array.array('q')
+    segment_end = 0
+    for i in range(length):
+        if i >= segment_end:
+            robot.set_motor_dps(robot.MOTOR_LEFT, rng.randint(-300, 300))
+            robot.set_motor_dps(robot.MOTOR_RIGHT, rng.randint(-300, 300))
+            segment_end = i + rng.randint(RATE // 2, RATE * 3)
+        clock[0] = i / RATE
+        left.append(robot.get_motor_encoder(robot.MOTOR_LEFT))
+        right.append(robot.get_motor_encoder(robot.MOTOR_RIGHT))
+    return left, right, (robot.x, robot.y, robot.heading)
+
+def feed(left, right):
+    """
+    Feed trace to an Odometry sample by sample, return it.
+    """
+    odometer = odometry.Odometry(simulation.SimulatedEasyGoPiGo3, history=len(left))
+    for i, (l, r) in enumerate(zip(left, right)):
+        odometer.on_sample('encoders', telemetry.Sample({'left': l, 'right': r}, i / RATE, i / RATE))
+    return odometer
+
+def main():
+    parser = argparse.ArgumentParser(description='Odometry integration micro-benchmark')
+    parser.add_argument('--lengths', default='1000,30000,300000',
+        help='trace lengths in samples, comma separated')
+    args = parser.parse_args()
+
+    geometry = (simulation.SimulatedEasyGoPiGo3.WHEEL_CIRCUMFERENCE / 360,
+                simulation.SimulatedEasyGoPiGo3.WHEEL_BASE_WIDTH)
+    integrators = [('python', odometry.integrate_python)]
+    if odometry.numpy is not None:
+        integrators.append(('numpy', odometry.integrate_numpy))
+    else:
+        print("NumPy not installed")
+
+    print("{:>8} {:<10} {:>14} {:>10} {:>12}".format('samples', '', 'samples/s', 'ms',
+                                                    'end error mm'))
+    for length in [int(n) for n in args.lengths.split(',')]:
+        left, right, (x, y, _) = record(length)
+        for name, integrate in integrators:
+            start = time.perf_counter()
+            xs, ys, headings = integrate(left, right, *geometry)
+            elapsed = time.perf_counter() - start
+            error = math.hypot(xs[-1] - x, ys[-1] - y)
+            print("{:>8} {:<10} {:>14.0f} {:>10.3f} {:>12.1f}".format(length, name,
+                length / elapsed, elapsed * 1000, error))
+        start = time.perf_counter()
+        pose = feed(left, right).pose()
+        elapsed = time.perf_counter() - start
+        print("{:>8} {:<10} {:>14.0f} {:>10.3f} {:>12.1f}".format(length, 'on_sample',
+            length / elapsed, elapsed * 1000, math.hypot(pose['x'] - x, pose['y'] - y)))
+
+if __name__ == "__main__":
+    main()
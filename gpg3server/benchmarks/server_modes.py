@@ -0,0 +1,160 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Compares the threading and the asyncio server, runs without hardware.
+#
+# For each server mode the server is started with simulated hardware and a
+# synthetic camera. A number of clients keep M-JPEG streams open, the others
+# poll the distance sensor like a Scratch project does, together the given
+# number of concurrent connections. Prints the server's memory (RSS) and
+# thread count under load, and the latency of the polling requests.
+#
+# Usage: python3 benchmarks/server_modes.py [--connections 100] [--viewers 30]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get(port, path):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def viewer(port, stop, frames):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        conn.request('GET', '/camera.mjpg?profile=thumbnail')
+        response = conn.getresponse()
+        while not stop.is_set():
+            data = response.read1(65536)
+            if not data:
+                break
+            frames[0] += data.count(b'Content-Type: image/jpeg')
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def poller(port, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            status = get(port, '/v1/sensors/I2C/distance/distance')
+        except OSError:
+            continue
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        # a Scratch project polls roughly every 50 ms
+        time.sleep(0.05)
+
+def process_status(pid):
+    status = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.strip()
+    return int(status['VmRSS'].split()[0]), int(status['Threads'])
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(mode, args):
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', mode,
+        '--hardware', 'simulated',
+        '--camera', 'synthetic'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                get(args.port, '/ping')
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        rss_idle, _ = process_status(server.pid)
+
+        stop = threading.Event()
+        frames = [0]
+        latencies = []
+        threads = []
+        for i in range(args.connections):
+            if i < args.viewers:
+                t = threading.Thread(target=viewer, args=(args.port, stop, frames))
+            else:
+                t = threading.Thread(target=poller, args=(args.port, stop, latencies))
+            t.daemon = True
+            threads.append(t)
+            t.start()
+
+        time.sleep(args.seconds)
+        rss, threads_count = process_status(server.pid)
+        stop.set()
+        for t in threads:
+            t.join(2)
+
+        return {
+            'rss_idle': rss_idle,
+            'rss': rss,
+            'threads': threads_count,
+            'requests': len(latencies),
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'frames': frames[0]
+            }
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Server mode comparison')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--viewers', type=int, default=30,
+                        help='connections that are M-JPEG streams')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print("{:<10} {:>10} {:>10} {:>8} {:>9} {:>8} {:>8} {:>8}".format(
+        'server', 'idle KiB', 'load KiB', 'threads', 'requests', 'p50 ms', 'p99 ms', 'frames'))
+    for mode in ('threading', 'asyncio'):
+        r = run(mode, args)
+        print("{:<10} {:>10} {:>10} {:>8} {:>9} {:>8.1f} {:>8.1f} {:>8}".format(
+            mode, r['rss_idle'], r['rss'], r['threads'], r['requests'],
+            r['p50'], r['p99'], r['frames']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Stop latency under a read flood, runs without hardware.
+#
+# Starts the server with simulated hardware (I2C and SPI transactions take
+# --i2c-latency and --spi-latency seconds, by default slow enough that the
+# bus, not the CPU, is the bottleneck) and measures POST /v1/motors/stop,
+# sent every --interval seconds over a persistent connection:
+#
+#   idle       nothing else going on
+#   conns      --idle-connections persistent connections are open after a
+#              request each, as many clients sent half a request head
+#              (slowloris), and --streams clients watch the telemetry
+#              stream; they stay open for the flood. Every stop is sent on
+#              a new connection
+#   flood      --readers clients read the distance sensor, motor status,
+#              encoders and voltages with max_age=0 (a bus transaction
+#              each), as fast as they can, ignoring 429 and 503
+#
+# for each --server implementation. Prints stop latency (p50/p99/max),
+# reads served, rejected with 429 and 503, and the hardware queue figures
+# of /v1/stats. Exits with status 1 if a stop is not answered with 204 or
+# the p99 stop latency with open connections or under flood is above
+# --bound milliseconds.
+#
+# Usage: python3 benchmarks/stop_latency.py [--readers 30] [--seconds 10]
+#        [--idle-connections 100] [--streams 4]
+#        [--server threading --server asyncio] [--server-arg=--rate-limit=telemetry=0]
+#        [--server-dir path/to/other/checkout/gpg3server]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ_PATHS = [
+    '/v1/sensors/I2C/distance/distance?max_age=0',
+    '/v1/motors/status?max_age=0',
+    '/v1/telemetry/encoders?max_age=0',
+    '/v1/platform/voltages/battery?max_age=0',
+    '/v1/platform/voltages/5v?max_age=0'
+    ]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def wait_for(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            conn = http.client.HTTPConnection('localhost', port, timeout=10)
+            conn.request('GET', '/ping')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Server at port {} did not start".format(port))
+            time.sleep(0.1)
+
+def reader(port, index, stop, counts):
+    conn = None
+    i = index
+    while not stop.is_set():
+        path = READ_PATHS[i % len(READ_PATHS)]
+        i += 1
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('localhost', port, timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            counts[response.status] += 1
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            counts['errors'] += 1
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+def open_connections(port, idle, streams):
+    """
+    Return sockets of idle persistent connections after a request each,
+    idle connections that sent half a request head, and telemetry streams.
+    Responses are not read, so opening them does not wait for the server.
+    """
+    sockets = []
+    for i in range(idle):
+        sock = socket.create_connection(('localhost', port), timeout=30)
+        sock.sendall(b'GET /ping HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        sockets.append(sock)
+    for i in range(idle):
+        sock = socket.create_connection(('localhost', port), timeout=30)
+        sock.sendall(b'GET /v1/motors/status HTTP/1.1\r\nHo')
+        sockets.append(sock)
+    for i in range(streams):
+        sock = socket.create_connection(('localhost', port), timeout=30)
+        sock.sendall(b'GET /v1/telemetry/stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        sockets.append(sock)
+    return sockets
+
+def measure_stops(port, seconds, interval, reconnect=False):
+    """
+    Send stops for seconds, return list of latencies in seconds. With
+    reconnect, every stop is sent on a new connection.
+    """
+    conn = http.client.HTTPConnection('localhost', port, timeout=30)
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        if reconnect:
+            conn.close()
+            conn = http.client.HTTPConnection('localhost', port, timeout=30)
+        conn.request('POST', '/v1/motors/stop')
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 204:
+            raise RuntimeError("Stop answered with {}".format(response.status))
+        time.sleep(interval)
+    conn.close()
+    return latencies
+
+def stats(port):
+    conn = http.client.HTTPConnection('localhost', port, timeout=30)
+    conn.request('GET', '/v1/stats')
+    data = json.loads(conn.getresponse().read().decode())
+    conn.close()
+    return data
+
+def run(args, server):
+    process = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', server,
+        '--hardware', 'simulated',
+        '--simulated-spi-latency', str(args.spi_latency),
+        '--simulated-i2c-latency', str(args.i2c_latency),
+        '--no-access-log'] + args.server_arg,
+        cwd=args.server_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(args.port)
+        idle = measure_stops(args.port, min(args.seconds, 2), args.interval)
+        sockets = open_connections(args.port, args.idle_connections, args.streams)
+        conns = measure_stops(args.port, min(args.seconds, 2), args.interval, reconnect=True)
+
+        stop = threading.Event()
+        counts = collections.Counter()
+        readers = [threading.Thread(target=reader, args=(args.port, i, stop, counts))
+                   for i in range(args.readers)]
+        for t in readers:
+            t.start()
+        # let the flood build up
+        time.sleep(0.5)
+        start_counts = collections.Counter(counts)
+        flood = measure_stops(args.port, args.seconds, args.interval)
+        end_counts = collections.Counter(counts)
+        stop.set()
+        for t in readers:
+            t.join()
+        figures = stats(args.port)
+        for sock in sockets:
+            sock.close()
+    finally:
+        process.terminate()
+        process.wait()
+    counts = end_counts - start_counts
+    return idle, conns, flood, counts, figures.get('scheduler')
+
+def main():
+    parser = argparse.ArgumentParser(description='Stop latency under a read flood')
+    parser.add_argument('--port', type=int, default=8120)
+    parser.add_argument('--server', action='append', choices=['threading', 'asyncio'],
+        help='server implementation, can be repeated (default: both)')
+    parser.add_argument('--readers', type=int, default=30)
+    parser.add_argument('--idle-connections', type=int, default=100,
+        help='idle persistent connections, and as many sending half a request')
+    parser.add_argument('--streams', type=int, default=4,
+        help='telemetry stream clients')
+    parser.add_argument('--seconds', type=float, default=10,
+        help='duration of the flood measurement')
+    parser.add_argument('--interval', type=float, default=0.05,
+        help='seconds between stops')
+    parser.add_argument('--i2c-latency', type=float, default=0.01)
+    parser.add_argument('--spi-latency', type=float, default=0.002)
+    parser.add_argument('--bound', type=float, default=50,
+        help='p99 stop latency in ms with open connections or under flood above which '
+             'the test fails')
+    parser.add_argument('--server-arg', action='append', default=[],
+        help='extra server argument, can be repeated')
+    parser.add_argument('--server-dir', default=SERVER_DIR,
+        help='directory of gpg3server.py, e.g. of another checkout to compare')
+    args = parser.parse_args()
+
+    print("{:<10} {:<6} {:>7} {:>8} {:>8} {:>8} {:>9} {:>7} {:>7}".format(
+        'server', '', 'stops', 'p50 ms', 'p99 ms', 'max ms', 'reads/s', '429', '503'))
+    failed = False
+    for server in args.server or ['threading', 'asyncio']:
+        try:
+            idle, conns, flood, counts, scheduler = run(args, server)
+        except RuntimeError as e:
+            print("{:<10} FAILED: {}".format(server, e))
+            failed = True
+            continue
+        for name, latencies in (('idle', idle), ('conns', conns), ('flood', flood)):
+            line = "{:<10} {:<6} {:>7} {:>8.2f} {:>8.2f} {:>8.2f}".format(server, name,
+                len(latencies), percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, max(latencies) * 1000)
+            if name == 'flood':
+                line += " {:>9.0f} {:>7} {:>7}".format(counts[200] / args.seconds,
+                                                       counts[429], counts[503])
+            print(line)
+        if max(percentile(conns, 99), percentile(flood, 99)) * 1000 > args.bound:
+            failed = True
+        if scheduler is not None:
+            for name, queue in scheduler['hardware'].items():
+                print("{:<10} hardware queue {:<10} taken {:>7} peak {:>3} wait p99 {} s".format(
+                    '', name, queue['taken'], queue['peak'], queue['wait']['p99']))
+    if failed:
+        print("FAILED: stop rejected, or p99 stop latency with open connections or under flood "
+              "above {} ms".format(args.bound))
+        sys.exit(1)
+    print("p99 stop latency with open connections and under flood within {} ms".format(
+        args.bound))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Benchmark for the telemetry cache, runs without hardware.
+#
+# Starts the server with simulated hardware and bus latencies, then lets
+# a number of clients poll the sensor and status endpoints as fast as they
+# can. The first run bypasses the cache with max_age=0, so every request
+# reads the hardware like before the telemetry sampler existed. The second
+# run is served from the cache. Prints requests/sec and hardware
+# reads/sec (from /v1/telemetry) for both runs.
+#
+# Usage: python3 benchmarks/telemetry_cache.py [--clients 20] [--seconds 5]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = [
+    '/v1/sensors/I2C/distance/distance',
+    '/v1/motors/status',
+    '/v1/platform/voltages/battery'
+    ]
+
+def get(port, path):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, body
+    finally:
+        conn.close()
+
+def total_reads(port):
+    status, body = get(port, '/v1/telemetry')
+    return sum(source['reads'] for source in json.loads(body.decode('utf-8')).values())
+
+def client(port, query, stop, counts, index):
+    i = index
+    while not stop.is_set():
+        status, body = get(port, PATHS[i % len(PATHS)] + query)
+        if status == 200:
+            counts[index] += 1
+        i += 1
+
+def run(port, query, clients, seconds):
+    stop = threading.Event()
+    counts = [0] * clients
+    threads = [threading.Thread(target=client, args=(port, query, stop, counts, i))
+               for i in range(clients)]
+    reads_before = total_reads(port)
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    reads = total_reads(port) - reads_before
+    return sum(counts) / elapsed, reads / elapsed
+
+def wait_for_server(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            get(port, '/ping')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description='Telemetry cache benchmark')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--spi-latency', type=float, default=0.0005,
+                        help='seconds per simulated SPI transaction')
+    parser.add_argument('--i2c-latency', type=float, default=0.002,
+                        help='seconds per simulated I2C transaction')
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--hardware', 'simulated',
+        '--simulated-spi-latency', str(args.spi_latency),
+        '--simulated-i2c-latency', str(args.i2c_latency)],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(args.port)
+        print("{:<20} {:>12} {:>12}".format('', 'requests/s', 'reads/s'))
+        for name, query in (('uncached', '?max_age=0'), ('cached', '')):
+            requests_per_s, reads_per_s = run(args.port, query, args.clients, args.seconds)
+            print("{:<20} {:>12.1f} {:>12.1f}".format(name, requests_per_s, reads_per_s))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
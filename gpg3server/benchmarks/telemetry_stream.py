@@ -0,0 +1,157 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Load test for /v1/telemetry/stream, runs without hardware.
+#
+# Starts the server with simulated hardware, lets the robot drive in a
+# circle so distance and motor status keep changing, and opens a number of
+# Server-Sent Events streams with different field selections and rate
+# limits. Prints events received per client, hardware reads/sec (which do
+# not depend on the number of clients) and the server's memory and threads.
+#
+# Usage: python3 benchmarks/telemetry_stream.py [--clients 100] [--server asyncio]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (fields, rate) of the clients, used round robin
+CLIENT_KINDS = [
+    ('distance', 2),
+    ('distance', 10),
+    ('motors', 5),
+    ('distance,battery,5v', 1),
+    ('', 0)
+    ]
+
+def request(port, method, path, data=None):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        body = None if data is None else json.dumps(data)
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def total_reads(port):
+    status, body = request(port, 'GET', '/v1/telemetry')
+    return sum(source['reads'] for source in json.loads(body.decode()).values())
+
+def stream_client(port, fields, rate, stop, events):
+    query = []
+    if fields:
+        query.append('fields=' + fields)
+    if rate:
+        query.append('rate=' + str(rate))
+    conn = http.client.HTTPConnection('localhost', port, timeout=30)
+    try:
+        conn.request('GET', '/v1/telemetry/stream?' + '&'.join(query))
+        response = conn.getresponse()
+        while not stop.is_set():
+            line = response.readline()
+            if not line:
+                break
+            if line.startswith(b'data:'):
+                events[0] += 1
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def process_status(pid):
+    status = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.strip()
+    return int(status['VmRSS'].split()[0]), int(status['Threads'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Telemetry stream load test')
+    parser.add_argument('--port', type=int, default=8094)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='asyncio')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', args.server,
+        '--hardware', 'simulated'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                request(args.port, 'GET', '/ping')
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        # drive in a circle
+        request(args.port, 'POST', '/v1/motors/set', {
+            'left_direction': 'forward', 'left_speed': 40,
+            'right_direction': 'forward', 'right_speed': 20})
+
+        stop = threading.Event()
+        clients = []
+        for i in range(args.clients):
+            fields, rate = CLIENT_KINDS[i % len(CLIENT_KINDS)]
+            events = [0]
+            t = threading.Thread(target=stream_client,
+                                 args=(args.port, fields, rate, stop, events))
+            t.daemon = True
+            clients.append((fields, rate, events))
+            t.start()
+
+        reads_before = total_reads(args.port)
+        start = time.monotonic()
+        time.sleep(args.seconds)
+        elapsed = time.monotonic() - start
+        reads = total_reads(args.port) - reads_before
+        rss, threads = process_status(server.pid)
+        stop.set()
+
+        print("{:<22} {:>5} {:>8} {:>10}".format('fields', 'rate', 'clients', 'events/s'))
+        for fields, rate in CLIENT_KINDS:
+            counts = [events[0] for f, r, events in clients if (f, r) == (fields, rate)]
+            if counts:
+                print("{:<22} {:>5} {:>8} {:>10.2f}".format(fields or '(all)', rate or '-',
+                    len(counts), sum(counts) / len(counts) / elapsed))
+        total = sum(events[0] for f, r, events in clients)
+        print("total events/s: {:.1f}".format(total / elapsed))
+        print("hardware reads/s: {:.1f}".format(reads / elapsed))
+        print("server RSS: {} KiB, threads: {}".format(rss, threads))
+
+        request(args.port, 'POST', '/v1/motors/stop')
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Command latency over WebSocket compared to REST, runs without hardware.
+#
+# Starts the server with simulated hardware and sends eye colour updates,
+# once as REST requests the way $.ajax does from ScratchX (a CORS pre-flight
+# OPTIONS request plus the PUT, persistent connection) and once as commands
+# on the /v1/ws WebSocket, waiting for each reply before sending the next.
+# Prints commands/sec and round-trip percentiles of both, and the number of
+# telemetry messages received while subscribed.
+#
+# Usage: python3 benchmarks/websocket_latency.py [--commands 2000] [--server asyncio]
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websocket
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class WebSocketClient:
+    """
+    Minimal blocking client, enough for the benchmark.
+    """
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            'GET /v1/ws HTTP/1.1\r\n'
+            'Host: localhost\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            '\r\n').format(key).encode())
+        self.buffer = b''
+        while b'\r\n\r\n' not in self.buffer:
+            self.buffer += self.sock.recv(4096)
+        head, _, self.buffer = self.buffer.partition(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.1 101') or \
+                websocket.accept_key(key).encode() not in head:
+            raise RuntimeError("Handshake failed: " + head.decode())
+
+    def send(self, data):
+        payload = json.dumps(data).encode()
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x81, 0x80 | length)
+        else:
+            header = struct.pack('!BBH', 0x81, 0x80 | 126, length)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def _read(self, n):
+        while len(self.buffer) < n:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("Connection closed")
+            self.buffer += data
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def receive(self):
+        b0, b1 = self._read(2)
+        length = b1 & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read(8))[0]
+        payload = self._read(length)
+        return json.loads(payload.decode())
+
+    def close(self):
+        self.sock.close()
+
+def eyes(i):
+    return {'red': i % 256, 'green': 0, 'blue': 0}
+
+def run_rest(port, count):
+    latencies = []
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    for i in range(count):
+        start = time.perf_counter()
+        conn.request('OPTIONS', '/v1/eyes', headers={
+            'Origin': 'http://scratchx.org',
+            'Access-Control-Request-Method': 'PUT',
+            'Access-Control-Request-Headers': 'content-type'})
+        conn.getresponse().read()
+        conn.request('PUT', '/v1/eyes', json.dumps(eyes(i)), {
+            'Origin': 'http://scratchx.org',
+            'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 204:
+            raise RuntimeError("Unexpected status {}".format(response.status))
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+def run_websocket(port, count):
+    latencies = []
+    client = WebSocketClient(port)
+    for i in range(count):
+        start = time.perf_counter()
+        client.send({'id': i, 'method': 'PUT', 'path': '/v1/eyes', 'body': eyes(i)})
+        reply = client.receive()
+        if reply.get('id') != i or reply.get('status') != 204:
+            raise RuntimeError("Unexpected reply {}".format(reply))
+        latencies.append(time.perf_counter() - start)
+    client.close()
+    return latencies
+
+def run_telemetry(port, seconds):
+    client = WebSocketClient(port)
+    client.send({'type': 'subscribe', 'rate': 10, 'fields': ['motors', 'distance', 'battery']})
+    received = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        if client.receive().get('type') == 'telemetry':
+            received += 1
+    client.close()
+    return received
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket latency benchmark')
+    parser.add_argument('--port', type=int, default=8093)
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading')
+    parser.add_argument('--commands', type=int, default=2000)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, 'gpg3server.py',
+        '--port', str(args.port),
+        '--server', args.server,
+        '--hardware', 'simulated'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                conn = http.client.HTTPConnection('localhost', args.port, timeout=10)
+                conn.request('GET', '/ping')
+                conn.getresponse().read()
+                conn.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+        print("{:<10} {:>12} {:>9} {:>9}".format('', 'commands/s', 'p50 ms', 'p99 ms'))
+        for name, run in (('REST', run_rest), ('WebSocket', run_websocket)):
+            start = time.perf_counter()
+            latencies = run(args.port, args.commands)
+            elapsed = time.perf_counter() - start
+            print("{:<10} {:>12.1f} {:>9.3f} {:>9.3f}".format(name,
+                len(latencies) / elapsed,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000))
+
+        print("telemetry messages in 2 s at 10/s: {}".format(run_telemetry(args.port, 2)))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
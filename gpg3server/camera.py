@@ -18,68 +18,533 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
+import collections
+import socket
+import struct
 import threading
+import time
 
-import picamera
+try:
+    import picamera
+except ImportError:
+    # synthetic frames still work, see SyntheticJPEGSource
+    picamera = None
 
-class _JPEGFrameOutputBuffer:
+MJPEG_BOUNDARY = 'FRAME'
+
+# initial capacity of a frame slot, grown if a frame does not fit
+_SLOT_CAPACITY = 64 * 1024
+
+# slots preallocated per ring
+_RING_SIZE = 4
+
+class _FrameSlot:
+
+    def __init__(self, capacity):
+        self.data = bytearray(capacity)
+        # number of holders of the frame stored in this slot
+        self.refs = 0
+
+class Frame:
+    """
+    A published JPEG frame.
+
+    data is a read-only memoryview into a preallocated slot of the frame
+    ring, it is never copied. The slot is not reused until every holder
+    called release(). Use as context manager to release automatically.
+    """
+
+    __slots__ = ('data', 'seq', '_ring', '_slot')
+
+    def __init__(self, ring, slot, length):
+        self.data = memoryview(slot.data)[:length].toreadonly()
+        self.seq = 0
+        self._ring = ring
+        self._slot = slot
+
+    def __len__(self):
+        return len(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def acquire(self):
+        self._ring._acquire(self._slot)
+
+    def release(self):
+        self._ring._release(self._slot)
+
+class _FrameRing:
+    """
+    Small ring of preallocated frame slots. A slot is handed to the writer
+    only if no consumer holds the frame stored in it. If all slots are
+    busy, e.g. because of slow consumers, the ring grows.
+    """
+
+    def __init__(self, size=_RING_SIZE, capacity=_SLOT_CAPACITY):
+        self._slots = [_FrameSlot(capacity) for i in range(size)]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire_slot(self):
+        """
+        Return free slot for writing. The caller holds the only reference.
+        """
+        with self._lock:
+            n = len(self._slots)
+            for i in range(n):
+                slot = self._slots[(self._next + i) % n]
+                if slot.refs == 0:
+                    self._next = (self._next + i + 1) % n
+                    slot.refs = 1
+                    return slot
+            slot = _FrameSlot(len(self._slots[0].data))
+            slot.refs = 1
+            self._slots.append(slot)
+            return slot
+
+    def _acquire(self, slot):
+        with self._lock:
+            slot.refs += 1
+
+    def _release(self, slot):
+        with self._lock:
+            slot.refs -= 1
+
+    def __len__(self):
+        return len(self._slots)
+
+class _FrameClient:
+    """
+    Per-consumer slot that holds the latest frame not yet taken.
+
+    A newer frame replaces an unsent one, which is counted as dropped. A
+    consumer never gets the same frame twice and never waits if a frame it
+    has not seen is already available.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self.last_seq = 0
+        self.sent = 0
+        self.dropped = 0
+        # limit frame rate, skipped frames are not counted as dropped
+        self.min_interval = 0
+        self._last_time = 0
+        # called on the camera thread when a frame was offered, for
+        # consumers that do not block in get_frame()
+        self.on_frame = None
+
+    def _offer(self, frame):
+        frame.acquire()
+        with self._condition:
+            replaced = self._frame
+            self._frame = frame
+            if replaced is not None and not self._throttled():
+                self.dropped += 1
+            self._condition.notify()
+        if replaced is not None:
+            replaced.release()
+        on_frame = self.on_frame
+        if on_frame is not None:
+            on_frame()
+
+    def _throttled(self):
+        return self.min_interval and \
+            time.monotonic() - self._last_time < self.min_interval
+
+    def _discard(self):
+        with self._condition:
+            frame = self._frame
+            self._frame = None
+        if frame is not None:
+            frame.release()
+
+    def frame_delay(self):
+        """
+        Seconds until the frame rate limit allows the next frame.
+        """
+        if not self.min_interval:
+            return 0
+        return max(0, self._last_time + self.min_interval - time.monotonic())
+
+    def get_frame(self, timeout=None):
+        """
+        Return next Frame, or None if no frame arrived within timeout.
+
+        The caller needs to release() the frame after use.
+        """
+        delay = self.frame_delay()
+        if delay > 0:
+            time.sleep(delay)
+        with self._condition:
+            if self._frame is None:
+                self._condition.wait_for(lambda: self._frame is not None, timeout)
+                if self._frame is None:
+                    return None
+            frame = self._frame
+            self._frame = None
+            self.last_seq = frame.seq
+            self.sent += 1
+        self._last_time = time.monotonic()
+        return frame
+
+class _FrameBroadcaster:
+    """
+    Fan out frames to any number of _FrameClients.
+    """
 
     def __init__(self):
-        self.buffer = io.BytesIO()
+        self._clients = set()
+        self._lock = threading.Lock()
         self.frame = None
-        self.condition = threading.Condition()
+        self.seq = 0
+
+    def register(self):
+        client = _FrameClient()
+        with self._lock:
+            self._clients.add(client)
+            if self.frame is not None:
+                # a fresh frame is already there, no need to wait for the next
+                client._offer(self.frame)
+        return client
+
+    def unregister(self, client):
+        with self._lock:
+            self._clients.discard(client)
+        client._discard()
+
+    def publish(self, frame):
+        """
+        Publish frame to all clients. Takes over the caller's reference.
+        """
+        with self._lock:
+            self.seq += 1
+            frame.seq = self.seq
+            previous = self.frame
+            self.frame = frame
+            for client in self._clients:
+                client._offer(frame)
+        if previous is not None:
+            previous.release()
+
+    def reset(self):
+        """
+        Forget latest frame, e.g. when the camera stops.
+        """
+        with self._lock:
+            previous = self.frame
+            self.frame = None
+        if previous is not None:
+            previous.release()
+
+    def client_stats(self):
+        with self._lock:
+            clients = list(self._clients)
+        return [
+            {'sent': c.sent, 'dropped': c.dropped, 'last_seq': c.last_seq}
+            for c in clients
+            ]
+
+class _JPEGFrameOutputBuffer:
+    """
+    File-like object the encoder writes to. Copies the encoder output into a
+    slot of the frame ring, splits the stream into frames at the JPEG EOI
+    marker and publishes each complete frame.
+
+    The marker is searched in the slot, in the bytes just written, so
+    frames are found however the encoder splits its output into writes.
+
+    This is the only copy a frame's bytes go through before they are sent.
+    """
+
+    def __init__(self, broadcaster):
+        self.ring = _FrameRing()
+        self.broadcaster = broadcaster
+        self._slot = None
+        self._length = 0
 
     def write(self, b):
-        if b.startswith(b'\xff\xd8') and \
-           self.buffer.tell() > 0:
-            # new frame, existing buffer contains come content
-            # size buffer to current positon 
-            self.buffer.truncate()
-            with self.condition:
-                self.frame = self.buffer.getvalue()
-                self.condition.notify_all()
-            self.buffer.seek(0)
-        return self.buffer.write(b)
-
-    def get_frame(self):
-        with self.condition:
-            self.condition.wait()
-            return self.frame
+        n = len(b)
+        if b[:2] == b'\xff\xd8' and self._length > 0:
+            # new frame without EOI of the previous one (encoder restarted),
+            # publish what was collected so far
+            self._publish()
+        self._append(b)
+        # a marker may straddle two writes, start at the byte before
+        start = max(0, self._length - n - 1)
+        while True:
+            end = self._slot.data.find(b'\xff\xd9', start, self._length)
+            if end < 0:
+                break
+            # EOI marker, frame complete: publish now rather than when the
+            # next frame starts, that saves a frame interval of latency
+            end += 2
+            slot, length = self._slot, self._length
+            self._length = end
+            self._publish()
+            if end == length:
+                break
+            # the write went on with the next frame
+            self._append(memoryview(slot.data)[end:length])
+            start = 0
+        return n
+
+    def _append(self, b):
+        if self._slot is None:
+            self._slot = self.ring.acquire_slot()
+        end = self._length + len(b)
+        data = self._slot.data
+        if end > len(data):
+            # frame larger than slot, replace the slot's buffer (views of
+            # frames previously stored in it stay valid)
+            grown = bytearray(max(end, 2 * len(data)))
+            grown[:self._length] = memoryview(data)[:self._length]
+            self._slot.data = data = grown
+        data[self._length:end] = b
+        self._length = end
+
+    def _publish(self):
+        frame = Frame(self.ring, self._slot, self._length)
+        self._slot = None
+        self._length = 0
+        self.broadcaster.publish(frame)
+
+    def flush(self):
+        pass
+
+class CameraProfile:
+    """
+    Size, JPEG quality and maximum frame rate of a camera stream.
+
+    Streams with the same resolution and quality share one splitter port of
+    the camera, framerate only limits what is sent to a viewer.
+    """
+
+    def __init__(self, name, resolution, quality, framerate=None):
+        self.name = name
+        self.resolution = resolution
+        self.quality = quality
+        self.framerate = framerate
+
+    @property
+    def key(self):
+        return (self.resolution, self.quality)
+
+# predefined profiles, selectable with /camera.mjpg?profile=<name>
+PROFILES = {
+    'thumbnail': CameraProfile('thumbnail', (160, 120), 50),
+    'default': CameraProfile('default', (320, 240), 85, 10),
+    'high': CameraProfile('high', (640, 480), 90)
+    }
+
+# The camera has 4 splitter ports, each can record one resized stream.
+_SPLITTER_PORTS = range(4)
+
+class CameraBusyError(Exception):
+    """
+    Raised if a stream needs a splitter port and none is free.
+    """
+    pass
+
+def _create_picamera(resolution, framerate):
+    if picamera is None:
+        raise RuntimeError("picamera module not available")
+    return picamera.PiCamera(resolution=resolution, framerate=framerate)
+
+class _Recording:
+    """
+    A profile being recorded on a splitter port.
+    """
+
+    def __init__(self, port, broadcaster):
+        self.port = port
+        self.broadcaster = broadcaster
+        self.buffer = _JPEGFrameOutputBuffer(broadcaster)
+        self.consumers = 0
+        # without consumers, keep recording until this monotonic time
+        self.linger_until = 0
+        self.timer = None
 
 class _CameraManager:
+    """
+    Opens the camera when the first stream starts and closes it when the
+    last recording ends. Every distinct profile is recorded on its own
+    splitter port, started and stopped by reference count.
 
-    def __init__(self):
+    A recording without consumers keeps running for idle_linger seconds (or
+    longer if a snapshot asked for it), so a page reload or a restarted
+    Scratch project does not pay for sensor initialization again. With
+    always_on the default profile is never stopped.
+
+    Opening the camera takes seconds. It is done holding only
+    _camera_lock, which serializes starting and stopping; _lock, which
+    guards the recordings and is taken by stats(), is held just to publish
+    the result.
+    """
+
+    def __init__(self, resolution=(640, 480), framerate=15, camera_factory=None,
+                 snapshot_linger=10, idle_linger=5, always_on=False):
+        self.resolution = resolution
+        self.framerate = framerate
+        self.camera_factory = camera_factory or _create_picamera
+        self.snapshot_linger = snapshot_linger
+        self.idle_linger = idle_linger
+        self.always_on = always_on
         self.camera = None
-        self.buffer = None
-        self._consumers = 0
+        # profile key -> _FrameBroadcaster, kept while the server runs
+        self._broadcasters = {}
+        # profile key -> _Recording, while recording
+        self._recordings = {}
         self._lock = threading.Lock()
+        # taken before _lock, never while holding it
+        self._camera_lock = threading.Lock()
+        # time-to-first-frame of recent streams and snapshots, in seconds
+        self.first_frame_times = collections.deque(maxlen=100)
+
+    def broadcaster(self, profile):
+        with self._lock:
+            return self._get_broadcaster(profile)
+
+    def _get_broadcaster(self, profile):
+        broadcaster = self._broadcasters.get(profile.key)
+        if broadcaster is None:
+            broadcaster = _FrameBroadcaster()
+            self._broadcasters[profile.key] = broadcaster
+        return broadcaster
+
+    def inc_consumers(self, profile):
+        def add(recording):
+            recording.consumers += 1
+        self._with_recording(profile, add)
+
+    def dec_consumers(self, profile):
+        with self._lock:
+            recording = self._recordings.get(profile.key)
+            if recording is None:
+                return
+            if recording.consumers > 0:
+                recording.consumers -= 1
+            if recording.consumers == 0:
+                self._linger(profile, recording, self.idle_linger)
+
+    def hold(self, profile, linger):
+        """
+        Start profile recording if needed, and keep it running for at least
+        linger seconds from now even without consumers.
+        """
+        self._with_recording(profile,
+            lambda recording: self._linger(profile, recording, linger))
 
-    def inc_consumers(self):
+    def prestart(self, profile):
+        """
+        Start profile recording in the background, e.g. when a page that
+        will show the stream is requested.
+        """
+        def run():
+            try:
+                self.hold(profile, self.idle_linger)
+            except Exception:
+                # the stream request itself will report the problem
+                pass
+        threading.Thread(target=run, daemon=True).start()
+
+    def _with_recording(self, profile, fn):
+        """
+        Call fn(recording) holding _lock, with the recording of profile,
+        started first if needed.
+        """
         with self._lock:
-            if self._consumers == 0:
-                self._start_camera()
-            self._consumers += 1
+            recording = self._recordings.get(profile.key)
+            if recording is not None:
+                return fn(recording)
+        with self._camera_lock:
+            with self._lock:
+                # another thread may have started it while we waited
+                recording = self._recordings.get(profile.key)
+                if recording is not None:
+                    return fn(recording)
+                used_ports = {r.port for r in self._recordings.values()}
+                free_ports = [p for p in _SPLITTER_PORTS if p not in used_ports]
+                if not free_ports:
+                    raise CameraBusyError("All camera splitter ports in use")
+                camera = self.camera
+                recording = _Recording(free_ports[0], self._get_broadcaster(profile))
+            if camera is None:
+                camera = self.camera_factory(self.resolution, self.framerate)
+            try:
+                camera.start_recording(recording.buffer, format='mjpeg',
+                    splitter_port=recording.port, resize=profile.resolution,
+                    quality=profile.quality)
+            except:
+                if self.camera is None:
+                    camera.close()
+                raise
+            with self._lock:
+                self.camera = camera
+                self._recordings[profile.key] = recording
+                return fn(recording)
+
+    def _linger(self, profile, recording, linger):
+        if self.always_on and profile.key == PROFILES['default'].key:
+            return
+        recording.linger_until = max(recording.linger_until, time.monotonic() + linger)
+        if recording.timer is None:
+            self._arm_timer(profile, recording, recording.linger_until - time.monotonic())
 
-    def dec_consumers(self):
+    def _arm_timer(self, profile, recording, delay):
+        recording.timer = threading.Timer(delay, self._linger_expired, (profile, recording))
+        recording.timer.daemon = True
+        recording.timer.start()
+
+    def _linger_expired(self, profile, recording):
+        with self._camera_lock:
+            with self._lock:
+                recording.timer = None
+                if self._recordings.get(profile.key) is not recording or \
+                   recording.consumers > 0:
+                    return
+                remaining = recording.linger_until - time.monotonic()
+                if remaining > 0:
+                    # linger was extended in the meantime
+                    self._arm_timer(profile, recording, remaining)
+                    return
+                del self._recordings[profile.key]
+                camera = self.camera
+                if not self._recordings:
+                    self.camera = None
+            if camera is not None:
+                camera.stop_recording(splitter_port=recording.port)
+                if self.camera is None:
+                    camera.close()
+            # don't hand out a stale frame when the recording restarts
+            recording.broadcaster.reset()
+
+    def stats(self):
         with self._lock:
-            if self._consumers > 0:
-                self._consumers -= 1
-            if self._consumers == 0:
-                self._stop_camera()
-
-    def _start_camera(self):
-        self.camera = picamera.PiCamera(resolution=(320, 240), framerate=10)
-        self.buffer = _JPEGFrameOutputBuffer()
-        self.camera.start_recording(self.buffer, format='mjpeg')
-
-    def _stop_camera(self):
-        if self.camera != None:
-            self.camera.stop_recording()
-            self.camera.close()
-            self.camera = None
-        if self.buffer != None:
-            self.buffer = None
+            recordings = {
+                '{}x{}q{}'.format(key[0][0], key[0][1], key[1]): {
+                    'port': r.port,
+                    'consumers': r.consumers,
+                    'frames': r.broadcaster.seq,
+                    'viewers': r.broadcaster.client_stats()
+                    }
+                for key, r in self._recordings.items()
+                }
+            times = list(self.first_frame_times)
+        return {
+            'camera_open': self.camera is not None,
+            'recordings': recordings,
+            'time_to_first_frame': {
+                'last': times[-1] if times else None,
+                'avg': sum(times) / len(times) if times else None,
+                'max': max(times) if times else None
+                }
+            }
 
 _camera_mgr = None
 _camera_mgr_lock = threading.Lock()
@@ -92,14 +557,335 @@ def _get_camera_mgr():
                 _camera_mgr = _CameraManager()
     return _camera_mgr
 
+def configure(resolution=(640, 480), framerate=15, camera_factory=None,
+              snapshot_linger=10, idle_linger=5, always_on=False):
+    """
+    Configure camera before first use.
+
+    resolution and framerate are used to open the camera, profiles are
+    resized from it. camera_factory(resolution, framerate) returns an object
+    with the PiCamera recording interface, e.g. SyntheticPiCamera. Default
+    is picamera.PiCamera. snapshot_linger and idle_linger are the number of
+    seconds the camera keeps running after a snapshot or after the last
+    viewer left. With always_on the camera is started right away and the
+    default profile is never stopped, other profiles linger as usual.
+    """
+    global _camera_mgr
+    with _camera_mgr_lock:
+        _camera_mgr = _CameraManager(resolution, framerate, camera_factory,
+                                     snapshot_linger, idle_linger, always_on)
+    if always_on:
+        _camera_mgr.prestart(PROFILES['default'])
+
+def prestart(profile=None):
+    """
+    Start camera in the background, so a stream that is likely to be
+    requested soon does not wait for camera initialization.
+    """
+    _get_camera_mgr().prestart(profile or PROFILES['default'])
+
+def stats():
+    """
+    Return dict with camera state, per-viewer frame counts and
+    time-to-first-frame figures.
+    """
+    return _get_camera_mgr().stats()
+
+def make_profile(profile='default', width=None, height=None, quality=None, framerate=None):
+    """
+    Return CameraProfile for a predefined profile name, optionally with
+    width, height, quality or framerate overridden. Parameters may be
+    strings (e.g. from a query string). Raises ValueError if invalid.
+    """
+    if profile not in PROFILES:
+        raise ValueError("Unknown profile " + profile)
+    profile = PROFILES[profile]
+    if width is None and height is None and quality is None and framerate is None:
+        return profile
+
+    max_width, max_height = _get_camera_mgr().resolution
+
+    def to_int(param, value, low, high):
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError("Parameter {} not an int ({})".format(param, value))
+        if value < low or value > high:
+            raise ValueError("Parameter {} not in range {}..{} ({})".format(param, low, high, value))
+        return value
+
+    resolution = profile.resolution
+    if width is not None or height is not None:
+        if width is None or height is None:
+            raise ValueError("Parameters width and height need to be given together")
+        # the resizer requires multiples of 16 and 32
+        resolution = (to_int('width', width, 32, max_width) // 32 * 32,
+                      to_int('height', height, 16, max_height) // 16 * 16)
+    if quality is not None:
+        quality = to_int('quality', quality, 1, 100)
+    else:
+        quality = profile.quality
+    if framerate is not None:
+        framerate = to_int('framerate', framerate, 1, 90)
+    else:
+        framerate = profile.framerate
+
+    return CameraProfile('custom', resolution, quality, framerate)
+
 class CameraMJPEGStream:
 
+    def __init__(self, profile=None):
+        self.profile = profile or PROFILES['default']
+
     def __enter__(self):
-        _get_camera_mgr().inc_consumers()
+        self.open()
         return self
 
     def __exit__(self, type, value, traceback):
-        _get_camera_mgr().dec_consumers()
+        self.close()
+
+    def open(self):
+        """
+        Start receiving frames, starts camera if needed. Raises
+        CameraBusyError if no splitter port is available for the profile.
+        """
+        mgr = _get_camera_mgr()
+        self._opened = time.monotonic()
+        self.first_frame_time = None
+        self._broadcaster = mgr.broadcaster(self.profile)
+        self._client = self._broadcaster.register()
+        if self.profile.framerate:
+            self._client.min_interval = 1.0 / self.profile.framerate
+        try:
+            mgr.inc_consumers(self.profile)
+        except:
+            self._broadcaster.unregister(self._client)
+            raise
+
+    def close(self):
+        mgr = _get_camera_mgr()
+        self._broadcaster.unregister(self._client)
+        mgr.dec_consumers(self.profile)
+
+    def set_frame_callback(self, callback):
+        """
+        Call callback() on the camera thread whenever a frame arrives, None
+        removes it. Lets an event loop wait for frames, see frame_delay().
+        """
+        self._client.on_frame = callback
+
+    def frame_delay(self):
+        """
+        Seconds until the next frame may be taken without get_frame()
+        sleeping for the frame rate limit.
+        """
+        return self._client.frame_delay()
+
+    def get_frame(self, timeout=None):
+        """
+        Return next Frame, or None if no frame arrived within timeout. The
+        caller needs to release() it after use.
+        """
+        frame = self._client.get_frame(timeout)
+        if frame is not None and self.first_frame_time is None:
+            self.first_frame_time = time.monotonic() - self._opened
+            _get_camera_mgr().first_frame_times.append(self.first_frame_time)
+        return frame
+
+    @property
+    def sent(self):
+        return self._client.sent
+
+    @property
+    def dropped(self):
+        return self._client.dropped
+
+def take_snapshot(profile=None, timeout=5.0):
+    """
+    Return most recent Frame of profile, or None if the camera did not
+    deliver a frame within timeout seconds. The caller needs to release()
+    the frame after use.
+
+    If the profile is not streaming, the camera is started and kept running
+    for the configured linger period.
+    """
+    profile = profile or PROFILES['default']
+    mgr = _get_camera_mgr()
+    start = time.monotonic()
+    mgr.hold(profile, mgr.snapshot_linger)
+    broadcaster = mgr.broadcaster(profile)
+    # a registered client gets the latest frame right away, if there is one
+    client = broadcaster.register()
+    try:
+        frame = client.get_frame(timeout)
+    finally:
+        broadcaster.unregister(client)
+    if frame is not None:
+        mgr.first_frame_times.append(time.monotonic() - start)
+    return frame
+
+def frame_etag(profile, frame):
+    """
+    Return ETag for frame, based on profile and frame sequence number.
+    """
+    (width, height), quality = profile.key
+    return '"{}x{}q{}-{}"'.format(width, height, quality, frame.seq)
+
+def mjpeg_part(frame):
+    """
+    Return list of buffers that make up one part of the
+    multipart/x-mixed-replace stream: boundary, part headers, JPEG, CRLF.
+
+    frame is a Frame or any bytes-like object.
+    """
+    if isinstance(frame, Frame):
+        frame = frame.data
+    header = ('--' + MJPEG_BOUNDARY + '\r\n'
+              'Content-Type: image/jpeg\r\n'
+              'Content-Length: ' + str(len(frame)) + '\r\n'
+              '\r\n').encode()
+    return [header, frame, b'\r\n']
+
+def send_buffers(sock, buffers):
+    """
+    Send all buffers with as few system calls as possible (vectored I/O).
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    views = [memoryview(b).cast('B') for b in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        # drop fully sent buffers, trim partially sent one
+        while sent > 0:
+            n = len(views[0])
+            if sent >= n:
+                sent -= n
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+def synthetic_jpeg(width, height, comment=b''):
+    """
+    Build a valid baseline JPEG of the given size showing a uniform grey
+    area. comment is stored in a COM segment, e.g. to make frames distinct
+    or to pad them to a realistic size.
+    """
+    def segment(marker, payload):
+        return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+    blocks = ((width + 7) // 8) * ((height + 7) // 8)
+    # every block: DC difference 0 (code '0'), end of block (code '0')
+    bits = '00' * blocks
+    bits += '1' * (-len(bits) % 8)
+    scan = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+
+    jpeg = b'\xff\xd8'
+    jpeg += segment(0xe0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+    jpeg += segment(0xdb, b'\x00' + b'\x01' * 64)
+    jpeg += segment(0xc0, struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00')
+    jpeg += segment(0xc4, b'\x00' + b'\x01' + b'\x00' * 15 + b'\x00')
+    jpeg += segment(0xc4, b'\x10' + b'\x01' + b'\x00' * 15 + b'\x00')
+    while comment:
+        chunk, comment = comment[:65533], comment[65533:]
+        jpeg += segment(0xfe, chunk)
+    jpeg += segment(0xda, b'\x01\x01\x00\x00\x3f\x00')
+    jpeg += scan
+    jpeg += b'\xff\xd9'
+    return jpeg
+
+class SyntheticJPEGSource:
+    """
+    Stand-in for the camera's MJPEG encoder. Writes numbered synthetic JPEG
+    frames of roughly frame_size bytes to output at the given frame rate, in
+    chunks like the real encoder does.
+
+    Used for load tests without camera hardware.
+    """
+
+    def __init__(self, output, resolution=(320, 240), framerate=10,
+                 frame_size=15000, chunk_size=65536):
+        self.output = output
+        self.resolution = resolution
+        self.framerate = framerate
+        self.frame_size = frame_size
+        self.chunk_size = chunk_size
+        self.frames = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _make_frame(self):
+        width, height = self.resolution
+        comment = 'frame {}'.format(self.frames).encode()
+        frame = synthetic_jpeg(width, height, comment)
+        padding = self.frame_size - len(frame)
+        if padding > 0:
+            frame = synthetic_jpeg(width, height, comment + b' ' * padding)
+        return frame
+
+    def _run(self):
+        interval = 1.0 / self.framerate
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            frame = self._make_frame()
+            for i in range(0, len(frame), self.chunk_size):
+                self.output.write(frame[i:i + self.chunk_size])
+            self.frames += 1
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.monotonic()
+
+class SyntheticPiCamera:
+    """
+    Stand-in for picamera.PiCamera, supporting the recording interface used
+    by _CameraManager. Every splitter port gets its own
+    SyntheticJPEGSource. init_delay simulates sensor initialization.
+
+    Use with configure(camera_factory=SyntheticPiCamera).
+    """
+
+    def __init__(self, resolution=(640, 480), framerate=15, init_delay=0):
+        if init_delay:
+            time.sleep(init_delay)
+        self.resolution = resolution
+        self.framerate = framerate
+        self.closed = False
+        self._sources = {}
+
+    def start_recording(self, output, format='mjpeg', splitter_port=1,
+                        resize=None, quality=85):
+        if format != 'mjpeg':
+            raise ValueError("Only mjpeg format is supported")
+        if splitter_port in self._sources:
+            raise RuntimeError("Port {} already recording".format(splitter_port))
+        resolution = resize or self.resolution
+        # rough size of a real JPEG at this resolution and quality
+        frame_size = int(resolution[0] * resolution[1] * 0.2 * quality / 85)
+        source = SyntheticJPEGSource(output, resolution, self.framerate, frame_size)
+        self._sources[splitter_port] = source
+        source.start()
+
+    def stop_recording(self, splitter_port=1):
+        if splitter_port not in self._sources:
+            raise RuntimeError("Port {} not recording".format(splitter_port))
+        self._sources.pop(splitter_port).stop()
 
-    def get_frame(self):
-        return _get_camera_mgr().buffer.get_frame()
+    def close(self):
+        for port in list(self._sources):
+            self.stop_recording(port)
+        self.closed = True
@@ -0,0 +1,969 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Fleet Gateway
+#
+# One HTTP endpoint for several GoPiGo3 servers (gpg3server.py), e.g. the
+# robots of a classroom:
+#
+#     python3 gpg3gateway.py --robot alpha=192.168.1.21 --robot beta=192.168.1.22:8080
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# RESTful webservices (request/response format is JSON):
+#     GET  /fleet
+#          { "robots": { "alpha": { "url": "http://192.168.1.21:8080",
+#                                   "pool": { "idle": 2, "opened": 3, "reused": 840, ... },
+#                                   "camera": { "viewers": 1, "frames": 1234, ... } }, ... },
+#            "mosaic": { ... }, "telemetry": { ... } }
+#
+#     GET|PUT|POST|DELETE /fleet/{robot}/...
+#          e.g. GET /fleet/alpha/v1/motors/status
+#          Forwarded to the robot, the response is passed through. Streams
+#          (/v1/telemetry/stream, /camera.mjpg with parameters) get a
+#          connection of their own. WebSockets are not supported (501).
+#     GET|PUT|POST|DELETE /fleet/all/...
+#     GET|PUT|POST|DELETE /fleet/alpha,beta/...
+#          e.g. POST /fleet/all/v1/motors/stop
+#          Fan-out: forwarded to all (the listed) robots concurrently.
+#          { "results": { "alpha": { "status": 204 },
+#                         "beta": { "status": 200, "body": { ... } },
+#                         "gamma": { "status": 502, "error": "timed out" } } }
+#          Like /v1/batch, the response is 200 if the request was valid,
+#          the status of every robot is in the results. Fan-outs run on
+#          --fan-out-workers threads, except stop requests (STOP_PATHS) and
+#          requests with ?wait=true, which get a thread per robot so that a
+#          stop never waits behind a drive waiting to finish.
+#
+#     GET  /fleet/telemetry[?max_age=ms]
+#          { "robots": { "alpha": { "status": 200, "body": { ...GET /v1/telemetry... } },
+#                        "gamma": { "status": 502, "error": "..." } },
+#            "timestamp": 1543000000.1 }
+#          All robots' telemetry, fetched concurrently and cached for
+#          --telemetry-cache seconds (max_age limits the age). Concurrent
+#          requests share one fetch.
+#
+# Camera:
+#     /fleet/{robot}/camera.mjpg  Robot's camera as M-JPEG, relayed
+#     /fleet/camera.mjpg          Mosaic of all robots' cameras as M-JPEG
+#                                 (needs Pillow)
+#     /fleet/camera.html          Page with all robots' cameras
+#
+#     Every robot's camera is fetched once (GET /camera.mjpg?
+#     --camera-query), no matter how many viewers watch it directly or in
+#     the mosaic. Viewers get the latest frame, slow viewers skip frames.
+#     The upstream stream is closed --camera-linger seconds after the last
+#     viewer left. /fleet/{robot}/camera.mjpg with a query string is
+#     forwarded like other requests instead.
+#
+# Upstream connections are persistent: every robot has a pool of up to
+# --pool-size idle connections. Connections idle longer than
+# --upstream-idle seconds are closed (the servers' keep-alive timeout is 15
+# s); a request on a pooled connection the server closed in the meantime
+# is retried once on a new one. Requests wait --upstream-timeout seconds
+# for a robot, those with ?wait=true (a drive or turn answered when done)
+# --upstream-wait-timeout seconds. Forwarded streams are read with a
+# timeout of STREAM_TIMEOUT, above the keep-alive interval of the
+# telemetry stream.
+
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import http.server
+import io
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+try:
+    import PIL.Image
+    import PIL.ImageDraw
+except ImportError:
+    # no mosaic
+    PIL = None
+
+import camera
+import jsoncodec
+import requestlog
+import routing
+import scheduler
+
+# request headers forwarded to the robots
+FORWARDED_REQUEST_HEADERS = ('Accept', 'Content-Type', 'If-None-Match', 'If-Modified-Since',
+                             'Origin')
+
+# response headers not passed through, set by the gateway itself
+HOP_BY_HOP_HEADERS = frozenset(h.lower() for h in (
+    'Connection', 'Keep-Alive', 'Proxy-Authenticate', 'Proxy-Authorization', 'TE',
+    'Trailer', 'Transfer-Encoding', 'Upgrade', 'Server', 'Date'))
+
+# fleet names that are not robots
+RESERVED_NAMES = frozenset(('all', 'telemetry', 'camera.mjpg', 'camera.html'))
+
+ROBOT_NAME = re.compile(r'[A-Za-z0-9_-]+')
+
+# socket timeout in seconds of forwarded streams; the servers send an SSE
+# keep-alive every 15 s, M-JPEG frames several times a second
+STREAM_TIMEOUT = 60
+
+# paths of the robots' stop requests (scheduler.STOP class), fanned out
+# without waiting for a fan-out worker
+STOP_PATHS = frozenset(('/v1/motors/stop', '/v1/behaviours/stop'))
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class UpstreamError(Exception):
+    """
+    Robot not reachable or no valid response.
+    """
+
+class ConnectionPool:
+    """
+    Persistent HTTP connections to the server at host:port, at most size
+    idle ones. timeout is the socket timeout, connections idle longer than
+    idle_timeout seconds are not reused.
+    """
+
+    def __init__(self, host, port, size=4, timeout=5.0, idle_timeout=10.0):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # (connection, monotonic time it became idle), oldest first
+        self._idle = collections.deque()
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.expired = 0
+        self.retries = 0
+        self.errors = 0
+
+    def _get(self):
+        """
+        Return (connection, True if it was idle).
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+                self._idle.popleft()[0].close()
+                self.expired += 1
+            if self._idle:
+                # the most recently used one
+                self.reused += 1
+                return self._idle.pop()[0], True
+            self.opened += 1
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Send request, return the http.client.HTTPResponse. timeout is the
+        socket timeout of this request, by default the pool's. If the
+        response has a length, its body has been read into response.data
+        and the connection is back in the pool. Otherwise (a stream)
+        response.data is None, the caller reads the response and closes it.
+
+        Raises UpstreamError.
+        """
+        headers = headers or {}
+        with self._lock:
+            self.requests += 1
+        for attempt in range(2):
+            conn, idle = self._get()
+            conn.timeout = self.timeout if timeout is None else timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, path, body, headers)
+                # getresponse() drops conn.sock of a stream
+                sock = conn.sock
+                response = conn.getresponse()
+                if response.length is None and not response.will_close:
+                    # chunked, not sent by gpg3server
+                    response.data = response.read()
+                elif response.length is None:
+                    # the connection belongs to the response now
+                    sock.settimeout(STREAM_TIMEOUT)
+                    response.data = None
+                    return response
+                else:
+                    response.data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                # the server closed the idle connection before it got the
+                # request
+                if idle and attempt == 0:
+                    with self._lock:
+                        self.retries += 1
+                    continue
+                self._error()
+                raise UpstreamError(str(e) or type(e).__name__)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._error()
+                raise UpstreamError(str(e) or type(e).__name__)
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return response
+
+    def _error(self):
+        with self._lock:
+            self.errors += 1
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.popleft()[0].close()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'requests': self.requests,
+                'opened': self.opened,
+                'reused': self.reused,
+                'expired': self.expired,
+                'retries': self.retries,
+                'errors': self.errors
+                }
+
+class FrameSlot:
+    """
+    Latest JPEG frame (bytes) and its sequence number. Viewers wait for a
+    frame newer than the one they have; frames are shared, not copied.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+
+    def publish(self, frame):
+        with self._cond:
+            self.frame = frame
+            self.seq += 1
+            self._cond.notify_all()
+
+    def wait(self, seq, timeout=None):
+        """
+        Return (sequence number, frame) of a frame newer than seq, (seq,
+        None) after timeout seconds.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+            return self.seq, self.frame
+
+class _Shared:
+    """
+    Thread that runs while there are users, and linger seconds after the
+    last one left. Subclasses implement _run(), which returns when
+    _should_stop() is true.
+    """
+
+    name = 'shared'
+
+    def __init__(self, linger):
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._users = 0
+        self._idle_since = None
+        self._thread = None
+
+    def open(self):
+        with self._lock:
+            self._users += 1
+            self._idle_since = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._main, name=self.name, daemon=True)
+                self._thread.start()
+
+    def close(self):
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self._idle_since = time.monotonic()
+
+    @property
+    def users(self):
+        return self._users
+
+    def _should_stop(self):
+        with self._lock:
+            if self._users or time.monotonic() - self._idle_since < self.linger:
+                return False
+            # a user opening now starts a new thread
+            self._thread = None
+            return True
+
+    def _main(self):
+        self._run()
+
+class CameraRelay(_Shared):
+    """
+    Reads the M-JPEG stream at path of the robot at host:port into a
+    FrameSlot while there are viewers (open()/close()). Reconnects after
+    errors.
+    """
+
+    name = 'camera-relay'
+
+    # seconds between connection attempts
+    RETRY_INTERVAL = 2.0
+
+    def __init__(self, host, port, path, timeout=10.0, linger=5.0):
+        super().__init__(linger)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.slot = FrameSlot()
+        self.connects = 0
+        self.frames = 0
+        self.errors = 0
+        self.error = None
+
+    def _run(self):
+        while not self._should_stop():
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connects += 1
+                conn.request('GET', self.path)
+                response = conn.getresponse()
+                if response.status != 200:
+                    raise UpstreamError("{} {}".format(response.status, response.reason))
+                boundary = _multipart_boundary(response.getheader('Content-Type', ''))
+                while not self._should_stop():
+                    self.slot.publish(_read_part(response, boundary))
+                    self.frames += 1
+                    self.error = None
+                return
+            except (OSError, ValueError, http.client.HTTPException, UpstreamError) as e:
+                self.errors += 1
+                self.error = str(e) or type(e).__name__
+            finally:
+                conn.close()
+            time.sleep(self.RETRY_INTERVAL)
+
+    def to_dict(self):
+        return {
+            'viewers': self.users,
+            'running': self._thread is not None,
+            'connects': self.connects,
+            'frames': self.frames,
+            'errors': self.errors,
+            'error': self.error
+            }
+
+def _multipart_boundary(content_type):
+    m = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not content_type.startswith('multipart/') or m is None:
+        raise ValueError("Not a multipart response: " + content_type)
+    return m.group(1).encode()
+
+def _read_part(fp, boundary):
+    """
+    Read the next part of a multipart stream from fp, return its body.
+    Parts need a Content-Length header (gpg3server sends one).
+    """
+    line = fp.readline()
+    # CRLF ending the previous part
+    while line in (b'\r\n', b'\n'):
+        line = fp.readline()
+    if not line:
+        raise UpstreamError("Stream ended")
+    if line.strip() != b'--' + boundary:
+        raise ValueError("Expected boundary, got {!r}".format(line[:80]))
+    length = None
+    while True:
+        line = fp.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    if length is None:
+        raise ValueError("Part without Content-Length")
+    data = fp.read(length)
+    if len(data) < length:
+        raise UpstreamError("Stream ended")
+    return data
+
+class Mosaic(_Shared):
+    """
+    Composes the latest frames of relays (dict robot name -> CameraRelay)
+    into a grid of tiles of tile_size, columns wide, fps times per second
+    while there are viewers. Frames are decoded at reduced size where the
+    JPEG decoder can (draft mode); a tile is only decoded again when its
+    robot sent a new frame, and nothing is encoded when no tile changed.
+    """
+
+    name = 'mosaic'
+
+    def __init__(self, relays, tile_size=(320, 240), columns=None, fps=5, quality=75,
+                 linger=5.0):
+        super().__init__(linger)
+        self.relays = relays
+        self.tile_size = tile_size
+        self.columns = columns or max(1, int(len(relays) ** 0.5 + 0.999))
+        self.rows = (len(relays) + self.columns - 1) // self.columns
+        self.fps = fps
+        self.quality = quality
+        self.slot = FrameSlot()
+        self.composed = 0
+        self.decoded = 0
+        self.decode_errors = 0
+
+    def _run(self):
+        for relay in self.relays.values():
+            relay.open()
+        try:
+            width, height = self.tile_size
+            image = PIL.Image.new('RGB', (width * self.columns, height * self.rows))
+            draw = PIL.ImageDraw.Draw(image)
+            # robot -> sequence number of the frame in its tile
+            shown = {name: -1 for name in self.relays}
+            period = 1.0 / self.fps
+            next_time = time.monotonic()
+            while not self._should_stop():
+                changed = False
+                for i, (name, relay) in enumerate(self.relays.items()):
+                    seq, frame = relay.slot.seq, relay.slot.frame
+                    if seq == shown[name]:
+                        continue
+                    shown[name] = seq
+                    changed = True
+                    box = ((i % self.columns) * width, (i // self.columns) * height)
+                    image.paste(self._tile(frame), box)
+                    draw.text((box[0] + 4, box[1] + 4), name, fill=(255, 255, 0))
+                if changed:
+                    out = io.BytesIO()
+                    image.save(out, 'JPEG', quality=self.quality)
+                    self.slot.publish(out.getvalue())
+                    self.composed += 1
+                next_time += period
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+        finally:
+            for relay in self.relays.values():
+                relay.close()
+
+    def _tile(self, frame):
+        """
+        Return frame scaled to fit the tile, centred on black, grey if
+        there is no frame or it cannot be decoded.
+        """
+        tile = PIL.Image.new('RGB', self.tile_size, (64, 64, 64) if frame is None else (0, 0, 0))
+        if frame is None:
+            return tile
+        try:
+            image = PIL.Image.open(io.BytesIO(frame))
+            # decode at 1/2, 1/4 or 1/8 size if that still fits
+            image.draft('RGB', self.tile_size)
+            image = image.convert('RGB')
+            image.thumbnail(self.tile_size)
+        except (OSError, ValueError, SyntaxError):
+            self.decode_errors += 1
+            tile.paste((64, 64, 64), (0, 0) + self.tile_size)
+            return tile
+        self.decoded += 1
+        tile.paste(image, ((self.tile_size[0] - image.width) // 2,
+                           (self.tile_size[1] - image.height) // 2))
+        return tile
+
+    def to_dict(self):
+        return {
+            'viewers': self.users,
+            'running': self._thread is not None,
+            'composed': self.composed,
+            'decoded': self.decoded,
+            'decode_errors': self.decode_errors
+            }
+
+class Fleet:
+    """
+    The robots, dict name -> (host, port), with a ConnectionPool and a
+    CameraRelay each. Fan-out requests run on a pool of workers threads,
+    stop requests and those with ?wait=true on threads of their own.
+    wait_timeout is the socket timeout of requests with ?wait=true.
+    """
+
+    def __init__(self, robots, pool_size=4, timeout=5.0, idle_timeout=10.0, workers=16,
+                 camera_path='/camera.mjpg', camera_linger=5.0, wait_timeout=300.0):
+        self.robots = dict(robots)
+        self.wait_timeout = wait_timeout
+        self.pools = {name: ConnectionPool(host, port, pool_size, timeout, idle_timeout)
+                      for name, (host, port) in self.robots.items()}
+        self.relays = {name: CameraRelay(host, port, camera_path, linger=camera_linger)
+                       for name, (host, port) in self.robots.items()}
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers,
+                                                               thread_name_prefix='fan-out')
+        self._threads = scheduler.WaitingThreads(0, 'fan-out-urgent')
+
+    def timeout(self, query):
+        """
+        Return the socket timeout of a request with query (dict), None for
+        the pools' one.
+        """
+        return self.wait_timeout if routing.query_flag(query, 'wait') else None
+
+    def fan_out(self, names, method, path, body=None, headers=None, timeout=None):
+        """
+        Send request to robots names concurrently, return dict name ->
+        result, see call(). timeout is given for requests that wait.
+        """
+        if timeout is not None or urllib.parse.urlsplit(path).path in STOP_PATHS:
+            submit = self._threads.submit
+        else:
+            submit = self._executor.submit
+        futures = [(name, submit(self.call, name, method, path, body, headers, timeout))
+                   for name in names]
+        return {name: future.result() for name, future in futures}
+
+    def call(self, name, method, path, body=None, headers=None, timeout=None):
+        """
+        Send request to robot name, return dict with its status, and body
+        (parsed JSON) or error.
+        """
+        try:
+            response = self.pools[name].request(method, path, body, headers, timeout)
+        except UpstreamError as e:
+            return {'status': 502, 'error': str(e)}
+        if response.data is None:
+            response.close()
+            return {'status': 502, 'error': "Streams cannot be fanned out"}
+        result = {'status': response.status}
+        if response.data:
+            if response.getheader('Content-Type', '').startswith('application/json'):
+                try:
+                    result['body'] = jsoncodec.loads(response.data)
+                except ValueError:
+                    result['error'] = "Response not JSON"
+            else:
+                result['content_type'] = response.getheader('Content-Type')
+                result['length'] = len(response.data)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        for pool in self.pools.values():
+            pool.close()
+
+    def to_dict(self):
+        return {name: {
+            'url': 'http://{}:{}'.format(host, port),
+            'pool': self.pools[name].to_dict(),
+            'camera': self.relays[name].to_dict()
+            } for name, (host, port) in self.robots.items()}
+
+class TelemetryAggregator:
+    """
+    GET /v1/telemetry of all robots of fleet, cached for max_age seconds.
+    Only one fetch runs at a time, requests arriving meanwhile get its
+    result.
+    """
+
+    def __init__(self, fleet, max_age=0.5):
+        self.fleet = fleet
+        self.max_age = max_age
+        self._cond = threading.Condition()
+        self._result = None
+        self._time = 0.0
+        # number of completed fetches
+        self._generation = 0
+        self._fetching = False
+        self.requests = 0
+        self.fetches = 0
+
+    def get(self, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        with self._cond:
+            self.requests += 1
+            generation = self._generation
+            while True:
+                if self._result is not None and (time.monotonic() - self._time <= max_age or
+                                                 self._generation > generation):
+                    return self._result
+                if not self._fetching:
+                    break
+                self._cond.wait()
+            self._fetching = True
+            self.fetches += 1
+        result = None
+        try:
+            timestamp = time.time()
+            result = {
+                'robots': self.fleet.fan_out(self.fleet.robots, 'GET', '/v1/telemetry'),
+                'timestamp': timestamp
+                }
+            return result
+        finally:
+            with self._cond:
+                if result is not None:
+                    self._result = result
+                    self._time = time.monotonic()
+                    self._generation += 1
+                self._fetching = False
+                self._cond.notify_all()
+
+    def to_dict(self):
+        return {'requests': self.requests, 'fetches': self.fetches}
+
+class GPG3GatewayHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # persistent connections, see GPG3ServerHTTPRequestHandler
+    protocol_version = 'HTTP/1.1'
+    timeout = 15
+    disable_nagle_algorithm = True
+
+    # largest request body forwarded
+    MAX_BODY = 1024 * 1024
+
+    # gateway's own resources; other /fleet/{robots}/... paths are
+    # forwarded, see dispatch()
+    ROUTES = [
+        ('GET', '/fleet', 'get_fleet'),
+        ('GET', '/fleet/telemetry', 'get_telemetry'),
+        ('GET', '/fleet/camera.mjpg', 'get_mosaic_stream'),
+        ('GET', '/fleet/camera.html', 'get_camera_page'),
+        ('GET', '/fleet/{robot}/camera.mjpg', 'get_camera_stream')
+        ]
+
+    routes = routing.Router(ROUTES)
+
+    TELEMETRY_SCHEMA = {'max_age': routing.Int(0, optional=True)}
+
+    # requestlog.RequestLog, None to write to stderr
+    request_log = None
+
+    # handler name, for the request log
+    route = None
+
+    # headers added to the next response, set for RequestErrors
+    error_headers = {}
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def do_OPTIONS(self):
+        self.dispatch('OPTIONS')
+
+    def dispatch(self, method):
+        """
+        Call the handler method of the gateway route matching method and
+        path, or forward the request to the robots named by the path.
+        """
+        url = urllib.parse.urlsplit(self.path)
+        self.query = routing.parse_query(url.query)
+        try:
+            try:
+                handler, params = self.routes.match(method, url.path)
+                if handler == 'get_camera_stream' and url.query:
+                    # a stream of its own
+                    raise routing.RequestError("Forwarded", 404)
+            except routing.RequestError as e:
+                if e.status != 404 or not url.path.startswith('/fleet/'):
+                    raise
+                handler, params = 'forward', {'method': method, 'url': url}
+            self.route = handler
+            getattr(self, handler)(**params)
+        except routing.RequestError as e:
+            self.error_headers = e.headers
+            self.send_error(e.status, e.message)
+
+    def end_headers(self):
+        # e.g. Allow of a 405 response
+        for name, value in self.error_headers.items():
+            self.send_header(name, value)
+        self.error_headers = {}
+        super().end_headers()
+
+    def robot_names(self, names):
+        """
+        Return list of robots for the robot part of a path: 'all', a name,
+        or names separated by commas. Raises RequestError 404 for unknown
+        robots.
+        """
+        if names == 'all':
+            return list(fleet.robots)
+        result = names.split(',')
+        for name in result:
+            if name not in fleet.robots:
+                raise routing.RequestError("Unknown robot " + name, 404)
+        return result
+
+    def forward(self, method, url):
+        if self.headers.get('Upgrade') is not None:
+            raise routing.RequestError("Upgrade not supported by the gateway", 501)
+        parts = url.path.split('/', 3)
+        if len(parts) < 4:
+            raise routing.RequestError("Unknown path " + url.path, 404)
+        names = parts[2]
+        robots = self.robot_names(names)
+        path = '/' + parts[3] + ('?' + url.query if url.query else '')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise routing.RequestError("Invalid Content-Length")
+        if length < 0 or length > self.MAX_BODY:
+            raise routing.RequestError("Request body too large", 413)
+        body = self.rfile.read(length) if length else None
+        headers = {name: self.headers[name] for name in FORWARDED_REQUEST_HEADERS
+                   if name in self.headers}
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        timeout = fleet.timeout(self.query)
+
+        if names == 'all' or ',' in names:
+            self.route = 'fan_out'
+            self.send_json_response({'results': fleet.fan_out(robots, method, path, body,
+                                                              headers, timeout)})
+            return
+
+        try:
+            response = fleet.pools[robots[0]].request(method, path, body, headers, timeout)
+        except UpstreamError as e:
+            raise routing.RequestError("Robot {}: {}".format(robots[0], e), 502)
+        self.send_response(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(name, value)
+        if response.data is not None:
+            self.end_headers()
+            self.wfile.write(response.data)
+            return
+
+        # stream, until either side closes the connection
+        self.route = 'forward_stream'
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.connection.settimeout(None)
+        try:
+            while True:
+                data = response.read1(65536)
+                if not data:
+                    break
+                self.wfile.write(data)
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            response.close()
+
+    def get_fleet(self):
+        self.send_json_response({
+            'robots': fleet.to_dict(),
+            'mosaic': None if mosaic is None else mosaic.to_dict(),
+            'telemetry': telemetry_aggregator.to_dict()
+            })
+
+    def get_telemetry(self):
+        max_age = routing.validate(self.TELEMETRY_SCHEMA, self.query)['max_age']
+        self.send_json_response(telemetry_aggregator.get(
+            None if max_age is None else max_age / 1000))
+
+    def get_camera_stream(self, robot):
+        if robot not in fleet.relays:
+            raise routing.RequestError("Unknown robot " + robot, 404)
+        self.send_mjpeg_stream(fleet.relays[robot])
+
+    def get_mosaic_stream(self):
+        if mosaic is None:
+            raise routing.RequestError("Mosaic needs Pillow (pip3 install pillow)", 501)
+        self.send_mjpeg_stream(mosaic)
+
+    def send_mjpeg_stream(self, source):
+        """
+        Send frames of source (CameraRelay or Mosaic) as M-JPEG stream until
+        the client disconnects.
+        """
+        source.open()
+        try:
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.send_header('Age', 0)
+            self.send_header('Cache-Control', 'no-cache, private')
+            self.send_header('Pragma', 'no-cache')
+            self.send_header('Content-Type',
+                'multipart/x-mixed-replace; boundary=' + camera.MJPEG_BOUNDARY)
+            self.end_headers()
+            self.connection.settimeout(None)
+            seq = 0
+            sent = 0
+            while True:
+                seq, frame = source.slot.wait(seq, 10)
+                if frame is None:
+                    continue
+                try:
+                    camera.send_buffers(self.connection, camera.mjpeg_part(frame))
+                except OSError:
+                    break
+                sent += 1
+            self.log_message('"%s" sent %d frames', self.requestline, sent)
+        finally:
+            source.close()
+
+    def get_camera_page(self):
+        images = ''.join(
+            '<figure><img src="/fleet/{0}/camera.mjpg" width="320"><figcaption>{0}</figcaption>'
+            '</figure>\n'.format(name) for name in fleet.robots)
+        body = ('<!DOCTYPE html>\n<html><head><title>Fleet cameras</title>'
+                '<style>figure { display: inline-block; margin: 4px; }</style></head>\n'
+                '<body>\n' + images + '</body></html>\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_response(self, data, status=200):
+        body = jsoncodec.dumps(data)
+        self.send_response(status)
+        if self.headers.get('Origin') is not None:
+            self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        if self.request_log is None:
+            super().log_request(code, size)
+        else:
+            self.request_log.request(self.route, self.address_string(), self.requestline,
+                                     code, size)
+
+    def log_message(self, format, *args):
+        if self.request_log is None:
+            super().log_message(format, *args)
+        else:
+            self.request_log.message(self.address_string(), format % args)
+
+def parse_robot(s):
+    """
+    Parse NAME=HOST[:PORT], return (name, (host, port)).
+    """
+    name, sep, address = s.partition('=')
+    if not sep or not ROBOT_NAME.fullmatch(name) or name in RESERVED_NAMES or not address:
+        raise argparse.ArgumentTypeError("Expected NAME=HOST[:PORT], got " + s)
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        host, port = address, 8080
+    return name, (host, int(port))
+
+def parse_size(s):
+    try:
+        width, height = (int(v) for v in s.split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Expected WIDTHxHEIGHT, got " + s)
+    return width, height
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='GoPiGo3 Fleet Gateway')
+    parser.add_argument('--robot', type=parse_robot, action='append', required=True,
+        help='robot server NAME=HOST[:PORT] (default port 8080), repeat for every robot')
+    parser.add_argument('--port', type=int, default=8090,
+        help='port the gateway listens at (default: 8090)')
+    parser.add_argument('--pool-size', type=int, default=4,
+        help='idle connections kept per robot (default: 4)')
+    parser.add_argument('--upstream-timeout', type=float, default=5,
+        help='seconds to wait for a robot (default: 5)')
+    parser.add_argument('--upstream-wait-timeout', type=float, default=300,
+        help='seconds to wait for a robot answering a request with ?wait=true (default: 300)')
+    parser.add_argument('--upstream-idle', type=float, default=10,
+        help='seconds an idle connection to a robot is reused (default: 10)')
+    parser.add_argument('--fan-out-workers', type=int, default=32,
+        help='threads sending fan-out requests, stop requests and those with ?wait=true '
+             'get threads of their own (default: 32)')
+    parser.add_argument('--telemetry-cache', type=float, default=0.5,
+        help='seconds aggregated telemetry is cached (default: 0.5)')
+    parser.add_argument('--camera-query', default='profile=thumbnail',
+        help='query string of the relayed robot cameras (default: profile=thumbnail)')
+    parser.add_argument('--camera-linger', type=float, default=5,
+        help='seconds a robot camera stays connected after its last viewer left (default: 5)')
+    parser.add_argument('--mosaic-tile', type=parse_size, default=(320, 240),
+        help='size of a robot in the mosaic (default: 320x240)')
+    parser.add_argument('--mosaic-columns', type=int,
+        help='robots per row of the mosaic (default: square)')
+    parser.add_argument('--mosaic-fps', type=float, default=5,
+        help='mosaic frames per second (default: 5)')
+    parser.add_argument('--access-log', choices=requestlog.LEVELS, default='all',
+        help='request lines written to the log (default: all)')
+    args = parser.parse_args()
+
+    names = [name for name, _ in args.robot]
+    if len(set(names)) < len(names):
+        parser.error("Robot names must be unique")
+
+    fleet = Fleet(args.robot, args.pool_size, args.upstream_timeout, args.upstream_idle,
+                  args.fan_out_workers,
+                  '/camera.mjpg' + ('?' + args.camera_query if args.camera_query else ''),
+                  args.camera_linger, args.upstream_wait_timeout)
+    telemetry_aggregator = TelemetryAggregator(fleet, args.telemetry_cache)
+    mosaic = None
+    if PIL is not None:
+        mosaic = Mosaic(fleet.relays, args.mosaic_tile, args.mosaic_columns, args.mosaic_fps,
+                        linger=args.camera_linger)
+    else:
+        print("Pillow not installed, no camera mosaic")
+
+    request_log = requestlog.RequestLog(default_level=args.access_log)
+    GPG3GatewayHTTPRequestHandler.request_log = request_log
+    httpd = ThreadingHTTPServer(('', args.port), GPG3GatewayHTTPRequestHandler)
+
+    # 'with' does not work with HTTPServer, so using try-finally to close the socket.
+    try:
+        print("Gateway listening at " + httpd.server_address[0] + ":" + str(httpd.server_address[1]))
+        for name, (host, port) in args.robot:
+            print("  /fleet/{}/ -> http://{}:{}/".format(name, host, port))
+        print("")
+        print("Press Ctrl-C to stop gateway")
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    finally:
+        httpd.server_close()
+        fleet.shutdown()
+        request_log.close()
@@ -38,46 +38,242 @@
 #            "hardware_version": "3.x.x",
 #            "firmware_version": "1.0.0",
 #            "hardware_serial_number": "0123456789ABCDEF0123456789ABCDEF" }
-#     GET  /v1/platform/voltages/5v
+#          Read once at startup. /ping, /v1/ping and this resource are sent
+#          with a strong ETag and answer If-None-Match with 304.
+#     GET  /v1/platform/voltages/5v[?max_age=ms]
 #          { "voltage": 4.931 }
-#     GET  /v1/platform/voltages/battery
+#     GET  /v1/platform/voltages/battery[?max_age=ms]
 #          { "voltage": 9.434 }
 #
 #     PUT  /v1/blinkers[/left|right] { "state": "on"|"off" }
 #     PUT  /v1/eyes[/left|right] { "red": 255, "green": 0, "blue": 0 } (range 0..255)
 #
-#     POST /v1/motors/drive { "direction": "forward"|"backward", "speed": [pct] [, "distance": [mm]] }
-#     POST /v1/motors/turn { "direction": right"|"left", "speed": [pct] [, "angle": [deg]] }
+#     POST /v1/motors/drive[?wait=true][&queue=true] { "direction": "forward"|"backward", "speed": [pct] [, "distance": [mm]] }
+#     POST /v1/motors/turn[?wait=true][&queue=true] { "direction": right"|"left", "speed": [pct] [, "angle": [deg]] }
+#          With distance/angle the command is run in the background, the
+#          response is 202 with the command status (see below). wait=true
+#          waits for the command to finish (204). A new motor command
+#          preempts a running one, unless queue=true.
 #     POST /v1/motors/set { left_direction: "forward"|"backward", "left_speed": [pct], "right_direction"="forward"|"backward", "right_speed": [pct] }
 #     POST /v1/motors/stop
-#     GET  /v1/motors/status
+#     POST /v1/batch
+#          { "operations": [ { "method": "PUT", "path": "/v1/eyes/left", "body": { "red": 255, ... } },
+#                            { "method": "POST", "path": "/v1/motors/drive", "body": { ... } }, ... ] }
+#          { "results": [ { "status": 204 }, { "status": 202, "body": { "id": 3, ... } } ],
+#            "led_writes": 1 }
+#          Runs blinkers, eyes, servo position and motor operations in order
+#          under one hardware lock. All operations are validated first, none
+#          is run if one is invalid (400). LED writes are merged and applied
+#          last. Motor commands with distance/angle are queued.
+#     GET  /v1/motors/commands/[id]
+#          { "id": 1, "type": "drive", "state": "queued"|"running"|"completed"|"preempted"|"failed",
+#            "progress": 0.42, "target_degrees": { "left": 345, "right": 345 },
+#            "travelled_degrees": { "left": 145, "right": 147 }, ... }
+#     GET  /v1/motors/status[?max_age=ms]
 #          { left:  { "flags": 0, "power": 52, "encoder": 5270, "dps": 175 },
 #            right: { "flags": 0, "power": 54, "encoder": 5624, "dps": 174 } }
 #
-#     PUT  /v1/servos/SERVO1|SERVO2/position { "position": 90 } (range 0..180)
+#     PUT  /v1/servos/SERVO1|SERVO2/position[?wait=true] { "position": 90 } (range 0..180)
+#          wait=true waits until the servo is estimated to have arrived
+#     GET  /v1/servos/SERVO1|SERVO2/position[?wait=true]
+#          { "position": 90, "estimated_position": 72, "moving": true, "eta": 0.03, "sweeping": false }
+#     POST /v1/servos/SERVO1|SERVO2/sweep[?wait=true]
+#          { "positions": [0, 90, { "position": 180, "dwell": 500 }], "dwell": 100 } (dwell in ms)
+#          { "steps": 3, "duration": 0.95 }
 #
-#     GET  /v1/sensors/I2C/distance/distance
+#     GET  /v1/behaviours
+#          { "behaviours": { "drive_until": { "speed": 50, "distance": 200 },
+#                            "avoid_obstacles": { ... }, "follow_wall": { ... } },
+#            "current": { ... } (see below, null if no behaviour ran yet) }
+#     PUT  /v1/behaviours/drive_until|avoid_obstacles|follow_wall { "speed": 60 }
+#          sets parameters (all optional), also of the running behaviour
+#     POST /v1/behaviours/drive_until|avoid_obstacles|follow_wall/start[?wait=true] { parameters }
+#          { "id": 1, "behaviour": "drive_until", "parameters": { ... },
+#            "state": "running"|"completed"|"stopped"|"preempted"|"failed",
+#            "distance": 523, "speeds": { "left": 150, "right": 150 }, "rate": 50,
+#            "timing": { "ticks": 250, "overruns": 0, "skipped": 0, "motor_writes": 1,
+#                        "jitter": { "count": 250, "p50": 0.0001, "p99": 0.001, "max": 0.0012, ... },
+#                        "step": { ... } }, ... }
+#          the body is optional
+#     GET  /v1/behaviours/current
+#          the running or last behaviour, as above
+#     POST /v1/behaviours/stop
+#
+#     Behaviours are control loops run by the server, --behaviour-rate
+#     times per second, see behaviours.py. Other motor operations stop them.
+#
+#     GET  /v1/sensors/I2C/distance/distance[?max_age=ms]
 #          { "distance": 523 } (in mm)
 #
+#     Sensor and status values are sampled in the background and served from
+#     cache. max_age limits the age of the value, max_age=0 forces a read.
+#
+#     GET  /v1/odometry/pose[?max_age=ms]
+#          { "x": 523.1, "y": -12.4, "heading": -3.5, "distance": 610.2,
+#            "timestamp": 1543000000.1, "encoders": { "left": 5270, "right": 5224 },
+#            "samples": 1234 }
+#          Pose estimated from the motor encoders (telemetry source
+#          encoders), see odometry.py. x and y in mm, x ahead and y left of
+#          the robot at the last reset, heading in degrees counterclockwise.
+#     POST /v1/odometry/reset [{ "x": 0, "y": 0, "heading": 0 }]
+#     GET  /v1/odometry/trajectory[?since=timestamp][&step=n][&format=json|binary]
+#          { "fields": ["timestamp", "x", "y", "heading"],
+#            "samples": [[1543000000.1, 523.1, -12.4, -3.5], ...] }
+#          Pose at every step-th encoder sample since the last reset (at
+#          most --odometry-history samples). format=binary sends
+#          application/octet-stream records of 20 bytes: timestamp
+#          (float64), x, y, heading (float32), little-endian.
+#
+#     GET  /v1/telemetry
+#          { "distance": { "rate": 10, "reads": 1234, "errors": 0, "age": 0.04,
+#                          "latest": { "value": 523, "timestamp": 1543000000.1 } }, ... }
+#     GET  /v1/telemetry/5v|battery|motors|distance[?max_age=ms]
+#          { "latest": { "value": 523, "timestamp": 1543000000.1 },
+#            "history": [ { "value": 524, "timestamp": 1543000000.0 }, ... ] }
+#     GET  /v1/telemetry/stream[?fields=distance,motors][&rate=5]
+#          text/event-stream, first event has all fields, then only the
+#          fields that changed (beyond the deadband), at most rate events/s
+#          event: telemetry
+#          data: { "distance": 523 }
+#
+#     GET  /v1/ws
+#          WebSocket for commands (same methods, paths and bodies as above)
+#          and telemetry push, see websocket.py
+#
+#     GET  /v1/stats
+#          { "http": { "connections": 12, "requests": 840, "reused": 828,
+#                      "requests_per_connection": 70.0, "closed_at_limit": 3 },
+#            "routes": { "put_eyes": { "responses": { "2xx": 500 }, "in_flight": 0,
+#                                      "latency": { "count": 500, "sum": 0.21, "p50": 0.0005, "p99": 0.001 },
+#                                      "hardware": { ... } }, ... },
+#            "hardware_calls": { "set_led": { "count": 90, ... }, ... },
+#            "actuators": { "received": 500, "coalesced": 320, "skipped": 90,
+#                           "flushed": 90, "flushes": 60, "errors": 0, "pending": 0,
+#                           "max_rate": 50 },
+#            "camera": { ... }, "threads": { "Thread": 3, "motion": 1, ... },
+#            "log": { "queued": 840, "written": 120, "dropped": 0,
+#                     "not_sampled": 0, "suppressed": 720, "pending": 0 },
+#            "scheduler": { "hardware": { "stop": { "waiting": 0, "peak": 1, "limit": 0,
+#                                                   "taken": 12, "rejected": 0,
+#                                                   "wait": { ... } }, ... },
+#                           "workers": { "workers": 16, "busy": 3, "queues": { ... } },
+#                           "waiting": { "running": 1, "peak": 2, "limit": 32,
+#                                        "taken": 5, "rejected": 0 },
+#                           "connections": { "connections": 85, "max_connections": 256,
+#                                             "rejected": 0, "streams": 2 },
+#                           "rate_limits": { "telemetry": { "rate": 200, "burst": 400,
+#                                                           "limited": 0 }, ... } } }
+#          Routes are named after their handler method, see ROUTES. hardware
+#          is the part of the request time spent in GoPiGo3 calls.
+#     GET  /metrics
+#          The same figures in Prometheus text format, with latency
+#          histograms
+#
+#     Eye, blinker and motor (drive/turn without distance/angle, set)
+#     requests are answered right away and written by a background thread,
+#     at most --actuator-rate times per second. Only the latest value of
+#     each LED and of the motors is written, unchanged values are skipped.
+#
+#     Connections are persistent (HTTP/1.1 keep-alive), M-JPEG streams and
+#     error responses close the connection.
+#
+#     GoPiGo3 calls are made one at a time, by priority of their class: stop
+#     > motion > actuators > telemetry (see scheduler.py and ROUTE_CLASSES).
+#     A request finding the queue of its class full (--queue-limit) is
+#     answered with 503, a client exceeding the request rate of a class
+#     (--rate-limit) with 429, both with Retry-After. With --server
+#     threading, requests are handled by --workers threads, see
+#     pooled_server.py; idle connections and streams take none.
+#
+#     Routes are listed in GPG3ServerHTTPRequestHandler.ROUTES. Unknown
+#     paths are answered with 404, known paths with an unsupported method
+#     with 405 and an Allow header.
+#
+#     Request lines are written to the log by a background thread (see
+#     requestlog.py); --access-log and --route-log select which, identical
+#     lines are summarized.
+#
 # Camera support:
 #     /camera.mjpg  Camera video stream as M-JPEG
-
+#                   [?profile=thumbnail|default|high]
+#                   [&width=..&height=..] [&quality=1..100] [&framerate=..]
+#     /camera.jpg   Most recent camera frame as JPEG (same parameters, except
+#                   framerate)
+#     GET  /v1/camera/snapshot
+#          same as /camera.jpg
+
+import argparse
+import collections
+import email.utils
 import http.server
-import json
-import mimetypes
+import io
+import re
 import socket
 import socketserver
+import threading
 import time
 import urllib.parse
 
-import easygopigo3
-
+import actuators
+import async_server
+import behaviours
 import camera
+import hardware
+import jsoncodec
+import metrics
+import motion
+import odometry
+import pooled_server
+import requestlog
+import routing
+import scheduler
+import servo_control
+import static_assets
+import telemetry
+import websocket
 
 class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     allow_reuse_address = True
     daemon_threads = True
 
+class ConnectionStats:
+    """
+    Counts connections and requests, to see how well clients reuse
+    persistent connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.reused = 0
+        self.closed_at_limit = 0
+
+    def request(self, requests_on_connection):
+        with self._lock:
+            self.requests += 1
+            if requests_on_connection == 1:
+                self.connections += 1
+            else:
+                self.reused += 1
+
+    def limit_reached(self):
+        with self._lock:
+            self.closed_at_limit += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'requests': self.requests,
+                'reused': self.reused,
+                'requests_per_connection':
+                    round(self.requests / self.connections, 2) if self.connections else 0,
+                'closed_at_limit': self.closed_at_limit
+                }
+
+connection_stats = ConnectionStats()
+
 class GPG3ServerHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
 
     # whitelist of allowed paths
@@ -97,493 +293,1019 @@ class GPG3ServerHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         "/favicon.ico"
         }
 
+    # persistent connections; timeout is the idle timeout in seconds, after
+    # max_requests_per_connection requests the connection is closed
+    protocol_version = 'HTTP/1.1'
+    timeout = 15
+    max_requests_per_connection = 100
+
+    # headers and body are written separately; with Nagle's algorithm the
+    # body waits for the client's delayed ACK of the headers (40 ms) on a
+    # persistent connection
+    disable_nagle_algorithm = True
+
+    # highest event rate of a telemetry stream client
+    MAX_STREAM_RATE = 50
+
+    # seconds without change after which a telemetry stream sends a comment
+    STREAM_KEEP_ALIVE = 15
+
+    # request bodies the handler did not read are discarded up to this size,
+    # larger ones close the connection
+    MAX_DISCARDED_BODY = 65536
+
+    # method, path, handler method; compiled into routes below, see
+    # routing.py for the path syntax
+    ROUTES = [
+        ('GET', '/v1/platform/voltages/{name:5v|battery}', 'get_voltage'),
+        ('GET', '/v1/sensors/I2C/distance/distance', 'get_distance'),
+        ('GET', '/v1/motors/status', 'get_motors_status'),
+        ('GET', '/v1/motors/commands/{command_id:int}', 'get_motion_command'),
+        ('POST', '/v1/motors/drive', 'post_drive'),
+        ('POST', '/v1/motors/turn', 'post_turn'),
+        ('POST', '/v1/motors/set', 'post_motors_set'),
+        ('POST', '/v1/motors/stop', 'post_motors_stop'),
+        ('POST', '/v1/batch', 'post_batch'),
+        ('GET', '/v1/behaviours', 'get_behaviours'),
+        ('GET', '/v1/behaviours/current', 'get_current_behaviour'),
+        ('POST', '/v1/behaviours/stop', 'post_behaviours_stop'),
+        ('PUT', '/v1/behaviours/{name:drive_until|avoid_obstacles|follow_wall}',
+         'put_behaviour_parameters'),
+        ('POST', '/v1/behaviours/{name:drive_until|avoid_obstacles|follow_wall}/start',
+         'post_behaviour_start'),
+        ('PUT', '/v1/blinkers', 'put_blinkers'),
+        ('PUT', '/v1/blinkers/{blinkers_id:left|right}', 'put_blinkers'),
+        ('PUT', '/v1/eyes', 'put_eyes'),
+        ('PUT', '/v1/eyes/{eyes_id:left|right}', 'put_eyes'),
+        ('GET', '/v1/servos/{port:SERVO1|SERVO2}/position', 'get_servo_position'),
+        ('PUT', '/v1/servos/{port:SERVO1|SERVO2}/position', 'put_servo_position'),
+        ('POST', '/v1/servos/{port:SERVO1|SERVO2}/sweep', 'post_servo_sweep'),
+        ('GET', '/v1/telemetry', 'get_telemetry'),
+        ('GET', '/v1/telemetry/stream', 'send_telemetry_stream'),
+        ('GET', '/v1/telemetry/{name}', 'get_telemetry_source'),
+        ('GET', '/v1/ws', 'handle_websocket'),
+        ('GET', '/v1/odometry/pose', 'get_odometry_pose'),
+        ('POST', '/v1/odometry/reset', 'post_odometry_reset'),
+        ('GET', '/v1/odometry/trajectory', 'get_odometry_trajectory'),
+        ('GET', '/v1/stats', 'get_stats'),
+        ('GET', '/metrics', 'get_metrics'),
+        ('GET', '/camera.jpg', 'get_snapshot'),
+        ('GET', '/v1/camera/snapshot', 'get_snapshot'),
+        ('GET', '/camera.mjpg', 'get_mjpeg_stream')
+        ]
+
+    routes = routing.Router(ROUTES +
+        [('GET', path, 'get_static_asset')
+         for path in sorted(ALLOWED_TEXT_DOWNLOADS | ALLOWED_BINARY_DOWNLOADS)])
+
+    # handlers of routes that stream until the client disconnects, their
+    # duration is not measured
+    STREAM_ROUTES = {'get_mjpeg_stream', 'send_telemetry_stream', 'handle_websocket'}
+
+    # handlers of routes that with ?wait=true answer when the motors, the
+    # servo or the behaviour are done, see request_waits()
+    WAITING_ROUTES = {'post_drive', 'post_turn', 'get_servo_position', 'put_servo_position',
+                      'post_servo_sweep', 'post_behaviour_start'}
+
+    # scheduler class of the routes that access the hardware: their
+    # GoPiGo3 calls are scheduled with this priority, and their rate is
+    # limited per client (--rate-limit)
+    ROUTE_CLASSES = {
+        'post_motors_stop': scheduler.STOP,
+        'post_behaviours_stop': scheduler.STOP,
+        'post_drive': scheduler.MOTION,
+        'post_turn': scheduler.MOTION,
+        'post_motors_set': scheduler.MOTION,
+        'post_batch': scheduler.MOTION,
+        'post_behaviour_start': scheduler.MOTION,
+        'put_blinkers': scheduler.ACTUATORS,
+        'put_eyes': scheduler.ACTUATORS,
+        'put_servo_position': scheduler.ACTUATORS,
+        'post_servo_sweep': scheduler.ACTUATORS,
+        'get_voltage': scheduler.TELEMETRY,
+        'get_distance': scheduler.TELEMETRY,
+        'get_motors_status': scheduler.TELEMETRY,
+        'get_telemetry_source': scheduler.TELEMETRY,
+        'get_odometry_pose': scheduler.TELEMETRY
+        }
+
+    # scheduler.RateLimiter of requests per client, None for no limits
+    rate_limiter = None
+
+    # requestlog.RequestLog that request lines and messages are written
+    # to, None to write them to stderr on the request thread
+    request_log = None
+
+    # handler name of the request's route, for the request log
+    route = None
+
+    # status of the response sent, 0 if none
+    response_status = 0
+
+    # headers added to the next response, set for RequestErrors
+    error_headers = {}
+
+    # responses that never change while the server runs, path ->
+    # static_assets.AssetVariant, see add_immutable_resource()
+    immutable_resources = {}
+
+    @classmethod
+    def add_immutable_resource(cls, path, data):
+        """
+        Serve data as JSON from pre-encoded bytes for GET path, with a
+        strong ETag.
+        """
+        body = jsoncodec.dumps(data)
+        cls.immutable_resources[path] = static_assets.AssetVariant(
+            body, "application/json; charset=UTF-8", time.time(), False)
+        cls.routes.add('GET', path, 'get_immutable_resource')
+
+    def handle(self):
+        self.requests_on_connection = 0
+        super().handle()
+
+    @classmethod
+    def handle_in_memory(cls, server, client_address, request_bytes,
+                         requests_on_connection=1, limit_requests=True):
+        """
+        Handle one request given as bytes, without a socket. Returns the
+        response bytes and whether the connection is to be closed.
+
+        Used by the asyncio server and for WebSocket commands. With
+        limit_requests False, max_requests_per_connection does not apply.
+        """
+        # BaseRequestHandler.__init__ would handle the request right away,
+        # on a socket. Set up what StreamRequestHandler.setup() does, with
+        # in-memory files instead.
+        handler = cls.__new__(cls)
+        handler.server = server
+        handler.request = None
+        handler.connection = None
+        handler.client_address = client_address
+        handler.rfile = io.BytesIO(request_bytes)
+        handler.wfile = io.BytesIO()
+        handler.close_connection = True
+        if not limit_requests:
+            handler.max_requests_per_connection = 0
+        # counted up again in parse_request()
+        handler.requests_on_connection = requests_on_connection - 1
+        handler.handle_one_request()
+        return handler.wfile.getvalue(), handler.close_connection
+
+    @classmethod
+    def handle_stream(cls, server, connection, client_address, rfile, requests_on_connection):
+        """
+        Handle one request, read from rfile, on connection. Used by the
+        pooled server for streams, which hold the calling thread until the
+        client disconnects.
+        """
+        handler = cls.__new__(cls)
+        handler.server = server
+        handler.request = handler.connection = connection
+        handler.client_address = client_address
+        handler.rfile = rfile
+        # as StreamRequestHandler.setup() with wbufsize 0
+        handler.wfile = socketserver._SocketWriter(connection)
+        handler.close_connection = True
+        # counted up again in parse_request()
+        handler.requests_on_connection = requests_on_connection - 1
+        handler.handle_one_request()
+
+    @classmethod
+    def request_route(cls, requestline):
+        """
+        Return handler name of the route of requestline, None if there is
+        none.
+        """
+        words = requestline.split()
+        if len(words) == 3:
+            try:
+                handler, _ = cls.routes.match(words[0], urllib.parse.urlsplit(words[1]).path)
+                return handler
+            except routing.RequestError:
+                pass
+        return None
+
+    @classmethod
+    def request_waits(cls, requestline):
+        """
+        True if requestline waits for a manoeuvre to finish (?wait=true),
+        for the servers, which handle such requests on threads of their
+        own rather than on a worker.
+        """
+        if cls.request_route(requestline) not in cls.WAITING_ROUTES:
+            return False
+        query = urllib.parse.urlsplit(requestline.split()[1]).query
+        return routing.query_flag(routing.parse_query(query), 'wait')
+
+    @classmethod
+    def request_priority(cls, requestline):
+        """
+        Return scheduler class of the route of requestline, telemetry for
+        routes that do not access the hardware, for the servers' worker
+        queues.
+        """
+        return cls.ROUTE_CLASSES.get(cls.request_route(requestline), scheduler.TELEMETRY)
+
+    @classmethod
+    def open_telemetry_stream(cls, query):
+        """
+        Return telemetry.Subscription for the query string of a stream
+        request (fields, rate). Raises ValueError if it is invalid.
+        """
+        query = urllib.parse.parse_qs(query)
+        fields = None
+        if 'fields' in query:
+            fields = [f for f in query['fields'][-1].split(',') if f]
+            unknown = [f for f in fields if f not in telemetry_sampler]
+            if unknown or not fields:
+                raise ValueError("Unknown fields " + ", ".join(unknown))
+        rate = 0
+        if 'rate' in query:
+            try:
+                rate = float(query['rate'][-1])
+            except ValueError:
+                rate = -1
+            if not 0 < rate <= cls.MAX_STREAM_RATE:
+                raise ValueError("Parameter rate not in range 0..{} ({})".format(
+                    cls.MAX_STREAM_RATE, query['rate'][-1]))
+        return telemetry_sampler.subscribe(fields, rate)
+
+    @classmethod
+    def create_websocket_session(cls, server, client_address, send):
+        """
+        Return websocket.Session whose commands are handled like REST
+        requests of client_address.
+        """
+
+        def execute(method, path, body, requests_on_connection):
+            if method not in {'GET', 'PUT', 'POST'} or not path.startswith('/') or \
+                    any(c.isspace() for c in path):
+                return 400, "Invalid method or path", None
+            request = ('{} {} HTTP/1.1\r\n'
+                       'Host: localhost\r\n'
+                       'Content-Type: application/json\r\n'
+                       'Content-Length: {}\r\n'
+                       '\r\n').format(method, path, len(body)).encode() + body
+            response, close = cls.handle_in_memory(server, client_address, request,
+                requests_on_connection, limit_requests=False)
+            return parse_response(response)
+
+        return websocket.Session(send, execute, telemetry_sampler)
+
+    def parse_request(self):
+        # remember when request processing started, used for time-to-first-
+        # frame figures
+        self.request_start = time.monotonic()
+        self.requests_on_connection += 1
+        self.body_read = False
+        self.error_headers = {}
+        connection_stats.request(self.requests_on_connection)
+        return super().parse_request()
+
+    def end_headers(self):
+        if not self.close_connection and self.max_requests_per_connection and \
+                self.requests_on_connection >= self.max_requests_per_connection:
+            connection_stats.limit_reached()
+            self.send_header('Connection', 'close')
+        # e.g. Allow of a 405 response
+        for name, value in self.error_headers.items():
+            self.send_header(name, value)
+        self.error_headers = {}
+        if not self.close_connection:
+            self.discard_request_body()
+        super().end_headers()
+
+    def discard_request_body(self):
+        """
+        Read the request body if the handler did not, so the next request
+        on the connection starts at the right place.
+        """
+        if self.body_read or not hasattr(self, 'headers'):
+            return
+        self.body_read = True
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.MAX_DISCARDED_BODY:
+            self.send_header('Connection', 'close')
+        elif length > 0:
+            self.rfile.read(length)
+
     def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
 
-        # text file download with placeholder support
-        if self.path in self.ALLOWED_TEXT_DOWNLOADS:
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        """
+        Call the handler method of the route matching method and path, with
+        the path parameters as keyword arguments. The parsed query string
+        is available as self.query.
+        """
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            handler, params = self.routes.match(method, url.path)
+        except routing.RequestError as e:
+            self.measure('unmatched', self.send_request_error, e)
+            return
+        if handler in self.STREAM_ROUTES and self.connection is None:
+            # handle_in_memory(), e.g. a WebSocket command: the response
+            # is collected in memory, a stream would never end
+            self.measure(handler, self.send_request_error,
+                         routing.RequestError("Streams need a connection of their own"))
+            return
+        self.query = routing.parse_query(url.query)
+        self.measure(handler, self.call_route, handler, params)
 
-            if self.path == "/":
-                fname = "static/index.html"
+    def call_route(self, handler, params):
+        try:
+            cls = self.ROUTE_CLASSES.get(handler)
+            if cls is None:
+                getattr(self, handler)(**params)
             else:
-                fname = "static" + self.path
+                self.admit(cls)
+                with scheduler.request_class(cls):
+                    getattr(self, handler)(**params)
+        except scheduler.QueueFull as e:
+            self.send_request_error(routing.RequestError(str(e), 503,
+                {'Retry-After': scheduler.retry_after(e.retry_after)}))
+        except routing.RequestError as e:
+            self.send_request_error(e)
+
+    def admit(self, cls):
+        """
+        Raise RequestError (429) if the client exceeded its request rate of
+        scheduler class cls.
+        """
+        if self.rate_limiter is None:
+            return
+        delay = self.rate_limiter.check(self.client_address[0], cls)
+        if delay:
+            raise routing.RequestError("Rate limit of {} requests exceeded".format(
+                scheduler.CLASSES[cls]), 429, {'Retry-After': scheduler.retry_after(delay)})
 
-            # read file in text mode
-            with open(fname, "r") as f:
-                content = f.read()
+    def send_request_error(self, e):
+        self.error_headers = e.headers
+        self.send_error(e.status, e.message)
 
-            # replace placeholders
-            host_port = self.headers.get('Host')
-            if host_port is None:
-                host_port = 'localhost'
+    def measure(self, route, fn, *args):
+        """
+        Call fn(*args), counted in the request metrics of route: response
+        status, and except for streams, the request's duration and the
+        part of it spent in GoPiGo3 calls.
+        """
+        route_metrics = request_metrics.route(route)
+        self.route = route
+        self.response_status = 0
+        hardware_start = metrics.hardware_time()
+        route_metrics.begin()
+        try:
+            fn(*args)
+        finally:
+            if route in self.STREAM_ROUTES:
+                route_metrics.end(self.response_status)
+            else:
+                route_metrics.end(self.response_status,
+                    time.monotonic() - self.request_start,
+                    metrics.hardware_time() - hardware_start)
 
-            content = content.replace('{{host_port}}', host_port)
-            binary = content.encode()
+    @classmethod
+    def route_metrics(cls, route):
+        """
+        Return metrics.RouteMetrics of route, for streams the asyncio
+        server serves itself.
+        """
+        return request_metrics.route(route)
+
+    def log_request(self, code='-', size='-'):
+        # called by send_response(), also for errors
+        if isinstance(code, int):
+            self.response_status = code
+        if self.request_log is None:
+            super().log_request(code, size)
+        else:
+            self.request_log.request(self.route, self.address_string(), self.requestline,
+                                     code, size)
 
-            self.send_response(200)
-            # set Content-Type
-            # guess content type based on URL path
-            content_type = mimetypes.MimeTypes().guess_type(fname)[0]
-            if content_type is not None:
-                self.send_header('Content-Type', content_type + "; charset=UTF-8")
-            self.send_header('Content-Length', len(binary))
-            self.end_headers()
+    def log_message(self, format, *args):
+        if self.request_log is None:
+            super().log_message(format, *args)
+        else:
+            self.request_log.message(self.address_string(), format % args)
 
-            # send content to requester
-            self.wfile.write(binary)
+    @classmethod
+    def log_client_message(cls, client_address, message):
+        """
+        Log message about client_address, for streams the asyncio server
+        serves itself.
+        """
+        if cls.request_log is None:
+            requestlog.write_line(client_address[0], message)
+        else:
+            cls.request_log.message(client_address[0], message)
 
-        # binary file download
-        elif self.path in self.ALLOWED_BINARY_DOWNLOADS:
+    def do_OPTIONS(self):
+        self.measure('options', self.send_cors_preflight)
 
-            fname = "static" + self.path
+    def send_cors_preflight(self):
+        """ needed for CORS pre-flight requests """
 
-            # read file in binary mode
-            with open(fname, "rb") as f:
-                content = f.read()
+        if self.headers.get('Origin') is None:
+            self.send_error(501, "Non-CORS OPTIONS request not implemented")
+            return
 
-            self.send_response(200)
-            # set Content-Type
-            content_type = mimetypes.MimeTypes().guess_type(fname)[0]
-            if content_type is not None:
-                self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
+        self.send_response(200)
 
-            # send content to requester
-            self.wfile.write(content)
+        self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+        self.send_header("Access-Control-Allow-Methods", "GET, PUT, POST, OPTIONS")
 
-        elif self.path == '/ping':
-            data = {'server': 'gpg3', 'v1': 'supported'}
-            self.send_json_response(data)
+        if self.headers.get('Access-Control-Request-Headers') is not None:
+            self.send_header("Access-Control-Allow-Headers", self.headers.get('Access-Control-Request-Headers'))
 
-        elif self.path == '/v1/ping':
-            data = {'server': 'gpg3'}
-            self.send_json_response(data)
+        self.send_header('Content-Length', 0)
+        self.end_headers()
 
-        elif self.path == '/v1/platform/information':
-            data = {
-                'manufacturer': egpg3.get_manufacturer(),
-                'board_name': egpg3.get_board(),
-                'hardware_version': egpg3.get_version_hardware(),
-                'firmware_version': egpg3.get_version_firmware(),
-                'hardware_serial_number': egpg3.get_id()
-                }
-            self.send_json_response(data)
+    # route handlers, see ROUTES
 
-        elif self.path == '/v1/platform/voltages/5v':
-            data = {'voltage': egpg3.get_voltage_5v()}
-            self.send_json_response(data)
+    def get_static_asset(self):
+        """
+        Send whitelisted static file from the asset cache.
 
-        elif self.path == '/v1/platform/voltages/battery':
-            data = {'voltage': egpg3.get_voltage_battery()}
-            self.send_json_response(data)
+        Supports conditional requests (If-None-Match, If-Modified-Since) and
+        gzip/brotli content coding.
+        """
+        path = urllib.parse.urlsplit(self.path).path
+        if path not in assets:
+            raise routing.RequestError("Unknown path " + path, 404)
 
-        elif self.path == '/v1/sensors/I2C/distance/distance':
+        if path == '/camera.html':
+            # the page will request the stream right away, get the camera
+            # going while the browser loads the page
+            camera.prestart()
 
-            if distance_sensor is None:
-                self.send_error(404, "No distance sensor")
-                return
+        # placeholders are replaced by the address the client used
+        host_port = self.headers.get('Host')
+        if host_port is None:
+            host_port = 'localhost'
 
-            dist = distance_sensor.read_mm()
-
-            data = {'distance' : dist}
-            self.send_json_response(data)
-
-        elif self.path == '/v1/motors/status':
-
-            (left_flags, left_power, left_encoder, left_dps) = \
-                egpg3.get_motor_status(egpg3.MOTOR_LEFT)
-            (right_flags, right_power, right_encoder, right_dps) = \
-                egpg3.get_motor_status(egpg3.MOTOR_RIGHT)
-
-            data = {
-                'left': {
-                    'flags': left_flags,
-                    'power': left_power,
-                    'encoder': left_encoder,
-                    'dps': left_dps
-                    },
-                'right': {
-                    'flags': right_flags,
-                    'power': right_power,
-                    'encoder': right_encoder,
-                    'dps': right_dps
-                    }
-                }
+        self.send_asset_variant(assets.get(path, host_port))
 
-            self.send_json_response(data)
+    def get_immutable_resource(self):
+        """
+        Send constant response (/ping, /v1/ping, /v1/platform/information).
+        """
+        path = urllib.parse.urlsplit(self.path).path
+        self.send_asset_variant(self.immutable_resources[path], cors=True)
 
-        elif self.path == '/camera.mjpg':
+    def get_voltage(self, name):
 
-            self.send_response(200)
-            self.send_header('Age', 0)
-            self.send_header('Cache-Control', 'no-cache, private')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
-            self.end_headers()
+        sample = self.get_telemetry_sample(name)
 
-            with camera.CameraMJPEGStream() as stream:
+        data = {'voltage': sample.value}
+        self.send_json_template(VOLTAGE_TEMPLATE, data)
 
-                while True:
+    def get_distance(self):
 
-                    frame = stream.get_frame()
+        if distance_sensor is None:
+            raise routing.RequestError("No distance sensor", 404)
 
-                    try:
-                        self.wfile.write(b'--FRAME\r\n')
-                        self.send_header('Content-Type', 'image/jpeg')
-                        self.send_header('Content-Length', len(frame))
-                        self.end_headers()
-                        self.wfile.write(frame)
-                        self.wfile.write(b'\r\n')
-                    except ConnectionError:
-                        self.log_error('"%s" ended with ConnectionError', 
-                            self.requestline)
-                        break
+        sample = self.get_telemetry_sample('distance')
 
-        else:
-            self.send_error(404, "Unknown path " + self.path)
+        data = {'distance' : sample.value}
+        self.send_json_template(DISTANCE_TEMPLATE, data)
 
-    def do_PUT(self):
+    def get_motors_status(self):
 
-        if self.path.startswith('/v1/blinkers'):
+        sample = self.get_telemetry_sample('motors')
 
-            data = self.receive_json_request()
+        self.send_json_template(MOTORS_STATUS_TEMPLATE, sample.value)
 
-            # blinkers_id from URL
-            blinkers_id = urllib.parse.unquote(self.path[13:])
-            if blinkers_id not in {'', 'left', 'right'}:
-                self.send_error(400, "Unknown blinkers_id " + blinkers_id)
-                return
+    def get_motion_command(self, command_id):
 
-            # state from PUT data
-            state = data['state']
-            if state not in {'on', 'off'}:
-                self.send_error(400, "Unknown state " + data['state'])
-                return
+        command = motion_executor.get(command_id)
+        if command is None:
+            raise routing.RequestError("Unknown command {}".format(command_id), 404)
 
-            # Class EasyGoPiGo3 offers no method to change both blinkers with a
-            # single SPI transfer. Using GoPiGo3.set_led directly.
+        self.send_json_response(command.to_dict())
 
-            # map to GoPiGo3.set_led parameters
-            led = {
-                '': egpg3.LED_LEFT_BLINKER | egpg3.LED_RIGHT_BLINKER,
-                'left': egpg3.LED_LEFT_BLINKER,
-                'right': egpg3.LED_RIGHT_BLINKER
-                }[blinkers_id]
+    def get_stats(self):
 
-            brightness = {
-                'on': 255,
-                'off': 0
-                }[state]
+        run = behaviour_engine.current()
+        data = {
+            'http': connection_stats.to_dict(),
+            'routes': {
+                r.name: r.to_dict() for r in request_metrics.routes()
+                if r.in_flight or any(r.responses)
+                },
+            'hardware_calls': {
+                name: histogram.to_dict() for name, histogram in sorted(egpg3.calls.items())
+                },
+            'actuators': actuator_writer.to_dict(),
+            'camera': camera.stats(),
+            'behaviour': None if run is None else run.to_dict()['timing'],
+            'threads': thread_counts(),
+            'log': self.request_log.to_dict() if self.request_log else None,
+            'scheduler': scheduler_stats(self.server)
+            }
+        self.send_json_response(data)
 
-            egpg3.set_led(led, brightness)
+    def get_metrics(self):
 
-            self.send_no_content_response()
+        binary = prometheus_metrics(getattr(self.server, 'pool', None)).encode()
 
-        elif self.path.startswith('/v1/eyes'):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=UTF-8')
+        self.send_header('Content-Length', len(binary))
+        self.end_headers()
+        self.wfile.write(binary)
+
+    def get_telemetry(self):
+
+        data = telemetry_sampler.stats()
+        for name in data:
+            sample = telemetry_sampler.get(name, float('inf'))
+            data[name]['latest'] = sample.to_dict()
+
+        self.send_json_response(data)
+
+    def get_telemetry_source(self, name):
+
+        if name not in telemetry_sampler:
+            raise routing.RequestError("Unknown telemetry source " + name, 404)
+
+        sample = self.get_telemetry_sample(name)
+
+        data = {
+            'latest': sample.to_dict(),
+            'history': [s.to_dict() for s in telemetry_sampler.history(name)]
+            }
+        self.send_json_response(data)
+
+    def get_odometry_pose(self):
 
+        # integrated by the odometer when read
+        self.get_telemetry_sample('encoders')
+
+        self.send_json_response(odometer.pose())
+
+    def post_odometry_reset(self):
+
+        data = {}
+        if self.has_request_body():
             data = self.receive_json_request()
+        params = routing.validate(ODOMETRY_RESET_SCHEMA, data)
 
-            # eyes_id from URL
-            eyes_id = urllib.parse.unquote(self.path[9:])
-            if eyes_id not in {'', 'left', 'right'}:
-                self.send_error(400, "Unknown eyes_id " + blinkers_id)
-                return
+        odometer.reset(**params)
 
-            # color from PUT data
+        self.send_no_content_response()
 
-            if not self.is_convertible_to_int(data['red']):
-                self.send_error(400, "Parameter red not an int ({})".format(data['red']))
-                return
-            red = int(data['red'])
-            if red < 0 or red > 255:
-                self.send_error(400, "Parameter red not in range 0..255 ({})".format(red))
-                return
+    def get_odometry_trajectory(self):
 
-            if not self.is_convertible_to_int(data['green']):
-                self.send_error(400, "Parameter green not an int ({})".format(data['green']))
-                return
-            green = int(data['green'])
-            if green < 0 or green > 255:
-                self.send_error(400, "Parameter green not in range 0..255 ({})".format(green))
-                return
+        params = routing.validate(self.TRAJECTORY_SCHEMA, self.query)
 
-            if not self.is_convertible_to_int(data['blue']):
-                self.send_error(400, "Parameter blue not an int ({})".format(data['blue']))
-                return
-            blue = int(data['blue'])
-            if blue < 0 or blue > 255:
-                self.send_error(400, "Parameter blue not in range 0..255 ({})".format(blue))
-                return
+        if params['format'] == 'json':
+            self.send_json_response(odometer.trajectory_json(params['since'], params['step']))
+            return
 
-            # Class EasyGoPiGo3 offers some eye open/close semantic that is
-            # rather confusing than helpful. Also, the class does not provide
-            # a method to change both eyes with a single SPI transfer. Using
-            # GoPiGo3.set_led directly.
+        binary = odometer.trajectory_binary(params['since'], params['step'])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', len(binary))
+        self.end_headers()
+        self.wfile.write(binary)
 
-            # map to GoPiGo3.set_led parameters
-            led = {
-                '': egpg3.LED_LEFT_EYE | egpg3.LED_RIGHT_EYE,
-                'left': egpg3.LED_LEFT_EYE,
-                'right': egpg3.LED_RIGHT_EYE
-                }[eyes_id]
+    def get_servo_position(self, port):
 
-            egpg3.set_led(led, red, green, blue)
+        if servos[port] is None:
+            raise routing.RequestError("No servo " + port, 404)
 
-            self.send_no_content_response()
+        if self.query_flag('wait'):
+            servos[port].wait()
+
+        self.send_json_response(servos[port].status())
 
-        elif self.path in ('/v1/servos/SERVO1/position', '/v1/servos/SERVO2/position'):
+    def get_snapshot(self):
 
-            port = self.path[11:17]
+        profile = self.camera_profile_from_query()
 
-            if servos[port] is None:
-                self.send_error(404, "No servo " + port)
+        try:
+            frame = camera.take_snapshot(profile)
+        except camera.CameraBusyError as e:
+            raise routing.RequestError(str(e), 503)
+        if frame is None:
+            raise routing.RequestError("No frame received from camera", 503)
+
+        with frame:
+            self.log_message('"%s" frame after %.3f s', self.requestline,
+                time.monotonic() - self.request_start)
+            etag = camera.frame_etag(profile, frame)
+            if self.headers.get('If-None-Match') == etag:
+                # client polls faster than the camera delivers frames
+                self.send_response(304)
+                if self.headers.get('Origin') is not None:
+                    self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache, private')
+                self.end_headers()
                 return
 
-            data = self.receive_json_request()
+            self.send_response(200)
+            if self.headers.get('Origin') is not None:
+                self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', len(frame))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache, private')
+            self.end_headers()
+            self.wfile.write(frame.data)
 
-            if not self.is_convertible_to_int(data['position']):
-                self.send_error(400, "Parameter position not an int ({})".format(data['position']))
-                return
-            position = int(data['position'])
-            if position < 0 or position > 180:
-                self.send_error(400, "Parameter position not in range 0..180 ({})".format(position))
-                return
+    def get_mjpeg_stream(self):
 
-            servos[port].rotate_servo(position)
+        profile = self.camera_profile_from_query()
 
-            # wait for servo to reach its position
-            #
-            # The specified timespan almost is arbitrary as servo speed and
-            # previous position determine the time to reach the new position.
-            time.sleep(0.25)
+        stream = camera.CameraMJPEGStream(profile)
+        try:
+            stream.open()
+        except camera.CameraBusyError as e:
+            raise routing.RequestError(str(e), 503)
 
-            self.send_no_content_response()
+        try:
+            self.send_response(200)
+            # the stream has no length, it ends when the connection is
+            # closed
+            self.send_header('Connection', 'close')
+            self.send_header('Age', 0)
+            self.send_header('Cache-Control', 'no-cache, private')
+            self.send_header('Pragma', 'no-cache')
+            self.send_header('Content-Type', 
+                'multipart/x-mixed-replace; boundary=' + camera.MJPEG_BOUNDARY)
+            self.end_headers()
+            # a viewer may stall longer than the idle timeout
+            self.connection.settimeout(None)
 
-        else:
-            self.send_error(404, "Unknown path " + self.path)
+            while True:
 
-    def do_POST(self):
+                try:
+                    with stream.get_frame() as frame:
+                        # boundary, part headers and JPEG in one system call
+                        camera.send_buffers(self.connection, camera.mjpeg_part(frame))
+                except ConnectionError:
+                    self.log_error('"%s" ended with ConnectionError', 
+                        self.requestline)
+                    break
 
-        if self.path == '/v1/motors/drive':
+            self.log_message('"%s" sent %d frames, dropped %d frames, first frame after %s s',
+                self.requestline, stream.sent, stream.dropped,
+                '-' if stream.first_frame_time is None else '%.3f' % stream.first_frame_time)
 
-            data = self.receive_json_request()
+        finally:
+            stream.close()
 
-            direction = data['direction']
-            if direction not in {'forward', 'backward'}:
-                self.send_error(400, "Unknown direction " + direction)
-                return
+    def put_blinkers(self, blinkers_id=''):
 
-            if not self.is_convertible_to_int(data['speed']):
-                self.send_error(400, "Parameter speed not a int ({})".format(data['speed']))
-                return
-            speed = int(data['speed'])
-            if speed < 0 or speed > 100:
-                self.send_error(400, "Parameter speed not in range 0..100 ({})".format(speed))
-                return
+        led, color = parse_blinkers(blinkers_id, self.receive_json_request())
 
-            distance = None
-            if 'distance' in data:
-                if not self.is_convertible_to_int(data['distance']):
-                    self.send_error(400, "Parameter distance not an int ({})".format(data['distance']))
-                    return
-                distance = int(data['distance'])
-                if distance < 0:
-                    self.send_error(400, "Parameter distance less than 0 ({})".format(distance))
-                    return
-
-            # Set Speed
-            #
-            # Speed in dps is a percentage of the 'default speed' (which reflects
-            # a reasonable maximum).
-            #
-            # Method EasyGoPiGo3.set_speed() calls GoPiGo3.set_motor_limits(),
-            # and EasyGoPiGo3.forward() calls GoPiGo3.set_motor_dps(). Even
-            # though the speed is also passed to set_motor_dps,
-            # set_motor_limits needs to be called to remove any limits a
-            # previous operation may have set.
-            dps = int(egpg3.DEFAULT_SPEED * speed / 100)
-            egpg3.set_speed(dps)
-
-            if distance is None:
-                # drive forever
-                if direction == 'forward':
-                    egpg3.forward()
-                else:
-                    egpg3.backward()
-            else:
-                # drive given distance
-                dist_cm = distance / 10
-                if direction == 'backward':
-                    dist_cm = -dist_cm
-                egpg3.drive_cm(dist_cm, blocking=True)
+        # Written by the actuator writer, which merges LEDs of the same
+        # color into a single SPI transfer (see flush_actuators()).
+        for bit in led_bits(led):
+            actuator_writer.write(bit, color)
 
-            self.send_no_content_response()
+        self.send_no_content_response()
 
-        elif self.path == '/v1/motors/turn':
+    def put_eyes(self, eyes_id=''):
 
-            data = self.receive_json_request()
+        led, color = parse_eyes(eyes_id, self.receive_json_request())
 
-            direction = data['direction']
-            if direction not in {'right', 'left'}:
-                self.send_error(400, "Unknown direction " + direction)
-                return
+        # see put_blinkers()
+        for bit in led_bits(led):
+            actuator_writer.write(bit, color)
 
-            if not self.is_convertible_to_int(data['speed']):
-                self.send_error(400, "Parameter speed not a int ({})".format(data['speed']))
-                return
-            speed = int(data['speed'])
-            if speed < 0 or speed > 100:
-                self.send_error(400, "Parameter speed not in range 0..100 ({})".format(speed))
-                return
+        self.send_no_content_response()
 
-            angle = None
-            if 'angle' in data:
-                if not self.is_convertible_to_int(data['angle']):
-                    self.send_error(400, "Parameter angle not an int ({})".format(data['angle']))
-                    return
-                angle = int(data['angle'])
-                if angle < 0:
-                    self.send_error(400, "Parameter angle less than 0 ({})".format(angle))
-                    return
-
-            # Set Speed
-            #
-            # Speed in dps is a percentage of the 'default speed' (which reflects
-            # a reasonable maximum).
-            #
-            # Method EasyGoPiGo3.set_speed() calls GoPiGo3.set_motor_limits().
-            # Even though the speed is also passed to set_motor_dps,
-            # set_motor_limits needs to be called to remove any limits a
-            # previous operation may have set.
-            dps = int(egpg3.DEFAULT_SPEED * speed / 100)
-            egpg3.set_speed(dps)
-
-            if angle is None:
-                # turn forever
-                if direction == 'right':
-                    egpg3.set_motor_dps(egpg3.MOTOR_LEFT, dps)
-                    egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, -dps)
-                else:
-                    egpg3.set_motor_dps(egpg3.MOTOR_LEFT, -dps)
-                    egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, dps)
-            else:
-                # turn given degrees
-                if direction == 'right':
-                    egpg3.turn_degrees(angle, blocking=True)
-                else:
-                    egpg3.turn_degrees(-angle, blocking=True)
+    def put_servo_position(self, port):
+
+        position = parse_servo_position(port, self.receive_json_request())
+
+        servos[port].move(position)
+
+        # wait for servo to reach its position
+        #
+        # The time is estimated from servo speed and previous position.
+        if self.query_flag('wait'):
+            servos[port].wait()
+
+        self.send_no_content_response()
 
+    def post_drive(self):
+
+        direction, dps, distance = parse_drive(self.receive_json_request())
+
+        if distance is None:
+            actuator_writer.write('motors', (drive_forever, (direction, dps)))
             self.send_no_content_response()
+        else:
+            # drive given distance, executed by motion executor
+            if direction == 'backward':
+                distance = -distance
+            with hardware_lock:
+                actuator_writer.forget('motors')
+                command = motion_executor.drive(distance, dps,
+                    enqueue=self.query_flag('queue'))
+            self.send_motion_command_response(command)
 
-        elif self.path == '/v1/motors/set':
+    def post_turn(self):
 
-            data = self.receive_json_request()
+        direction, dps, angle = parse_turn(self.receive_json_request())
 
-            left_direction = data['left_direction']
-            if left_direction not in {'forward', 'backward'}:
-                self.send_error(400, "Unknown left_direction " + left_direction)
-                return
+        if angle is None:
+            actuator_writer.write('motors', (turn_forever, (direction, dps)))
+            self.send_no_content_response()
+        else:
+            # turn given degrees, executed by motion executor
+            if direction == 'left':
+                angle = -angle
+            with hardware_lock:
+                actuator_writer.forget('motors')
+                command = motion_executor.turn(angle, dps,
+                    enqueue=self.query_flag('queue'))
+            self.send_motion_command_response(command)
 
-            if not self.is_convertible_to_int(data['left_speed']):
-                self.send_error(400, "Parameter left_speed not a int ({})".format(data['left_speed']))
-                return
-            left_speed = int(data['left_speed'])
-            if left_speed < 0 or left_speed > 100:
-                self.send_error(400, "Parameter left_speed not in range 0..100 ({})".format(left_speed))
-                return
+    def post_motors_set(self):
 
-            right_direction = data['right_direction']
-            if right_direction not in {'forward', 'backward'}:
-                self.send_error(400, "Unknown right_direction " + right_direction)
-                return
+        speeds = parse_motors_set(self.receive_json_request())
 
-            if not self.is_convertible_to_int(data['right_speed']):
-                self.send_error(400, "Parameter right_speed not a int ({})".format(data['right_speed']))
-                return
-            right_speed = int(data['right_speed'])
-            if right_speed < 0 or right_speed > 100:
-                self.send_error(400, "Parameter right_speed not in range 0..100 ({})".format(right_speed))
-                return
+        actuator_writer.write('motors', (set_motors, speeds))
 
-            if (left_direction == right_direction and
-                left_speed == right_speed):
+        self.send_no_content_response()
 
-                # similar logic as in /v1/motors/drive
+    def post_motors_stop(self):
 
-                dps = int(egpg3.DEFAULT_SPEED * left_speed / 100)
-                egpg3.set_speed(dps)
+        # not coalesced, stops right away
+        with hardware_lock:
+            actuator_writer.forget('motors')
+            motion_executor.run_exclusive(egpg3.stop)
 
-                if left_direction == 'forward':
-                    egpg3.forward()
-                else:
-                    egpg3.backward()
+        self.send_no_content_response()
 
-            else:
+    def post_batch(self):
+
+        batch = parse_batch(self.receive_json_request())
+
+        self.send_json_response(run_batch(batch))
+
+    def get_behaviours(self):
 
-                # Remove any potential limits from previous operation.
-                egpg3.reset_speed()
+        run = behaviour_engine.current()
+        data = {
+            'behaviours': dict(behaviour_engine.parameters),
+            'current': None if run is None else run.to_dict()
+            }
+        self.send_json_response(data)
 
-                left_dps = int(egpg3.DEFAULT_SPEED * left_speed / 100)
-                if (left_direction == 'backward'):
-                    left_dps = -left_dps
+    def get_current_behaviour(self):
 
-                right_dps = int(egpg3.DEFAULT_SPEED * right_speed / 100)
-                if (right_direction == 'backward'):
-                    right_dps = -right_dps
+        run = behaviour_engine.current()
+        if run is None:
+            raise routing.RequestError("No behaviour ran yet", 404)
 
-                egpg3.set_motor_dps(egpg3.MOTOR_LEFT, left_dps)
-                egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, right_dps)
+        self.send_json_response(run.to_dict())
 
+    def put_behaviour_parameters(self, name):
+
+        params = parse_behaviour_parameters(name, self.receive_json_request())
+
+        behaviour_engine.set_parameters(name, params)
+
+        self.send_no_content_response()
+
+    def post_behaviour_start(self, name):
+
+        if distance_sensor is None:
+            raise routing.RequestError("No distance sensor", 404)
+
+        data = {}
+        if self.has_request_body():
+            data = self.receive_json_request()
+        params = parse_behaviour_parameters(name, data)
+
+        with hardware_lock:
+            actuator_writer.forget('motors')
+            behaviour_engine.set_parameters(name, params)
+            run = behaviour_engine.start(name)
+
+        if self.query_flag('wait'):
+            run.wait()
             self.send_no_content_response()
+            return
+        self.send_json_response(run.to_dict(), 202)
+
+    def post_behaviours_stop(self):
+
+        if behaviour_engine.stop() is not None:
+            motion_executor.run_exclusive(egpg3.stop)
 
-        elif self.path == '/v1/motors/stop':
+        self.send_no_content_response()
 
-            egpg3.stop()
+    def post_servo_sweep(self, port):
 
+        steps = parse_servo_sweep(port, self.receive_json_request())
+
+        done, duration = servos[port].sweep(steps)
+
+        if self.query_flag('wait'):
+            done.wait()
             self.send_no_content_response()
+            return
 
-        else:
-            self.send_error(404, "Unknown path " + self.path)
+        self.send_json_response({'steps': len(steps), 'duration': round(duration, 3)}, 202)
 
-    def do_OPTIONS(self):
-        """ needed for CORS pre-flight requests """
+    def send_telemetry_stream(self):
+        """
+        Send telemetry changes as Server-Sent Events until the client
+        disconnects.
+        """
+        try:
+            subscription = self.open_telemetry_stream(urllib.parse.urlsplit(self.path).query)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
 
-        if self.headers.get('Origin') is None:
-            self.send_error(501, "Non-CORS OPTIONS request not implemented")
+        try:
+            self.send_response(200)
+            # the stream has no length, it ends when the connection is
+            # closed
+            self.send_header('Connection', 'close')
+            if self.headers.get('Origin') is not None:
+                self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+            self.send_header('Content-Type', 'text/event-stream; charset=UTF-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.connection.settimeout(None)
+
+            self.wfile.write(telemetry.sse_event(subscription.snapshot()))
+            while True:
+                values = subscription.get_update(self.STREAM_KEEP_ALIVE)
+                if values is None:
+                    self.wfile.write(telemetry.SSE_KEEP_ALIVE)
+                else:
+                    self.wfile.write(telemetry.sse_event(values))
+
+        except ConnectionError:
+            pass
+        finally:
+            subscription.close()
+        self.log_message('"%s" sent %d telemetry events, %d samples suppressed',
+            self.requestline, subscription.updates, subscription.suppressed)
+
+    def handle_websocket(self):
+        """
+        Upgrade connection to WebSocket and serve it until it is closed.
+        """
+        if not websocket.is_upgrade_request(self.headers):
+            self.send_error(400, "WebSocket upgrade required")
             return
 
-        self.send_response(200)
+        # the connection is not used for HTTP anymore
+        self.close_connection = True
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept',
+            websocket.accept_key(self.headers['Sec-WebSocket-Key']))
+        self.end_headers()
+        self.connection.settimeout(None)
 
-        self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
-        self.send_header("Access-Control-Allow-Methods", "GET, PUT, POST, OPTIONS")
+        send_lock = threading.Lock()
 
-        if self.headers.get('Access-Control-Request-Headers') is not None:
-            self.send_header("Access-Control-Allow-Headers", self.headers.get('Access-Control-Request-Headers'))
+        def send(data):
+            with send_lock:
+                self.connection.sendall(data)
+
+        session = self.create_websocket_session(self.server, self.client_address, send)
+        try:
+            while True:
+                # rfile may hold frames sent right after the handshake
+                data = self.rfile.read1(65536)
+                if not data or not session.receive(data):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+        self.log_message('"%s" WebSocket closed after %d commands, %d telemetry messages',
+            self.requestline, session.commands, session.pushed)
+
+    def send_asset_variant(self, variant, cors=False):
+        """
+        Send a prepared response body. With cors the origin of the request
+        is allowed, like for API responses.
+        """
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = variant.matches_etag(if_none_match)
+        else:
+            not_modified = variant.not_modified_since(self.headers.get('If-Modified-Since'))
+
+        encoding = variant.negotiate(self.headers.get('Accept-Encoding'))
+
+        if not_modified:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+        if cors and self.headers.get('Origin') is not None:
+            self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
+        if variant.content_type is not None:
+            self.send_header('Content-Type', variant.content_type)
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        if len(variant.bodies) > 1:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', variant.etags[encoding])
+        self.send_header('Last-Modified', 
+            email.utils.formatdate(variant.last_modified, usegmt=True))
+        # let browsers revalidate, a 304 is cheap
+        self.send_header('Cache-Control', 'no-cache')
+        if not_modified:
+            self.end_headers()
+            return
 
+        binary = variant.bodies[encoding]
+        self.send_header('Content-Length', len(binary))
         self.end_headers()
 
+        # send content to requester
+        self.wfile.write(binary)
+
+    def camera_profile_from_query(self):
+        """
+        Return camera profile selected by query parameters, e.g.
+        ?profile=thumbnail or ?width=640&height=480&quality=80&framerate=5.
+
+        Raises RequestError if parameters are invalid.
+        """
+        params = {name: value for name, value in self.query.items()
+                  if name in {'profile', 'width', 'height', 'quality', 'framerate'}}
+        try:
+            return camera.make_profile(**params)
+        except ValueError as e:
+            raise routing.RequestError(str(e))
+
+    def has_request_body(self):
+        """
+        True if the request has a body (Content-Length above 0). Raises
+        RequestError if Content-Length is not a number.
+        """
+        try:
+            return int(self.headers.get('Content-Length', 0)) > 0
+        except ValueError:
+            self.close_connection = True
+            raise routing.RequestError("Invalid Content-Length")
+
     def receive_json_request(self):
         """
         Read request body and parse as JSON.
 
-        Typically used by PUT and POST operations.
+        Typically used by PUT and POST operations. Raises RequestError if
+        the body is not JSON.
         """
         # read and parse request data
-        data_bytes = self.rfile.read(int(self.headers['Content-Length']))
-        data_string = data_bytes.decode()
-        return json.loads(data_string)
+        self.body_read = True
+        try:
+            data_bytes = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return jsoncodec.loads(data_bytes)
+        except ValueError:
+            self.close_connection = True
+            raise routing.RequestError("Request data not JSON")
 
-    def send_json_response(self, data):
+    def send_json_response(self, data, status=200):
         """
-        Send 200 success response with JSON as body.
+        Send success response (default 200) with JSON as body.
         
         Typically used for GET operations.
         """
 
-        data_string = json.dumps(data)
-        binary = data_string.encode()
+        self.send_json_body(jsoncodec.dumps(data), status)
 
-        self.send_response(200)
+    def send_json_template(self, template, data):
+        """
+        Send success response with data encoded by jsoncodec.Template, for
+        fixed-shape responses.
+        """
+        self.send_json_body(template.encode(data))
+
+    def send_json_body(self, binary, status=200):
+        """
+        Send success response (default 200) with encoded JSON binary as
+        body.
+        """
+        self.send_response(status)
         if self.headers.get('Origin') is not None:
             self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
         self.send_header("Content-Type", "application/json; charset=UTF-8")
@@ -602,12 +1324,582 @@ class GPG3ServerHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             self.send_header("Access-Control-Allow-Origin", self.headers.get('Origin'))
         self.end_headers()
 
-    def is_convertible_to_int(self, s):
+    def send_motion_command_response(self, command):
+        """
+        Send 202 response with the command's status, or wait for the command
+        to finish and send 204 if the request has query parameter wait=true.
+        """
+        if self.query_flag('wait'):
+            command.wait()
+            self.send_no_content_response()
+            return
+        self.send_json_response(command.to_dict(), 202)
+
+    # query string schemas, see routing.validate()
+    MAX_AGE_SCHEMA = {'max_age': routing.Int(0, optional=True)}
+    TRAJECTORY_SCHEMA = {
+        'since': routing.Float(optional=True),
+        'step': routing.Int(1, optional=True, default=1),
+        'format': routing.Enum('json', 'binary', optional=True, default='json')
+        }
+
+    def get_telemetry_sample(self, name):
+        """
+        Return cached telemetry sample, at most max_age milliseconds old if
+        the query parameter is given.
+
+        Raises RequestError if max_age is invalid.
+        """
+        max_age = routing.validate(self.MAX_AGE_SCHEMA, self.query)['max_age']
+        if max_age is not None:
+            max_age = max_age / 1000
+        return telemetry_sampler.get(name, max_age)
+
+    def query_flag(self, name):
+        """
+        True if query parameter name is 'true' (or '1').
+        """
+        return routing.query_flag(self.query, name)
+
+# request metrics of all routes, preallocated
+request_metrics = metrics.RequestMetrics(
+    [handler for method, path, handler in GPG3ServerHTTPRequestHandler.ROUTES] +
+    ['get_static_asset', 'get_immutable_resource', 'options', 'unmatched'])
+
+def thread_counts():
+    """
+    Return dict thread name (without number) -> number of threads.
+    """
+    counts = collections.Counter()
+    for thread in threading.enumerate():
+        name = re.sub(r'[-_ ]?\d.*$', '', thread.name)
+        counts[name or thread.name] += 1
+    return dict(sorted(counts.items()))
+
+def scheduler_stats(server):
+    """
+    Return figures of the hardware gate, the worker pool and waiting
+    request threads of server (None for a thread per connection), its
+    connections (pooled server only) and the rate limits.
+    """
+    pool = getattr(server, 'pool', None)
+    waiting = getattr(server, 'waiting', None)
+    rate_limiter = GPG3ServerHTTPRequestHandler.rate_limiter
+    return {
+        'hardware': hardware_gate.to_dict(),
+        'workers': None if pool is None else pool.to_dict(),
+        'waiting': None if waiting is None else waiting.to_dict(),
+        'connections': server.to_dict()
+            if isinstance(server, pooled_server.PooledHTTPServer) else None,
+        'rate_limits': None if rate_limiter is None else rate_limiter.to_dict()
+        }
+
+def prometheus_metrics(pool=None):
+    """
+    Return all metrics in Prometheus text format. pool is the
+    scheduler.WorkerPool of the server, if any.
+    """
+    routes = request_metrics.routes()
+    writer = metrics.PrometheusWriter()
+
+    writer.metric('gpg3_http_responses_total', 'counter',
+        'HTTP responses by route and status class',
+        [([('route', r.name), ('status', '{}xx'.format(i) if i else 'none')], n)
+         for r in routes for i, n in enumerate(r.responses) if n])
+    writer.metric('gpg3_http_in_flight', 'gauge',
+        'Requests being handled (open streams for stream routes)',
+        [([('route', r.name)], r.in_flight) for r in routes if r.in_flight or any(r.responses)])
+    writer.histogram('gpg3_http_request_duration_seconds',
+        'Request handling time by route, without streams',
+        [([('route', r.name)], r.latency) for r in routes if r.latency.count])
+    writer.histogram('gpg3_http_request_hardware_seconds',
+        'Part of the request handling time spent in GoPiGo3 calls',
+        [([('route', r.name)], r.hardware) for r in routes if r.hardware.count])
+    writer.histogram('gpg3_hardware_call_duration_seconds',
+        'Duration of GoPiGo3 calls (SPI) by method, from all threads',
+        [([('call', name)], h) for name, h in sorted(egpg3.calls.items())])
+
+    http = connection_stats.to_dict()
+    writer.metric('gpg3_http_connections_total', 'counter', 'HTTP connections',
+        [([], http['connections'])])
+    writer.metric('gpg3_http_requests_total', 'counter', 'HTTP requests',
+        [([], http['requests'])])
+    writer.metric('gpg3_http_requests_reused_total', 'counter',
+        'HTTP requests on a persistent connection', [([], http['reused'])])
+
+    actuator_stats = actuator_writer.to_dict()
+    writer.metric('gpg3_actuator_writes_total', 'counter',
+        'LED and motor writes by outcome',
+        [([('outcome', name)], actuator_stats[name])
+         for name in ('received', 'coalesced', 'skipped', 'flushed', 'errors')])
+
+    request_log = GPG3ServerHTTPRequestHandler.request_log
+    if request_log is not None:
+        log_stats = request_log.to_dict()
+        writer.metric('gpg3_log_records_total', 'counter',
+            'Request log records by outcome (queued records are written, suppressed '
+            'as repeats or dropped because the queue was full)',
+            [([('outcome', name)], log_stats[name])
+             for name in ('queued', 'not_sampled', 'suppressed', 'dropped')])
+        writer.metric('gpg3_log_lines_written_total', 'counter', 'Lines written to the log',
+            [([], log_stats['written'])])
+
+    writer.metric('gpg3_behaviour_ticks_total', 'counter', 'Behaviour control loop ticks',
+        [([], behaviour_engine.ticks)])
+    writer.metric('gpg3_behaviour_overruns_total', 'counter',
+        'Behaviour ticks that took longer than the period', [([], behaviour_engine.overruns)])
+    writer.metric('gpg3_behaviour_skipped_total', 'counter',
+        'Behaviour ticks skipped because the loop was late', [([], behaviour_engine.skipped)])
+    writer.histogram('gpg3_behaviour_jitter_seconds',
+        'Delay of behaviour ticks from their scheduled time', [([], behaviour_engine.jitter)])
+
+    sources = telemetry_sampler.stats()
+    writer.metric('gpg3_telemetry_reads_total', 'counter', 'Telemetry source reads',
+        [([('source', name)], source['reads']) for name, source in sources.items()])
+    writer.metric('gpg3_telemetry_errors_total', 'counter', 'Telemetry source read errors',
+        [([('source', name)], source['errors']) for name, source in sources.items()])
+
+    camera_stats = camera.stats()
+    recordings = camera_stats['recordings']
+    writer.metric('gpg3_camera_frames_total', 'counter', 'Frames produced by recording',
+        [([('recording', name)], r['frames']) for name, r in recordings.items()])
+    writer.metric('gpg3_camera_viewer_frames_sent_total', 'counter', 'Frames sent by viewer',
+        [([('recording', name), ('viewer', i)], v['sent'])
+         for name, r in recordings.items() for i, v in enumerate(r['viewers'])])
+    writer.metric('gpg3_camera_viewer_frames_dropped_total', 'counter',
+        'Frames dropped because the viewer was too slow',
+        [([('recording', name), ('viewer', i)], v['dropped'])
+         for name, r in recordings.items() for i, v in enumerate(r['viewers'])])
+
+    queues = hardware_gate.queues
+    writer.metric('gpg3_hardware_queue_waiting', 'gauge',
+        'GoPiGo3 calls waiting for the hardware by scheduler class',
+        [([('class', q.name)], q.waiting) for q in queues])
+    writer.metric('gpg3_hardware_queue_rejected_total', 'counter',
+        'Requests rejected (503) because the hardware queue of their class was full',
+        [([('class', q.name)], q.rejected) for q in queues])
+    writer.histogram('gpg3_hardware_queue_wait_seconds',
+        'Time GoPiGo3 calls waited for the hardware by scheduler class',
+        [([('class', q.name)], q.wait) for q in queues if q.wait.count])
+
+    if pool is not None:
+        writer.metric('gpg3_workers_busy', 'gauge', 'Server worker threads handling a task',
+            [([], pool.busy)])
+        writer.metric('gpg3_worker_queue_waiting', 'gauge',
+            'Requests waiting for a server worker by scheduler class',
+            [([('queue', q.name)], q.waiting) for q in pool.queues])
+        writer.metric('gpg3_worker_queue_rejected_total', 'counter',
+            'Requests rejected (503) because the worker queue of their class was full',
+            [([('queue', q.name)], q.rejected) for q in pool.queues])
+        writer.histogram('gpg3_worker_queue_wait_seconds',
+            'Time requests waited for a server worker by scheduler class',
+            [([('queue', q.name)], q.wait) for q in pool.queues if q.wait.count])
+
+    rate_limiter = GPG3ServerHTTPRequestHandler.rate_limiter
+    if rate_limiter is not None:
+        writer.metric('gpg3_rate_limited_total', 'counter',
+            'Requests rejected (429) because the client exceeded its rate by scheduler class',
+            [([('class', scheduler.CLASSES[cls])], rate_limiter.limited[cls])
+             for cls in sorted(rate_limiter.rates)])
+
+    writer.metric('gpg3_threads', 'gauge', 'Threads by name',
+        [([('name', name)], n) for name, n in thread_counts().items()])
+
+    return writer.text()
+
+# responses of fixed shape, polled at a high rate
+_N = jsoncodec.Template.NUMBER
+VOLTAGE_TEMPLATE = jsoncodec.Template({'voltage': _N})
+DISTANCE_TEMPLATE = jsoncodec.Template({'distance': _N})
+MOTORS_STATUS_TEMPLATE = jsoncodec.Template({
+    side: {'flags': _N, 'power': _N, 'encoder': _N, 'dps': _N}
+    for side in ('left', 'right')
+    })
+
+def read_distance_now():
+    """
+    Read the distance sensor, used by behaviours every tick. The value is
+    cached for other clients too.
+    """
+    return telemetry_sampler.get('distance', 0).value
+
+def read_encoders():
+    """
+    Read both motor encoders, used as telemetry source for odometry.
+    """
+    return {
+        'left': egpg3.get_motor_encoder(egpg3.MOTOR_LEFT),
+        'right': egpg3.get_motor_encoder(egpg3.MOTOR_RIGHT)
+        }
+
+def read_motor_status():
+    """
+    Read status of both motors, used as telemetry source.
+    """
+
+    (left_flags, left_power, left_encoder, left_dps) = \
+        egpg3.get_motor_status(egpg3.MOTOR_LEFT)
+    (right_flags, right_power, right_encoder, right_dps) = \
+        egpg3.get_motor_status(egpg3.MOTOR_RIGHT)
+
+    return {
+        'left': {
+            'flags': left_flags,
+            'power': left_power,
+            'encoder': left_encoder,
+            'dps': left_dps
+            },
+        'right': {
+            'flags': right_flags,
+            'power': right_power,
+            'encoder': right_encoder,
+            'dps': right_dps
+            }
+        }
+
+# request body schemas, see routing.validate()
+
+BLINKERS_SCHEMA = {
+    'state': routing.Enum('on', 'off')
+    }
+
+EYES_SCHEMA = {
+    'red': routing.Int(0, 255),
+    'green': routing.Int(0, 255),
+    'blue': routing.Int(0, 255)
+    }
+
+SERVO_POSITION_SCHEMA = {
+    'position': routing.Int(0, 180)
+    }
+
+SERVO_SWEEP_SCHEMA = {
+    'dwell': routing.Int(0, optional=True, default=0)
+    }
+
+DRIVE_SCHEMA = {
+    'direction': routing.Enum('forward', 'backward'),
+    'speed': routing.Int(0, 100),
+    'distance': routing.Int(0, optional=True)
+    }
+
+TURN_SCHEMA = {
+    'direction': routing.Enum('right', 'left'),
+    'speed': routing.Int(0, 100),
+    'angle': routing.Int(0, optional=True)
+    }
+
+MOTORS_SET_SCHEMA = {
+    'left_direction': routing.Enum('forward', 'backward'),
+    'left_speed': routing.Int(0, 100),
+    'right_direction': routing.Enum('forward', 'backward'),
+    'right_speed': routing.Int(0, 100)
+    }
+
+def parse_blinkers(blinkers_id, data):
+    """
+    Validate PUT /v1/blinkers[/left|right], return GoPiGo3.set_led()
+    parameters led and color (red, green, blue).
+    """
+    params = routing.validate(BLINKERS_SCHEMA, data)
+
+    led = {
+        '': egpg3.LED_LEFT_BLINKER | egpg3.LED_RIGHT_BLINKER,
+        'left': egpg3.LED_LEFT_BLINKER,
+        'right': egpg3.LED_RIGHT_BLINKER
+        }[blinkers_id]
+
+    brightness = {
+        'on': 255,
+        'off': 0
+        }[params['state']]
+
+    return led, (brightness, 0, 0)
+
+def parse_eyes(eyes_id, data):
+    """
+    Validate PUT /v1/eyes[/left|right], return GoPiGo3.set_led()
+    parameters led and color (red, green, blue).
+    """
+    params = routing.validate(EYES_SCHEMA, data)
+
+    led = {
+        '': egpg3.LED_LEFT_EYE | egpg3.LED_RIGHT_EYE,
+        'left': egpg3.LED_LEFT_EYE,
+        'right': egpg3.LED_RIGHT_EYE
+        }[eyes_id]
+
+    return led, (params['red'], params['green'], params['blue'])
+
+def parse_servo_position(port, data):
+    """
+    Validate PUT /v1/servos/[port]/position, return position.
+    """
+    if servos[port] is None:
+        raise routing.RequestError("No servo " + port, 404)
+    return routing.validate(SERVO_POSITION_SCHEMA, data)['position']
+
+def parse_servo_sweep(port, data):
+    """
+    Validate POST /v1/servos/[port]/sweep, return list of (position, dwell
+    in seconds).
+    """
+    if servos[port] is None:
+        raise routing.RequestError("No servo " + port, 404)
+
+    # steps from POST data, either positions with a common dwell time or
+    # objects with individual dwell times
+    default_dwell = routing.validate(SERVO_SWEEP_SCHEMA, data)['dwell']
+    if not isinstance(data.get('positions'), list) or not data['positions']:
+        raise routing.RequestError("Parameter positions not a non-empty list")
+
+    step_schema = dict(SERVO_POSITION_SCHEMA,
+        dwell=routing.Int(0, optional=True, default=default_dwell))
+    steps = []
+    for step in data['positions']:
+        if not isinstance(step, dict):
+            step = {'position': step}
+        params = routing.validate(step_schema, step)
+        steps.append((params['position'], params['dwell'] / 1000))
+    return steps
+
+def _dps(speed):
+    # Speed in dps is a percentage of the 'default speed' (which reflects a
+    # reasonable maximum).
+    return int(egpg3.DEFAULT_SPEED * speed / 100)
+
+def parse_drive(data):
+    """
+    Validate POST /v1/motors/drive, return direction, dps and distance
+    (None to drive forever).
+    """
+    params = routing.validate(DRIVE_SCHEMA, data)
+    return params['direction'], _dps(params['speed']), params['distance']
+
+def parse_turn(data):
+    """
+    Validate POST /v1/motors/turn, return direction, dps and angle (None to
+    turn forever).
+    """
+    params = routing.validate(TURN_SCHEMA, data)
+    return params['direction'], _dps(params['speed']), params['angle']
+
+def parse_motors_set(data):
+    """
+    Validate POST /v1/motors/set, return left_direction, left_speed,
+    right_direction and right_speed.
+    """
+    params = routing.validate(MOTORS_SET_SCHEMA, data)
+    return (params['left_direction'], params['left_speed'],
+            params['right_direction'], params['right_speed'])
+
+ODOMETRY_RESET_SCHEMA = {
+    'x': routing.Float(optional=True, default=0.0),
+    'y': routing.Float(optional=True, default=0.0),
+    'heading': routing.Float(-180, 180, optional=True, default=0.0)
+    }
+
+def parse_behaviour_parameters(name, data):
+    """
+    Validate parameters of behaviour name, return the ones given in data.
+    """
+    params = routing.validate(behaviours.BEHAVIOURS[name].SCHEMA, data)
+    return {key: value for key, value in params.items() if key in data}
+
+def drive_forever(direction, dps):
+    # Method EasyGoPiGo3.set_speed() calls GoPiGo3.set_motor_limits(), and
+    # EasyGoPiGo3.forward() calls GoPiGo3.set_motor_dps(). Even though the
+    # speed is also passed to set_motor_dps, set_motor_limits needs to be
+    # called to remove any limits a previous operation may have set.
+    egpg3.set_speed(dps)
+    if direction == 'forward':
+        egpg3.forward()
+    else:
+        egpg3.backward()
+
+def turn_forever(direction, dps):
+    # see drive_forever() why set_speed() is called
+    egpg3.set_speed(dps)
+    if direction == 'right':
+        egpg3.set_motor_dps(egpg3.MOTOR_LEFT, dps)
+        egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, -dps)
+    else:
+        egpg3.set_motor_dps(egpg3.MOTOR_LEFT, -dps)
+        egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, dps)
+
+def set_motors(left_direction, left_speed, right_direction, right_speed):
+
+    if (left_direction == right_direction and
+        left_speed == right_speed):
+
+        # similar logic as in /v1/motors/drive
+        drive_forever(left_direction, _dps(left_speed))
+
+    else:
+
+        # Remove any potential limits from previous operation.
+        egpg3.reset_speed()
+
+        left_dps = _dps(left_speed)
+        if (left_direction == 'backward'):
+            left_dps = -left_dps
+
+        right_dps = _dps(right_speed)
+        if (right_direction == 'backward'):
+            right_dps = -right_dps
+
+        egpg3.set_motor_dps(egpg3.MOTOR_LEFT, left_dps)
+        egpg3.set_motor_dps(egpg3.MOTOR_RIGHT, right_dps)
+
+# operations allowed in a batch, (method, path) -> parse function that
+# returns (kind, parameters)
+BATCH_OPERATIONS = {
+    ('PUT', '/v1/blinkers'): lambda data: ('led', parse_blinkers('', data)),
+    ('PUT', '/v1/blinkers/left'): lambda data: ('led', parse_blinkers('left', data)),
+    ('PUT', '/v1/blinkers/right'): lambda data: ('led', parse_blinkers('right', data)),
+    ('PUT', '/v1/eyes'): lambda data: ('led', parse_eyes('', data)),
+    ('PUT', '/v1/eyes/left'): lambda data: ('led', parse_eyes('left', data)),
+    ('PUT', '/v1/eyes/right'): lambda data: ('led', parse_eyes('right', data)),
+    ('PUT', '/v1/servos/SERVO1/position'):
+        lambda data: ('servo', ('SERVO1', parse_servo_position('SERVO1', data))),
+    ('PUT', '/v1/servos/SERVO2/position'):
+        lambda data: ('servo', ('SERVO2', parse_servo_position('SERVO2', data))),
+    ('POST', '/v1/motors/drive'): lambda data: ('drive', parse_drive(data)),
+    ('POST', '/v1/motors/turn'): lambda data: ('turn', parse_turn(data)),
+    ('POST', '/v1/motors/set'): lambda data: ('set', parse_motors_set(data)),
+    ('POST', '/v1/motors/stop'): lambda data: ('stop', ())
+    }
+
+def parse_batch(data):
+    """
+    Validate POST /v1/batch, return list of (kind, parameters). Raises
+    RequestError naming the first invalid operation.
+    """
+    if not isinstance(data, dict):
+        raise routing.RequestError("Request data not a JSON object")
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        raise routing.RequestError("Parameter operations not a non-empty list")
+    batch = []
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise routing.RequestError("Operation {} not a JSON object".format(i))
+        method, path = operation.get('method'), operation.get('path')
+        if not isinstance(method, str) or not isinstance(path, str):
+            raise routing.RequestError("Operation {}: method and path not strings".format(i))
+        key = (method.upper(), path)
+        parse = BATCH_OPERATIONS.get(key)
+        if parse is None:
+            raise routing.RequestError("Operation {}: {} {} not supported in batch".format(i, *key))
         try:
-            int(s)
-            return True
-        except ValueError:
-            return False
+            batch.append(parse(operation.get('body', {})))
+        except routing.RequestError as e:
+            raise routing.RequestError("Operation {}: {}".format(i, e.message), e.status)
+    return batch
+
+def led_bits(led):
+    """
+    Return list of the single LED bits set in led.
+    """
+    return [1 << i for i in range(led.bit_length()) if led & (1 << i)]
+
+def merge_led_writes(writes):
+    """
+    Reduce list of (led, color) writes, in order, to the fewest
+    GoPiGo3.set_led() calls giving the same end result: later writes
+    override earlier ones, LEDs ending with the same color are set together.
+    """
+    final = collections.OrderedDict()
+    for led, color in writes:
+        for bit in led_bits(led):
+            final[bit] = color
+    merged = collections.OrderedDict()
+    for bit, color in final.items():
+        merged[color] = merged.get(color, 0) | bit
+    return [(led, color) for color, led in merged.items()]
+
+def run_batch(batch):
+    """
+    Execute validated batch holding the hardware lock once. LED writes are
+    merged and done after the other operations. Returns per-operation
+    results. Raises QueueFull before the first operation only, a batch
+    is not rejected halfway.
+    """
+    hardware_gate.admit(scheduler.MOTION)
+    results = []
+    led_writes = []
+    with hardware_lock, scheduler.request_class(scheduler.MOTION, reject=False):
+        for kind, params in batch:
+            result = {'status': 204}
+            # pending writes of earlier requests are superseded
+            if kind == 'led':
+                actuator_writer.forget(*led_bits(params[0]))
+            elif kind != 'servo':
+                actuator_writer.forget('motors')
+            if kind == 'led':
+                led_writes.append(params)
+            elif kind == 'servo':
+                port, position = params
+                servos[port].move(position)
+            elif kind in ('drive', 'turn'):
+                direction, dps, amount = params
+                if amount is None:
+                    fn = drive_forever if kind == 'drive' else turn_forever
+                    motion_executor.run_exclusive(fn, direction, dps)
+                else:
+                    if direction in ('backward', 'left'):
+                        amount = -amount
+                    submit = motion_executor.drive if kind == 'drive' else motion_executor.turn
+                    # queued behind earlier motion operations of the batch
+                    command = submit(amount, dps, enqueue=True)
+                    result = {'status': 202, 'body': command.to_dict()}
+            elif kind == 'set':
+                motion_executor.run_exclusive(set_motors, *params)
+            elif kind == 'stop':
+                motion_executor.run_exclusive(egpg3.stop)
+            results.append(result)
+
+        merged = merge_led_writes(led_writes)
+        for led, color in merged:
+            egpg3.set_led(led, *color)
+
+    return {'results': results, 'led_writes': len(merged)}
+
+def flush_actuators(changes):
+    """
+    Write changes coalesced by actuator_writer, list of (key, value). Keys
+    are single LED bits with color (red, green, blue) as value, and
+    'motors' with (function, arguments) as value.
+    """
+    led_writes = []
+    for key, value in changes:
+        if key == 'motors':
+            fn, fn_args = value
+            motion_executor.run_exclusive(fn, *fn_args)
+        else:
+            led_writes.append((key, value))
+
+    # Class EasyGoPiGo3 offers some eye open/close semantic that is rather
+    # confusing than helpful. Also, the class does not provide a method to
+    # change both eyes or blinkers with a single SPI transfer. Using
+    # GoPiGo3.set_led directly.
+    for led, color in merge_led_writes(led_writes):
+        egpg3.set_led(led, *color)
+
+def parse_response(response):
+    """
+    Split response bytes of handle_in_memory() into status, reason and
+    JSON body (None if the body is not JSON).
+    """
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('iso-8859-1').split('\r\n')
+    _, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+    data = None
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-type' and value.strip().startswith('application/json'):
+            data = jsoncodec.loads(body)
+    return int(status), reason, data
 
 def get_own_ip():
     """
@@ -625,25 +1917,226 @@ def get_own_ip():
         s.close()
     return ip
 
+def parse_rate(s):
+    try:
+        name, rate = s.split('=')
+        return (name, float(rate))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Rate needs to be NAME=HZ, e.g. distance=10")
+
+def parse_deadband(s):
+    try:
+        name, deadband = s.split('=')
+        return (name, float(deadband))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Deadband needs to be NAME=VALUE, e.g. distance=5")
+
+def parse_route_log(s):
+    try:
+        route, level = s.split('=')
+    except ValueError:
+        level = None
+    if level not in requestlog.LEVELS:
+        raise argparse.ArgumentTypeError("Route log level needs to be ROUTE=LEVEL, LEVEL one of "
+                                         + ", ".join(requestlog.LEVELS) + ", e.g. get_distance=sampled")
+    return (route, level)
+
+def parse_queue_limit(s):
+    try:
+        name, limit = s.split('=')
+        return (scheduler.parse_class(name), int(limit))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Queue limit needs to be CLASS=N, CLASS one of "
+                                         + ", ".join(scheduler.CLASSES) + ", e.g. telemetry=32")
+
+def parse_rate_limit(s):
+    try:
+        name, rate = s.split('=')
+        rate, _, burst = rate.partition(':')
+        rate = float(rate)
+        return (scheduler.parse_class(name), (rate, float(burst) if burst else 2 * rate))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Rate limit needs to be CLASS=RATE[:BURST], CLASS one of "
+                                         + ", ".join(scheduler.CLASSES) + ", e.g. telemetry=100:200")
+
+def parse_resolution(s):
+    try:
+        width, height = s.lower().split('x')
+        return (int(width), int(height))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Resolution needs to be WIDTHxHEIGHT, e.g. 640x480")
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='GoPiGo3 Server')
+    parser.add_argument('--port', type=int, default=8080,
+        help='HTTP port (default: 8080)')
+    parser.add_argument('--server', choices=['threading', 'asyncio'], default='threading',
+        help='HTTP server implementation, asyncio serves all connections from one thread '
+             '(default: threading)')
+    parser.add_argument('--async-workers', type=int, default=8,
+        help='with --server asyncio, number of threads handling requests (default: 8)')
+    parser.add_argument('--workers', type=int, default=16,
+        help='with --server threading, number of threads handling requests, idle '
+             'connections and streams take none; 0 for a thread per connection '
+             '(default: 16)')
+    parser.add_argument('--max-waiting', type=int, default=32,
+        help='requests with ?wait=true waiting for the motors, a servo or a behaviour, on '
+             'threads of their own; more are answered with 503, 0 for no limit (default: 32)')
+    parser.add_argument('--max-connections', type=int, default=256,
+        help='with --server threading and --workers, open connections, more are answered '
+             'with 503, 0 for no limit (default: 256)')
+    parser.add_argument('--queue-limit', type=parse_queue_limit, action='append', default=[],
+        help='requests of a scheduler class (stop, motion, actuators, telemetry) waiting for '
+             'the hardware or for a worker; more are answered with '
+             '503, 0 for no limit; can be repeated (default: stop=0 motion=64 actuators=64 '
+             'telemetry=32)')
+    parser.add_argument('--rate-limit', type=parse_rate_limit, action='append', default=[],
+        help='requests per second and burst of a scheduler class per client IP address, '
+             'more are answered with 429, 0 for no limit; can be repeated (default: '
+             'motion=100:200 actuators=100:200 telemetry=200:400)')
+    parser.add_argument('--keep-alive-timeout', type=float, default=15,
+        help='seconds an idle persistent connection is kept open (default: 15)')
+    parser.add_argument('--keep-alive-max', type=int, default=100,
+        help='requests per persistent connection, 0 for no limit (default: 100)')
+    parser.add_argument('--hardware', default='gopigo3',
+        help='robot hardware: gopigo3, simulated (runs without GoPiGo3) or module:callable, '
+             'see hardware.py (default: gopigo3)')
+    parser.add_argument('--telemetry-rate', type=parse_rate, action='append', default=[],
+        help='sampling rate of a telemetry source (5v, battery, motors, encoders, distance) '
+             'in reads per second, 0 reads only on demand; can be repeated (default: 5v=1 '
+             'battery=1 motors=10 encoders=50 distance=10)')
+    parser.add_argument('--telemetry-deadband', type=parse_deadband, action='append', default=[],
+        help='smallest change of a telemetry value reported to stream clients; can be '
+             'repeated (default: 5v=0.02 battery=0.05 distance=5)')
+    parser.add_argument('--actuator-rate', type=float, default=50,
+        help='maximum LED and motor writes per second, 0 writes every request '
+             'through (default: 50)')
+    parser.add_argument('--odometry-history', type=int, default=30000,
+        help='encoder samples kept for the odometry trajectory (default: 30000, '
+             '10 minutes at encoders=50)')
+    parser.add_argument('--behaviour-rate', type=float, default=50,
+        help='control loop ticks per second of behaviours (default: 50)')
+    parser.add_argument('--no-access-log', action='store_true',
+        help='do not log a line per request (errors and streams are still logged), '
+             'same as --access-log off')
+    parser.add_argument('--access-log', choices=requestlog.LEVELS, default='all',
+        help='request lines logged: all, sampled (errors and every --access-log-sample-th '
+             'request), errors (status >= 400) or off (default: all)')
+    parser.add_argument('--route-log', type=parse_route_log, action='append', default=[],
+        help='--access-log level of a route (handler name, see ROUTES), e.g. '
+             'get_motors_status=sampled; can be repeated')
+    parser.add_argument('--access-log-sample', type=int, default=10,
+        help='log every n-th request of routes logged "sampled" (default: 10)')
+    parser.add_argument('--access-log-burst', type=int, default=5,
+        help='identical request lines logged per --access-log-interval, more are counted '
+             'in a summary line (default: 5)')
+    parser.add_argument('--access-log-interval', type=float, default=10,
+        help='seconds identical request lines are counted for (default: 10)')
+    parser.add_argument('--access-log-file',
+        help='write the log to this file instead of stderr, rotated by size')
+    parser.add_argument('--access-log-max-bytes', type=int, default=1000000,
+        help='size at which the log file is rotated, 0 for no rotation (default: 1000000)')
+    parser.add_argument('--access-log-backups', type=int, default=3,
+        help='rotated log files kept (default: 3)')
+    parser.add_argument('--json-backend', choices=['auto'] + sorted(jsoncodec.BACKENDS),
+        default='auto', help='JSON library, auto uses orjson or ujson if installed '
+                             '(default: auto)')
+    parser.add_argument('--telemetry-max-age', type=int, default=1000,
+        help='default maximum age in ms of a telemetry value served from cache (default: 1000)')
+    parser.add_argument('--simulated-spi-latency', type=float, default=0,
+        help='seconds a simulated SPI transaction takes (default: 0)')
+    parser.add_argument('--simulated-i2c-latency', type=float, default=0,
+        help='seconds a simulated I2C transaction takes (default: 0)')
+    parser.add_argument('--simulated-sensor-angle', type=float, default=0,
+        help='direction of the simulated distance sensor in degrees, clockwise from '
+             'straight ahead, 90 to follow a wall on the right (default: 0)')
+    parser.add_argument('--servo-speed', type=float, default=600,
+        help='servo speed in degrees per second, used to estimate when a servo arrives (default: 600)')
+    parser.add_argument('--camera', choices=sorted(hardware.CAMERAS), default='picamera',
+        help='camera implementation, synthetic generates frames without hardware (default: picamera)')
+    parser.add_argument('--camera-resolution', type=parse_resolution, default=(640, 480),
+        help='resolution the camera is opened with, streams are resized from it (default: 640x480)')
+    parser.add_argument('--camera-framerate', type=int, default=15,
+        help='camera frame rate (default: 15)')
+    parser.add_argument('--snapshot-linger', type=float, default=10,
+        help='seconds the camera keeps running after a snapshot (default: 10)')
+    parser.add_argument('--camera-linger', type=float, default=5,
+        help='seconds the camera keeps running after the last viewer left (default: 5)')
+    parser.add_argument('--camera-always-on', action='store_true',
+        help='start camera at server start and keep it running')
+    parser.add_argument('--synthetic-camera-init-delay', type=float, default=0,
+        help='seconds the synthetic camera takes to initialize (default: 0)')
+    args = parser.parse_args()
+
+    jsoncodec.select(args.json_backend)
+    print("JSON backend: " + jsoncodec.backend)
+
+    camera.configure(
+        resolution=args.camera_resolution,
+        framerate=args.camera_framerate,
+        camera_factory=hardware.camera_factory(args.camera,
+            init_delay=args.synthetic_camera_init_delay),
+        snapshot_linger=args.snapshot_linger,
+        idle_linger=args.camera_linger,
+        always_on=args.camera_always_on)
+
     # initialize GPG3 objects
 
-    egpg3 = easygopigo3.EasyGoPiGo3(use_mutex=True)
+    try:
+        egpg3 = hardware.create(args.hardware,
+            spi_latency=args.simulated_spi_latency,
+            i2c_latency=args.simulated_i2c_latency,
+            sensor_angle=args.simulated_sensor_angle)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # time spent in GoPiGo3 calls is reported at /metrics
+    egpg3 = metrics.TimedHardware(egpg3)
+
+    # GoPiGo3 calls are made one at a time, by priority of the request or
+    # thread that makes them, see scheduler.py
+    queue_limits = {scheduler.STOP: 0, scheduler.MOTION: 64, scheduler.ACTUATORS: 64,
+                    scheduler.TELEMETRY: 32}
+    queue_limits.update(args.queue_limit)
+    queue_limits = [queue_limits[cls] for cls in range(len(scheduler.CLASSES))]
+    hardware_gate = scheduler.HardwareGate(queue_limits)
+    egpg3 = scheduler.ScheduledHardware(egpg3, hardware_gate)
+
+    rate_limits = {scheduler.MOTION: (100, 200), scheduler.ACTUATORS: (100, 200),
+                   scheduler.TELEMETRY: (200, 400)}
+    rate_limits.update(args.rate_limit)
+    GPG3ServerHTTPRequestHandler.rate_limiter = scheduler.RateLimiter(
+        {cls: limit for cls, limit in rate_limits.items() if limit[0] > 0})
+
+    # serializes hardware access of requests, batches, motion executor and
+    # actuator writer
+    hardware_lock = threading.RLock()
+
+    # drive distance and turn angle commands are run by the motion executor
+    # thread
+    motion_executor = motion.MotionExecutor(egpg3, motor_lock=hardware_lock)
+
+    # LED and motor writes of requests are coalesced, see actuators.py
+    actuator_writer = actuators.CoalescingWriter(flush_actuators, hardware_lock,
+        args.actuator_rate)
+
     try:
         # TODO: Make configurable what hardware is connected. Here we just
         # initialize both servo ports - if used or not - and try to initialize
         # the distance sensor.
 
-        servos = {
-            'SERVO1': egpg3.init_servo(port = "SERVO1"),
-            'SERVO2': egpg3.init_servo(port = "SERVO2")
-        }
+        servos = {}
+        for port in ('SERVO1', 'SERVO2'):
+            servo = egpg3.init_servo(port = port)
+            servos[port] = None
+            if servo is not None:
+                servos[port] = servo_control.ServoController(servo, args.servo_speed)
 
         # move servos in middle position
         for port in servos:
             if servos[port] is not None:
-                servos[port].reset_servo()
+                servos[port].reset()
 
         try:
             distance_sensor = egpg3.init_distance_sensor()
@@ -651,11 +2144,82 @@ if __name__ == "__main__":
             print("No distance sensor found")
             distance_sensor = None
 
+        # sample sensors and status in the background
+
+        telemetry_rates = {'5v': 1, 'battery': 1, 'motors': 10, 'encoders': 50, 'distance': 10}
+        telemetry_rates.update(args.telemetry_rate)
+        telemetry_deadbands = {'5v': 0.02, 'battery': 0.05, 'motors': 0, 'encoders': 0,
+                               'distance': 5}
+        telemetry_deadbands.update(args.telemetry_deadband)
+
+        telemetry_sampler = telemetry.TelemetrySampler(args.telemetry_max_age / 1000)
+        telemetry_sampler.add_source('5v', egpg3.get_voltage_5v,
+            telemetry_rates['5v'], telemetry_deadbands['5v'])
+        telemetry_sampler.add_source('battery', egpg3.get_voltage_battery,
+            telemetry_rates['battery'], telemetry_deadbands['battery'])
+        telemetry_sampler.add_source('motors', read_motor_status,
+            telemetry_rates['motors'], telemetry_deadbands['motors'])
+        telemetry_sampler.add_source('encoders', read_encoders,
+            telemetry_rates['encoders'], telemetry_deadbands['encoders'])
+        if distance_sensor is not None:
+            telemetry_sampler.add_source('distance', distance_sensor.read_mm,
+                telemetry_rates['distance'], telemetry_deadbands['distance'])
+
+        # pose from the encoder samples
+        odometer = odometry.Odometry(egpg3, args.odometry_history)
+        telemetry_sampler.add_listener(odometer.on_sample)
+
+        telemetry_sampler.start()
+
+        # closed-loop behaviours, preempted by other motor operations
+        behaviour_engine = behaviours.BehaviourEngine(egpg3, motion_executor,
+            read_distance_now, args.behaviour_rate)
+
+        # constant responses; platform information is read once, it does
+        # not change while the server runs
+
+        GPG3ServerHTTPRequestHandler.add_immutable_resource('/ping',
+            {'server': 'gpg3', 'v1': 'supported'})
+        GPG3ServerHTTPRequestHandler.add_immutable_resource('/v1/ping',
+            {'server': 'gpg3'})
+        GPG3ServerHTTPRequestHandler.add_immutable_resource('/v1/platform/information', {
+            'manufacturer': egpg3.get_manufacturer(),
+            'board_name': egpg3.get_board(),
+            'hardware_version': egpg3.get_version_hardware(),
+            'firmware_version': egpg3.get_version_firmware(),
+            'hardware_serial_number': egpg3.get_id()
+            })
+
+        # load static files
+
+        assets = static_assets.StaticAssetCache(
+            'static',
+            GPG3ServerHTTPRequestHandler.ALLOWED_TEXT_DOWNLOADS,
+            GPG3ServerHTTPRequestHandler.ALLOWED_BINARY_DOWNLOADS)
+
         # start HTTP server
 
-        # TODO: make port configurable
-        server_address = ('', 8080)
-        httpd = ThreadingHTTPServer(server_address, GPG3ServerHTTPRequestHandler)
+        server_address = ('', args.port)
+        GPG3ServerHTTPRequestHandler.timeout = args.keep_alive_timeout
+        sink = None
+        if args.access_log_file:
+            sink = requestlog.RotatingFile(args.access_log_file, args.access_log_max_bytes,
+                                           args.access_log_backups)
+        request_log = requestlog.RequestLog(sink,
+            default_level='off' if args.no_access_log else args.access_log,
+            levels=dict(args.route_log), sample_every=args.access_log_sample,
+            burst=args.access_log_burst, interval=args.access_log_interval)
+        GPG3ServerHTTPRequestHandler.request_log = request_log
+        GPG3ServerHTTPRequestHandler.max_requests_per_connection = args.keep_alive_max
+        if args.server == 'asyncio':
+            httpd = async_server.AsyncHTTPServer(server_address, GPG3ServerHTTPRequestHandler,
+                max_workers=args.async_workers, queue_limits=queue_limits,
+                max_waiting=args.max_waiting)
+        elif args.workers:
+            httpd = pooled_server.PooledHTTPServer(server_address, GPG3ServerHTTPRequestHandler,
+                args.workers, queue_limits, args.max_connections, args.max_waiting)
+        else:
+            httpd = ThreadingHTTPServer(server_address, GPG3ServerHTTPRequestHandler)
 
         # 'with' does not work with HTTPServer, so using try-finally to close the socket.
         try:
@@ -677,6 +2241,11 @@ if __name__ == "__main__":
 
         finally:
             httpd.server_close()
+            telemetry_sampler.shutdown()
+            request_log.close()
+            if sink is not None:
+                sink.close()
 
     finally:
+        motion_executor.shutdown()
         egpg3.reset_all()
@@ -0,0 +1,104 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Hardware backends: the robot the server talks to and its camera.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A robot backend is a callable that gets the backend options as keyword
+# arguments and returns an object with the part of the
+# easygopigo3.EasyGoPiGo3 interface the server uses (simulation.py has
+# all of it):
+#
+#     gopigo3    the GoPiGo3 board, needs easygopigo3
+#     simulated  simulation.SimulatedEasyGoPiGo3; options spi_latency,
+#                i2c_latency (seconds per bus transaction) and
+#                sensor_angle (degrees)
+#
+# Other robots are given as module:callable, e.g. --hardware mybot:create.
+# Backends ignore options they do not know.
+#
+# A camera backend returns the camera_factory for camera.configure(), a
+# callable (resolution, framerate) -> picamera.PiCamera-like object:
+#
+#     picamera   the Raspberry Pi camera, needs picamera when the camera is
+#                used
+#     synthetic  camera.SyntheticPiCamera; option init_delay (seconds)
+
+import importlib
+
+try:
+    import easygopigo3
+except ImportError:
+    # only simulated hardware available
+    easygopigo3 = None
+
+import camera
+import simulation
+
+def _gopigo3(**options):
+    return easygopigo3.EasyGoPiGo3(use_mutex=True)
+
+def _simulated(spi_latency=0, i2c_latency=0, sensor_angle=0, **options):
+    return simulation.SimulatedEasyGoPiGo3(use_mutex=True, spi_latency=spi_latency,
+        i2c_latency=i2c_latency, sensor_angle=sensor_angle)
+
+BACKENDS = {'simulated': _simulated}
+if easygopigo3 is not None:
+    BACKENDS['gopigo3'] = _gopigo3
+
+def _picamera(**options):
+    # camera.py's default
+    return None
+
+def _synthetic(init_delay=0, **options):
+    def camera_factory(resolution, framerate):
+        return camera.SyntheticPiCamera(resolution, framerate, init_delay=init_delay)
+    return camera_factory
+
+CAMERAS = {'picamera': _picamera, 'synthetic': _synthetic}
+
+def _load(name):
+    module_name, _, attribute = name.partition(':')
+    try:
+        return getattr(importlib.import_module(module_name), attribute)
+    except (ImportError, AttributeError) as e:
+        raise ValueError("Hardware backend {} not found ({})".format(name, e))
+
+def create(name, **options):
+    """
+    Return the robot of backend name, see above. Raises ValueError if the
+    backend is not available.
+    """
+    if ':' in name:
+        factory = _load(name)
+    elif name in BACKENDS:
+        factory = BACKENDS[name]
+    elif name == 'gopigo3':
+        raise ValueError("Hardware backend gopigo3 needs easygopigo3, which is not "
+                         "installed (--hardware simulated runs without it)")
+    else:
+        raise ValueError("Unknown hardware backend " + name)
+    return factory(**options)
+
+def camera_factory(name, **options):
+    """
+    Return camera factory of camera backend name, None for camera.py's
+    default. Raises ValueError for unknown backends.
+    """
+    if name not in CAMERAS:
+        raise ValueError("Unknown camera backend " + name)
+    return CAMERAS[name](**options)
@@ -0,0 +1,160 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# JSON encoding and decoding, with orjson or ujson if installed.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# dumps() returns bytes and loads() accepts bytes, so request and response
+# bodies are not converted between str and bytes. The backend is chosen
+# once with select(); all backends produce compact JSON (no spaces).
+#
+# Responses of a fixed shape with only numbers changing (voltage, distance,
+# motor status) can be rendered from a Template, which formats the numbers
+# into a pre-encoded document. That is about twice as fast as the json
+# module, but slower than orjson and ujson, so Template.encode() only uses
+# it with the json backend (see benchmarks/json_codec.py).
+
+import json
+import math
+import operator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+def _json_dumps(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+def _json_loads(data):
+    # json.loads() detects the encoding of bytes itself
+    return json.loads(data)
+
+def _ujson_dumps(data):
+    return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode()
+
+def _ujson_loads(data):
+    return ujson.loads(data)
+
+def _orjson_dumps(data):
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+# name -> (dumps, loads), only backends that are installed
+BACKENDS = {'json': (_json_dumps, _json_loads)}
+if ujson is not None:
+    BACKENDS['ujson'] = (_ujson_dumps, _ujson_loads)
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+backend = None
+dumps = None
+loads = None
+
+def select(name='auto'):
+    """
+    Use backend name, 'auto' for the fastest one installed. Raises
+    ValueError if it is not installed.
+    """
+    global backend, dumps, loads
+    if name == 'auto':
+        name = next(n for n in ('orjson', 'ujson', 'json') if n in BACKENDS)
+    if name not in BACKENDS:
+        raise ValueError("JSON backend {} not installed".format(name))
+    backend = name
+    dumps, loads = BACKENDS[name]
+
+select()
+
+class Template:
+    """
+    JSON document with number fields. shape is an object like
+    {'voltage': Template.NUMBER}, fill() takes an object of that shape and
+    render() the numbers in the order they appear in shape.
+    """
+
+    NUMBER = object()
+
+    def __init__(self, shape):
+        # %-format string with a %r per number field (repr() of int and
+        # finite float is valid JSON), and the keys leading to each field
+        self._literals = [[]]
+        self._paths = []
+        self._encode(shape, ())
+        self._format = '%r'.join(b''.join(literal).decode().replace('%', '%%')
+                                 for literal in self._literals)
+        self._getters = [self._getter(path) for path in self._paths]
+
+    @staticmethod
+    def _getter(path):
+        if len(path) == 1:
+            return operator.itemgetter(path[0])
+        outer, inner = Template._getter(path[:-1]), operator.itemgetter(path[-1])
+        return lambda data: inner(outer(data))
+
+    def _encode(self, shape, path):
+        if shape is self.NUMBER:
+            self._paths.append(path)
+            self._literals.append([])
+        elif isinstance(shape, dict):
+            self._literals[-1].append(b'{')
+            for i, (name, value) in enumerate(shape.items()):
+                if i:
+                    self._literals[-1].append(b',')
+                self._literals[-1].append(_json_dumps(name) + b':')
+                self._encode(value, path + (name,))
+            self._literals[-1].append(b'}')
+        else:
+            self._literals[-1].append(_json_dumps(shape))
+
+    def render(self, *numbers):
+        """
+        Return JSON bytes with numbers filled in. Raises TypeError if a
+        value is not a finite int or float.
+        """
+        if len(numbers) != len(self._paths):
+            raise TypeError("Template takes {} numbers, got {}".format(
+                len(self._paths), len(numbers)))
+        for number in numbers:
+            # bool is an int, but not a JSON number
+            if type(number) is not int and \
+                    (type(number) is not float or not math.isfinite(number)):
+                raise TypeError("Not a JSON number: {!r}".format(number))
+        return (self._format % numbers).encode()
+
+    def fill(self, data):
+        """
+        Return JSON bytes of data, which must have the template's shape.
+        Raises KeyError or TypeError if it does not.
+        """
+        return self.render(*[getter(data) for getter in self._getters])
+
+    def encode(self, data):
+        """
+        Return JSON bytes of data, filled into the template if that is
+        faster than the backend and data has the template's shape.
+        """
+        if backend == 'json':
+            try:
+                return self.fill(data)
+            except (KeyError, IndexError, TypeError):
+                pass
+        return dumps(data)
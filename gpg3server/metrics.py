@@ -0,0 +1,272 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Request metrics and latency histograms.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Every route has a RouteMetrics, created when the route table is known,
+# with request counts per status class, an in-flight gauge and two
+# histograms: total request time and the part of it spent in GoPiGo3 calls
+# (SPI). Histogram buckets are preallocated lists of counters, observing a
+# value is a bisect and an increment.
+#
+# Time spent in GoPiGo3 calls is measured by TimedHardware, a proxy around
+# the EasyGoPiGo3 object. It adds the duration of each call to a per-thread
+# total, which the request handler reads before and after the request, and
+# to a histogram per method. Devices returned by init_servo() and
+# init_distance_sensor() are wrapped too, their methods are named servo.*
+# and distance_sensor.*.
+#
+# PrometheusWriter renders the text exposition format (text()), to_dict()
+# of the histograms the same figures as JSON.
+
+import bisect
+import threading
+import time
+
+# upper bounds in seconds; a Pi serves most requests in a few milliseconds,
+# SPI transfers take tens of microseconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets (upper bounds, ascending) and
+    an implicit +Inf bucket.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        Return (cumulative counts per bucket including +Inf, count, sum).
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count, total = self.count, self.sum
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, count, total
+
+    def quantile(self, q):
+        """
+        Estimated q-quantile (upper bound of the bucket it falls into),
+        None if nothing was observed.
+        """
+        cumulative, count, _ = self.snapshot()
+        if count == 0:
+            return None
+        rank = q * count
+        for bound, c in zip(self.buckets + (float('inf'),), cumulative):
+            if c >= rank:
+                return bound
+
+    def to_dict(self):
+        cumulative, count, total = self.snapshot()
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+            }
+
+class RouteMetrics:
+    """
+    Counters of one route (named after its handler method).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # responses per status class, index 1 for 1xx .. 5 for 5xx, 0 for
+        # requests that ended without a response
+        self.responses = [0] * 6
+        self.in_flight = 0
+        self.latency = Histogram()
+        self.hardware = Histogram()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, status, latency=None, hardware=None):
+        """
+        Count a finished request. latency and hardware (seconds in GoPiGo3
+        calls) are observed unless None, e.g. for streams.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.responses[status // 100 if 100 <= status < 600 else 0] += 1
+        if latency is not None:
+            self.latency.observe(latency)
+        if hardware is not None:
+            self.hardware.observe(hardware)
+
+    def to_dict(self):
+        with self._lock:
+            responses = {'{}xx'.format(i): n for i, n in enumerate(self.responses) if n and i}
+            if self.responses[0]:
+                responses['none'] = self.responses[0]
+            in_flight = self.in_flight
+        return {
+            'responses': responses,
+            'in_flight': in_flight,
+            'latency': self.latency.to_dict(),
+            'hardware': self.hardware.to_dict()
+            }
+
+class RequestMetrics:
+    """
+    RouteMetrics of all routes. Metrics of routes not given to the
+    constructor are created on first use.
+    """
+
+    def __init__(self, routes=()):
+        self._routes = {name: RouteMetrics(name) for name in routes}
+        self._lock = threading.Lock()
+
+    def route(self, name):
+        metrics = self._routes.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self._routes.setdefault(name, RouteMetrics(name))
+        return metrics
+
+    def routes(self):
+        with self._lock:
+            return sorted(self._routes.values(), key=lambda r: r.name)
+
+_hardware_time = threading.local()
+
+def hardware_time():
+    """
+    Seconds the calling thread spent in GoPiGo3 calls so far.
+    """
+    return getattr(_hardware_time, 'seconds', 0.0)
+
+# methods returning a device whose methods are timed too, and the prefix of
+# their names
+DEVICE_METHODS = {
+    'init_servo': 'servo.',
+    'init_distance_sensor': 'distance_sensor.'
+    }
+
+class TimedHardware:
+    """
+    Proxy for an EasyGoPiGo3 object (or a device it returned) that times
+    method calls. Attributes that are not methods are passed through.
+    """
+
+    def __init__(self, egpg3, calls=None, calls_lock=None, prefix=''):
+        # set through __dict__, __setattr__ forwards to the real object
+        self.__dict__['_egpg3'] = egpg3
+        # devices share the histograms of the EasyGoPiGo3 object
+        self.__dict__['calls'] = {} if calls is None else calls
+        self.__dict__['_calls_lock'] = threading.Lock() if calls_lock is None else calls_lock
+        self.__dict__['_prefix'] = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._egpg3, name)
+        if not callable(value):
+            return value
+        with self._calls_lock:
+            histogram = self.calls.setdefault(self._prefix + name, Histogram())
+        device_prefix = DEVICE_METHODS.get(name) if not self._prefix else None
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                _hardware_time.seconds = hardware_time() + elapsed
+                histogram.observe(elapsed)
+            if device_prefix is not None and result is not None:
+                result = TimedHardware(result, self.calls, self._calls_lock, device_prefix)
+            return result
+
+        # found in __dict__ from now on, __getattr__ is not called again
+        self.__dict__[name] = timed
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._egpg3, name, value)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+class PrometheusWriter:
+    """
+    Collects metrics in the Prometheus text exposition format (0.0.4).
+    """
+
+    def __init__(self):
+        self._lines = []
+
+    def metric(self, name, type, help, samples):
+        """
+        samples is a list of (labels, value), labels a list of (name,
+        value).
+        """
+        self._lines.append('# HELP {} {}'.format(name, help))
+        self._lines.append('# TYPE {} {}'.format(name, type))
+        for labels, value in samples:
+            self._lines.append('{}{} {}'.format(name, _labels(labels), _format(value)))
+
+    def histogram(self, name, help, histograms):
+        """
+        histograms is a list of (labels, Histogram).
+        """
+        self._lines.append('# HELP {} {}'.format(name, help))
+        self._lines.append('# TYPE {} histogram'.format(name))
+        for labels, histogram in histograms:
+            cumulative, count, total = histogram.snapshot()
+            for bound, c in zip(histogram.buckets + (float('inf'),), cumulative):
+                self._lines.append('{}_bucket{} {}'.format(name,
+                    _labels(list(labels) + [('le', _format(bound))]), c))
+            self._lines.append('{}_sum{} {}'.format(name, _labels(labels), _format(total)))
+            self._lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+
+    def text(self):
+        return '\n'.join(self._lines) + '\n'
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
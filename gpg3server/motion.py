@@ -0,0 +1,279 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Motion commands (drive distance, turn angle) executed by a dedicated
+# thread, so HTTP handler threads do not block for a whole manoeuvre.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A command moves both motors to target encoder positions, like
+# EasyGoPiGo3.drive_cm() and turn_degrees() do, and is then watched by the
+# executor thread until the targets are reached. Progress is computed from
+# the encoder deltas. A new command, any other motor operation or stop
+# preempts the running command. Motor operations go through the executor's
+# motor lock, so a preempted command cannot issue motor commands after the
+# preempting operation did. Other motor users (behaviours) register a
+# preempt listener to be stopped the same way.
+
+import collections
+import itertools
+import queue
+import threading
+import time
+
+import scheduler
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+PREEMPTED = 'preempted'
+FAILED = 'failed'
+
+class MotionCommand:
+
+    def __init__(self, id, type, dps, left_degrees, right_degrees, params):
+        self.id = id
+        self.type = type
+        self.dps = dps
+        self.left_degrees = left_degrees
+        self.right_degrees = right_degrees
+        self.params = params
+        self.state = QUEUED
+        self.error = None
+        self.left_start = None
+        self.right_start = None
+        self.left_travelled = 0
+        self.right_travelled = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._preempt = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def progress(self):
+        """
+        Fraction 0..1 of the distance travelled, average of both wheels.
+        """
+        target = abs(self.left_degrees) + abs(self.right_degrees)
+        if target == 0:
+            return 1.0 if self.state == COMPLETED else 0.0
+        travelled = abs(self.left_travelled) + abs(self.right_travelled)
+        return min(1.0, travelled / target)
+
+    def wait(self, timeout=None):
+        """
+        Wait until command finished, return True if it did.
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'params': self.params,
+            'state': self.state,
+            'error': self.error,
+            'progress': round(self.progress, 3),
+            'target_degrees': {
+                'left': round(self.left_degrees),
+                'right': round(self.right_degrees)
+                },
+            'travelled_degrees': {
+                'left': self.left_travelled,
+                'right': self.right_travelled
+                },
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+            }
+
+class MotionExecutor:
+    """
+    Runs MotionCommands one after the other on a dedicated thread.
+
+    egpg3 is an EasyGoPiGo3 (or compatible) object. Finished commands are
+    kept for status queries, up to history commands. motor_lock is the lock
+    held while issuing motor commands, a new RLock if None.
+    """
+
+    def __init__(self, egpg3, poll_interval=0.05, tolerance=5, stall_timeout=3.0,
+                 history=100, motor_lock=None):
+        self.egpg3 = egpg3
+        self.poll_interval = poll_interval
+        self.tolerance = tolerance
+        self.stall_timeout = stall_timeout
+        self._queue = queue.Queue()
+        self._commands = collections.OrderedDict()
+        self._history = history
+        self._ids = itertools.count(1)
+        self._current = None
+        self._lock = threading.Lock()
+        # held while issuing motor commands, may be shared with other
+        # hardware users
+        self.motor_lock = motor_lock or threading.RLock()
+        self._preempt_listeners = []
+        self._thread = threading.Thread(target=self._run, name='motion', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self.preempt()
+        self._queue.put(None)
+        self._thread.join()
+
+    def drive(self, distance_mm, dps, enqueue=False):
+        """
+        Submit command to drive distance_mm (negative for backward) at dps.
+        """
+        degrees = distance_mm / self.egpg3.WHEEL_CIRCUMFERENCE * 360
+        return self._submit('drive', dps, degrees, degrees,
+            {'distance': distance_mm, 'dps': dps}, enqueue)
+
+    def turn(self, angle, dps, enqueue=False):
+        """
+        Submit command to turn angle degrees (positive is clockwise) at dps.
+        """
+        wheel_travel = self.egpg3.WHEEL_BASE_CIRCUMFERENCE * angle / 360
+        degrees = wheel_travel / self.egpg3.WHEEL_CIRCUMFERENCE * 360
+        return self._submit('turn', dps, degrees, -degrees,
+            {'angle': angle, 'dps': dps}, enqueue)
+
+    def add_preempt_listener(self, listener):
+        """
+        Call listener() whenever a motor operation starts, before the motor
+        lock is taken. Once the operation holds the lock, the listener's
+        owner must not issue motor commands anymore.
+        """
+        self._preempt_listeners.append(listener)
+
+    def _notify_preempt(self):
+        for listener in self._preempt_listeners:
+            listener()
+
+    def _submit(self, type, dps, left_degrees, right_degrees, params, enqueue):
+        if enqueue:
+            # queued behind other commands, but not behind other motor users
+            self._notify_preempt()
+        else:
+            self.preempt()
+        with self._lock:
+            command = MotionCommand(next(self._ids), type, dps,
+                left_degrees, right_degrees, params)
+            self._commands[command.id] = command
+            while len(self._commands) > self._history:
+                self._commands.popitem(last=False)
+        self._queue.put(command)
+        return command
+
+    def get(self, id):
+        with self._lock:
+            return self._commands.get(id)
+
+    def preempt(self):
+        """
+        Preempt running command and cancel queued ones. Returns after the
+        running command stopped issuing motor commands.
+        """
+        self._notify_preempt()
+        with self._lock:
+            pending = [c for c in self._commands.values() if c.state in (QUEUED, RUNNING)]
+        for command in pending:
+            command._preempt.set()
+        with self.motor_lock:
+            for command in pending:
+                if command.state == QUEUED:
+                    self._finish(command, PREEMPTED)
+
+    def run_exclusive(self, fn, *args):
+        """
+        Preempt motion commands, then call fn while holding the motor lock.
+        Used for all other motor operations (stop, drive forever, ...).
+        """
+        self.preempt()
+        with self.motor_lock:
+            return fn(*args)
+
+    def _finish(self, command, state, error=None):
+        command.state = state
+        command.error = error
+        command.finished = time.time()
+        command._done.set()
+
+    def _run(self):
+        with scheduler.request_class(scheduler.MOTION, reject=False):
+            while True:
+                command = self._queue.get()
+                if command is None:
+                    return
+                if command.state != QUEUED:
+                    # cancelled while queued
+                    continue
+                try:
+                    self._execute(command)
+                except Exception as e:
+                    with self.motor_lock:
+                        self.egpg3.stop()
+                    self._finish(command, FAILED, str(e))
+
+    def _read_encoders(self):
+        return (self.egpg3.get_motor_encoder(self.egpg3.MOTOR_LEFT),
+                self.egpg3.get_motor_encoder(self.egpg3.MOTOR_RIGHT))
+
+    def _execute(self, command):
+        egpg3 = self.egpg3
+
+        with self.motor_lock:
+            if command._preempt.is_set():
+                self._finish(command, PREEMPTED)
+                return
+            command.state = RUNNING
+            command.started = time.time()
+            # remove limits a previous operation may have set, see
+            # /v1/motors/drive
+            egpg3.set_speed(command.dps)
+            command.left_start, command.right_start = self._read_encoders()
+            left_target = command.left_start + command.left_degrees
+            right_target = command.right_start + command.right_degrees
+            egpg3.set_motor_position(egpg3.MOTOR_LEFT, left_target)
+            egpg3.set_motor_position(egpg3.MOTOR_RIGHT, right_target)
+
+        last_progress = time.monotonic()
+        while True:
+            if command._preempt.wait(self.poll_interval):
+                # whoever preempted takes care of the motors
+                self._finish(command, PREEMPTED)
+                return
+
+            left, right = self._read_encoders()
+            moved = (left - command.left_start != command.left_travelled or
+                     right - command.right_start != command.right_travelled)
+            command.left_travelled = left - command.left_start
+            command.right_travelled = right - command.right_start
+
+            if abs(left - left_target) <= self.tolerance and \
+               abs(right - right_target) <= self.tolerance:
+                self._finish(command, COMPLETED)
+                return
+
+            now = time.monotonic()
+            if moved:
+                last_progress = now
+            elif now - last_progress > self.stall_timeout:
+                with self.motor_lock:
+                    if not command._preempt.is_set():
+                        egpg3.stop()
+                self._finish(command, FAILED, "Motors stalled")
+                return
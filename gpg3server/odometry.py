@@ -0,0 +1,262 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Pose estimation (x, y, heading) from the motor encoders.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Both encoders are sampled by the telemetry sampler ('encoders' source).
+# Odometry is a listener of the sampler: every sample advances the pose by
+# one step of differential drive kinematics, moving along the arc with the
+# mean heading of the step:
+#
+#     dl, dr = wheel travel in mm (encoder degrees * circumference / 360)
+#     heading += (dr - dl) / wheel base width
+#     x += (dl + dr) / 2 * cos(heading before + half the heading change)
+#     y += (dl + dr) / 2 * sin(...)
+#
+# x points ahead of the robot when the pose was reset, y to its left, the
+# heading is counterclockwise. Units are mm and degrees.
+#
+# The encoder samples are kept in a trace, a ring of preallocated arrays,
+# with the pose at its first sample. The trajectory (pose at every sample)
+# is computed from the trace when it is downloaded, vectorized with NumPy
+# if installed (which reads the arrays without converting them), with a
+# Python loop otherwise.
+
+import array
+import bisect
+import math
+import struct
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# binary trajectory record: timestamp (s, float64), x, y (mm), heading
+# (degrees, unwrapped), float32, little-endian
+RECORD = struct.Struct('<dfff')
+
+def integrate_python(left, right, mm_per_degree, wheel_base, x=0.0, y=0.0, heading=0.0):
+    """
+    Integrate encoder positions left and right (sequences of degrees) from
+    pose (x, y, heading in radians) at their first element. Returns lists
+    x, y and heading (radians, unwrapped), one element per sample.
+    """
+    xs = [x]
+    ys = [y]
+    headings = [heading]
+    cos = math.cos
+    sin = math.sin
+    for i in range(1, len(left)):
+        dl = (left[i] - left[i - 1]) * mm_per_degree
+        dr = (right[i] - right[i - 1]) * mm_per_degree
+        dc = (dl + dr) / 2
+        dheading = (dr - dl) / wheel_base
+        mid = heading + dheading / 2
+        x += dc * cos(mid)
+        y += dc * sin(mid)
+        heading += dheading
+        xs.append(x)
+        ys.append(y)
+        headings.append(heading)
+    return xs, ys, headings
+
+def integrate_numpy(left, right, mm_per_degree, wheel_base, x=0.0, y=0.0, heading=0.0):
+    """
+    Same as integrate_python(), returns NumPy arrays.
+    """
+    left = numpy.asarray(left, dtype=numpy.float64)
+    right = numpy.asarray(right, dtype=numpy.float64)
+    dl = numpy.diff(left) * mm_per_degree
+    dr = numpy.diff(right) * mm_per_degree
+    dc = (dl + dr) / 2
+    dheading = (dr - dl) / wheel_base
+    headings = numpy.empty(len(left))
+    headings[0] = heading
+    numpy.cumsum(dheading, out=headings[1:])
+    headings[1:] += heading
+    mid = headings[:-1] + dheading / 2
+    xs = numpy.empty(len(left))
+    ys = numpy.empty(len(left))
+    xs[0] = x
+    ys[0] = y
+    numpy.cumsum(dc * numpy.cos(mid), out=xs[1:])
+    numpy.cumsum(dc * numpy.sin(mid), out=ys[1:])
+    xs[1:] += x
+    ys[1:] += y
+    return xs, ys, headings
+
+integrate = integrate_python if numpy is None else integrate_numpy
+
+class Odometry:
+    """
+    Pose of the robot, wheel geometry from egpg3 (WHEEL_CIRCUMFERENCE,
+    WHEEL_BASE_WIDTH in mm). The trace keeps the last history encoder
+    samples.
+    """
+
+    def __init__(self, egpg3, history=30000):
+        self.mm_per_degree = egpg3.WHEEL_CIRCUMFERENCE / 360
+        self.wheel_base = egpg3.WHEEL_BASE_WIDTH
+        self.history = history
+        self._lock = threading.Lock()
+        # trace, sample i of the ring at index i of each array
+        self._timestamps = array.array('d', bytes(8 * history))
+        self._left = array.array('q', bytes(8 * history))
+        self._right = array.array('q', bytes(8 * history))
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        """
+        Set pose (mm, mm, degrees) and clear the trace. The next encoder
+        sample is taken as the pose's position.
+        """
+        with self._lock:
+            self._x = x
+            self._y = y
+            self._heading = math.radians(heading)
+            self._distance = 0.0
+            # samples in the trace, index of the next sample
+            self._count = 0
+            self._next = 0
+            self._last = None
+            # pose at the first sample of the trace
+            self._start = (self._x, self._y, self._heading)
+
+    def on_sample(self, name, sample):
+        """
+        Telemetry sampler listener, integrates 'encoders' samples
+        ({'left': degrees, 'right': degrees}).
+        """
+        if name != 'encoders':
+            return
+        left, right = sample.value['left'], sample.value['right']
+        with self._lock:
+            if self._last is not None:
+                last_monotonic, last_left, last_right = self._last
+                # samples read by request threads may arrive out of order
+                if sample.monotonic <= last_monotonic:
+                    return
+                dl = (left - last_left) * self.mm_per_degree
+                dr = (right - last_right) * self.mm_per_degree
+                dc = (dl + dr) / 2
+                dheading = (dr - dl) / self.wheel_base
+                mid = self._heading + dheading / 2
+                self._x += dc * math.cos(mid)
+                self._y += dc * math.sin(mid)
+                self._heading += dheading
+                self._distance += abs(dc)
+                if self._count == self.history:
+                    self._advance_start()
+            i = self._next
+            self._timestamps[i] = sample.timestamp
+            self._left[i] = left
+            self._right[i] = right
+            self._next = (i + 1) % self.history
+            self._count = min(self._count + 1, self.history)
+            self._last = (sample.monotonic, left, right)
+
+    def _advance_start(self):
+        # the first sample (overwritten next) drops out of the trace, move
+        # the start pose to the second one
+        first, second = self._next, (self._next + 1) % self.history
+        xs, ys, headings = integrate_python(
+            (self._left[first], self._left[second]), (self._right[first], self._right[second]),
+            self.mm_per_degree, self.wheel_base, *self._start)
+        self._start = (xs[1], ys[1], headings[1])
+
+    def _trace(self):
+        """
+        Return copies of the trace's timestamps, left and right encoder
+        positions in order, as arrays.
+        """
+        if self._count < self.history:
+            n = self._count
+            return self._timestamps[:n], self._left[:n], self._right[:n]
+        i = self._next
+        return (self._timestamps[i:] + self._timestamps[:i], self._left[i:] + self._left[:i],
+                self._right[i:] + self._right[:i])
+
+    def pose(self):
+        """
+        Return current pose as dict.
+        """
+        with self._lock:
+            last = None
+            if self._count:
+                i = (self._next - 1) % self.history
+                last = (self._timestamps[i], self._left[i], self._right[i])
+            return {
+                'x': round(self._x, 1),
+                'y': round(self._y, 1),
+                # -180..180
+                'heading': round(math.degrees(math.remainder(self._heading, 2 * math.pi)), 2),
+                'distance': round(self._distance, 1),
+                'timestamp': None if last is None else last[0],
+                'encoders': None if last is None else {'left': last[1], 'right': last[2]},
+                'samples': self._count
+                }
+
+    def trajectory(self, since=None, step=1):
+        """
+        Return (timestamps, xs, ys, headings in degrees, unwrapped) of
+        every step-th sample of the trace taken after timestamp since.
+        """
+        with self._lock:
+            timestamps, left, right = self._trace()
+            start = self._start
+        if not timestamps:
+            return [], [], [], []
+        xs, ys, headings = integrate(left, right, self.mm_per_degree, self.wheel_base, *start)
+        first = 0 if since is None else bisect.bisect_right(timestamps, since)
+        if numpy is not None:
+            headings = numpy.degrees(headings)
+        else:
+            headings = [math.degrees(h) for h in headings]
+        return (timestamps[first::step], xs[first::step], ys[first::step],
+                headings[first::step])
+
+    def trajectory_json(self, since=None, step=1):
+        """
+        Return trajectory as dict with field names and one row per sample.
+        """
+        timestamps, xs, ys, headings = self.trajectory(since, step)
+        return {
+            'fields': ['timestamp', 'x', 'y', 'heading'],
+            'samples': [[t, round(float(x), 1), round(float(y), 1), round(float(h), 2)]
+                        for t, x, y, h in zip(timestamps, xs, ys, headings)]
+            }
+
+    def trajectory_binary(self, since=None, step=1):
+        """
+        Return trajectory as bytes of RECORDs.
+        """
+        timestamps, xs, ys, headings = self.trajectory(since, step)
+        if numpy is not None:
+            records = numpy.empty(len(timestamps), dtype=[('t', '<f8'), ('x', '<f4'),
+                                                          ('y', '<f4'), ('heading', '<f4')])
+            records['t'] = timestamps
+            records['x'] = xs
+            records['y'] = ys
+            records['heading'] = headings
+            return records.tobytes()
+        data = bytearray(RECORD.size * len(timestamps))
+        for i, record in enumerate(zip(timestamps, xs, ys, headings)):
+            RECORD.pack_into(data, i * RECORD.size, *record)
+        return bytes(data)
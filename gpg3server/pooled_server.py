@@ -0,0 +1,348 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# HTTP server with a fixed number of request threads, alternative to
+# ThreadingHTTPServer.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ThreadingHTTPServer holds a thread per connection, also while a
+# persistent connection is idle or a client sends its request slowly. A
+# pool of threads per connection would be used up by such connections, and
+# a stop request would wait for one of them to go away. This server
+# separates reading requests from handling them:
+#
+# - One thread waits for requests on all connections (selectors) and reads
+#   request heads and bodies. Complete requests are handled by the regular
+#   request handler class on a thread of a scheduler.WorkerPool, with the
+#   request bytes as input and the response collected in memory, like with
+#   the asyncio server. Requests wait for a thread in a queue per scheduler
+#   class, a stop request is taken before queued reads. A request finding
+#   the queue of its class full is answered with 503.
+# - Streams (M-JPEG, telemetry stream, WebSocket, see
+#   handler_class.STREAM_ROUTES) are served on a thread of their own for
+#   as long as they last, they do not take a worker. The connection is
+#   closed when the stream ends.
+# - Requests that wait for a manoeuvre to finish (?wait=true, see
+#   handler_class.request_waits()) are handled on a thread of their own
+#   too, at most max_waiting at once (scheduler.WaitingThreads), so they
+#   cannot hold all workers while a stop request waits.
+# - A connection is closed if the client does not send a complete request
+#   within handler_class.timeout seconds, whether it sends nothing or
+#   sends slowly. At most max_connections connections are open, more are
+#   answered with 503.
+#
+# Idle connections, streams and waiting requests therefore take no worker.
+
+import collections
+import http.client
+import http.server
+import io
+import selectors
+import socket
+import threading
+import time
+
+import async_server
+import routing
+import scheduler
+
+class _Connection:
+    """
+    A client connection and the bytes received but not handled yet.
+    """
+
+    def __init__(self, sock, client_address):
+        self.sock = sock
+        self.client_address = client_address
+        self.buffer = bytearray()
+        self.requests = 0
+        # monotonic time the connection started waiting for a request
+        self.waiting_since = time.monotonic()
+
+class _PrefixedReader(io.RawIOBase):
+    """
+    Raw stream returning data, then what is received on sock.
+    """
+
+    def __init__(self, data, sock):
+        self._data = memoryview(bytes(data))
+        self._sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._data:
+            n = min(len(b), len(self._data))
+            b[:n] = self._data[:n]
+            self._data = self._data[n:]
+            return n
+        return self._sock.recv_into(b)
+
+def split_request(buffer):
+    """
+    Return (request line, request bytes) of the first request in buffer,
+    None if it is not complete yet. The request line is empty if the
+    client sent an empty line instead of a request. Raises RequestError
+    for requests that are too large.
+    """
+    end = buffer.find(b'\r\n\r\n', 0, async_server.MAX_HEAD_SIZE)
+    if end < 0:
+        if len(buffer) >= async_server.MAX_HEAD_SIZE:
+            raise routing.RequestError("Request head too large", 431)
+        return None
+    head = bytes(buffer[:end + 4])
+    requestline, _, header_bytes = head.partition(b'\r\n')
+    if not requestline:
+        return '', head
+    headers = http.client.parse_headers(io.BytesIO(header_bytes))
+    try:
+        length = int(headers.get('Content-Length', 0))
+    except ValueError:
+        raise routing.RequestError("Invalid Content-Length")
+    if length < 0 or length > async_server.MAX_BODY_SIZE:
+        raise routing.RequestError("Invalid Content-Length", 413)
+    if len(buffer) < len(head) + length:
+        return None
+    return requestline.decode('iso-8859-1'), bytes(buffer[:len(head) + length])
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """
+    Serves handler_class (GPG3ServerHTTPRequestHandler, which provides
+    handle_in_memory(), handle_stream(), request_route(), request_waits()
+    and request_priority()) on server_address. Requests are handled on
+    workers threads, queue_limits is the most requests waiting per
+    scheduler class (0 for no limit). At most max_connections connections
+    are open and max_waiting requests wait for a manoeuvre (0 for no
+    limit).
+    """
+
+    allow_reuse_address = True
+    # connections are accepted right away, but may arrive in bursts
+    request_queue_size = 128
+
+    # sent to connections above max_connections
+    REJECT_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                       b'Retry-After: 1\r\n'
+                       b'Connection: close\r\n'
+                       b'Content-Length: 0\r\n'
+                       b'\r\n')
+
+    def __init__(self, server_address, handler_class, workers=16,
+                 queue_limits=(0, 0, 0, 0), max_connections=0, max_waiting=0):
+        super().__init__(server_address, handler_class)
+        self.max_connections = max_connections
+        self.connections = 0
+        self.streams = 0
+        self.rejected_connections = 0
+        self._lock = threading.Lock()
+        # connections to be watched for requests, new ones and those whose
+        # request was handled
+        self._resumed = collections.deque()
+        self._closed = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_send = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self.pool = scheduler.WorkerPool(workers, queue_limits, scheduler.CLASSES, 'http')
+        self.waiting = scheduler.WaitingThreads(max_waiting, 'http-waiting')
+        self._reader = threading.Thread(target=self._read_connections, name='http-reader',
+                                        daemon=True)
+        self._reader.start()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            full = self.max_connections and self.connections >= self.max_connections
+            if full:
+                self.rejected_connections += 1
+            else:
+                self.connections += 1
+        if full:
+            try:
+                request.sendall(self.REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        if self.RequestHandlerClass.disable_nagle_algorithm:
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+        self._resume(_Connection(request, client_address))
+
+    def server_close(self):
+        super().server_close()
+        self._closed = True
+        self._wake()
+        self._reader.join()
+        self.pool.shutdown()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'max_connections': self.max_connections,
+                'rejected': self.rejected_connections,
+                'streams': self.streams
+                }
+
+    def _wake(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # a wakeup is pending anyway
+            pass
+
+    def _resume(self, conn):
+        """
+        Watch conn for its next request, called on any thread.
+        """
+        conn.waiting_since = time.monotonic()
+        self._resumed.append(conn)
+        self._wake()
+
+    def _close(self, conn):
+        self.shutdown_request(conn.sock)
+        with self._lock:
+            self.connections -= 1
+
+    # the reader thread
+
+    def _read_connections(self):
+        timeout = self.RequestHandlerClass.timeout
+        while not self._closed:
+            for key, _ in self._selector.select(1):
+                if key.fileobj is self._wakeup:
+                    try:
+                        self._wakeup.recv(4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._receive(key.data)
+            while self._resumed:
+                conn = self._resumed.popleft()
+                conn.sock.setblocking(False)
+                self._selector.register(conn.sock, selectors.EVENT_READ, conn)
+                # pipelined requests are read already
+                if conn.buffer:
+                    self._dispatch(conn)
+            if timeout is not None:
+                now = time.monotonic()
+                for key in list(self._selector.get_map().values()):
+                    if key.data is not None and now - key.data.waiting_since > timeout:
+                        self._selector.unregister(key.fileobj)
+                        self._close(key.data)
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._close(key.data)
+        self._selector.close()
+        self._wakeup.close()
+        self._wakeup_send.close()
+
+    def _receive(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._selector.unregister(conn.sock)
+            self._close(conn)
+            return
+        conn.buffer += data
+        self._dispatch(conn)
+
+    def _dispatch(self, conn):
+        """
+        Hand the request in conn's buffer, if complete, to a worker, a
+        waiting request thread or a stream thread.
+        """
+        try:
+            split = split_request(conn.buffer)
+        except routing.RequestError as e:
+            self._selector.unregister(conn.sock)
+            self._reject(conn, e.status, e.message)
+            return
+        if split is None:
+            return
+        self._selector.unregister(conn.sock)
+        requestline, request = split
+        if not requestline:
+            # as the request handler does
+            self._close(conn)
+            return
+        del conn.buffer[:len(request)]
+        conn.requests += 1
+
+        handler_class = self.RequestHandlerClass
+        if handler_class.request_route(requestline) in handler_class.STREAM_ROUTES:
+            threading.Thread(target=self._serve_stream, args=(conn, request),
+                             name='http-stream', daemon=True).start()
+            return
+        try:
+            if handler_class.request_waits(requestline):
+                self.waiting.submit(self._handle, conn, request)
+            else:
+                self.pool.submit(handler_class.request_priority(requestline),
+                                 self._handle, conn, request)
+        except scheduler.QueueFull as e:
+            handler_class.log_client_message(conn.client_address,
+                '"%s" rejected: %s' % (requestline, e))
+            self._reject(conn, 503, str(e), {'Retry-After': scheduler.retry_after(e.retry_after)})
+
+    def _reject(self, conn, status, message, headers={}):
+        try:
+            conn.sock.sendall(async_server.error_response(status, message, headers))
+        except OSError:
+            # the client does not read, it is closed anyway
+            pass
+        self._close(conn)
+
+    # workers, waiting request threads and stream threads
+
+    def _handle(self, conn, request):
+        try:
+            response, close = self.RequestHandlerClass.handle_in_memory(self,
+                conn.client_address, request, conn.requests)
+            conn.sock.settimeout(self.RequestHandlerClass.timeout)
+            conn.sock.sendall(response)
+        except OSError:
+            close = True
+        except Exception:
+            self.handle_error(conn.sock, conn.client_address)
+            close = True
+        if close:
+            self._close(conn)
+        else:
+            self._resume(conn)
+
+    def _serve_stream(self, conn, request):
+        with self._lock:
+            self.streams += 1
+        try:
+            conn.sock.settimeout(self.RequestHandlerClass.timeout)
+            rfile = io.BufferedReader(_PrefixedReader(request + conn.buffer, conn.sock))
+            self.RequestHandlerClass.handle_stream(self, conn.sock, conn.client_address,
+                                                   rfile, conn.requests)
+        except OSError:
+            pass
+        except Exception:
+            self.handle_error(conn.sock, conn.client_address)
+        finally:
+            with self._lock:
+                self.streams -= 1
+            self._close(conn)
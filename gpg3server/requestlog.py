@@ -0,0 +1,245 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Buffered, asynchronous request log.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# BaseHTTPRequestHandler writes a line to stderr for every request, on the
+# request thread. Under systemd that ends up in the journal on the SD card,
+# and a polling Scratch project produces hundreds of lines per second.
+#
+# Request threads only append a record (a tuple) to a bounded queue; if the
+# queue is full the record is dropped and counted. A writer thread formats
+# the records, in the same format as BaseHTTPRequestHandler, and writes
+# them in batches to stderr or a RotatingFile.
+#
+# Which request lines are logged is decided per route (handler name):
+#
+#     all      every request
+#     sampled  errors (status >= 400) and every sample_every-th request
+#     errors   errors only
+#     off      nothing
+#
+# Messages that are not request lines (errors, stream summaries) are always
+# logged. Identical lines (same client and text, request lines with the same
+# request line and status) beyond burst per interval seconds are
+# suppressed, and a summary line with their count is written when the
+# interval ends.
+
+import os
+import queue
+import sys
+import threading
+import time
+
+LEVELS = ('off', 'errors', 'sampled', 'all')
+
+_REQUEST = 0
+_MESSAGE = 1
+
+class RotatingFile:
+    """
+    Log file that is renamed to path.1 (path.1 to path.2, ...) when it
+    exceeds max_bytes, keeping backups old files.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, text):
+        self._file.write(text)
+        self._file.flush()
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            source = '{}.{}'.format(self.path, i)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._file.close()
+
+class RequestLog:
+    """
+    sink has write(text), default sys.stderr. levels maps route names to a
+    level (see LEVELS), routes not in it use default_level.
+    """
+
+    def __init__(self, sink=None, default_level='all', levels=None, sample_every=10,
+                 burst=5, interval=10.0, queue_size=4096):
+        self.sink = sink
+        self.default_level = default_level
+        self.levels = dict(levels or {})
+        self.sample_every = sample_every
+        self.burst = burst
+        self.interval = interval
+        self._queue = queue.Queue(queue_size)
+        # route -> requests seen, for sampling
+        self._sampled = {}
+        # (client, text without size) -> [interval end, lines in interval]
+        self._repeats = {}
+        self.queued = 0
+        self.dropped = 0
+        self.not_sampled = 0
+        self.suppressed = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name='request-log', daemon=True)
+        self._thread.start()
+
+    def request(self, route, client, requestline, status, size='-'):
+        """
+        Log request line, depending on the level of route. Does not block.
+        """
+        level = self.levels.get(route, self.default_level)
+        if level != 'all':
+            if level == 'off':
+                return
+            if not isinstance(status, int) or status < 400:
+                if level == 'errors':
+                    return
+                # 'sampled'; unsynchronized, an occasional lost count does
+                # not matter
+                n = self._sampled.get(route, 0) + 1
+                self._sampled[route] = n
+                if n % self.sample_every != 1 and self.sample_every > 1:
+                    self.not_sampled += 1
+                    return
+        self._put((_REQUEST, time.time(), client, requestline, status, size))
+
+    def message(self, client, text):
+        """
+        Log message text about client. Does not block.
+        """
+        self._put((_MESSAGE, time.time(), client, text))
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Write queued records and stop the writer.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def to_dict(self):
+        return {
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'not_sampled': self.not_sampled,
+            'suppressed': self.suppressed,
+            'pending': self._queue.qsize()
+            }
+
+    def _run(self):
+        while True:
+            try:
+                # wakes up regularly to write summaries of suppressed lines
+                record = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                record = ()
+            lines = []
+            closing = record is None
+            records = [] if closing or not record else [record]
+            # take what else is queued, written as one batch
+            while not closing and len(records) < 256:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    closing = True
+                else:
+                    records.append(record)
+            now = time.time()
+            self._summarize(now, lines, closing)
+            for record in records:
+                self._format(record, now, lines)
+            if lines:
+                self._write(''.join(lines))
+            if closing:
+                return
+
+    def _format(self, record, now, lines):
+        if record[0] == _MESSAGE:
+            _, t, client, text = record
+            line = text
+        else:
+            _, t, client, requestline, status, size = record
+            # size is not part of what makes lines identical
+            text = '"%s" %s' % (requestline, status)
+            line = '%s %s' % (text, size)
+        key = (client, text)
+        repeat = self._repeats.get(key)
+        if repeat is None or repeat[0] <= now:
+            repeat = self._repeats[key] = [now + self.interval, 0]
+        repeat[1] += 1
+        if repeat[1] > self.burst:
+            self.suppressed += 1
+            return
+        lines.append(_line(t, client, line))
+
+    def _summarize(self, now, lines, all):
+        """
+        Add summary lines of suppressed repeats whose interval ended (all
+        with all), and forget them.
+        """
+        for key, (end, count) in list(self._repeats.items()):
+            if end <= now or all:
+                del self._repeats[key]
+                if count > self.burst:
+                    client, text = key
+                    lines.append(_line(now, client, '%s repeated %d more times in %g s' % (
+                        text, count - self.burst, self.interval)))
+
+    def _write(self, text):
+        sink = self.sink or sys.stderr
+        try:
+            sink.write(text)
+            if sink is sys.stderr:
+                sink.flush()
+            self.written += text.count('\n')
+        except (OSError, ValueError):
+            # e.g. disk full; logging must not stop the server
+            pass
+
+def write_line(client, text):
+    """
+    Write a line to stderr right away, for when there is no RequestLog.
+    """
+    sys.stderr.write(_line(time.time(), client, text))
+
+def _line(t, client, text):
+    # same format as BaseHTTPRequestHandler.log_message()
+    return "%s - - [%s] %s\n" % (client, time.strftime('%d/%b/%Y %H:%M:%S',
+                                                       time.localtime(t)), text)
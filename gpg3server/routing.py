@@ -0,0 +1,246 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Route table and declarative request parameter validation.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Routes map a method and a path to the name of a handler method. Paths
+# without parameters are looked up in a dict. Paths with parameters, like
+# /v1/servos/{port:SERVO1|SERVO2}/position or /v1/motors/commands/{id:int},
+# are compiled to regular expressions once and tried in the order they were
+# added. A parameter is a path segment ([^/]+) unless a regular expression
+# (that does not match '/') is given; 'int' matches digits and converts the
+# value. Only patterns with
+# the same number of segments and the same literal prefix as the path are
+# tried. Paths are matched percent-decoded (/v1/eyes/%6Ceft is
+# /v1/eyes/left), an encoded '/' matches no route.
+#
+# Request parameters (JSON bodies and query strings) are described by
+# schemas, dicts of parameter name -> Int, Float, Enum or Flag, and checked
+# by validate():
+#
+#     EYES = {'red': Int(0, 255), 'green': Int(0, 255), 'blue': Int(0, 255)}
+#     validate(EYES, {'red': 255, 'green': 0, 'blue': 0})
+
+import math
+import re
+import urllib.parse
+
+class RequestError(Exception):
+    """
+    Invalid request, reported to the client with status (default 400) and
+    additional response headers.
+    """
+
+    def __init__(self, message, status=400, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
+
+class Int:
+    """
+    Integer parameter in range low..high (None for no limit).
+    """
+
+    def __init__(self, low=None, high=None, optional=False, default=None):
+        self.low = low
+        self.high = high
+        self.optional = optional
+        self.default = default
+
+    def convert(self, name, value):
+        try:
+            result = int(value)
+        except (TypeError, ValueError, OverflowError):
+            # OverflowError for infinity, which the json module parses
+            raise RequestError("Parameter {} not an int ({})".format(name, value))
+        return _check_range(name, result, self.low, self.high)
+
+class Float:
+    """
+    Number parameter in range low..high (None for no limit).
+    """
+
+    def __init__(self, low=None, high=None, optional=False, default=None):
+        self.low = low
+        self.high = high
+        self.optional = optional
+        self.default = default
+
+    def convert(self, name, value):
+        try:
+            result = float(value)
+        except (TypeError, ValueError):
+            raise RequestError("Parameter {} not a number ({})".format(name, value))
+        if not math.isfinite(result):
+            raise RequestError("Parameter {} not a finite number ({})".format(name, value))
+        return _check_range(name, result, self.low, self.high)
+
+class Enum:
+    """
+    Parameter with one of the given values.
+    """
+
+    def __init__(self, *values, optional=False, default=None):
+        self.values = frozenset(values)
+        self.optional = optional
+        self.default = default
+
+    def convert(self, name, value):
+        if value not in self.values:
+            raise RequestError("Unknown {} {}".format(name, value))
+        return value
+
+class Flag:
+    """
+    Boolean query parameter, true if 'true' or '1'. Always optional.
+    """
+
+    optional = True
+    default = False
+
+    def convert(self, name, value):
+        return str(value).lower() in {'true', '1'}
+
+def _check_range(name, value, low, high):
+    if low is not None and high is not None:
+        if not low <= value <= high:
+            raise RequestError("Parameter {} not in range {}..{} ({})".format(name, low, high, value))
+    elif low is not None and value < low:
+        raise RequestError("Parameter {} less than {} ({})".format(name, low, value))
+    elif high is not None and value > high:
+        raise RequestError("Parameter {} greater than {} ({})".format(name, high, value))
+    return value
+
+def validate(schema, data):
+    """
+    Return dict with the parameters of schema, converted, from data (a dict
+    from a JSON body or parse_query()). Parameters not in the schema are
+    ignored. Raises RequestError for the first invalid parameter.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("Request data not a JSON object")
+    result = {}
+    for name, spec in schema.items():
+        if name in data:
+            result[name] = spec.convert(name, data[name])
+        elif spec.optional:
+            result[name] = spec.default
+        else:
+            raise RequestError("Parameter {} missing".format(name))
+    return result
+
+def parse_query(query):
+    """
+    Return dict of query string parameters, the last value of repeated
+    ones.
+    """
+    return {name: values[-1] for name, values in
+            urllib.parse.parse_qs(query, keep_blank_values=True).items()}
+
+def query_flag(query, name):
+    """
+    True if parameter name of query (a dict, see parse_query()) is 'true'
+    (or '1').
+    """
+    return query.get(name, '').lower() in {'true', '1'}
+
+_PARAMETER = re.compile(r'\{(\w+)(?::([^{}]+))?\}')
+
+def _compile(path):
+    """
+    Return regular expression and converters of a path with parameters.
+    """
+    regex = ''
+    converters = {}
+    pos = 0
+    for m in _PARAMETER.finditer(path):
+        name, pattern = m.group(1), m.group(2)
+        if pattern == 'int':
+            pattern = r'\d+'
+            converters[name] = int
+        elif pattern is None:
+            pattern = r'[^/]+'
+        regex += re.escape(path[pos:m.start()]) + '(?P<{}>{})'.format(name, pattern)
+        pos = m.end()
+    regex += re.escape(path[pos:])
+    return re.compile(regex), converters
+
+class Router:
+    """
+    Route table, routes is a list of (method, path, handler name).
+    """
+
+    def __init__(self, routes=()):
+        self._exact = {}
+        # number of '/' -> list of (literal prefix, regex, converters, methods)
+        self._patterns = {}
+        for method, path, handler in routes:
+            self.add(method, path, handler)
+
+    def add(self, method, path, handler):
+        if _PARAMETER.search(path) is None:
+            self._exact.setdefault(path, {})[method] = handler
+            return
+        regex, converters = _compile(path)
+        patterns = self._patterns.setdefault(path.count('/'), [])
+        for prefix, route_regex, route_converters, methods in patterns:
+            if route_regex.pattern == regex.pattern:
+                methods[method] = handler
+                return
+        prefix = path[:_PARAMETER.search(path).start()]
+        patterns.append((prefix, regex, converters, {method: handler}))
+
+    def methods(self, path):
+        """
+        Return (dict method -> handler name, path parameters) for path,
+        (None, None) if no route matches.
+        """
+        if '%' in path:
+            unquoted = urllib.parse.unquote(path)
+            if unquoted.count('/') != path.count('/'):
+                return None, None
+            path = unquoted
+        methods = self._exact.get(path)
+        if methods is not None:
+            return methods, {}
+        for prefix, regex, converters, methods in self._patterns.get(path.count('/'), ()):
+            if not path.startswith(prefix):
+                continue
+            m = regex.fullmatch(path)
+            if m is not None:
+                params = m.groupdict()
+                for name, convert in converters.items():
+                    params[name] = convert(params[name])
+                return methods, params
+        return None, None
+
+    def match(self, method, path):
+        """
+        Return (handler name, path parameters). Raises RequestError 404 for
+        an unknown path, 405 (with Allow header) if the path does not
+        support method.
+        """
+        methods, params = self.methods(path)
+        if methods is None:
+            raise RequestError("Unknown path " + path, 404)
+        handler = methods.get(method)
+        if handler is None:
+            raise RequestError("Method {} not allowed for {}".format(method, path), 405,
+                               {'Allow': ', '.join(sorted(methods))})
+        return handler, params
@@ -0,0 +1,460 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Priority scheduling of hardware access and admission control.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requests and background threads are in one of four classes, highest
+# priority first:
+#
+#     stop       motors stop, behaviours stop
+#     motion     motor commands, behaviours
+#     actuators  LEDs and servos
+#     telemetry  sensor and status reads
+#
+# HardwareGate admits one GoPiGo3 call at a time. Waiting calls are taken
+# by class, then in arrival order, so a stop request waits for at most the
+# one call in progress, however many reads are queued. ScheduledHardware is
+# the proxy around the EasyGoPiGo3 object that passes every call through
+# the gate; the class is the one of the request the calling thread serves
+# (see request_class()), or, for calls outside of one, the one of the
+# method (METHOD_CLASSES). The motion and behaviour threads run in the
+# motion class, without admission control.
+#
+# WorkerPool is a fixed number of threads taking tasks from a priority
+# queue, used by the servers instead of a thread per connection (threading)
+# or a FIFO executor (asyncio). Requests that wait for a manoeuvre to finish
+# (?wait=true) would hold a worker for seconds, and with all workers
+# waiting a stop request would wait too; they run on threads of their own
+# instead (WaitingThreads), at most a limited number at once.
+#
+# Admission control answers requests fast instead of queueing them without
+# bound: a request finding the gate queue or the worker queue of its class
+# full raises QueueFull (503), a client exceeding the request rate of a
+# class gets 429 (RateLimiter, a token bucket per client and class). Both
+# come with Retry-After.
+
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import math
+import threading
+import time
+
+import metrics
+
+STOP, MOTION, ACTUATORS, TELEMETRY = range(4)
+
+CLASSES = ('stop', 'motion', 'actuators', 'telemetry')
+
+# class of GoPiGo3, servo and distance sensor methods called outside of a
+# request; methods not listed are reads
+METHOD_CLASSES = {
+    'stop': STOP,
+    'reset_all': STOP,
+    'set_motor_dps': MOTION,
+    'set_motor_position': MOTION,
+    'set_motor_power': MOTION,
+    'set_motor_limits': MOTION,
+    'offset_motor_encoder': MOTION,
+    'set_speed': MOTION,
+    'reset_speed': MOTION,
+    'forward': MOTION,
+    'backward': MOTION,
+    'drive_cm': MOTION,
+    'turn_degrees': MOTION,
+    'set_led': ACTUATORS,
+    'rotate_servo': ACTUATORS,
+    'reset_servo': ACTUATORS
+    }
+
+# methods returning a device whose methods are scheduled too
+DEVICE_METHODS = {'init_servo', 'init_distance_sensor'}
+
+def parse_class(name):
+    """
+    Return class number of name (stop, motion, ...). Raises ValueError.
+    """
+    try:
+        return CLASSES.index(name)
+    except ValueError:
+        raise ValueError("Unknown class {}, one of {}".format(name, ", ".join(CLASSES)))
+
+class QueueFull(Exception):
+    """
+    Raised when a request finds the queue of its class full. retry_after is
+    the suggested delay in seconds.
+    """
+
+    def __init__(self, queue, retry_after=1):
+        super().__init__("Too many requests queued for " + queue)
+        self.queue = queue
+        self.retry_after = retry_after
+
+_context = threading.local()
+
+@contextlib.contextmanager
+def request_class(cls, reject=True):
+    """
+    Within the with block, GoPiGo3 calls of the calling thread are
+    scheduled at least with the priority of cls, and raise QueueFull if
+    reject is set and the gate queue is full.
+    """
+    previous = getattr(_context, 'cls', None), getattr(_context, 'reject', False)
+    _context.cls, _context.reject = cls, reject
+    try:
+        yield
+    finally:
+        _context.cls, _context.reject = previous
+
+class QueueStats:
+    """
+    Figures of one queue: entries waiting now and at most, entries taken,
+    rejected, and their waiting time.
+    """
+
+    def __init__(self, name, limit=0):
+        self.name = name
+        # 0 for no limit
+        self.limit = limit
+        self.waiting = 0
+        self.peak = 0
+        self.taken = 0
+        self.rejected = 0
+        self.wait = metrics.Histogram()
+
+    # callers hold the lock of the queue
+
+    def full(self):
+        return bool(self.limit) and self.waiting >= self.limit
+
+    def enter(self):
+        self.waiting += 1
+        self.peak = max(self.peak, self.waiting)
+
+    def leave(self):
+        self.waiting -= 1
+        self.taken += 1
+
+    def to_dict(self):
+        return {
+            'waiting': self.waiting,
+            'peak': self.peak,
+            'limit': self.limit,
+            'taken': self.taken,
+            'rejected': self.rejected,
+            'wait': self.wait.to_dict()
+            }
+
+class HardwareGate:
+    """
+    Lock with priority classes. limits is a list of the most callers
+    waiting per class, 0 for no limit; it applies to requests only (see
+    request_class()), background threads always wait. Reentrant.
+    """
+
+    def __init__(self, limits=(0, 0, 0, 0)):
+        self._lock = threading.Lock()
+        self._owner = None
+        self._depth = 0
+        # (class, ticket, thread ident, threading.Event) of waiting callers
+        self._waiting = []
+        self._tickets = itertools.count()
+        self.queues = [QueueStats(name, limit) for name, limit in zip(CLASSES, limits)]
+
+    def acquire(self, cls, reject=False):
+        """
+        Wait for the gate. Raises QueueFull if reject is set and the queue
+        of cls is full.
+        """
+        me = threading.get_ident()
+        queue = self.queues[cls]
+        with self._lock:
+            if self._owner == me:
+                self._depth += 1
+                return
+            if self._owner is None and not self._waiting:
+                self._owner = me
+                self._depth = 1
+                queue.taken += 1
+                queue.wait.observe(0)
+                return
+            if reject and queue.full():
+                queue.rejected += 1
+                raise QueueFull('hardware access (' + queue.name + ')')
+            event = threading.Event()
+            heapq.heappush(self._waiting, (cls, next(self._tickets), me, event))
+            queue.enter()
+        start = time.monotonic()
+        # release() hands the gate over
+        event.wait()
+        queue.wait.observe(time.monotonic() - start)
+
+    def admit(self, cls):
+        """
+        Raise QueueFull if the queue of cls is full, for requests making
+        several calls that must not fail halfway (see request_class()).
+        """
+        queue = self.queues[cls]
+        with self._lock:
+            if queue.full():
+                queue.rejected += 1
+                raise QueueFull('hardware access (' + queue.name + ')')
+
+    def release(self):
+        with self._lock:
+            self._depth -= 1
+            if self._depth:
+                return
+            if not self._waiting:
+                self._owner = None
+                return
+            cls, _, thread, event = heapq.heappop(self._waiting)
+            self.queues[cls].leave()
+            self._owner = thread
+            self._depth = 1
+        event.set()
+
+    def to_dict(self):
+        with self._lock:
+            return {queue.name: queue.to_dict() for queue in self.queues}
+
+class ScheduledHardware:
+    """
+    Proxy for an EasyGoPiGo3 object (or a device it returned) that passes
+    method calls through gate. Attributes that are not methods are passed
+    through.
+    """
+
+    def __init__(self, egpg3, gate):
+        # set through __dict__, __setattr__ forwards to the real object
+        self.__dict__['_egpg3'] = egpg3
+        self.__dict__['_gate'] = gate
+
+    def __getattr__(self, name):
+        value = getattr(self._egpg3, name)
+        if not callable(value):
+            return value
+        gate = self._gate
+        method_class = METHOD_CLASSES.get(name, TELEMETRY)
+
+        def scheduled(*args, **kwargs):
+            cls = getattr(_context, 'cls', None)
+            if cls is None:
+                gate.acquire(method_class)
+            else:
+                gate.acquire(min(cls, method_class), _context.reject)
+            try:
+                result = value(*args, **kwargs)
+            finally:
+                gate.release()
+            if name in DEVICE_METHODS and result is not None:
+                result = ScheduledHardware(result, gate)
+            return result
+
+        # found in __dict__ from now on, __getattr__ is not called again
+        self.__dict__[name] = scheduled
+        return scheduled
+
+    def __setattr__(self, name, value):
+        setattr(self._egpg3, name, value)
+
+class WorkerPool:
+    """
+    workers threads running tasks from a priority queue. limits is the
+    most tasks waiting per priority (0 for no limit), names the names of
+    the priorities for stats.
+    """
+
+    def __init__(self, workers, limits, names, thread_name_prefix='worker'):
+        self.workers = workers
+        self.busy = 0
+        self._cond = threading.Condition(threading.Lock())
+        # (priority, ticket, enqueued, future, fn, args)
+        self._tasks = []
+        self._tickets = itertools.count()
+        self._shutdown = False
+        self.queues = [QueueStats(name, limit) for name, limit in zip(names, limits)]
+        self._threads = [threading.Thread(target=self._run,
+                                          name='{}-{}'.format(thread_name_prefix, i + 1),
+                                          daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority, fn, *args):
+        """
+        Return concurrent.futures.Future of fn(*args), run on a worker.
+        Raises QueueFull if the queue of priority is full.
+        """
+        future = concurrent.futures.Future()
+        queue = self.queues[priority]
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Worker pool shut down")
+            if queue.full():
+                queue.rejected += 1
+                raise QueueFull(queue.name)
+            heapq.heappush(self._tasks, (priority, next(self._tickets), time.monotonic(),
+                                         future, fn, args))
+            queue.enter()
+            self._cond.notify()
+        return future
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._tasks and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                priority, _, enqueued, future, fn, args = heapq.heappop(self._tasks)
+                self.queues[priority].leave()
+                self.busy += 1
+            self.queues[priority].wait.observe(time.monotonic() - enqueued)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.busy -= 1
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'queues': {queue.name: queue.to_dict() for queue in self.queues}
+                }
+
+class WaitingThreads:
+    """
+    Runs tasks that wait for a long time on a thread each, at most limit
+    at once (0 for no limit).
+    """
+
+    def __init__(self, limit, thread_name='waiting'):
+        self.limit = limit
+        self.thread_name = thread_name
+        self.running = 0
+        self.peak = 0
+        self.taken = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        Return concurrent.futures.Future of fn(*args), run on a new
+        thread. Raises QueueFull if limit tasks are running.
+        """
+        with self._lock:
+            if self.limit and self.running >= self.limit:
+                self.rejected += 1
+                raise QueueFull('waiting requests')
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.taken += 1
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        threading.Thread(target=run, name=self.thread_name, daemon=True).start()
+        return future
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'peak': self.peak,
+                'limit': self.limit,
+                'taken': self.taken,
+                'rejected': self.rejected
+                }
+
+class RateLimiter:
+    """
+    Token bucket per client and class. rates maps class to (requests per
+    second, burst); classes without rate are not limited. Buckets of at
+    most max_clients clients are kept, the least recently seen are
+    dropped (and start with a full bucket again).
+    """
+
+    def __init__(self, rates, max_clients=1024):
+        self.rates = dict(rates)
+        self.max_clients = max_clients
+        self.limited = [0] * len(CLASSES)
+        # (client, class) -> [tokens, time of last update]
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client, cls):
+        """
+        Take a token of client's bucket of cls. Return 0 if there was one,
+        else the seconds until there is.
+        """
+        if cls not in self.rates:
+            return 0
+        rate, burst = self.rates[cls]
+        now = time.monotonic()
+        key = (client, cls)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_clients * len(CLASSES):
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.limited[cls] += 1
+            return (1 - bucket[0]) / rate
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                CLASSES[cls]: {'rate': rate, 'burst': burst, 'limited': self.limited[cls]}
+                for cls, (rate, burst) in sorted(self.rates.items())
+                }
+
+def retry_after(seconds):
+    """
+    Value of a Retry-After header (whole seconds, at least 1).
+    """
+    return str(max(1, math.ceil(seconds)))
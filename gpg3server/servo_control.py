@@ -0,0 +1,150 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Servo positioning with completion estimation.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Servos give no feedback about their position. ServoController remembers
+# the last commanded position and estimates, based on a configurable speed
+# in degrees per second, where the servo is and when it arrives. Waiting for
+# a move therefore takes as long as the move needs, and nothing for a move
+# to the current position.
+
+import threading
+import time
+
+class ServoController:
+    """
+    Wraps an easygopigo3 Servo object.
+
+    speed is the servo speed in degrees per second.
+    """
+
+    def __init__(self, servo, speed=600):
+        self.servo = servo
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._start_position = None
+        self._target = None
+        self._start_time = 0
+        self._arrival = 0
+        self._sweep_cancel = None
+
+    def _estimated_position(self, now):
+        if self._target is None:
+            return None
+        if now >= self._arrival:
+            return self._target
+        travelled = (now - self._start_time) * self.speed
+        if self._target > self._start_position:
+            return self._start_position + travelled
+        return self._start_position - travelled
+
+    def _move(self, position):
+        now = time.monotonic()
+        current = self._estimated_position(now)
+        if current is None:
+            # position unknown, assume worst case
+            current = 180 if position < 90 else 0
+        self.servo.rotate_servo(position)
+        self._start_position = current
+        self._target = position
+        self._start_time = now
+        self._arrival = now + abs(position - current) / self.speed
+        return self._arrival - now
+
+    def move(self, position):
+        """
+        Rotate servo to position (0..180), cancelling a running sweep.
+        Returns estimated seconds until arrival, 0 if already there.
+        """
+        self.cancel_sweep()
+        with self._lock:
+            return self._move(position)
+
+    def reset(self):
+        """
+        Move servo to middle position.
+        """
+        self.move(90)
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            estimated = self._estimated_position(now)
+            return {
+                'position': self._target,
+                'estimated_position': None if estimated is None else round(estimated),
+                'moving': now < self._arrival,
+                'eta': round(max(0, self._arrival - now), 3),
+                'sweeping': self._sweep_cancel is not None
+                }
+
+    def wait(self):
+        """
+        Block until the servo is estimated to have arrived at its position.
+        """
+        delay = self._arrival - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def sweep(self, steps):
+        """
+        Move servo through steps in the background, a list of
+        (position, dwell) tuples: after the servo arrived at position it
+        stays there for dwell seconds. Cancels a running sweep. Returns
+        threading.Event that is set when the sweep finished or was
+        cancelled, and the estimated duration.
+        """
+        self.cancel_sweep()
+        cancel = threading.Event()
+        done = threading.Event()
+
+        with self._lock:
+            self._sweep_cancel = cancel
+            estimated = self._estimated_position(time.monotonic())
+        duration = 0
+        for position, dwell in steps:
+            if estimated is not None:
+                duration += abs(position - estimated) / self.speed
+            estimated = position
+            duration += dwell
+
+        def run():
+            try:
+                for position, dwell in steps:
+                    with self._lock:
+                        if cancel.is_set():
+                            return
+                        delay = self._move(position)
+                    if cancel.wait(delay + dwell):
+                        return
+            finally:
+                with self._lock:
+                    if self._sweep_cancel is cancel:
+                        self._sweep_cancel = None
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return done, duration
+
+    def cancel_sweep(self):
+        with self._lock:
+            cancel = self._sweep_cancel
+            self._sweep_cancel = None
+        if cancel is not None:
+            cancel.set()
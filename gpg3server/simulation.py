@@ -0,0 +1,342 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Simulated GoPiGo3, used to run the server without hardware.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SimulatedEasyGoPiGo3 implements the part of the easygopigo3.EasyGoPiGo3
+# interface the server uses. Motors are modelled in time: in dps mode the
+# encoder advances with the set speed, in position mode it moves towards the
+# target position at the speed limit. The robot's pose is integrated from
+# the wheel movement, and the distance sensor measures the distance to the
+# walls of a rectangular room, in the direction it is mounted in.
+#
+# Every GoPiGo3 call is counted as SPI transaction and every distance sensor
+# read as I2C transaction. Transactions are serialized and take a
+# configurable time, like on the real bus.
+
+import math
+import threading
+import time
+
+class SimulatedServo:
+
+    def __init__(self, port):
+        self.port = port
+        self.position = None
+
+    def rotate_servo(self, position):
+        self.position = position
+
+    def reset_servo(self):
+        self.position = 90
+
+class SimulatedDistanceSensor:
+
+    # readings above this value are reported as out of range
+    MAX_RANGE = 3000
+
+    def __init__(self, robot):
+        self._robot = robot
+
+    def read_mm(self):
+        self._robot._i2c_transfer()
+        return self._robot._distance_to_wall()
+
+class _SimulatedMotor:
+
+    def __init__(self):
+        self.encoder = 0.0
+        self.dps = 0
+        # None in dps mode, target encoder position in position mode
+        self.target = None
+        self.limit_dps = 0
+
+    def advance(self, dt):
+        """
+        Move motor for dt seconds, return travelled degrees.
+        """
+        start = self.encoder
+        if self.target is None:
+            self.encoder += self.dps * dt
+        else:
+            speed = self.limit_dps or 1000
+            remaining = self.target - self.encoder
+            step = speed * dt
+            if abs(remaining) <= step:
+                self.encoder = self.target
+                self.dps = 0
+            else:
+                self.encoder += math.copysign(step, remaining)
+                self.dps = int(math.copysign(speed, remaining))
+        return self.encoder - start
+
+class SimulatedEasyGoPiGo3:
+    """
+    Stand-in for easygopigo3.EasyGoPiGo3.
+
+    room is the size (width, depth) in mm of the rectangular room the robot
+    starts in, at its centre, heading towards +x. spi_latency and
+    i2c_latency are the seconds a transaction takes. sensor_angle is the
+    direction of the distance sensor in degrees, clockwise from straight
+    ahead. clock returns the time in seconds the motion model uses.
+    """
+
+    WHEEL_BASE_WIDTH = 117
+    WHEEL_DIAMETER = 66.5
+    WHEEL_BASE_CIRCUMFERENCE = WHEEL_BASE_WIDTH * math.pi
+    WHEEL_CIRCUMFERENCE = WHEEL_DIAMETER * math.pi
+
+    MOTOR_LEFT = 0x01
+    MOTOR_RIGHT = 0x02
+    MOTOR_FLOAT = -128
+
+    LED_EYE_LEFT = 0x02
+    LED_EYE_RIGHT = 0x01
+    LED_BLINKER_LEFT = 0x04
+    LED_BLINKER_RIGHT = 0x08
+    LED_LEFT_EYE = LED_EYE_LEFT
+    LED_RIGHT_EYE = LED_EYE_RIGHT
+    LED_LEFT_BLINKER = LED_BLINKER_LEFT
+    LED_RIGHT_BLINKER = LED_BLINKER_RIGHT
+    LED_WIFI = 0x80
+
+    DEFAULT_SPEED = 300
+
+    def __init__(self, use_mutex=False, room=(2000, 2000), spi_latency=0, i2c_latency=0,
+                 sensor_angle=0, clock=time.monotonic):
+        self.use_mutex = use_mutex
+        self.room = room
+        self.spi_latency = spi_latency
+        self.i2c_latency = i2c_latency
+        self.sensor_angle = sensor_angle
+        self._clock = clock
+        self.spi_transactions = 0
+        self.i2c_transactions = 0
+        self._bus_lock = threading.Lock()
+        self.speed = self.DEFAULT_SPEED
+        self.leds = {}
+        self.servos = {}
+        self._motors = {self.MOTOR_LEFT: _SimulatedMotor(), self.MOTOR_RIGHT: _SimulatedMotor()}
+        # pose in mm and radians
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self._lock = threading.RLock()
+        self._last_update = clock()
+
+    # motion model
+
+    def _update(self):
+        now = self._clock()
+        dt = now - self._last_update
+        self._last_update = now
+        if dt <= 0:
+            return
+        left = self._motors[self.MOTOR_LEFT].advance(dt)
+        right = self._motors[self.MOTOR_RIGHT].advance(dt)
+        # differential drive kinematics
+        mm_per_degree = self.WHEEL_CIRCUMFERENCE / 360
+        dl = left * mm_per_degree
+        dr = right * mm_per_degree
+        dc = (dl + dr) / 2
+        dtheta = (dr - dl) / self.WHEEL_BASE_WIDTH
+        self.x += dc * math.cos(self.heading + dtheta / 2)
+        self.y += dc * math.sin(self.heading + dtheta / 2)
+        self.heading = (self.heading + dtheta + math.pi) % (2 * math.pi) - math.pi
+
+    def _distance_to_wall(self):
+        with self._lock:
+            self._update()
+            half_w = self.room[0] / 2
+            half_d = self.room[1] / 2
+            # heading is counterclockwise
+            direction = self.heading - math.radians(self.sensor_angle)
+            dx = math.cos(direction)
+            dy = math.sin(direction)
+            distances = []
+            if dx > 1e-9:
+                distances.append((half_w - self.x) / dx)
+            elif dx < -1e-9:
+                distances.append((-half_w - self.x) / dx)
+            if dy > 1e-9:
+                distances.append((half_d - self.y) / dy)
+            elif dy < -1e-9:
+                distances.append((-half_d - self.y) / dy)
+            distance = max(0, min(distances))
+            return int(min(distance, SimulatedDistanceSensor.MAX_RANGE))
+
+    def _spi_transfer(self):
+        with self._bus_lock:
+            self.spi_transactions += 1
+            if self.spi_latency:
+                time.sleep(self.spi_latency)
+
+    def _i2c_transfer(self):
+        with self._bus_lock:
+            self.i2c_transactions += 1
+            if self.i2c_latency:
+                time.sleep(self.i2c_latency)
+
+    def _ports(self, port):
+        return [m for p, m in self._motors.items() if port & p]
+
+    # GoPiGo3 interface
+
+    def get_manufacturer(self):
+        self._spi_transfer()
+        return "Dexter Industries"
+
+    def get_board(self):
+        self._spi_transfer()
+        return "GoPiGo3"
+
+    def get_version_hardware(self):
+        self._spi_transfer()
+        return "3.x.x"
+
+    def get_version_firmware(self):
+        self._spi_transfer()
+        return "1.0.0"
+
+    def get_id(self):
+        self._spi_transfer()
+        return "00000000000000000000000000000000"
+
+    def get_voltage_5v(self):
+        self._spi_transfer()
+        return 4.95
+
+    def get_voltage_battery(self):
+        self._spi_transfer()
+        return 9.4
+
+    def set_led(self, led, red, green=0, blue=0):
+        self._spi_transfer()
+        with self._lock:
+            for bit in (self.LED_EYE_LEFT, self.LED_EYE_RIGHT,
+                        self.LED_BLINKER_LEFT, self.LED_BLINKER_RIGHT, self.LED_WIFI):
+                if led & bit:
+                    self.leds[bit] = (red, green, blue)
+
+    def set_motor_dps(self, port, dps):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            for motor in self._ports(port):
+                motor.target = None
+                motor.dps = dps
+
+    def set_motor_position(self, port, position):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            for motor in self._ports(port):
+                motor.target = position
+
+    def set_motor_limits(self, port, power=0, dps=0):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            for motor in self._ports(port):
+                motor.limit_dps = dps
+
+    def get_motor_encoder(self, port):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            return int(self._ports(port)[0].encoder)
+
+    def offset_motor_encoder(self, port, offset):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            for motor in self._ports(port):
+                motor.encoder -= offset
+                if motor.target is not None:
+                    motor.target -= offset
+
+    def get_motor_status(self, port):
+        self._spi_transfer()
+        with self._lock:
+            self._update()
+            motor = self._ports(port)[0]
+            power = 0 if motor.dps == 0 else int(min(100, abs(motor.dps) / 10))
+            return [0, math.copysign(power, motor.dps) if power else 0,
+                    int(motor.encoder), int(motor.dps)]
+
+    def reset_all(self):
+        with self._lock:
+            self.set_motor_dps(self.MOTOR_LEFT + self.MOTOR_RIGHT, 0)
+            self.leds = {}
+
+    # EasyGoPiGo3 interface
+
+    def set_speed(self, in_speed):
+        self.speed = in_speed
+        self.set_motor_limits(self.MOTOR_LEFT + self.MOTOR_RIGHT, dps=self.speed)
+
+    def get_speed(self):
+        return self.speed
+
+    def reset_speed(self):
+        self.set_speed(self.DEFAULT_SPEED)
+
+    def stop(self):
+        self.set_motor_dps(self.MOTOR_LEFT + self.MOTOR_RIGHT, 0)
+
+    def forward(self):
+        self.set_motor_dps(self.MOTOR_LEFT + self.MOTOR_RIGHT, self.get_speed())
+
+    def backward(self):
+        self.set_motor_dps(self.MOTOR_LEFT + self.MOTOR_RIGHT, -self.get_speed())
+
+    def target_reached(self, left_target_degrees, right_target_degrees):
+        tolerance = 10
+        left = self.get_motor_encoder(self.MOTOR_LEFT)
+        right = self.get_motor_encoder(self.MOTOR_RIGHT)
+        return abs(left - left_target_degrees) <= tolerance and \
+               abs(right - right_target_degrees) <= tolerance
+
+    def drive_cm(self, dist, blocking=True):
+        wheel_turn_degrees = (dist * 10 / self.WHEEL_CIRCUMFERENCE) * 360
+        left_target = self.get_motor_encoder(self.MOTOR_LEFT) + wheel_turn_degrees
+        right_target = self.get_motor_encoder(self.MOTOR_RIGHT) + wheel_turn_degrees
+        self.set_motor_position(self.MOTOR_LEFT, left_target)
+        self.set_motor_position(self.MOTOR_RIGHT, right_target)
+        if blocking:
+            while not self.target_reached(left_target, right_target):
+                time.sleep(0.1)
+
+    def turn_degrees(self, degrees, blocking=False):
+        wheel_travel_distance = (self.WHEEL_BASE_CIRCUMFERENCE * degrees) / 360
+        wheel_turn_degrees = (wheel_travel_distance / self.WHEEL_CIRCUMFERENCE) * 360
+        left_target = self.get_motor_encoder(self.MOTOR_LEFT) + wheel_turn_degrees
+        right_target = self.get_motor_encoder(self.MOTOR_RIGHT) - wheel_turn_degrees
+        self.set_motor_position(self.MOTOR_LEFT, left_target)
+        self.set_motor_position(self.MOTOR_RIGHT, right_target)
+        if blocking:
+            while not self.target_reached(left_target, right_target):
+                time.sleep(0.1)
+
+    def init_servo(self, port="SERVO1"):
+        servo = SimulatedServo(port)
+        self.servos[port] = servo
+        return servo
+
+    def init_distance_sensor(self, port="I2C"):
+        return SimulatedDistanceSensor(self)
@@ -21,54 +21,98 @@
 
 $(document).ready(function() {
 
-  $("#platformInformationSubmit").click(function() {
-    $("#platformInformationValue").val("?");
+  // Requests are sent over a WebSocket while it is open, otherwise as AJAX
+  // requests.
+  var webSocket = null;
+  var nextId = 1;
+  var pendingCallbacks = {};
+
+  function connectWebSocket() {
+    if (!("WebSocket" in window)) {
+      return;
+    }
+    var ws = new WebSocket("ws://" + window.location.host + "/v1/ws");
+    ws.onopen = function() {
+      webSocket = ws;
+    };
+    ws.onmessage = function(event) {
+      var message = JSON.parse(event.data);
+      if (message.id in pendingCallbacks) {
+        var callback = pendingCallbacks[message.id];
+        delete pendingCallbacks[message.id];
+        callback(message);
+      }
+    };
+    ws.onclose = function() {
+      webSocket = null;
+      var callbacks = pendingCallbacks;
+      pendingCallbacks = {};
+      for (var id in callbacks) {
+        callbacks[id]({status: 0, error: "Connection closed"});
+      }
+      setTimeout(connectWebSocket, 5000);
+    };
+  }
+
+  // Send request, call success(data) with the JSON response (if any) or
+  // show the error.
+  function sendRequest(method, url, data, success) {
+    if (webSocket !== null && webSocket.readyState == WebSocket.OPEN) {
+      var id = nextId++;
+      pendingCallbacks[id] = function(message) {
+        if (message.status >= 200 && message.status < 300) {
+          if (success) {
+            success(message.body);
+          }
+        } else {
+          alert("Error: " + message.error);
+        }
+      };
+      var message = {id: id, method: method, path: url};
+      if (data !== null) {
+        message.body = data;
+      }
+      webSocket.send(JSON.stringify(message));
+      return;
+    }
     $.ajax({
-      method: "GET",
-      url: "/v1/platform/information",
-      dataType: "json",
-      success: function(data) {
-        $("#platformInformationValue").val(
-          "Manufacturer: " + data.manufacturer + "\n" +
-          "Board name: " + data.board_name + "\n" +
-          "Hardware version: " + data.hardware_version + "\n" +
-          "Firmware version: " + data.firmware_version + "\n" +
-          "Hardware serial number: " + data.hardware_serial_number
-          );
-      },
+      method: method,
+      url: url,
+      data: data === null ? undefined : JSON.stringify(data),
+      contentType: "application/json; charset=UTF-8",
+      success: success,
       error: function(jqXHR, textStatus, errorThrown) {
         alert("Error: " + errorThrown);
       }
     });
+  }
+
+  connectWebSocket();
+
+  $("#platformInformationSubmit").click(function() {
+    $("#platformInformationValue").val("?");
+    sendRequest("GET", "/v1/platform/information", null, function(data) {
+      $("#platformInformationValue").val(
+        "Manufacturer: " + data.manufacturer + "\n" +
+        "Board name: " + data.board_name + "\n" +
+        "Hardware version: " + data.hardware_version + "\n" +
+        "Firmware version: " + data.firmware_version + "\n" +
+        "Hardware serial number: " + data.hardware_serial_number
+        );
+    });
   });
 
   $("#platformInformationVoltages5VSubmit").click(function() {
     $("#platformInformationVoltages5VValue").val("?");
-    $.ajax({
-      method: "GET",
-      url: "/v1/platform/voltages/5v",
-      dataType: "json",
-      success: function(data) {
-        $("#platformInformationVoltages5VValue").val(data.voltage);
-      },
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("GET", "/v1/platform/voltages/5v", null, function(data) {
+      $("#platformInformationVoltages5VValue").val(data.voltage);
     });
   });
 
   $("#platformInformationVoltagesBatterySubmit").click(function() {
     $("#platformInformationVoltagesBatteryValue").val("?");
-    $.ajax({
-      method: "GET",
-      url: "/v1/platform/voltages/battery",
-      dataType: "json",
-      success: function(data) {
-        $("#platformInformationVoltagesBatteryValue").val(data.voltage);
-      },
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("GET", "/v1/platform/voltages/battery", null, function(data) {
+      $("#platformInformationVoltagesBatteryValue").val(data.voltage);
     });
   });
 
@@ -77,15 +121,7 @@ $(document).ready(function() {
     if ($("#blinkersId").val() != "both") {
       url = url + "/" + encodeURIComponent($("#blinkersId").val());
     }
-    $.ajax({
-      method: "PUT",
-      url: url,
-      data: JSON.stringify({state: $("#blinkersState").val()}),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("PUT", url, {state: $("#blinkersState").val()});
   });
 
   $("#eyesSubmit").click(function() {
@@ -93,18 +129,10 @@ $(document).ready(function() {
     if ($("#eyesId").val() != "both") {
       url = url + "/" + encodeURIComponent($("#eyesId").val());
     }
-    $.ajax({
-      method: "PUT",
-      url: url,
-      data: JSON.stringify({
-        red: $("#eyesRed").val(),
-        blue: $("#eyesBlue").val(),
-        green: $("#eyesGreen").val()
-      }),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("PUT", url, {
+      red: $("#eyesRed").val(),
+      blue: $("#eyesBlue").val(),
+      green: $("#eyesGreen").val()
     });
   });
 
@@ -116,15 +144,7 @@ $(document).ready(function() {
     if ($("#motorsDriveDistance").val() != "") {
       data.distance = $("#motorsDriveDistance").val();
     }
-    $.ajax({
-      method: "POST",
-      url: "/v1/motors/drive",
-      data: JSON.stringify(data),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("POST", "/v1/motors/drive", data);
   });
 
   $("#motorsTurnSubmit").click(function() {
@@ -135,66 +155,36 @@ $(document).ready(function() {
     if ($("#motorsTurnAngle").val() != "") {
       data.angle = $("#motorsTurnAngle").val();
     }
-    $.ajax({
-      method: "POST",
-      url: "/v1/motors/turn",
-      data: JSON.stringify(data),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("POST", "/v1/motors/turn", data);
   });
 
   $("#motorsSetSubmit").click(function() {
-    $.ajax({
-      method: "POST",
-      url: "/v1/motors/set",
-      data: JSON.stringify({
-        left_direction: $("#motorsSetLeftDirection").val(),
-        left_speed: $("#motorsSetLeftSpeed").val(),
-        right_direction: $("#motorsSetRightDirection").val(),
-        right_speed: $("#motorsSetRightSpeed").val(),
-      }),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("POST", "/v1/motors/set", {
+      left_direction: $("#motorsSetLeftDirection").val(),
+      left_speed: $("#motorsSetLeftSpeed").val(),
+      right_direction: $("#motorsSetRightDirection").val(),
+      right_speed: $("#motorsSetRightSpeed").val(),
     });
   });
 
   $("#motorsStopSubmit").click(function() {
-    $.ajax({
-      method: "POST",
-      url: "/v1/motors/stop",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("POST", "/v1/motors/stop", null);
   });
 
   $("#motorsStatusSubmit").click(function() {
-    $.ajax({
-      method: "GET",
-      url: "/v1/motors/status",
-      dataType: "json",
-      success: function(data) {
-        $("#motorStatusValue").val(
-          $("#motorStatusValue").val() + "\n" +
-          data.left.flags.toString().padStart(5) + " " +
-          data.left.power.toString().padStart(5) + " " +
-          data.left.encoder.toString().padStart(7) + " " +
-          data.left.dps.toString().padStart(4) + " | " +
-          data.right.flags.toString().padStart(5) + " " +
-          data.right.power.toString().padStart(5) + " " +
-          data.right.encoder.toString().padStart(7) + " " +
-          data.right.dps.toString().padStart(4)
-          );
-          $("#motorStatusValue").scrollTop($("#motorStatusValue")[0].scrollHeight);
-      },
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("GET", "/v1/motors/status", null, function(data) {
+      $("#motorStatusValue").val(
+        $("#motorStatusValue").val() + "\n" +
+        data.left.flags.toString().padStart(5) + " " +
+        data.left.power.toString().padStart(5) + " " +
+        data.left.encoder.toString().padStart(7) + " " +
+        data.left.dps.toString().padStart(4) + " | " +
+        data.right.flags.toString().padStart(5) + " " +
+        data.right.power.toString().padStart(5) + " " +
+        data.right.encoder.toString().padStart(7) + " " +
+        data.right.dps.toString().padStart(4)
+        );
+        $("#motorStatusValue").scrollTop($("#motorStatusValue")[0].scrollHeight);
     });
   });
 
@@ -208,41 +198,17 @@ $(document).ready(function() {
   $("#motorStatusValue").val(motorStatusValueHeader);
 
   $("#servosServo1Submit").click(function() {
-    $.ajax({
-      method: "PUT",
-      url: "/v1/servos/SERVO1/position",
-      data: JSON.stringify({position: $("#servosServo1Position").val()}),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("PUT", "/v1/servos/SERVO1/position", {position: $("#servosServo1Position").val()});
   });
 
   $("#servosServo2Submit").click(function() {
-    $.ajax({
-      method: "PUT",
-      url: "/v1/servos/SERVO2/position",
-      data: JSON.stringify({position: $("#servosServo2Position").val()}),
-      contentType: "application/json; charset=UTF-8",
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
-    });
+    sendRequest("PUT", "/v1/servos/SERVO2/position", {position: $("#servosServo2Position").val()});
   });
 
   $("#sensorsDistanceSubmit").click(function() {
     $("#sensorsDistanceValue").val("?");
-    $.ajax({
-      method: "GET",
-      url: "/v1/sensors/I2C/distance/distance",
-      dataType: "json",
-      success: function(data) {
-        $("#sensorsDistanceValue").val(data.distance);
-      },
-      error: function(jqXHR, textStatus, errorThrown) {
-        alert("Error: " + errorThrown);
-      }
+    sendRequest("GET", "/v1/sensors/I2C/distance/distance", null, function(data) {
+      $("#sensorsDistanceValue").val(data.distance);
     });
   });
 
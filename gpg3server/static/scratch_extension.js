@@ -24,170 +24,198 @@
   // host_port in double curly brackets is a placeholder that is replaced by
   // the server before sent to the client.
   var baseUrl = "http://{{host_port}}";
+  var webSocketUrl = "ws://{{host_port}}/v1/ws";
 
-  ext._shutdown = function() {};
+  // Commands go over a WebSocket while it is open, which saves the CORS
+  // pre-flight and the connection setup of an AJAX request. Without it, they
+  // are sent as AJAX requests. The WebSocket also pushes the distance sensor
+  // value, so the distance reporter needs no request at all.
+  var webSocket = null;
+  var nextId = 1;
+  var pendingCallbacks = {};
+  var latestDistance = null;
+  var shutdown = false;
+
+  function connectWebSocket() {
+    if (!("WebSocket" in window)) {
+      return;
+    }
+    var ws = new WebSocket(webSocketUrl);
+    ws.onopen = function() {
+      webSocket = ws;
+      ws.send(JSON.stringify({type: "subscribe", rate: 10, fields: ["distance"]}));
+    };
+    ws.onmessage = function(event) {
+      var message = JSON.parse(event.data);
+      if (message.type == "telemetry") {
+        latestDistance = message.values.distance;
+      } else if (message.id in pendingCallbacks) {
+        var callback = pendingCallbacks[message.id];
+        delete pendingCallbacks[message.id];
+        callback(message.status, message.body);
+      }
+    };
+    ws.onclose = function() {
+      webSocket = null;
+      latestDistance = null;
+      // replies to commands in flight are lost, let the blocks continue
+      var callbacks = pendingCallbacks;
+      pendingCallbacks = {};
+      for (var id in callbacks) {
+        callbacks[id](0, null);
+      }
+      if (!shutdown) {
+        setTimeout(connectWebSocket, 5000);
+      }
+    };
+  }
+
+  // Send request, call callback(status, data) with the HTTP status and the
+  // JSON response (if any).
+  function sendRequest(method, path, data, callback) {
+    if (webSocket !== null && webSocket.readyState == WebSocket.OPEN) {
+      var id = nextId++;
+      pendingCallbacks[id] = callback;
+      var message = {id: id, method: method, path: path};
+      if (data !== null) {
+        message.body = data;
+      }
+      webSocket.send(JSON.stringify(message));
+      return;
+    }
+    $.ajax({
+      method: method,
+      url: baseUrl + path,
+      data: data === null ? undefined : JSON.stringify(data),
+      contentType: "application/json; charset=UTF-8",
+      complete: function(jqXHR, textStatus) {
+        callback(jqXHR.status, jqXHR.responseJSON);
+      }
+    });
+  }
+
+  connectWebSocket();
+
+  ext._shutdown = function() {
+    shutdown = true;
+    if (webSocket !== null) {
+      webSocket.close();
+    }
+  };
 
   ext._getStatus = function() {
     return {status: 2, msg: "Ready"};
   };
 
   ext.setBlinkers = function(blinkers, state, callback) {
-    var url = baseUrl + "/v1/blinkers";
+    var url = "/v1/blinkers";
     if (blinkers == "left blinker") {
       url += "/left";
     } else if (blinkers == "right blinker") {
       url += "/right";
     }
-    $.ajax({
-      method: "PUT",
-      url: url,
-      data: JSON.stringify({state: state}),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("PUT", url, {state: state}, function(status, data) {
+      callback();
     });
   };
 
   ext.setEyes = function(eyes, red, green, blue, callback) {
-    var url = baseUrl + "/v1/eyes";
+    var url = "/v1/eyes";
     if (eyes == "left eye") {
       url += "/left";
     } else if (eyes == "right eye") {
       url += "/right";
     }
-    $.ajax({
-      method: "PUT",
-      url: url,
-      data: JSON.stringify({
-        red: red * 255 / 100,
-        green: green * 255 / 100,
-        blue: blue * 255 / 100
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("PUT", url, {
+      red: red * 255 / 100,
+      green: green * 255 / 100,
+      blue: blue * 255 / 100
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.drive = function(direction, distance, speed, callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/drive",
-      data: JSON.stringify({
-        direction: direction,
-        speed: speed,
-        distance: distance * 10
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    // wait=true: respond when the robot arrived
+    sendRequest("POST", "/v1/motors/drive?wait=true", {
+      direction: direction,
+      speed: speed,
+      distance: distance * 10
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.driveContiniously = function(direction, speed, callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/drive",
-      data: JSON.stringify({
-        direction: direction,
-        speed: speed
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("POST", "/v1/motors/drive", {
+      direction: direction,
+      speed: speed
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.turn = function(angle, direction, speed, callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/turn",
-      data: JSON.stringify({
-        direction: direction,
-        speed: speed,
-        angle: angle
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    // wait=true: respond when the turn is completed
+    sendRequest("POST", "/v1/motors/turn?wait=true", {
+      direction: direction,
+      speed: speed,
+      angle: angle
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.turnContiniously = function(direction, speed, callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/turn",
-      data: JSON.stringify({
-        direction: direction,
-        speed: speed
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("POST", "/v1/motors/turn", {
+      direction: direction,
+      speed: speed
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.setMotors = function(leftDirection, leftSpeed, rightDirection, rightSpeed, callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/set",
-      data: JSON.stringify({
-        left_direction: leftDirection,
-        left_speed: leftSpeed,
-        right_direction: rightDirection,
-        right_speed: rightSpeed,
-      }),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("POST", "/v1/motors/set", {
+      left_direction: leftDirection,
+      left_speed: leftSpeed,
+      right_direction: rightDirection,
+      right_speed: rightSpeed,
+    }, function(status, data) {
+      callback();
     });
   };
 
   ext.stopMotors = function(callback) {
-    $.ajax({
-      method: "POST",
-      url: baseUrl + "/v1/motors/stop",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    sendRequest("POST", "/v1/motors/stop", null, function(status, data) {
+      callback();
     });
   };
 
   ext.setServo = function(servo, position, callback) {
-    var url = baseUrl + "/v1/servos/";
+    var url = "/v1/servos/";
     if (servo == "Servo 1") {
       url += "SERVO1";
     } else {
       url += "SERVO2";
     }
-    url += "/position"
-    $.ajax({
-      method: "PUT",
-      url: url,
-      data: JSON.stringify({position: position}),
-      contentType: "application/json; charset=UTF-8",
-      complete: function(jqXHR, textStatus) {
-        callback();
-      }
+    // wait=true: respond when the servo is estimated to have arrived
+    url += "/position?wait=true"
+    sendRequest("PUT", url, {position: position}, function(status, data) {
+      callback();
     });
   };
 
   ext.getDistance = function(callback) {
-    $.ajax({
-      method: "GET",
-      url: baseUrl + "/v1/sensors/I2C/distance/distance",
-      dataType: "json",
-      success: function(data) {
+    // pushed over the WebSocket
+    if (latestDistance !== null) {
+      callback(Math.round(latestDistance / 10));
+      return;
+    }
+    sendRequest("GET", "/v1/sensors/I2C/distance/distance", null, function(status, data) {
+      if (status == 200) {
         callback(Math.round(data.distance / 10));
-      },
-      error: function(jqXHR, textStatus, errorThrown) {
+      } else {
         callback(-1.0);
       }
     });
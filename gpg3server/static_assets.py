@@ -0,0 +1,230 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# In-memory cache for the whitelisted static files.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# All files are read once at startup. Text files are split around the
+# {{host_port}} placeholder, so rendering a page for a given Host header is a
+# join of the prepared parts. Rendered variants are kept in a bounded LRU
+# together with their gzip (and, if the brotli module is installed, brotli)
+# compressed bodies, ETag and Last-Modified values.
+
+import collections
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PLACEHOLDER = '{{host_port}}'
+
+# preferred order if the client accepts several encodings
+_ENCODINGS = ('br', 'gzip', 'identity')
+
+# compressing tiny bodies does not pay off
+_MIN_COMPRESS_SIZE = 256
+
+class AssetVariant:
+    """
+    A fully rendered asset, ready to be sent.
+
+    bodies maps content coding ('identity', 'gzip', 'br') to the encoded body.
+    """
+
+    def __init__(self, body, content_type, last_modified, compressible):
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.bodies = {'identity': body}
+        if compressible and len(body) >= _MIN_COMPRESS_SIZE:
+            gz = gzip.compress(body, 9, mtime=0)
+            if len(gz) < len(body):
+                self.bodies['gzip'] = gz
+            if brotli is not None:
+                br = brotli.compress(body)
+                if len(br) < len(body):
+                    self.bodies['br'] = br
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self._etag_base = digest
+        self.etags = {
+            encoding: self._make_etag(encoding) for encoding in self.bodies
+            }
+
+    def _make_etag(self, encoding):
+        if encoding == 'identity':
+            return '"{}"'.format(self._etag_base)
+        return '"{}-{}"'.format(self._etag_base, encoding)
+
+    def negotiate(self, accept_encoding):
+        """
+        Return content coding to use for the given Accept-Encoding header.
+        """
+        if not accept_encoding or len(self.bodies) == 1:
+            return 'identity'
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in _ENCODINGS:
+            if encoding in self.bodies and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+    def matches_etag(self, if_none_match):
+        """
+        True if the If-None-Match header matches any representation of this
+        variant.
+        """
+        if if_none_match is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag in self.etags.values():
+                return True
+        return False
+
+    def not_modified_since(self, if_modified_since):
+        """
+        True if the If-Modified-Since header is not older than the asset.
+        """
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return int(since.timestamp()) >= int(self.last_modified)
+
+def _parse_accept_encoding(header):
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+class _StaticAsset:
+
+    def __init__(self, content, text, content_type, last_modified):
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.compressible = text
+        if text and PLACEHOLDER in content:
+            # keep file split around the placeholder, render per Host
+            self.parts = content.split(PLACEHOLDER)
+            self.variant = None
+        else:
+            self.parts = None
+            if text:
+                content = content.encode()
+            self.variant = AssetVariant(content, content_type, last_modified, text)
+
+    def render(self, host_port):
+        body = host_port.join(self.parts).encode()
+        return AssetVariant(body, self.content_type, self.last_modified, self.compressible)
+
+class StaticAssetCache:
+    """
+    Whitelisted static files, loaded once and served from memory.
+    """
+
+    def __init__(self, root, text_paths, binary_paths, max_variants=64):
+        self._assets = {}
+        self._variants = collections.OrderedDict()
+        self._max_variants = max_variants
+        self._lock = threading.Lock()
+
+        mime = mimetypes.MimeTypes()
+
+        for path in text_paths:
+            self._load(mime, root, path, True)
+        for path in binary_paths:
+            self._load(mime, root, path, False)
+
+    def _load(self, mime, root, path, text):
+        if path == '/':
+            fname = os.path.join(root, 'index.html')
+        else:
+            fname = os.path.join(root, path.lstrip('/'))
+
+        if text:
+            # read file in text mode
+            with open(fname, 'r') as f:
+                content = f.read()
+        else:
+            # read file in binary mode
+            with open(fname, 'rb') as f:
+                content = f.read()
+
+        # guess content type based on file name
+        content_type = mime.guess_type(fname)[0]
+        if content_type is not None and text:
+            content_type += '; charset=UTF-8'
+
+        last_modified = os.path.getmtime(fname)
+
+        self._assets[path] = _StaticAsset(content, text, content_type, last_modified)
+
+    def __contains__(self, path):
+        return path in self._assets
+
+    def get(self, path, host_port):
+        """
+        Return AssetVariant for path as seen by a client that addressed the
+        server as host_port, or None if path is not a known asset.
+        """
+        asset = self._assets.get(path)
+        if asset is None:
+            return None
+        if asset.variant is not None:
+            return asset.variant
+
+        key = (path, host_port)
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is not None:
+                self._variants.move_to_end(key)
+                return variant
+
+        # render outside the lock, compression takes a few ms
+        variant = asset.render(host_port)
+
+        with self._lock:
+            self._variants[key] = variant
+            self._variants.move_to_end(key)
+            while len(self._variants) > self._max_variants:
+                self._variants.popitem(last=False)
+        return variant
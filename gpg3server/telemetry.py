@@ -0,0 +1,340 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Background sampling of sensor and status values.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Reading voltages, motor status or the distance sensor is an SPI or I2C
+# transaction, serialized with all other hardware access. Instead of reading
+# on every HTTP request, a sampler thread polls each source at its own rate
+# and keeps the latest value and a short history. Requests are served from
+# that cache. A request can ask for a maximum age, if the cached value is
+# older the source is read synchronously.
+#
+# Stream clients get a Subscription, fed by the sampler thread: it keeps
+# the values that changed since they were last sent to the client. Small
+# changes within a source's deadband (sensor noise) are not reported.
+
+import collections
+import heapq
+import threading
+import time
+
+import jsoncodec
+import scheduler
+
+class Sample:
+
+    __slots__ = ('value', 'timestamp', 'monotonic')
+
+    def __init__(self, value, timestamp, monotonic):
+        self.value = value
+        # wall clock time, for clients
+        self.timestamp = timestamp
+        # monotonic time, for age calculation
+        self.monotonic = monotonic
+
+    def age(self, now=None):
+        return (now or time.monotonic()) - self.monotonic
+
+    def to_dict(self):
+        return {'value': self.value, 'timestamp': self.timestamp}
+
+class _Source:
+
+    def __init__(self, name, read, rate, history, deadband):
+        self.name = name
+        self.read = read
+        self.rate = rate
+        self.deadband = deadband
+        self.latest = None
+        self.history = collections.deque(maxlen=history)
+        self.reads = 0
+        self.errors = 0
+        # monotonic time the read of the latest sample started
+        self.read_start = 0
+        # serializes reads of this source
+        self.lock = threading.Lock()
+
+class TelemetrySampler:
+    """
+    Polls registered sources on a background thread.
+
+    A source is a function without parameters that returns a JSON
+    serializable value. rate is the number of reads per second, 0 means the
+    source is only read on demand. Changes of a numeric value smaller than
+    deadband are not reported to subscriptions.
+    """
+
+    def __init__(self, default_max_age=1.0, history=50):
+        self.default_max_age = default_max_age
+        self._history = history
+        self._sources = collections.OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+
+    def add_source(self, name, read, rate=0, deadband=0):
+        self._sources[name] = _Source(name, read, rate, self._history, deadband)
+
+    def __contains__(self, name):
+        return name in self._sources
+
+    def names(self):
+        return list(self._sources)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def add_listener(self, listener):
+        """
+        Call listener(name, sample) for every new sample.
+        """
+        with self._listeners_lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._listeners_lock:
+            self._listeners.remove(listener)
+
+    def _sample(self, source):
+        with source.lock:
+            start = time.monotonic()
+            try:
+                value = source.read()
+            except scheduler.QueueFull:
+                # rejected by admission control, not a read of the source
+                raise
+            except Exception:
+                source.reads += 1
+                source.errors += 1
+                raise
+            source.reads += 1
+            sample = Sample(value, time.time(), time.monotonic())
+            source.latest = sample
+            source.read_start = start
+            source.history.append(sample)
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(source.name, sample)
+        return sample
+
+    def get(self, name, max_age=None):
+        """
+        Return latest Sample of source name, at most max_age seconds old
+        (default_max_age if None). Reads the source if the cached sample is
+        older.
+
+        Callers that find a read in progress wait for it, and take its
+        value if it started after they asked, so a burst of requests with
+        max_age 0 reads the source twice at most.
+        """
+        source = self._sources[name]
+        if max_age is None:
+            max_age = self.default_max_age
+        sample = source.latest
+        if sample is not None and sample.age() <= max_age:
+            return sample
+        asked = time.monotonic()
+        with source.lock:
+            # another thread may have read the source while we waited
+            sample = source.latest
+            if sample is not None and (sample.age() <= max_age or source.read_start >= asked):
+                return sample
+        return self._sample(source)
+
+    def subscribe(self, fields=None, rate=0):
+        """
+        Return Subscription for changes of fields (all sources if None), at
+        most rate updates per second (0 for no limit). Raises KeyError for
+        unknown fields.
+        """
+        if fields is None:
+            fields = self.names()
+        for name in fields:
+            if name not in self._sources:
+                raise KeyError(name)
+        deadbands = {name: self._sources[name].deadband for name in fields}
+        subscription = Subscription(self, fields, 1.0 / rate if rate else 0, deadbands)
+        self.add_listener(subscription._offer)
+        return subscription
+
+    def history(self, name):
+        return list(self._sources[name].history)
+
+    def stats(self):
+        return {
+            name: {
+                'rate': source.rate,
+                'reads': source.reads,
+                'errors': source.errors,
+                'age': None if source.latest is None else round(source.latest.age(), 3)
+                }
+            for name, source in self._sources.items()
+            }
+
+    def _run(self):
+        # (due time, name) for every periodically sampled source
+        schedule = [(time.monotonic(), name)
+                    for name, source in self._sources.items() if source.rate > 0]
+        heapq.heapify(schedule)
+        while schedule and not self._stop.is_set():
+            due, name = schedule[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                if self._stop.wait(delay):
+                    return
+            source = self._sources[name]
+            try:
+                self._sample(source)
+            except Exception:
+                # counted in source.errors, keep sampling other sources
+                pass
+            interval = 1.0 / source.rate
+            next_due = due + interval
+            now = time.monotonic()
+            if next_due < now:
+                # fell behind, don't try to catch up
+                next_due = now + interval
+            heapq.heapreplace(schedule, (next_due, name))
+
+class Subscription:
+    """
+    Changed values of some sources, not yet taken by the client.
+
+    Changes are coalesced: if a value changes several times before the
+    client takes it, only the latest one is reported.
+    """
+
+    def __init__(self, sampler, fields, min_interval, deadbands):
+        self._sampler = sampler
+        self.fields = list(fields)
+        self.min_interval = min_interval
+        self._deadbands = deadbands
+        self._condition = threading.Condition()
+        # values last reported to the client
+        self._sent = {}
+        # changed values not yet reported
+        self._pending = {}
+        self._last_time = 0
+        # called on the sampler thread when a change is pending, for
+        # consumers that do not block in get_update()
+        self.on_change = None
+        self.updates = 0
+        self.suppressed = 0
+
+    def close(self):
+        self._sampler.remove_listener(self._offer)
+
+    def _changed(self, name, value):
+        if name not in self._sent:
+            return True
+        sent = self._sent[name]
+        deadband = self._deadbands.get(name, 0)
+        if deadband and isinstance(value, (int, float)) and isinstance(sent, (int, float)):
+            return abs(value - sent) >= deadband
+        return value != sent
+
+    def _offer(self, name, sample):
+        if name not in self._deadbands:
+            return
+        with self._condition:
+            if self._changed(name, sample.value):
+                self._pending[name] = sample.value
+                self._condition.notify()
+                notify = True
+            else:
+                # back within the deadband of the reported value
+                if self._pending.pop(name, None) is None:
+                    self.suppressed += 1
+                notify = False
+        on_change = self.on_change
+        if notify and on_change is not None:
+            on_change()
+
+    def snapshot(self):
+        """
+        Return latest values of all fields, reported as sent.
+        """
+        values = {}
+        for name in self.fields:
+            sample = self._sampler.get(name, float('inf'))
+            values[name] = sample.value
+        with self._condition:
+            self._sent.update(values)
+            for name in values:
+                self._pending.pop(name, None)
+            self._last_time = time.monotonic()
+        return values
+
+    def update_delay(self):
+        """
+        Seconds until the rate limit allows the next update.
+        """
+        if not self.min_interval:
+            return 0
+        return max(0, self._last_time + self.min_interval - time.monotonic())
+
+    def poll(self):
+        """
+        Return dict of changed values, None if nothing changed. Does not
+        wait, see update_delay().
+        """
+        with self._condition:
+            if not self._pending:
+                return None
+            return self._take()
+
+    def get_update(self, timeout=None):
+        """
+        Return dict of changed values, None if nothing changed within
+        timeout seconds.
+        """
+        delay = self.update_delay()
+        if delay > 0:
+            time.sleep(delay)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending, timeout):
+                return None
+            return self._take()
+
+    def _take(self):
+        values = self._pending
+        self._pending = {}
+        self._sent.update(values)
+        self._last_time = time.monotonic()
+        self.updates += 1
+        return values
+
+def sse_event(data, event='telemetry'):
+    """
+    Return data as text/event-stream event.
+    """
+    return b'event: ' + event.encode() + b'\ndata: ' + jsoncodec.dumps(data) + b'\n\n'
+
+# sent when nothing changed for a while, so dead connections are noticed
+SSE_KEEP_ALIVE = b': keep-alive\n\n'
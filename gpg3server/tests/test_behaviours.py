@@ -0,0 +1,136 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the behaviours and the behaviour engine, run against the
+# simulated GoPiGo3 and its distance sensor.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import behaviours
+import motion
+import routing
+import simulation
+
+def behaviour(name, **params):
+    cls = behaviours.BEHAVIOURS[name]
+    return cls(routing.validate(cls.SCHEMA, params), 0.02, 0.01)
+
+class BehaviourTest(unittest.TestCase):
+
+    def test_drive_until(self):
+        drive_until = behaviour('drive_until', speed=60, distance=200)
+        self.assertEqual(drive_until.step(500), (60, 60))
+        self.assertEqual(drive_until.step(200), (60, 60))
+        self.assertIsNone(drive_until.step(199))
+
+    def test_avoid_obstacles_clearance(self):
+        avoid = behaviour('avoid_obstacles', speed=50, distance=250, clearance=100,
+                          turn_speed=40, direction='left')
+        self.assertEqual(avoid.step(400), (50, 50))
+        self.assertEqual(avoid.step(240), (-40, 40))
+        # turns on until distance + clearance
+        self.assertEqual(avoid.step(300), (-40, 40))
+        self.assertEqual(avoid.step(350), (50, 50))
+        self.assertEqual(avoid.step(300), (50, 50))
+
+    def test_follow_wall_steers_towards_wall(self):
+        follow = behaviour('follow_wall', speed=40, distance=200, side='right')
+        left, right = follow.step(300)
+        self.assertGreater(left, right)
+        follow = behaviour('follow_wall', speed=40, distance=200, side='left')
+        left, right = follow.step(300)
+        self.assertLess(left, right)
+
+class BehaviourEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = simulation.SimulatedEasyGoPiGo3(room=(2000, 2000))
+        self.executor = motion.MotionExecutor(self.robot, poll_interval=0.01)
+        self.addCleanup(self.executor.shutdown)
+        sensor = self.robot.init_distance_sensor()
+        self.engine = behaviours.BehaviourEngine(self.robot, self.executor, sensor.read_mm)
+        self.addCleanup(self.engine.stop)
+
+    def motor_speeds(self):
+        return [self.robot.get_motor_status(port)[3]
+                for port in (self.robot.MOTOR_LEFT, self.robot.MOTOR_RIGHT)]
+
+    def test_drive_until_distance(self):
+        # starts 1000 mm from the wall
+        self.engine.set_parameters('drive_until', {'speed': 100, 'distance': 900})
+        run = self.engine.start('drive_until')
+        self.assertTrue(run.wait(5))
+        self.assertEqual(run.state, behaviours.COMPLETED)
+        self.assertLess(run.distance, 900)
+        self.assertGreater(run.distance, 850)
+        self.assertEqual(self.motor_speeds(), [0, 0])
+
+    def test_ticks_at_rate(self):
+        self.engine.set_parameters('drive_until', {'speed': 0, 'distance': 0})
+        run = self.engine.start('drive_until')
+        time.sleep(0.5)
+        self.assertIs(self.engine.stop(), run)
+        self.assertTrue(run.wait(1))
+        self.assertEqual(run.state, behaviours.STOPPED)
+        # 50 Hz
+        self.assertGreaterEqual(run.ticks + run.skipped, 20)
+        self.assertLessEqual(run.ticks + run.skipped, 30)
+        self.assertEqual(run.motor_writes, 1)
+        self.assertEqual(run.to_dict()['timing']['jitter']['count'], run.ticks)
+
+    def test_avoid_obstacles_turns_away(self):
+        self.engine.set_parameters('avoid_obstacles',
+            {'speed': 100, 'distance': 900, 'clearance': 100, 'turn_speed': 100})
+        run = self.engine.start('avoid_obstacles')
+        deadline = time.monotonic() + 5
+        while run.speeds is None or run.speeds[0] == run.speeds[1]:
+            self.assertLess(time.monotonic(), deadline, "did not turn")
+            time.sleep(0.01)
+        # turning until the distance is above 900 + 100 mm
+        while run.speeds[0] != run.speeds[1]:
+            self.assertLess(time.monotonic(), deadline, "did not turn back")
+            time.sleep(0.01)
+        # one tick may have passed since, driving a few mm
+        self.assertGreater(run.distance, 950)
+        self.assertEqual(run.state, behaviours.RUNNING)
+
+    def test_motion_command_preempts(self):
+        self.engine.set_parameters('drive_until', {'speed': 50, 'distance': 0})
+        run = self.engine.start('drive_until')
+        command = self.executor.drive(10, 500)
+        self.assertTrue(run.wait(1))
+        self.assertEqual(run.state, behaviours.PREEMPTED)
+        self.assertTrue(command.wait(5))
+        self.assertEqual(command.state, motion.COMPLETED)
+
+    def test_start_stops_running_behaviour(self):
+        first = self.engine.start('follow_wall')
+        second = self.engine.start('avoid_obstacles')
+        self.assertTrue(first.wait(1))
+        self.assertEqual(first.state, behaviours.PREEMPTED)
+        self.assertIs(self.engine.current(), second)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the camera frame buffer, run without hardware.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import camera
+
+def jpeg_size(data):
+    """
+    Return (width, height) from the SOF0 segment of a JPEG.
+    """
+    data = bytes(data)
+    i = data.index(b'\xff\xc0')
+    height, width = struct.unpack_from('>HH', data, i + 5)
+    return width, height
+
+class Collector:
+
+    def __init__(self):
+        self.frames = []
+
+    def publish(self, frame):
+        self.frames.append(bytes(frame.data))
+        frame.release()
+
+class JPEGFrameOutputBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = [camera.synthetic_jpeg(64, 48, 'frame {}'.format(i).encode())
+                       for i in range(5)]
+        self.stream = b''.join(self.frames)
+
+    def feed(self, chunk_sizes):
+        collector = Collector()
+        output = camera._JPEGFrameOutputBuffer(collector)
+        i = 0
+        sizes = iter(chunk_sizes)
+        while i < len(self.stream):
+            n = next(sizes)
+            output.write(self.stream[i:i + n])
+            i += n
+        return collector.frames
+
+    def test_frame_per_write(self):
+        collector = Collector()
+        output = camera._JPEGFrameOutputBuffer(collector)
+        for frame in self.frames:
+            output.write(frame)
+        self.assertEqual(collector.frames, self.frames)
+
+    def test_small_writes(self):
+        for size in (1, 2, 3, 7):
+            self.assertEqual(self.feed(iter(lambda: size, None)), self.frames, size)
+
+    def test_frames_merged_in_one_write(self):
+        self.assertEqual(self.feed([len(self.stream)]), self.frames)
+
+    def test_write_ends_inside_frame(self):
+        # every write ends 3 bytes into the next frame
+        sizes = [len(self.frames[0]) + 3] + [len(f) for f in self.frames[1:]]
+        self.assertEqual(self.feed(sizes), self.frames)
+
+    def test_frame_larger_than_slot(self):
+        big = camera.synthetic_jpeg(64, 48, b' ' * (2 * camera._SLOT_CAPACITY))
+        collector = Collector()
+        output = camera._JPEGFrameOutputBuffer(collector)
+        output.write(big[:1000])
+        output.write(big[1000:])
+        self.assertEqual(collector.frames, [big])
+
+class CameraManagerTest(unittest.TestCase):
+
+    def manager(self, init_delay=0, always_on=False):
+        def factory(resolution, framerate):
+            return camera.SyntheticPiCamera(resolution, framerate, init_delay=init_delay)
+        return camera._CameraManager(camera_factory=factory, idle_linger=0.1,
+                                     always_on=always_on)
+
+    def test_stats_do_not_wait_for_camera_start(self):
+        mgr = self.manager(init_delay=0.5)
+        starting = threading.Thread(target=mgr.hold, args=(camera.PROFILES['default'], 0.2))
+        starting.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        self.assertFalse(mgr.stats()['camera_open'])
+        self.assertLess(time.monotonic() - start, 0.1)
+        starting.join()
+        self.assertTrue(mgr.stats()['camera_open'])
+        time.sleep(0.4)
+        self.assertFalse(mgr.stats()['camera_open'])
+
+    def test_concurrent_starts_share_recording(self):
+        mgr = self.manager(init_delay=0.2)
+        profile = camera.PROFILES['default']
+        threads = [threading.Thread(target=mgr.inc_consumers, args=(profile,))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        recordings = mgr.stats()['recordings']
+        self.assertEqual(len(recordings), 1)
+        self.assertEqual(list(recordings.values())[0]['consumers'], 4)
+
+    def test_always_on_releases_custom_profiles(self):
+        mgr = self.manager(always_on=True)
+        default = camera.PROFILES['default']
+        custom = camera.CameraProfile('custom', (160, 128), 50)
+        mgr.inc_consumers(default)
+        mgr.inc_consumers(custom)
+        self.assertEqual(len(mgr.stats()['recordings']), 2)
+        mgr.dec_consumers(default)
+        mgr.dec_consumers(custom)
+        time.sleep(0.3)
+        stats = mgr.stats()
+        self.assertEqual(len(stats['recordings']), 1)
+        self.assertTrue(stats['camera_open'])
+
+    def test_profiles_served_at_once(self):
+        cameras = []
+        def factory(resolution, framerate):
+            cameras.append(camera.SyntheticPiCamera(resolution, 50))
+            return cameras[-1]
+        mgr = camera._CameraManager(camera_factory=factory, idle_linger=0.1)
+        profiles = [camera.PROFILES[name] for name in ('thumbnail', 'default', 'high')]
+        # same size and quality as default, shares its recording
+        profiles.append(camera.CameraProfile('slow', (320, 240), 85, 1))
+        clients = []
+        for profile in profiles:
+            mgr.inc_consumers(profile)
+            clients.append((profile, mgr.broadcaster(profile).register()))
+        self.assertEqual(len(cameras), 1)
+        recordings = mgr.stats()['recordings']
+        self.assertEqual(sorted(recordings), ['160x120q50', '320x240q85', '640x480q90'])
+        self.assertEqual(sorted(r['port'] for r in recordings.values()), [0, 1, 2])
+        self.assertEqual(recordings['320x240q85']['consumers'], 2)
+        for profile, client in clients:
+            with client.get_frame(2) as frame:
+                self.assertEqual(jpeg_size(frame.data), profile.resolution, profile.name)
+        # the fourth and last splitter port
+        mgr.hold(camera.CameraProfile('custom', (100, 100), 70), 0.1)
+        with self.assertRaises(camera.CameraBusyError):
+            mgr.hold(camera.CameraProfile('more', (200, 100), 70), 0.1)
+        for profile, client in clients:
+            mgr.broadcaster(profile).unregister(client)
+            mgr.dec_consumers(profile)
+        time.sleep(0.3)
+        self.assertFalse(mgr.stats()['camera_open'])
+        self.assertTrue(cameras[0].closed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the gateway's upstream connections.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.server
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpg3gateway
+
+class SlowHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /slow answers after 0.5 s, /stream sends two lines 0.5 s apart. POST
+    /v1/motors/stop answers at once, other POSTs after 2 s.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/stream':
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(b'one\n')
+            self.wfile.flush()
+            time.sleep(0.5)
+            self.wfile.write(b'two\n')
+            return
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Length', 2)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_POST(self):
+        if self.path != '/v1/motors/stop':
+            time.sleep(2)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class QuietHTTPServer(http.server.ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # clients that timed out
+        pass
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = QuietHTTPServer(('localhost', 0), SlowHandler)
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        self.pool = gpg3gateway.ConnectionPool('localhost', self.httpd.server_address[1],
+                                               timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_timeout(self):
+        with self.assertRaises(gpg3gateway.UpstreamError):
+            self.pool.request('GET', '/slow')
+
+    def test_request_timeout(self):
+        response = self.pool.request('GET', '/slow', timeout=2)
+        self.assertEqual(response.data, b'ok')
+        # back to the pool's timeout on the reused connection
+        with self.assertRaises(gpg3gateway.UpstreamError):
+            self.pool.request('GET', '/slow')
+
+    def test_stream_outlives_timeout(self):
+        response = self.pool.request('GET', '/stream')
+        self.assertIsNone(response.data)
+        try:
+            self.assertEqual(response.read(), b'one\ntwo\n')
+        finally:
+            response.close()
+
+    def test_wait_timeout(self):
+        fleet = gpg3gateway.Fleet({}, wait_timeout=60)
+        try:
+            self.assertEqual(fleet.timeout({'wait': 'true'}), 60)
+            self.assertIsNone(fleet.timeout({'wait': 'false'}))
+            self.assertIsNone(fleet.timeout({}))
+        finally:
+            fleet.shutdown()
+
+class FanOutTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = QuietHTTPServer(('localhost', 0), SlowHandler)
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        robots = {name: ('localhost', self.httpd.server_address[1]) for name in ('a', 'b')}
+        self.fleet = gpg3gateway.Fleet(robots, workers=2)
+
+    def tearDown(self):
+        self.fleet.shutdown()
+
+    def fan_out_later(self, path, timeout=None):
+        thread = threading.Thread(target=self.fleet.fan_out,
+                                  args=(['a', 'b'], 'POST', path, b'', None, timeout))
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_stop_not_behind_busy_workers(self):
+        # drives waiting to finish and more slow requests than workers
+        self.fan_out_later('/v1/drive?wait=true', 60)
+        for i in range(2):
+            self.fan_out_later('/v1/eyes')
+        time.sleep(0.2)
+        start = time.monotonic()
+        results = self.fleet.fan_out(['a', 'b'], 'POST', '/v1/motors/stop', b'')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(results, {'a': {'status': 204}, 'b': {'status': 204}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the motion command executor, run against the simulated
+# GoPiGo3.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import motion
+import simulation
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met")
+        time.sleep(0.01)
+
+class MotionExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = simulation.SimulatedEasyGoPiGo3()
+        self.executor = motion.MotionExecutor(self.robot, poll_interval=0.01)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def encoders(self):
+        return (self.robot.get_motor_encoder(self.robot.MOTOR_LEFT),
+                self.robot.get_motor_encoder(self.robot.MOTOR_RIGHT))
+
+    def test_drive_reaches_target(self):
+        command = self.executor.drive(50, 1000)
+        self.assertTrue(command.wait(5))
+        self.assertEqual(command.state, motion.COMPLETED)
+        self.assertAlmostEqual(command.progress, 1.0, delta=0.02)
+        target = 50 / self.robot.WHEEL_CIRCUMFERENCE * 360
+        for encoder in self.encoders():
+            self.assertAlmostEqual(encoder, target, delta=self.executor.tolerance)
+
+    def test_turn_moves_wheels_apart(self):
+        command = self.executor.turn(90, 1000)
+        self.assertTrue(command.wait(5))
+        self.assertEqual(command.state, motion.COMPLETED)
+        self.assertGreater(command.left_travelled, 0)
+        self.assertLess(command.right_travelled, 0)
+        # clockwise, the heading is counterclockwise
+        self.assertAlmostEqual(self.robot.heading, -1.5708, delta=0.1)
+
+    def test_new_drive_preempts_running_one(self):
+        first = self.executor.drive(1000, 100)
+        wait_until(lambda: first.state == motion.RUNNING)
+        second = self.executor.drive(-20, 1000)
+        self.assertTrue(first.wait(1))
+        self.assertEqual(first.state, motion.PREEMPTED)
+        self.assertLess(first.progress, 1.0)
+        self.assertTrue(second.wait(5))
+        self.assertEqual(second.state, motion.COMPLETED)
+
+    def test_enqueued_commands_run_in_order(self):
+        commands = [self.executor.drive(30, 1000),
+                    self.executor.turn(45, 1000, enqueue=True),
+                    self.executor.drive(-30, 1000, enqueue=True)]
+        self.assertTrue(commands[-1].wait(5))
+        self.assertEqual([c.state for c in commands], [motion.COMPLETED] * 3)
+        for previous, command in zip(commands, commands[1:]):
+            self.assertLessEqual(previous.finished, command.started)
+
+    def test_stop_cancels_everything(self):
+        preempted = []
+        self.executor.add_preempt_listener(lambda: preempted.append(True))
+        running = self.executor.drive(1000, 100)
+        queued = self.executor.drive(1000, 100, enqueue=True)
+        wait_until(lambda: running.state == motion.RUNNING)
+        preempted.clear()
+        self.executor.run_exclusive(self.robot.stop)
+        self.assertTrue(preempted)
+        self.assertTrue(running.wait(1))
+        self.assertEqual((running.state, queued.state), (motion.PREEMPTED, motion.PREEMPTED))
+        encoders = self.encoders()
+        time.sleep(0.1)
+        self.assertEqual(self.encoders(), encoders)
+
+    def test_stall_fails_command(self):
+        self.executor.stall_timeout = 0.1
+        # motors that hardly move, whatever speed is set
+        self.robot.set_motor_limits = lambda port, power=0, dps=0: None
+        self.robot._motors[self.robot.MOTOR_LEFT].limit_dps = 0.001
+        self.robot._motors[self.robot.MOTOR_RIGHT].limit_dps = 0.001
+        command = self.executor.drive(100, 1000)
+        self.assertTrue(command.wait(5))
+        self.assertEqual((command.state, command.error), (motion.FAILED, "Motors stalled"))
+
+    def test_history_limited(self):
+        executor = motion.MotionExecutor(self.robot, poll_interval=0.01, history=2)
+        self.addCleanup(executor.shutdown)
+        commands = [executor.drive(1, 1000, enqueue=True) for i in range(3)]
+        self.assertIsNone(executor.get(commands[0].id))
+        self.assertIs(executor.get(commands[2].id), commands[2])
+
+if __name__ == "__main__":
+    unittest.main()
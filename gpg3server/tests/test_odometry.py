@@ -0,0 +1,151 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the odometry: integration of encoder samples, the trace ring and
+# the trajectory.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import odometry
+import telemetry
+
+class Geometry:
+    # 1 mm per encoder degree
+    WHEEL_CIRCUMFERENCE = 360
+    WHEEL_BASE_WIDTH = 100
+
+def random_walk(n, seed=1):
+    rng = random.Random(seed)
+    left, right = [0], [0]
+    for i in range(n - 1):
+        left.append(left[-1] + rng.randint(-5, 20))
+        right.append(right[-1] + rng.randint(-5, 20))
+    return left, right
+
+class IntegrateTest(unittest.TestCase):
+
+    @unittest.skipIf(odometry.numpy is None, "NumPy not installed")
+    def test_python_and_numpy_agree(self):
+        left, right = random_walk(500)
+        start = (10.0, -20.0, 0.5)
+        expected = odometry.integrate_python(left, right, 0.58, 117, *start)
+        result = odometry.integrate_numpy(left, right, 0.58, 117, *start)
+        for expected_values, values in zip(expected, result):
+            self.assertEqual(len(values), len(expected_values))
+            for a, b in zip(expected_values, values):
+                self.assertAlmostEqual(a, b, places=6)
+
+    def test_single_sample(self):
+        self.assertEqual(odometry.integrate_python([5], [7], 1, 100, 1.0, 2.0, 0.3),
+                         ([1.0], [2.0], [0.3]))
+
+class OdometryTest(unittest.TestCase):
+
+    def feed(self, odo, left, right, timestamps=None):
+        for i, (l, r) in enumerate(zip(left, right)):
+            t = i if timestamps is None else timestamps[i]
+            odo.on_sample('encoders', telemetry.Sample({'left': l, 'right': r}, t, t))
+
+    def test_straight_line(self):
+        odo = odometry.Odometry(Geometry)
+        self.feed(odo, range(0, 110, 10), range(0, 110, 10))
+        pose = odo.pose()
+        self.assertEqual((pose['x'], pose['y'], pose['heading']), (100, 0, 0))
+        self.assertEqual((pose['distance'], pose['samples']), (100, 11))
+        _, xs, ys, headings = odo.trajectory()
+        self.assertEqual([round(x) for x in xs], list(range(0, 110, 10)))
+        self.assertEqual([round(y) for y in ys], [0] * 11)
+
+    def test_turn_in_place(self):
+        odo = odometry.Odometry(Geometry)
+        # wheels 2 * 80 mm apart in total: 1.6 radians counterclockwise
+        self.feed(odo, range(0, -88, -8), range(0, 88, 8))
+        pose = odo.pose()
+        self.assertEqual((pose['x'], pose['y'], pose['distance']), (0, 0, 0))
+        self.assertAlmostEqual(pose['heading'], math.degrees(1.6), places=2)
+
+    def test_heading_unwrapped_in_trajectory(self):
+        odo = odometry.Odometry(Geometry)
+        # one and a half turns
+        steps = int(3 * math.pi * 50 / 10) + 1
+        self.feed(odo, [-10 * i for i in range(steps)], [10 * i for i in range(steps)])
+        _, _, _, headings = odo.trajectory()
+        self.assertGreater(headings[-1], 360)
+        self.assertLess(odo.pose()['heading'], 180)
+
+    def test_ring_smaller_than_trace(self):
+        left, right = random_walk(50)
+        full = odometry.Odometry(Geometry)
+        self.feed(full, left, right)
+        ring = odometry.Odometry(Geometry, history=8)
+        self.feed(ring, left, right)
+        self.assertEqual(ring.pose(), dict(full.pose(), samples=8))
+        # the start pose follows the first sample of the ring
+        expected = [values[-8:] for values in full.trajectory()]
+        for expected_values, values in zip(expected, ring.trajectory()):
+            self.assertEqual(len(values), 8)
+            for a, b in zip(expected_values, values):
+                self.assertAlmostEqual(float(a), float(b), places=6)
+
+    def test_trajectory_since_and_step(self):
+        odo = odometry.Odometry(Geometry)
+        self.feed(odo, range(0, 110, 10), range(0, 110, 10),
+                  [1000.0 + i for i in range(11)])
+        timestamps, xs, _, _ = odo.trajectory(since=1004.0, step=2)
+        self.assertEqual(list(timestamps), [1005.0, 1007.0, 1009.0])
+        self.assertEqual([round(x) for x in xs], [50, 70, 90])
+        self.assertEqual(len(odo.trajectory(since=1010.0)[0]), 0)
+
+    def test_trajectory_without_numpy(self):
+        odo = odometry.Odometry(Geometry, history=5)
+        left, right = random_walk(20)
+        self.feed(odo, left, right)
+        expected = odo.trajectory_json()
+        with mock.patch.object(odometry, 'numpy', None), \
+             mock.patch.object(odometry, 'integrate', odometry.integrate_python):
+            self.assertEqual(odo.trajectory_json(), expected)
+            binary = odo.trajectory_binary()
+        self.assertEqual(len(binary), 5 * odometry.RECORD.size)
+        self.assertEqual(binary, odo.trajectory_binary())
+
+    def test_out_of_order_sample_ignored(self):
+        odo = odometry.Odometry(Geometry)
+        self.feed(odo, [0, 10], [0, 10], [1.0, 2.0])
+        odo.on_sample('encoders', telemetry.Sample({'left': 500, 'right': 500}, 1.5, 1.5))
+        self.assertEqual(odo.pose()['x'], 10)
+
+    def test_reset(self):
+        odo = odometry.Odometry(Geometry)
+        self.feed(odo, [0, 10], [0, 10])
+        odo.reset(x=5, y=6, heading=90)
+        self.feed(odo, [10, 20], [10, 20], [2, 3])
+        pose = odo.pose()
+        self.assertEqual((pose['x'], pose['y'], pose['heading'], pose['samples']),
+                         (5, 16, 90, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the router and parameter validation.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing
+
+class RouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = routing.Router([
+            ('GET', '/v1/motors/commands/{command_id:int}', 'get_command'),
+            ('PUT', '/v1/servos/{port:SERVO1|SERVO2}/position', 'put_servo'),
+            ('GET', '/v1/telemetry/{name}', 'get_source'),
+            ('GET', '/v1/telemetry/stream', 'get_stream')
+            ])
+
+    def test_match(self):
+        self.assertEqual(self.router.match('GET', '/v1/motors/commands/12'),
+                         ('get_command', {'command_id': 12}))
+        self.assertEqual(self.router.match('PUT', '/v1/servos/SERVO2/position'),
+                         ('put_servo', {'port': 'SERVO2'}))
+        self.assertEqual(self.router.match('GET', '/v1/telemetry/battery'),
+                         ('get_source', {'name': 'battery'}))
+
+    def test_percent_encoded(self):
+        self.assertEqual(self.router.match('PUT', '/v1/servos/SERVO%31/position'),
+                         ('put_servo', {'port': 'SERVO1'}))
+        self.assertEqual(self.router.match('GET', '/v1/telemetry/bat%20tery'),
+                         ('get_source', {'name': 'bat tery'}))
+        with self.assertRaises(routing.RequestError) as cm:
+            self.router.match('GET', '/v1/telemetry/a%2Fb')
+        self.assertEqual(cm.exception.status, 404)
+
+    def test_errors(self):
+        for method, path, status in (('GET', '/v1/motors/commands/x', 404),
+                                     ('GET', '/v1/servos/SERVO3/position', 404),
+                                     ('GET', '/v1/servos/SERVO1/position', 405)):
+            with self.assertRaises(routing.RequestError) as cm:
+                self.router.match(method, path)
+            self.assertEqual(cm.exception.status, status, path)
+        self.assertEqual(cm.exception.headers, {'Allow': 'PUT'})
+
+class ValidateTest(unittest.TestCase):
+
+    SCHEMA = {
+        'speed': routing.Int(0, 100),
+        'x': routing.Float(optional=True, default=0.0),
+        'mode': routing.Enum('a', 'b', optional=True, default='a'),
+        'wait': routing.Flag()
+        }
+
+    def test_valid(self):
+        self.assertEqual(routing.validate(self.SCHEMA, {'speed': '50', 'x': 1.5, 'wait': 'True'}),
+                         {'speed': 50, 'x': 1.5, 'mode': 'a', 'wait': True})
+
+    def test_invalid(self):
+        for data in ([], {}, {'speed': 101}, {'speed': None}, {'speed': [1]},
+                     {'speed': 1, 'x': 'y'}, {'speed': 1, 'mode': 'c'}):
+            with self.assertRaises(routing.RequestError, msg=data):
+                routing.validate(self.SCHEMA, data)
+
+    def test_non_finite_numbers(self):
+        # the json module parses these
+        for text in ('Infinity', '-Infinity', 'NaN'):
+            value = json.loads(text)
+            with self.assertRaises(routing.RequestError, msg=text):
+                routing.validate(self.SCHEMA, {'speed': value})
+            with self.assertRaises(routing.RequestError, msg=text):
+                routing.validate(self.SCHEMA, {'speed': 1, 'x': value})
+
+    def test_query_flag(self):
+        query = routing.parse_query('wait=1&queue=yes&a=TRUE')
+        self.assertTrue(routing.query_flag(query, 'wait'))
+        self.assertTrue(routing.query_flag(query, 'a'))
+        self.assertFalse(routing.query_flag(query, 'queue'))
+        self.assertFalse(routing.query_flag(query, 'missing'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,254 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of hardware scheduling and admission control.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler
+import telemetry
+
+class Recorder:
+    """
+    Stands in for the EasyGoPiGo3 object, records the order of calls.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def read_encoders(self, tag):
+        self.calls.append(tag)
+
+    def set_motor_dps(self, tag):
+        self.calls.append(tag)
+
+    def stop(self, tag):
+        self.calls.append(tag)
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met")
+        time.sleep(0.005)
+
+class HardwareGateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = scheduler.HardwareGate([0, 0, 0, 1])
+        self.recorder = Recorder()
+        self.hardware = scheduler.ScheduledHardware(self.recorder, self.gate)
+
+    def hold(self):
+        """
+        Take the gate on another thread, return function releasing it.
+        """
+        taken = threading.Event()
+        done = threading.Event()
+        def run():
+            self.gate.acquire(scheduler.TELEMETRY)
+            taken.set()
+            done.wait()
+            self.gate.release()
+        thread = threading.Thread(target=run)
+        thread.start()
+        taken.wait()
+        def release():
+            done.set()
+            thread.join()
+        return release
+
+    def waiting(self, cls):
+        return self.gate.queues[cls].waiting
+
+    def call(self, method, tag, cls=None, reject=True):
+        def run():
+            if cls is None:
+                getattr(self.hardware, method)(tag)
+            else:
+                with scheduler.request_class(cls, reject):
+                    getattr(self.hardware, method)(tag)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_priority_order(self):
+        release = self.hold()
+        threads = [self.call('read_encoders', 'read')]
+        wait_until(lambda: self.waiting(scheduler.TELEMETRY) == 1)
+        threads.append(self.call('set_motor_dps', 'motion'))
+        wait_until(lambda: self.waiting(scheduler.MOTION) == 1)
+        threads.append(self.call('stop', 'stop'))
+        wait_until(lambda: self.waiting(scheduler.STOP) == 1)
+        release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.recorder.calls, ['stop', 'motion', 'read'])
+
+    def test_request_rejected(self):
+        release = self.hold()
+        threads = [self.call('read_encoders', 'first', scheduler.TELEMETRY)]
+        wait_until(lambda: self.waiting(scheduler.TELEMETRY) == 1)
+        with scheduler.request_class(scheduler.TELEMETRY):
+            with self.assertRaises(scheduler.QueueFull):
+                self.hardware.read_encoders('second')
+        self.assertEqual(self.gate.queues[scheduler.TELEMETRY].rejected, 1)
+        release()
+        threads[0].join()
+        self.assertEqual(self.recorder.calls, ['first'])
+
+    def test_motion_context(self):
+        # reads of the motion and behaviour threads wait in the motion
+        # class, ahead of telemetry requests, and are not rejected
+        release = self.hold()
+        threads = [self.call('read_encoders', 'read', scheduler.TELEMETRY)]
+        wait_until(lambda: self.waiting(scheduler.TELEMETRY) == 1)
+        threads.append(self.call('read_encoders', 'motion', scheduler.MOTION, reject=False))
+        wait_until(lambda: self.waiting(scheduler.MOTION) == 1)
+        release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.recorder.calls, ['motion', 'read'])
+
+    def test_reentrant(self):
+        self.gate.acquire(scheduler.MOTION)
+        self.hardware.stop('nested')
+        self.gate.release()
+        self.assertEqual(self.recorder.calls, ['nested'])
+        self.assertIsNone(self.gate._owner)
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = scheduler.WorkerPool(1, [0, 0, 0, 2], scheduler.CLASSES, 'test')
+        self.addCleanup(self.pool.shutdown)
+
+    def block(self):
+        """
+        Occupy the worker, return function freeing it.
+        """
+        started = threading.Event()
+        done = threading.Event()
+        def run():
+            started.set()
+            done.wait()
+        future = self.pool.submit(scheduler.TELEMETRY, run)
+        started.wait()
+        def free():
+            done.set()
+            future.result()
+        return free
+
+    def test_priority_order(self):
+        free = self.block()
+        order = []
+        futures = [self.pool.submit(cls, order.append, name) for cls, name in (
+            (scheduler.TELEMETRY, 'read'), (scheduler.MOTION, 'motion'),
+            (scheduler.STOP, 'stop'))]
+        free()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ['stop', 'motion', 'read'])
+
+    def test_queue_limit(self):
+        free = self.block()
+        futures = [self.pool.submit(scheduler.TELEMETRY, time.sleep, 0) for i in range(2)]
+        with self.assertRaises(scheduler.QueueFull):
+            self.pool.submit(scheduler.TELEMETRY, time.sleep, 0)
+        # stop has no limit
+        futures.append(self.pool.submit(scheduler.STOP, time.sleep, 0))
+        self.assertEqual(self.pool.queues[scheduler.TELEMETRY].rejected, 1)
+        free()
+        for future in futures:
+            future.result(5)
+
+    def test_exception(self):
+        future = self.pool.submit(scheduler.MOTION, int, 'x')
+        with self.assertRaises(ValueError):
+            future.result(5)
+
+class WaitingThreadsTest(unittest.TestCase):
+
+    def test_limit(self):
+        waiting = scheduler.WaitingThreads(2)
+        done = threading.Event()
+        futures = [waiting.submit(done.wait) for i in range(2)]
+        with self.assertRaises(scheduler.QueueFull):
+            waiting.submit(done.wait)
+        self.assertEqual(waiting.to_dict()['rejected'], 1)
+        done.set()
+        for future in futures:
+            self.assertTrue(future.result(5))
+        wait_until(lambda: waiting.running == 0)
+        waiting.submit(int, '3').result(5)
+        self.assertEqual(waiting.peak, 2)
+
+    def test_exception(self):
+        future = scheduler.WaitingThreads(0).submit(int, 'x')
+        with self.assertRaises(ValueError):
+            future.result(5)
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_and_refill(self):
+        limiter = scheduler.RateLimiter({scheduler.TELEMETRY: (10, 3)})
+        for i in range(3):
+            self.assertEqual(limiter.check('a', scheduler.TELEMETRY), 0)
+        delay = limiter.check('a', scheduler.TELEMETRY)
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, 0.1)
+        # per client and class
+        self.assertEqual(limiter.check('b', scheduler.TELEMETRY), 0)
+        self.assertEqual(limiter.check('a', scheduler.STOP), 0)
+        time.sleep(delay + 0.01)
+        self.assertEqual(limiter.check('a', scheduler.TELEMETRY), 0)
+        self.assertEqual(limiter.limited[scheduler.TELEMETRY], 1)
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_gate_admit(self):
+        gate = scheduler.HardwareGate([0, 1, 0, 0])
+        gate.admit(scheduler.MOTION)
+        gate.queues[scheduler.MOTION].waiting = 1
+        with self.assertRaises(scheduler.QueueFull):
+            gate.admit(scheduler.MOTION)
+        self.assertEqual(gate.queues[scheduler.MOTION].rejected, 1)
+        # no limit
+        gate.queues[scheduler.STOP].waiting = 100
+        gate.admit(scheduler.STOP)
+
+    def test_rejected_read_not_an_error(self):
+        def read():
+            raise scheduler.QueueFull('hardware access (telemetry)')
+        sampler = telemetry.TelemetrySampler()
+        sampler.add_source('battery', read)
+        with self.assertRaises(scheduler.QueueFull):
+            sampler.get('battery', 0)
+        self.assertEqual(sampler._sources['battery'].errors, 0)
+        self.assertEqual(sampler._sources['battery'].reads, 0)
+
+if __name__ == "__main__":
+    unittest.main()
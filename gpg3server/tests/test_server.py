@@ -0,0 +1,341 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Behaviour tests of the REST API against the server with simulated
+# hardware (--hardware simulated), started once per test class.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+import unittest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Starts gpg3server.py with simulated hardware and server_args for the
+    tests of the class.
+    """
+
+    server_args = []
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.process = subprocess.Popen([sys.executable, 'gpg3server.py',
+            '--port', str(cls.port),
+            '--hardware', 'simulated',
+            '--camera', 'synthetic',
+            '--no-access-log'] + cls.server_args,
+            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                cls.request('GET', '/ping')
+                return
+            except OSError:
+                if time.monotonic() > deadline or cls.process.poll() is not None:
+                    cls.tearDownClass()
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.terminate()
+        cls.process.wait()
+
+    @classmethod
+    def request(cls, method, path, body=None, raw=None, headers={}, conn=None):
+        """
+        Send request, return (status, headers, JSON body or None). raw is
+        sent as body instead of body encoded as JSON.
+        """
+        close = conn is None
+        if conn is None:
+            conn = http.client.HTTPConnection('localhost', cls.port, timeout=10)
+        if raw is None and body is not None:
+            raw = json.dumps(body).encode()
+        try:
+            conn.request(method, path, raw, headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            if close:
+                conn.close()
+        if response.getheader('Content-Type', '').startswith('application/json'):
+            data = json.loads(data.decode())
+        return response.status, response, data
+
+class RoutingTest(ServerTestCase):
+
+    def test_unknown_path(self):
+        status, _, _ = self.request('GET', '/v1/nope')
+        self.assertEqual(status, 404)
+
+    def test_method_not_allowed(self):
+        status, response, _ = self.request('DELETE', '/v1/motors/stop')
+        self.assertIn(status, (405, 501))
+        status, response, _ = self.request('GET', '/v1/motors/stop')
+        self.assertEqual(status, 405)
+        self.assertEqual(response.getheader('Allow'), 'POST')
+
+    def test_invalid_body(self):
+        for raw in (b'not json', b'[1]', b'{"red": "x", "green": 0, "blue": 0}',
+                    b'{"red": 256, "green": 0, "blue": 0}', b'{"green": 0, "blue": 0}'):
+            status, _, _ = self.request('PUT', '/v1/eyes', raw=raw,
+                headers={'Content-Type': 'application/json'})
+            self.assertEqual(status, 400, raw)
+
+    def test_percent_encoded_path(self):
+        status, _, _ = self.request('PUT', '/v1/eyes/%6Ceft',
+                                    {'red': 1, 'green': 2, 'blue': 3})
+        self.assertEqual(status, 204)
+
+    def test_invalid_query(self):
+        status, _, _ = self.request('GET', '/v1/sensors/I2C/distance/distance?max_age=x')
+        self.assertEqual(status, 400)
+
+    def test_snapshot_not_modified(self):
+        origin = {'Origin': 'http://localhost:8601'}
+        status = 200
+        # the latest frame is sent right away, unless the next one arrived
+        # in between
+        for i in range(5):
+            _, response, _ = self.request('GET', '/v1/camera/snapshot', headers=origin)
+            status, response, _ = self.request('GET', '/v1/camera/snapshot',
+                headers=dict(origin, **{'If-None-Match': response.getheader('ETag')}))
+            if status == 304:
+                break
+        self.assertEqual(status, 304)
+        self.assertEqual(response.getheader('Access-Control-Allow-Origin'), origin['Origin'])
+
+    def test_persistent_connection(self):
+        conn = http.client.HTTPConnection('localhost', self.port, timeout=10)
+        for i in range(3):
+            status, _, data = self.request('GET', '/v1/sensors/I2C/distance/distance',
+                                           conn=conn)
+            self.assertEqual(status, 200)
+            self.assertIn('distance', data)
+        conn.close()
+
+class ConnectionTest(ServerTestCase):
+    """
+    Connections of the threading server, whose requests are handled by a
+    pool of --workers threads.
+    """
+
+    server_args = ['--workers', '2', '--max-connections', '200', '--keep-alive-timeout', '2']
+
+    def connect(self):
+        sock = socket.create_connection(('localhost', self.port), timeout=10)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_stop_not_starved_by_idle_connections(self):
+        for i in range(50):
+            self.connect().sendall(b'GET /ping HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        for i in range(50):
+            self.connect().sendall(b'GET /v1/motors/status HTTP/1.1\r\nHo')
+        for i in range(8):
+            self.connect().sendall(b'GET /v1/telemetry/stream HTTP/1.1\r\n\r\n')
+        start = time.monotonic()
+        status, _, _ = self.request('POST', '/v1/motors/stop')
+        self.assertEqual(status, 204)
+        self.assertLess(time.monotonic() - start, 1)
+        status, _, data = self.request('GET', '/v1/stats')
+        self.assertEqual(data['scheduler']['connections']['streams'], 8)
+
+    def test_stop_not_starved_by_waiting_requests(self):
+        # as many sweeps waiting to finish as there are workers
+        body = b'{"positions": [0, 180], "dwell": 8000}'
+        for port in ('SERVO1', 'SERVO2'):
+            self.connect().sendall(b'POST /v1/servos/%s/sweep?wait=true HTTP/1.1\r\n'
+                                   b'Content-Length: %d\r\n\r\n%s' % (port.encode(), len(body), body))
+        time.sleep(0.2)
+        start = time.monotonic()
+        status, _, _ = self.request('POST', '/v1/motors/stop')
+        self.assertEqual(status, 204)
+        self.assertLess(time.monotonic() - start, 1)
+        status, _, data = self.request('GET', '/v1/stats')
+        self.assertEqual(data['scheduler']['waiting']['running'], 2)
+
+    def test_request_sent_in_parts(self):
+        sock = self.connect()
+        for part in (b'PUT /v1/eyes HTTP/1.1\r\n', b'Content-Length: 33\r\n\r\n',
+                     b'{"red": 1, "green": 2, ', b'"blue": 3}'):
+            sock.sendall(part)
+            time.sleep(0.05)
+        self.assertTrue(sock.recv(65536).startswith(b'HTTP/1.1 204 '))
+
+    def test_pipelined_requests(self):
+        sock = self.connect()
+        sock.sendall(b'GET /ping HTTP/1.1\r\n\r\n' * 3)
+        responses = b''
+        while responses.count(b'HTTP/1.1 200 ') < 3:
+            data = sock.recv(65536)
+            self.assertTrue(data)
+            responses += data
+
+    def test_idle_connection_closed(self):
+        sock = self.connect()
+        sock.sendall(b'GET /v1/motors/status HTTP/1.1\r\nHo')
+        start = time.monotonic()
+        self.assertEqual(sock.recv(65536), b'')
+        self.assertLess(time.monotonic() - start, 5)
+
+class ThreadingServerTest(ServerTestCase):
+    """
+    Requests read by the request handler itself, a thread per connection.
+    """
+
+    server_args = ['--workers', '0']
+
+    def test_invalid_content_length(self):
+        for path in ('/v1/odometry/reset', '/v1/behaviours/drive_until/start'):
+            status, _, _ = self.request('POST', path, headers={'Content-Length': 'x'})
+            self.assertEqual(status, 400, path)
+
+class WebSocketTest(ServerTestCase):
+
+    def test_stream_command_rejected(self):
+        sock = socket.create_connection(('localhost', self.port), timeout=10)
+        self.addCleanup(sock.close)
+        key = base64.b64encode(os.urandom(16))
+        sock.sendall(b'GET /v1/ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Version: 13\r\n'
+                     b'Sec-WebSocket-Key: ' + key + b'\r\n\r\n')
+        rfile = sock.makefile('rb')
+        self.assertIn(b' 101 ', rfile.readline())
+        while rfile.readline() != b'\r\n':
+            pass
+        for path in ('/v1/telemetry/stream', '/camera.mjpg', '/v1/ws'):
+            payload = json.dumps({'id': path, 'method': 'GET', 'path': path}).encode()
+            # masked with a zero key
+            sock.sendall(struct.pack('!BB', 0x81, 0x80 | len(payload)) + bytes(4) + payload)
+            opcode, length = rfile.read(2)
+            reply = json.loads(rfile.read(length & 0x7F).decode())
+            self.assertEqual((reply['id'], reply['status']), (path, 400))
+
+class BehaviourTest(ServerTestCase):
+
+    def test_stop(self):
+        status, _, data = self.request('POST', '/v1/behaviours/drive_until/start',
+                                       {'speed': 10, 'distance': 0})
+        self.assertEqual((status, data['state']), (202, 'running'))
+        status, _, _ = self.request('POST', '/v1/behaviours/stop')
+        self.assertEqual(status, 204)
+        status, _, data = self.request('GET', '/v1/behaviours/current')
+        self.assertEqual(data['state'], 'stopped')
+        self.assertGreater(data['timing']['ticks'], 0)
+        status, _, data = self.request('GET', '/v1/motors/status')
+        self.assertEqual((data['left']['dps'], data['right']['dps']), (0, 0))
+
+class TelemetryStreamTest(ServerTestCase):
+
+    def read_event(self, rfile):
+        """
+        Return data of the next event of the stream, skipping keep-alives.
+        """
+        data = None
+        while True:
+            line = rfile.readline()
+            self.assertTrue(line, "stream closed")
+            if line.startswith(b'data: '):
+                data = json.loads(line[6:].decode())
+            elif line == b'\n' and data is not None:
+                return data
+
+    def test_first_events(self):
+        sock = socket.create_connection(('localhost', self.port), timeout=10)
+        self.addCleanup(sock.close)
+        sock.sendall(b'GET /v1/telemetry/stream?fields=encoders,distance HTTP/1.1\r\n\r\n')
+        rfile = sock.makefile('rb')
+        self.assertIn(b' 200 ', rfile.readline())
+        headers = []
+        while True:
+            line = rfile.readline()
+            if line == b'\r\n':
+                break
+            headers.append(line.lower())
+        self.assertIn(b'content-type: text/event-stream; charset=utf-8\r\n', headers)
+        # all fields first, then what changed
+        self.assertEqual(set(self.read_event(rfile)), {'encoders', 'distance'})
+        status, _, _ = self.request('POST', '/v1/motors/drive',
+                                    {'direction': 'forward', 'speed': 50, 'distance': 100})
+        self.assertEqual(status, 202)
+        self.assertIn('encoders', self.read_event(rfile))
+        self.request('POST', '/v1/motors/stop')
+
+class StatsTest(ServerTestCase):
+
+    def test_device_calls_timed(self):
+        status, _, _ = self.request('GET', '/v1/sensors/I2C/distance/distance?max_age=0')
+        self.assertEqual(status, 200)
+        status, _, _ = self.request('PUT', '/v1/servos/SERVO1/position', {'position': 90})
+        self.assertEqual(status, 204)
+        status, _, data = self.request('GET', '/v1/stats')
+        self.assertEqual(status, 200)
+        calls = data['hardware_calls']
+        self.assertGreater(calls['distance_sensor.read_mm']['count'], 0)
+        self.assertGreater(calls['servo.rotate_servo']['count'], 0)
+
+class BatchTest(ServerTestCase):
+
+    def batch(self, operations):
+        return self.request('POST', '/v1/batch', {'operations': operations})
+
+    def test_runs_operations(self):
+        status, _, data = self.batch([
+            {'method': 'PUT', 'path': '/v1/eyes/left', 'body': {'red': 1, 'green': 2, 'blue': 3}},
+            {'method': 'PUT', 'path': '/v1/eyes/right', 'body': {'red': 1, 'green': 2, 'blue': 3}},
+            {'method': 'POST', 'path': '/v1/motors/stop'}])
+        self.assertEqual(status, 200)
+        self.assertEqual([r['status'] for r in data['results']], [204, 204, 204])
+        # same color, one merged write
+        self.assertEqual(data['led_writes'], 1)
+
+    def test_invalid_operations(self):
+        for operations in ([], 'x', [1], [{'method': 'PUT', 'path': ['a']}],
+                           [{'method': ['PUT'], 'path': '/v1/eyes'}],
+                           [{'method': 'GET', 'path': '/v1/eyes'}],
+                           [{'method': 'PUT', 'path': '/v1/eyes', 'body': {'red': 1}}]):
+            status, _, data = self.batch(operations)
+            self.assertEqual(status, 400, operations)
+
+    def test_invalid_operation_named(self):
+        status, _, data = self.request('POST', '/v1/batch', {'operations': [
+            {'method': 'POST', 'path': '/v1/motors/stop'},
+            {'method': 'PUT', 'path': {'a': 1}}]})
+        self.assertEqual(status, 400)
+        self.assertIn(b'Operation 1: method and path not strings', data)
+
+if __name__ == "__main__":
+    unittest.main()
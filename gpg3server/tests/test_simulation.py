@@ -0,0 +1,138 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of the simulated GoPiGo3: motor and encoder model, servos and
+# distance sensor, run on a manual clock.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulation
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class SimulationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.robot = simulation.SimulatedEasyGoPiGo3(room=(2000, 1000), clock=self.clock)
+        self.both = self.robot.MOTOR_LEFT + self.robot.MOTOR_RIGHT
+
+    def encoders(self):
+        return (self.robot.get_motor_encoder(self.robot.MOTOR_LEFT),
+                self.robot.get_motor_encoder(self.robot.MOTOR_RIGHT))
+
+class MotorTest(SimulationTestCase):
+
+    def test_dps_mode(self):
+        self.robot.set_motor_dps(self.robot.MOTOR_LEFT, 100)
+        self.robot.set_motor_dps(self.robot.MOTOR_RIGHT, -50)
+        self.clock.now = 2
+        self.assertEqual(self.encoders(), (200, -100))
+        self.assertEqual(self.robot.get_motor_status(self.robot.MOTOR_LEFT)[3], 100)
+        self.robot.stop()
+        self.clock.now = 3
+        self.assertEqual(self.encoders(), (200, -100))
+
+    def test_position_mode_at_speed_limit(self):
+        self.robot.set_motor_limits(self.both, dps=100)
+        self.robot.set_motor_position(self.both, 150)
+        self.clock.now = 1
+        self.assertEqual(self.encoders(), (100, 100))
+        self.assertEqual(self.robot.get_motor_status(self.robot.MOTOR_LEFT)[3], 100)
+        self.clock.now = 5
+        # stops at the target
+        self.assertEqual(self.encoders(), (150, 150))
+        self.assertEqual(self.robot.get_motor_status(self.robot.MOTOR_LEFT)[3], 0)
+        self.assertTrue(self.robot.target_reached(150, 150))
+
+    def test_offset_encoder(self):
+        self.robot.set_motor_dps(self.both, 100)
+        self.clock.now = 1
+        self.robot.offset_motor_encoder(self.robot.MOTOR_LEFT, 100)
+        self.assertEqual(self.encoders(), (0, 100))
+
+    def test_drive_and_turn_pose(self):
+        self.robot.set_speed(500)
+        self.robot.drive_cm(10, blocking=False)
+        self.clock.now = 10
+        # the pose is updated by GoPiGo3 calls
+        self.encoders()
+        self.assertAlmostEqual(self.robot.x, 100, delta=0.5)
+        self.assertAlmostEqual(self.robot.y, 0)
+        self.robot.turn_degrees(-90)
+        self.clock.now = 20
+        self.encoders()
+        # counterclockwise
+        self.assertAlmostEqual(math.degrees(self.robot.heading), 90, delta=0.5)
+        self.assertAlmostEqual(self.robot.x, 100, delta=0.5)
+
+    def test_bus_transactions_counted(self):
+        self.encoders()
+        self.robot.init_distance_sensor().read_mm()
+        self.assertEqual((self.robot.spi_transactions, self.robot.i2c_transactions), (2, 1))
+
+class ServoTest(SimulationTestCase):
+
+    def test_position(self):
+        servo = self.robot.init_servo('SERVO2')
+        self.assertIs(self.robot.servos['SERVO2'], servo)
+        self.assertIsNone(servo.position)
+        servo.rotate_servo(30)
+        self.assertEqual(servo.position, 30)
+        servo.reset_servo()
+        self.assertEqual(servo.position, 90)
+
+class DistanceSensorTest(SimulationTestCase):
+
+    def test_distance_to_walls(self):
+        # at the centre of the 2000 x 1000 mm room, heading towards +x
+        self.assertEqual(self.robot.init_distance_sensor().read_mm(), 1000)
+        # turned clockwise to the right side wall
+        self.robot.sensor_angle = 90
+        self.assertEqual(self.robot.init_distance_sensor().read_mm(), 500)
+
+    def test_distance_while_driving(self):
+        sensor = self.robot.init_distance_sensor()
+        mm_per_second = 100 * self.robot.WHEEL_CIRCUMFERENCE / 360
+        self.robot.set_motor_dps(self.both, 100)
+        self.clock.now = 2
+        self.assertEqual(sensor.read_mm(), int(1000 - 2 * mm_per_second))
+        # driven into the wall
+        self.clock.now = 100
+        self.assertEqual(sensor.read_mm(), 0)
+
+    def test_out_of_range(self):
+        robot = simulation.SimulatedEasyGoPiGo3(room=(10000, 10000), clock=self.clock)
+        self.assertEqual(robot.init_distance_sensor().read_mm(),
+                         simulation.SimulatedDistanceSensor.MAX_RANGE)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of telemetry subscriptions: deadbands, rate limit and coalescing
+# of changes.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telemetry
+
+class SubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.values = {'distance': 100, 'state': 'idle', 'battery': 9.4}
+        self.sampler = telemetry.TelemetrySampler()
+        self.sampler.add_source('distance', lambda: self.values['distance'], deadband=10)
+        self.sampler.add_source('state', lambda: self.values['state'])
+        self.sampler.add_source('battery', lambda: self.values['battery'], deadband=0.05)
+
+    def subscribe(self, fields=('distance', 'state'), rate=0):
+        subscription = self.sampler.subscribe(fields, rate)
+        self.addCleanup(subscription.close)
+        self.assertEqual(subscription.snapshot(), {name: self.values[name] for name in fields})
+        return subscription
+
+    def sample(self, name, value):
+        self.values[name] = value
+        self.sampler.get(name, 0)
+
+    def test_deadband(self):
+        subscription = self.subscribe()
+        self.sample('distance', 105)
+        self.assertIsNone(subscription.poll())
+        self.assertEqual(subscription.suppressed, 1)
+        # relative to the value reported, not the last sample
+        self.sample('distance', 110)
+        self.assertEqual(subscription.poll(), {'distance': 110})
+        self.sample('distance', 101)
+        self.assertEqual(subscription.poll(), None)
+        self.sample('distance', 100)
+        self.assertEqual(subscription.poll(), {'distance': 100})
+
+    def test_change_back_within_deadband_cancelled(self):
+        subscription = self.subscribe()
+        self.sample('distance', 130)
+        self.sample('distance', 95)
+        self.assertIsNone(subscription.poll())
+
+    def test_non_numeric_values(self):
+        subscription = self.subscribe()
+        self.sample('state', 'idle')
+        self.assertIsNone(subscription.poll())
+        self.sample('state', 'driving')
+        self.assertEqual(subscription.poll(), {'state': 'driving'})
+
+    def test_changes_coalesced(self):
+        subscription = self.subscribe()
+        for distance in (120, 140, 160):
+            self.sample('distance', distance)
+        self.sample('state', 'driving')
+        self.assertEqual(subscription.poll(), {'distance': 160, 'state': 'driving'})
+        self.assertEqual(subscription.updates, 1)
+        self.assertIsNone(subscription.poll())
+
+    def test_other_fields_ignored(self):
+        subscription = self.subscribe()
+        self.sample('battery', 8.0)
+        self.assertIsNone(subscription.poll())
+
+    def test_rate_limit(self):
+        subscription = self.subscribe(rate=10)
+        self.assertGreater(subscription.update_delay(), 0.05)
+        self.assertLessEqual(subscription.update_delay(), 0.1)
+        self.sample('distance', 200)
+        start = time.monotonic()
+        self.assertEqual(subscription.get_update(1), {'distance': 200})
+        self.assertGreater(time.monotonic() - start, 0.05)
+        self.assertEqual(self.subscribe(rate=0).update_delay(), 0)
+
+    def test_get_update_waits_for_change(self):
+        subscription = self.subscribe()
+        self.assertIsNone(subscription.get_update(0.05))
+        changes = []
+        subscription.on_change = lambda: changes.append(True)
+        self.sample('distance', 200)
+        self.assertEqual(changes, [True])
+        self.assertEqual(subscription.get_update(1), {'distance': 200})
+
+    def test_closed_subscription_not_offered(self):
+        subscription = self.sampler.subscribe(['distance'])
+        subscription.snapshot()
+        subscription.close()
+        self.sample('distance', 500)
+        self.assertIsNone(subscription.poll())
+
+    def test_unknown_field(self):
+        with self.assertRaises(KeyError):
+            self.sampler.subscribe(['nope'])
+
+class SSEEventTest(unittest.TestCase):
+
+    def test_event(self):
+        self.assertEqual(telemetry.sse_event({'distance': 5}),
+                         b'event: telemetry\ndata: {"distance":5}\n\n')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# Tests of WebSocket framing and message handling, run without hardware.
+#
+# Usage: python3 -m pytest tests (or python3 -m unittest discover tests)
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telemetry
+import websocket
+
+def client_frame(opcode, payload, mask=b'\x01\x02\x03\x04'):
+    header = struct.pack('!BB', 0x80 | opcode, 0x80 | len(payload))
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+def server_message(frame):
+    opcode = frame[0] & 0x0F
+    length, pos = frame[1], 2
+    if length == 126:
+        length, pos = struct.unpack_from('!H', frame, 2)[0], 4
+    return opcode, frame[pos:pos + length]
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.sent_changed = threading.Condition()
+        self.executed = []
+        self.release = threading.Event()
+        self.reads = 0
+        self.sampler = telemetry.TelemetrySampler()
+        self.sampler.add_source('battery', self.read_battery)
+        self.session = websocket.Session(self.send, self.execute, self.sampler)
+
+    def tearDown(self):
+        self.release.set()
+        self.session.close()
+
+    def read_battery(self):
+        self.reads += 1
+        return 9.4
+
+    def send(self, data):
+        with self.sent_changed:
+            self.sent.append(data)
+            self.sent_changed.notify_all()
+
+    def execute(self, method, path, body, n):
+        self.executed.append((method, path))
+        if 'wait' in path:
+            self.release.wait(5)
+        return 204, 'No Content', None
+
+    def message(self, data):
+        self.session.on_message(websocket.OP_TEXT, json.dumps(data).encode())
+
+    def replies(self, count, timeout=2):
+        """
+        Wait for count JSON messages, return them.
+        """
+        deadline = time.monotonic() + timeout
+        with self.sent_changed:
+            while len(self.sent) < count:
+                remaining = deadline - time.monotonic()
+                self.assertGreater(remaining, 0, "no reply")
+                self.sent_changed.wait(remaining)
+            return [json.loads(server_message(f)[1].decode()) for f in self.sent[:count]]
+
+    def test_frame_parser_reassembles_fragments(self):
+        parser = websocket.FrameParser()
+        data = client_frame(websocket.OP_TEXT & 0x7F, b'hel')
+        # clear FIN of the first fragment
+        data = bytes([data[0] & 0x7F]) + data[1:]
+        data += client_frame(websocket.OP_CONTINUATION, b'lo')
+        self.assertEqual(parser.feed(data[:5]), [])
+        self.assertEqual(parser.feed(data[5:]), [(websocket.OP_TEXT, b'hello')])
+
+    def test_unmasked_frame_is_protocol_error(self):
+        with self.assertRaises(websocket.ProtocolError):
+            websocket.FrameParser().feed(websocket.encode_frame(websocket.OP_TEXT, b'x'))
+
+    def test_command_reply(self):
+        self.message({'id': 3, 'method': 'put', 'path': '/v1/eyes', 'body': {'red': 1}})
+        self.assertEqual(self.replies(1), [{'id': 3, 'status': 204}])
+        self.assertEqual(self.executed, [('PUT', '/v1/eyes')])
+
+    def test_waiting_command_does_not_block_stop(self):
+        for flag in ('true', '1', 'True'):
+            self.message({'id': flag, 'method': 'POST',
+                          'path': '/v1/motors/drive?wait=' + flag, 'body': {}})
+        self.message({'id': 'stop', 'method': 'POST', 'path': '/v1/motors/stop'})
+        self.assertEqual(self.replies(1), [{'id': 'stop', 'status': 204}])
+
+    def test_waiting_commands_limited(self):
+        for i in range(websocket.MAX_WAITING_COMMANDS + 1):
+            self.message({'id': i, 'method': 'POST', 'path': '/v1/motors/drive?wait=true'})
+        reply = self.replies(1)[0]
+        self.assertEqual((reply['id'], reply['status']), (websocket.MAX_WAITING_COMMANDS, 503))
+
+    def test_invalid_messages(self):
+        self.session.on_message(websocket.OP_TEXT, b'not json')
+        self.message([1, 2])
+        self.message({'type': 'subscribe', 'rate': 5, 'fields': [['battery']]})
+        self.message({'type': 'subscribe', 'rate': 5, 'fields': [{'a': 1}]})
+        self.message({'type': 'subscribe', 'rate': 5, 'fields': ['nope']})
+        self.message({'type': 'subscribe', 'rate': 500})
+        replies = self.replies(6)
+        self.assertTrue(all(r['type'] == 'error' for r in replies), replies)
+
+    def test_telemetry_push_uses_cache(self):
+        self.sampler.get('battery')
+        self.message({'type': 'subscribe', 'rate': 50, 'fields': ['battery']})
+        replies = self.replies(5)
+        self.assertEqual(replies[-1]['values'], {'battery': 9.4})
+        self.assertEqual(self.reads, 1)
+
+    def test_receive_ping_and_close(self):
+        self.assertTrue(self.session.receive(client_frame(websocket.OP_PING, b'hi')))
+        self.assertEqual(server_message(self.sent[-1]), (websocket.OP_PONG, b'hi'))
+        self.assertFalse(self.session.receive(client_frame(websocket.OP_CLOSE, b'')))
+
+if __name__ == "__main__":
+    unittest.main()
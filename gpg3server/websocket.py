@@ -0,0 +1,370 @@
+# https://github.com/markokimpel/gopigoscratchextension
+#
+# GoPiGo3 Server
+#
+# WebSocket (RFC 6455) channel for commands and telemetry.
+#
+# Copyright 2018 Marko Kimpel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Framing is kept free of I/O: FrameParser is fed the bytes received and
+# returns complete messages, encode_frame() returns the bytes to send. That
+# way the same code serves the threaded server (blocking socket) and the
+# asyncio server (stream reader/writer).
+#
+# Messages are JSON text messages. A command carries the method, path and
+# body of a REST request and an id that is repeated in the reply:
+#
+#     -> { "id": 7, "method": "PUT", "path": "/v1/eyes", "body": { "red": 255, ... } }
+#     <- { "id": 7, "status": 204 }
+#     <- { "id": 7, "status": 400, "error": "Parameter red not an int (x)" }
+#
+# Telemetry is pushed at the subscribed rate (0 unsubscribes):
+#
+#     -> { "type": "subscribe", "rate": 10, "fields": ["motors", "distance"] }
+#     <- { "type": "telemetry", "timestamp": 1543000000.1,
+#          "values": { "motors": { ... }, "distance": 523 } }
+
+import base64
+import hashlib
+import queue
+import struct
+import threading
+import time
+import urllib.parse
+
+import jsoncodec
+import routing
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# largest message accepted from a client
+MAX_MESSAGE_SIZE = 65536
+
+# highest telemetry rate a client can subscribe to
+MAX_TELEMETRY_RATE = 50
+
+# commands with ?wait=true running at once per session, more are answered
+# with 503
+MAX_WAITING_COMMANDS = 8
+
+class ProtocolError(Exception):
+    pass
+
+def accept_key(key):
+    """
+    Return Sec-WebSocket-Accept value for the client's Sec-WebSocket-Key.
+    """
+    digest = hashlib.sha1((key.strip() + GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+def is_upgrade_request(headers):
+    """
+    True if headers (a Message object) request a WebSocket upgrade.
+    """
+    upgrade = headers.get('Upgrade', '').lower()
+    connection = [t.strip().lower() for t in headers.get('Connection', '').split(',')]
+    return upgrade == 'websocket' and 'upgrade' in connection and \
+        headers.get('Sec-WebSocket-Key') is not None
+
+def encode_frame(opcode, payload):
+    """
+    Return an unfragmented, unmasked (server to client) frame.
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+def encode_close(code=1000, reason=''):
+    return encode_frame(OP_CLOSE, struct.pack('!H', code) + reason.encode())
+
+class FrameParser:
+    """
+    Reassembles client frames into messages.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._fragments = None
+        self._fragment_opcode = None
+
+    def feed(self, data):
+        """
+        Add received bytes, return list of complete (opcode, payload)
+        messages. Control frames are returned as they arrive, also in
+        between the fragments of a message.
+        """
+        self._buffer += data
+        messages = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return messages
+            fin, opcode, payload = frame
+            if opcode >= OP_CLOSE:
+                if not fin or len(payload) > 125:
+                    raise ProtocolError("Invalid control frame")
+                messages.append((opcode, payload))
+            elif opcode == OP_CONTINUATION:
+                if self._fragments is None:
+                    raise ProtocolError("Unexpected continuation frame")
+                self._fragments += payload
+                if len(self._fragments) > MAX_MESSAGE_SIZE:
+                    raise ProtocolError("Message too big")
+                if fin:
+                    messages.append((self._fragment_opcode, bytes(self._fragments)))
+                    self._fragments = None
+            elif opcode in (OP_TEXT, OP_BINARY):
+                if self._fragments is not None:
+                    raise ProtocolError("Expected continuation frame")
+                if fin:
+                    messages.append((opcode, payload))
+                else:
+                    self._fragments = bytearray(payload)
+                    self._fragment_opcode = opcode
+            else:
+                raise ProtocolError("Unknown opcode {}".format(opcode))
+
+    def _next_frame(self):
+        buf = self._buffer
+        if len(buf) < 2:
+            return None
+        fin = buf[0] & 0x80
+        if buf[0] & 0x70:
+            raise ProtocolError("Reserved bits set")
+        opcode = buf[0] & 0x0F
+        if not buf[1] & 0x80:
+            raise ProtocolError("Client frame not masked")
+        length = buf[1] & 0x7F
+        pos = 2
+        if length == 126:
+            if len(buf) < 4:
+                return None
+            length = struct.unpack_from('!H', buf, 2)[0]
+            pos = 4
+        elif length == 127:
+            if len(buf) < 10:
+                return None
+            length = struct.unpack_from('!Q', buf, 2)[0]
+            pos = 10
+        if length > MAX_MESSAGE_SIZE:
+            raise ProtocolError("Message too big")
+        if len(buf) < pos + 4 + length:
+            return None
+        mask = buf[pos:pos + 4]
+        pos += 4
+        payload = bytes(buf[pos:pos + length])
+        del buf[:pos + length]
+        return fin, opcode, _unmask(payload, mask)
+
+def _unmask(payload, mask):
+    # xor with the repeated 4 byte mask, as one big integer operation
+    if not payload:
+        return payload
+    n = len(payload)
+    key = (bytes(mask) * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+class Session:
+    """
+    Command and telemetry logic of one WebSocket connection.
+
+    send(bytes) sends a frame, it must be callable from any thread.
+    execute(method, path, body, n) runs a REST request, body is bytes, n
+    the number of the request on this connection, and returns (status,
+    reason, JSON response or None). sampler is the TelemetrySampler.
+
+    Commands are executed in the order they arrive, on a worker thread.
+    Commands that wait for completion (?wait=true) run on a thread of their
+    own, so they do not hold up later commands like stop; at most
+    MAX_WAITING_COMMANDS at once.
+    """
+
+    def __init__(self, send, execute, sampler):
+        self._send = send
+        self._execute = execute
+        self._sampler = sampler
+        self._commands = queue.Queue()
+        self._requests = 1
+        self._requests_lock = threading.Lock()
+        self._waiting = threading.BoundedSemaphore(MAX_WAITING_COMMANDS)
+        self._closed = threading.Event()
+        self._subscription = None
+        self._subscription_changed = threading.Condition()
+        self._pusher = None
+        self._parser = FrameParser()
+        self.commands = 0
+        self.pushed = 0
+        threading.Thread(target=self._run_commands, name='ws-commands', daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        self._commands.put(None)
+        with self._subscription_changed:
+            self._subscription = None
+            self._subscription_changed.notify()
+
+    def receive(self, data):
+        """
+        Handle bytes received from the client. Returns False when the
+        connection is to be closed.
+        """
+        try:
+            messages = self._parser.feed(data)
+        except ProtocolError as e:
+            self._send(encode_close(1002, str(e)))
+            return False
+        for opcode, payload in messages:
+            if opcode == OP_CLOSE:
+                self._send(encode_close())
+                return False
+            elif opcode == OP_PING:
+                self._send(encode_frame(OP_PONG, payload))
+            elif opcode in (OP_TEXT, OP_BINARY):
+                self.on_message(opcode, payload)
+        return True
+
+    def send_json(self, data):
+        self._send(encode_frame(OP_TEXT, jsoncodec.dumps(data)))
+
+    def on_message(self, opcode, payload):
+        """
+        Handle a data message. Does not block.
+        """
+        try:
+            message = jsoncodec.loads(payload)
+        except ValueError:
+            self.send_json({'type': 'error', 'error': "Message is not JSON"})
+            return
+        if not isinstance(message, dict):
+            self.send_json({'type': 'error', 'error': "Message is not a JSON object"})
+            return
+
+        if message.get('type') == 'subscribe':
+            self._subscribe(message)
+        elif 'method' in message and 'path' in message:
+            query = routing.parse_query(urllib.parse.urlsplit(str(message['path'])).query)
+            if not routing.query_flag(query, 'wait'):
+                self._commands.put(message)
+            elif self._waiting.acquire(blocking=False):
+                threading.Thread(target=self._run_waiting_command, args=(message,),
+                                 daemon=True).start()
+            else:
+                self.send_json({'id': message.get('id'), 'status': 503,
+                    'error': "More than {} commands waiting".format(MAX_WAITING_COMMANDS)})
+        else:
+            self.send_json({'id': message.get('id'), 'status': 400,
+                            'error': "Message is neither command nor subscription"})
+
+    def _run_commands(self):
+        while True:
+            message = self._commands.get()
+            if message is None:
+                return
+            self._run_command(message)
+
+    def _run_waiting_command(self, message):
+        try:
+            self._run_command(message)
+        finally:
+            self._waiting.release()
+
+    def _run_command(self, message):
+        body = message.get('body')
+        body = b'' if body is None else jsoncodec.dumps(body)
+        with self._requests_lock:
+            self._requests += 1
+            n = self._requests
+        try:
+            status, reason, data = self._execute(str(message['method']).upper(),
+                                                 str(message['path']), body, n)
+        except Exception as e:
+            status, reason, data = 500, str(e), None
+        self.commands += 1
+        reply = {'id': message.get('id'), 'status': status}
+        if status >= 400:
+            reply['error'] = reason
+        elif data is not None:
+            reply['body'] = data
+        if not self._closed.is_set():
+            try:
+                self.send_json(reply)
+            except OSError:
+                pass
+
+    def _subscribe(self, message):
+        rate = message.get('rate', 0)
+        fields = message.get('fields')
+        if fields is None:
+            fields = self._sampler.names()
+        if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+            self.send_json({'type': 'error', 'error': "Parameter fields not a list of strings"})
+            return
+        if not isinstance(rate, (int, float)) or not 0 <= rate <= MAX_TELEMETRY_RATE:
+            self.send_json({'type': 'error',
+                'error': "Parameter rate not in range 0..{}".format(MAX_TELEMETRY_RATE)})
+            return
+        unknown = [f for f in fields if f not in self._sampler]
+        if unknown:
+            self.send_json({'type': 'error', 'error': "Unknown fields " + ", ".join(map(str, unknown))})
+            return
+        with self._subscription_changed:
+            self._subscription = (rate, list(fields)) if rate > 0 else None
+            self._subscription_changed.notify()
+            if self._pusher is None and rate > 0:
+                self._pusher = threading.Thread(target=self._push_telemetry,
+                    name='ws-telemetry', daemon=True)
+                self._pusher.start()
+
+    def _push_telemetry(self):
+        next_push = 0
+        while not self._closed.is_set():
+            with self._subscription_changed:
+                subscription = self._subscription
+                if subscription is None:
+                    self._subscription_changed.wait()
+                    next_push = 0
+                    continue
+                delay = next_push - time.monotonic()
+                if delay > 0:
+                    # woken early if the subscription changes
+                    self._subscription_changed.wait(delay)
+                    continue
+            rate, fields = subscription
+            values = {}
+            for name in fields:
+                try:
+                    # latest cached value, sources are read at their own
+                    # rate (as for SSE streams)
+                    values[name] = self._sampler.get(name, float('inf')).value
+                except Exception:
+                    values[name] = None
+            try:
+                self.send_json({'type': 'telemetry', 'timestamp': time.time(), 'values': values})
+            except OSError:
+                return
+            self.pushed += 1
+            next_push = max(next_push + 1.0 / rate, time.monotonic())